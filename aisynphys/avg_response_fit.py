@@ -5,10 +5,8 @@ Spike time is set to 0ms
 import sys
 from collections import OrderedDict
 import numpy as np
-import pyqtgraph as pg
 from neuroanalysis.data import TSeries, TSeriesList
 from neuroanalysis.baseline import float_mode
-from neuroanalysis.fitting import Psp, StackedPsp
 from aisynphys.database import default_db as db
 import aisynphys.data.data_notes_db as notes_db
 from aisynphys.qc import spike_qc
@@ -39,24 +37,18 @@ def get_pair_avg_fits(pair, session, notes_session=None, ui=None):
         }
     
     """
-    prof = pg.debug.Profiler(disabled=True, delayed=False)
-    prof(str(pair))
     results = {}
     
     # query and sort pulse responses
     records = response_query(session=session, pair=pair).all()
-    prof('query prs')
     pulse_responses = [rec[0] for rec in records]
     sorted_responses = sort_responses(pulse_responses)
-    prof('sort prs')
 
     notes_rec = notes_db.get_pair_notes_record(pair.experiment.ext_id, pair.pre_cell.ext_id, pair.post_cell.ext_id, session=notes_session)
-    prof('get pair notes')
 
     if ui is not None:
         ui.show_pulse_responses(sorted_responses)
         ui.show_data_notes(notes_rec)
-        prof('update ui')
 
     for (clamp_mode, holding), responses in sorted_responses.items():
         if len(responses['qc_pass']) == 0:
@@ -84,9 +76,7 @@ def get_pair_avg_fits(pair, session, notes_session=None, ui=None):
             elif notes['synapse_type'] == 'in' and holding == -55:
                 sign = 1 if clamp_mode == 'vc' else -1
 
-        prof('prepare %s %s' % (clamp_mode, holding))
         fit_result, avg_response = fit_avg_pulse_response(responses['qc_pass'], latency_window, sign)
-        prof('fit avg')
 
         # measure baseline noise
         avg_baseline_noise = avg_response.time_slice(avg_response.t0, avg_response.t0+7e-3).data.std()
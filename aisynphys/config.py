@@ -24,9 +24,17 @@ synphys_db = None
 # utility config, not meant for external use
 synphys_data = None  # location of data repo network storage
 synphys_db_host_rw = None  # rw access to postgres / sqlite DB
+synphys_db_immutable = False  # open read-only sqlite DB with read-optimized settings; only for files that never change while open
 synphys_db_readonly_user = "readonly"  # readonly postgres username assigned whrn creating db/tables
 lims_address = None
+lims_cache_file = None  # sqlite file for caching LIMS results; default is cache_path/lims_cache.sqlite
+lims_cache_ttl = 0  # seconds before cached LIMS results expire; 0 (default) disables the cache
 rig_name = None
+intrinsic_workers = 1  # number of cells analyzed concurrently within each intrinsic pipeline job
+intrinsic_pool = 'thread'  # 'thread' or 'process'; daemonic pipeline workers always use threads
+stochastic_model_pipeline = False  # include the (slow) stochastic_model module in the multipatch pipeline
+stochastic_model_workers = 1  # worker processes per stochastic_model job; use 1 when jobs run in parallel
+stochastic_model_grid = {}  # {parameter: values} overriding the default stochastic model search grid
 n_headstages = 8
 rig_data_paths = {}
 known_addrs = {}
@@ -64,6 +72,7 @@ if args.db_version is not None:
     synphys_db_host = "sqlite:///"
     synphys_db_host_rw = None
     synphys_db = sqlite_file
+    synphys_db_immutable = True
     
 else:
     if args.db_host is not None:
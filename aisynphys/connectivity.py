@@ -1,6 +1,7 @@
 from collections import OrderedDict
+import concurrent.futures
 import numpy as np
-from statsmodels.stats.proportion import proportion_confint
+import scipy.optimize
 
 
 def connectivity_profile(connected, distance, bin_edges):
@@ -58,7 +59,7 @@ def connectivity_profile(connected, distance, bin_edges):
 
     return bin_edges, prop, lower, upper
 
-def measure_distance(pair_groups, window):
+def measure_distance(pair_groups, window, model=None, n_iter=1000, seed=None):
     """Given a description of cell pairs grouped together by cell class,
     return a structure that describes connectivity as a function of distance between cell classes.
     
@@ -68,6 +69,14 @@ def measure_distance(pair_groups, window):
         Output of `cell_class.classify_pairs`
     window: float
         binning window for distance
+    model : DistanceModel subclass | None
+        If given, this model is fit to the connectivity of each group, and confidence intervals
+        are estimated by parametric bootstrap (see `DistanceModel.bootstrap`). Results then also
+        include 'model', 'model_prob', 'model_lower_ci', and 'model_upper_ci' (evaluated at bin centers).
+    n_iter : int
+        Number of bootstrap iterations
+    seed : int | None
+        Random seed for bootstrap sampling
     """
 
     results = OrderedDict()
@@ -85,6 +94,20 @@ def measure_distance(pair_groups, window):
         'upper_ci': upper,
         }
 
+        # pairs with unknown connectivity are excluded, as in connectivity_profile
+        mask = np.isfinite(connected) & np.isfinite(distance)
+        connected, distance = connected[mask], distance[mask]
+        if model is not None and len(distance) > 0:
+            x_vals = 0.5 * (bin_edges[1:] + bin_edges[:-1])
+            fit = model.fit(distance, connected.astype(bool))
+            model_lower, model_upper = fit.bootstrap(distance, x_vals, n_iter=n_iter, seed=seed)
+            results[(pre_class, post_class)].update({
+                'model': fit,
+                'model_prob': fit.pdf(x_vals),
+                'model_lower_ci': model_lower,
+                'model_upper_ci': model_upper,
+            })
+
     return results
 
 def pair_distance(class_pairs, pre_class):
@@ -158,6 +181,7 @@ def connection_probability_ci(n_connected, n_probed, alpha=0.05):
     upper : float
         The upper confidence interval
     """
+    from statsmodels.stats.proportion import proportion_confint
     assert n_connected <= n_probed, "n_connected must be <= n_probed"
     if n_probed == 0:
         return (0, 1)
@@ -182,3 +206,272 @@ def pair_was_probed(pair, synapse_type):
     qc_field = 'n_%s_test_spikes' % synapse_type
     return getattr(pair, qc_field) > 10
 
+
+
+class DistanceModel(object):
+    """Base class for models of connection probability as a function of intersomatic distance.
+
+    Subclasses define *param_names*, default initial values and bounds for fitting, and
+    connection_probability(); they may also define an analytic connection_probability_gradient().
+
+    Model fitting maximizes the log-likelihood of the observed connectivity (logistic regression)::
+
+        LLF = Σᵢ(𝑦ᵢ log(𝑝(𝐱ᵢ)) + (1 − 𝑦ᵢ) log(1 − 𝑝(𝐱ᵢ)))
+
+    Many datasets can be fit at once with fit_batch(), which is used to estimate confidence intervals
+    by parametric bootstrap (see bootstrap()).
+    """
+    param_names = ()
+    init = ()
+    bounds = ()
+
+    # probabilities are clipped to [eps, 1-eps] when computing log-likelihood
+    eps = 1e-12
+
+    def __init__(self, *params):
+        for name, val in zip(self.param_names, params):
+            setattr(self, name, val)
+        self.fit_result = None
+
+    @property
+    def params(self):
+        return np.array([getattr(self, name) for name in self.param_names])
+
+    def __repr__(self):
+        return "<%s %s>" % (type(self).__name__, ' '.join(['%s=%g' % (name, getattr(self, name)) for name in self.param_names]))
+
+    @classmethod
+    def connection_probability(cls, params, x):
+        """Return the probability of connection at each distance in *x*.
+
+        *params* may have shape (n_params,) or (n_models, n_params); the returned array has shape
+        (len(x),) or (n_models, len(x)), respectively.
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def connection_probability_gradient(cls, params, x):
+        """Return (p, dp), where *p* is the output of connection_probability(params, x) with *params*
+        of shape (n_models, n_params), and *dp* is its gradient with respect to each parameter, with shape
+        (n_params, n_models, len(x)).
+
+        The default implementation uses finite differences; since models are independent, all models
+        are differentiated together with one extra evaluation per parameter.
+        """
+        p = cls.connection_probability(params, x)
+        dp = np.empty((params.shape[1],) + p.shape)
+        for i in range(params.shape[1]):
+            step = np.maximum(np.abs(params[:, i]) * 1e-7, 1e-12)
+            params2 = params.copy()
+            params2[:, i] += step
+            dp[i] = (cls.connection_probability(params2, x) - p) / step[:, None]
+        return p, dp
+
+    def pdf(self, x):
+        """Return the probability of connection at each distance in *x*.
+        """
+        return self.connection_probability(self.params, x)
+
+    def generate(self, x, n_samples=None, seed=None):
+        """Generate a random sample of connectivity given distances.
+
+        If *n_samples* is given, return a boolean array of shape (n_samples, len(x)) with one sample
+        per row. *seed* may be an integer or a numpy RandomState.
+        """
+        rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+        p = self.pdf(x)
+        shape = p.shape if n_samples is None else (n_samples,) + p.shape
+        return rng.random_sample(size=shape) < p
+
+    def likelihood(self, x, conn):
+        """Log-likelihood of the connectivity *conn* (boolean array) observed at distances *x*.
+        """
+        p = np.clip(self.pdf(x), self.eps, 1 - self.eps)
+        return np.log(p[conn]).sum() + np.log((1-p)[~conn]).sum()
+
+    @classmethod
+    def fit(cls, x, conn, init=None, bounds=None):
+        """Return a model fit to the connectivity *conn* (boolean array) observed at distances *x*.
+
+        The scipy optimization result is stored in the returned model's *fit_result* attribute.
+        """
+        params, results = cls._fit_chunk(x, np.asarray(conn)[np.newaxis, :], init, bounds)
+        ret = cls(*params[0])
+        ret.fit_result = scipy.optimize.OptimizeResult(x=params[0], fun=results.fun[0], nit=results.nit[0], 
+                                                       success=results.success[0], message=results.message)
+        return ret
+
+    @classmethod
+    def fit_batch(cls, x, conn, init=None, bounds=None, chunk_size=100, workers=1):
+        """Fit many connectivity samples measured at the same distances.
+
+        Parameters
+        ----------
+        x : array
+            Distances probed, shape (n_probes,)
+        conn : array
+            Boolean array of shape (n_samples, n_probes)
+        init, bounds :
+            Initial parameter values and (min, max) bounds for each parameter (default to
+            the class *init* and *bounds*)
+        chunk_size : int
+            Number of samples fit together in each vectorized optimization
+        workers : int
+            If greater than 1, chunks are fit in a pool of this many processes
+
+        Returns
+        -------
+        params : array
+            Fit parameters, shape (n_samples, n_params)
+        """
+        conn = np.asarray(conn)
+        chunks = [conn[i:i+chunk_size] for i in range(0, conn.shape[0], chunk_size)]
+        if workers > 1 and len(chunks) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(cls._fit_chunk, x, chunk, init, bounds) for chunk in chunks]
+                results = [fut.result() for fut in futures]
+        else:
+            results = [cls._fit_chunk(x, chunk, init, bounds) for chunk in chunks]
+        return np.concatenate([params for params, _ in results], axis=0)
+
+    @classmethod
+    def _fit_chunk(cls, x, conn, init=None, bounds=None, max_iter=200, tol=1e-10):
+        """Fit all rows of *conn* together by bounded Fisher scoring.
+
+        Each iteration computes the score and Fisher information of every model from the analytic
+        gradient of connection probability, takes a Newton step (with parameters held at any bound
+        they are pushed against), and halves the step for any model whose likelihood did not improve.
+
+        Returns (params, results), where *results* is a scipy OptimizeResult with per-model arrays.
+        """
+        init = np.asarray(cls.init if init is None else init, dtype=float)
+        bounds = np.asarray(cls.bounds if bounds is None else bounds, dtype=float)
+        x = np.asarray(x, dtype=float)
+        conn = np.asarray(conn, dtype=bool)
+        y = conn.astype(float)
+        n_models = conn.shape[0]
+        n_params = len(init)
+        lower = bounds[:, 0]
+        upper = bounds[:, 1]
+        scale = upper - lower
+
+        def llf(params, rows):
+            p = np.clip(cls.connection_probability(params, x), cls.eps, 1 - cls.eps)
+            return np.where(conn[rows], np.log(p), np.log(1 - p)).sum(axis=1)
+
+        params = np.tile(init, (n_models, 1))
+        current = llf(params, slice(None))
+        active = np.ones(n_models, dtype=bool)
+        n_iter = np.zeros(n_models, dtype=int)
+        for i in range(max_iter):
+            idx = np.argwhere(active)[:, 0]
+            if len(idx) == 0:
+                break
+            n_iter[idx] += 1
+            p, dp = cls.connection_probability_gradient(params[idx], x)
+            p = np.clip(p, cls.eps, 1 - cls.eps)
+            # work in units of each parameter's bounded range
+            dp = dp * scale[:, np.newaxis, np.newaxis]
+            w = 1.0 / (p * (1 - p))
+            score = (dp * ((y[idx] - p) * w)[np.newaxis]).sum(axis=2).T
+            fisher = np.einsum('inm,jnm,nm->nij', dp, dp, w)
+
+            # hold parameters that are at a bound and pushed outward
+            fixed = ((params[idx] <= lower) & (score < 0)) | ((params[idx] >= upper) & (score > 0))
+            score[fixed] = 0
+            fixed_pair = fixed[:, :, np.newaxis] | fixed[:, np.newaxis, :]
+            eye = np.broadcast_to(np.eye(n_params, dtype=bool), fisher.shape)
+            fisher = np.where(fixed_pair, np.where(eye, 1.0, 0.0), fisher)
+            # small damping keeps the system well conditioned
+            fisher += np.eye(n_params) * 1e-12 * np.einsum('nii->n', fisher)[:, np.newaxis, np.newaxis]
+            step = np.linalg.solve(fisher, score[:, :, np.newaxis])[:, :, 0] * scale
+
+            # backtracking line search
+            t = np.ones(len(idx))
+            new_params = params[idx]
+            new_llf = current[idx]
+            todo = np.ones(len(idx), dtype=bool)
+            for j in range(30):
+                trial = np.clip(params[idx][todo] + t[todo, np.newaxis] * step[todo], lower, upper)
+                trial_llf = llf(trial, idx[todo])
+                better = trial_llf >= current[idx][todo]
+                better_idx = np.argwhere(todo)[:, 0][better]
+                new_params[better_idx] = trial[better]
+                new_llf[better_idx] = trial_llf[better]
+                todo[better_idx] = False
+                if not todo.any():
+                    break
+                t[todo] *= 0.5
+
+            change = np.abs(new_params - params[idx]) / scale
+            params[idx] = new_params
+            current[idx] = new_llf
+            active[idx[(change.max(axis=1) < tol) | todo]] = False
+
+        results = scipy.optimize.OptimizeResult(
+            x=params, fun=-current, nit=n_iter, success=~active,
+            message='converged' if not active.any() else '%d models did not converge' % active.sum(),
+        )
+        return params, results
+
+    def bootstrap(self, x, x_vals, n_iter=1000, percentiles=(5, 95), seed=None, return_params=False, **kwds):
+        """Estimate confidence intervals on this model by parametric bootstrap.
+
+        *n_iter* connectivity samples are generated from this model at distances *x* and refit
+        (see fit_batch; extra keyword arguments are passed through). Returns the requested
+        *percentiles* of the refit connection probabilities at distances *x_vals*, with shape
+        (len(percentiles), len(x_vals)). If *return_params* is True, also return the refit parameters.
+        """
+        conn = self.generate(x, n_samples=n_iter, seed=seed)
+        params = self.fit_batch(x, conn, **kwds)
+        p = self.connection_probability(params, x_vals)
+        bands = np.percentile(p, percentiles, axis=0)
+        if return_params:
+            return bands, params
+        return bands
+
+
+class ExpModel(DistanceModel):
+    """Connection probability decays exponentially with distance: p(x) = pmax * exp(-x / tau)
+    """
+    param_names = ('pmax', 'tau')
+    init = (0.1, 100e-6)
+    bounds = ((0, 1), (10e-6, 1e-3))
+
+    @classmethod
+    def connection_probability(cls, params, x):
+        params = np.asarray(params)
+        pmax = params[..., 0:1]
+        tau = params[..., 1:2]
+        return pmax * np.exp(-x / tau)
+
+    @classmethod
+    def connection_probability_gradient(cls, params, x):
+        pmax = params[:, 0:1]
+        tau = params[:, 1:2]
+        e = np.exp(-x / tau)
+        p = pmax * e
+        return p, np.stack([e, p * x / tau**2])
+
+
+class GaussianModel(DistanceModel):
+    """Connection probability has a gaussian profile: p(x) = pmax * exp(-x² / 2σ²)
+    """
+    param_names = ('pmax', 'sigma')
+    init = (0.1, 100e-6)
+    bounds = ((0, 1), (10e-6, 1e-3))
+
+    @classmethod
+    def connection_probability(cls, params, x):
+        params = np.asarray(params)
+        pmax = params[..., 0:1]
+        sigma = params[..., 1:2]
+        return pmax * np.exp(-x**2 / (2 * sigma**2))
+
+    @classmethod
+    def connection_probability_gradient(cls, params, x):
+        pmax = params[:, 0:1]
+        sigma = params[:, 1:2]
+        e = np.exp(-x**2 / (2 * sigma**2))
+        p = pmax * e
+        return p, np.stack([e, p * x**2 / sigma**3])
@@ -8,6 +8,7 @@ from neuroanalysis.data import TSeries, TSeriesList
 from neuroanalysis.baseline import float_mode
 
 from .. import qc
+from ..trace_stack import TraceStack
 
 
 class MultiPatchDataset(MiesNwb):
@@ -483,6 +484,45 @@ class PulseResponseList(object):
             tsl.append(ts)
         return TSeriesList(tsl)
 
+    def post_stack(self, align=None, bsub=False, window=None, decimate=1):
+        """Return a TraceStack of all postsynaptic recordings.
+
+        This gives the same traces as post_tseries(), but stored in a single 2D array.
+        See TraceStack.from_arrays() for the *window* and *decimate* arguments.
+        """
+        return self._get_stack('post_tseries', align, bsub, window, decimate)
+
+    def pre_stack(self, align=None, bsub=False, window=None, decimate=1):
+        """Return a TraceStack of all presynaptic recordings.
+
+        This gives the same traces as pre_tseries(), but stored in a single 2D array.
+        """
+        return self._get_stack('pre_tseries', align, bsub, window, decimate)
+
+    def _get_stack(self, ts_name, align, bsub, window, decimate):
+        if align not in (None, 'spike', 'pulse'):
+            raise ValueError("align must be None, 'spike', or 'pulse'.")
+        tsl = []
+        stim_times = []
+        align_times = []
+        for pr in self.prs:
+            stim_time = pr.stim_pulse.onset_time
+            if align == 'spike':
+                align_t = pr.stim_pulse.first_spike_time
+                # ignore PRs with no known spike time
+                if align_t is None:
+                    continue
+            else:
+                align_t = stim_time if align == 'pulse' else 0
+            tsl.append(getattr(pr, ts_name))
+            stim_times.append(stim_time)
+            align_times.append(align_t)
+
+        stim_times = np.array(stim_times, dtype=float)
+        bsub_windows = np.stack([stim_times - 5e-3, stim_times], axis=1) if bsub is True else None
+        return TraceStack.from_tseries(tsl, align_times=align_times, baseline_windows=bsub_windows,
+            baseline='mode', window=window, decimate=decimate)
+
 
 class StimPulse(object):
     """Represents a single stimiulus pulse intended to evoke a synaptic response.
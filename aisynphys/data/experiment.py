@@ -12,8 +12,6 @@ import pickle
 from collections import OrderedDict
 
 import yaml
-import pyqtgraph as pg
-import pyqtgraph.configfile
 
 from .. import lims, yaml_local, config
 from ..constants import ALL_CRE_TYPES, ALL_LABELS, FLUOROPHORES, LAYERS, INJECTIONS
@@ -56,6 +54,7 @@ class Experiment(object):
         self._rig_name = None
         self._loaded = False
         self._yml_file = yml_file
+        self._pipettes_yml = None
         
         if site_path is not None:
             self._yml_file = os.path.join(site_path, 'pipettes.yml')
@@ -70,6 +69,54 @@ class Experiment(object):
             self._load_yml(self._yml_file)
             self._loaded = True
 
+    def index_state(self):
+        """Return a JSON-compatible dict of the metadata collected for this experiment
+        (pipettes.yml and .index contents, LIMS record, file locations and cell positions).
+
+        Used to store experiments in an ExperimentIndex; see from_index_state().
+        """
+        slice = self.slice
+        cells = self._cells or {}
+        pips = self._pipettes_yml
+        return {
+            'pipettes': None if pips is None else pips.pipettes,
+            'site_info': self._site_info,
+            'nwb_file': self._nwb_file,
+            'mosaic_file': self._mosaic_file,
+            'cell_positions': {cid: cell.position for cid, cell in cells.items() if cell.position is not None},
+            'slice_info': slice._slice_info,
+            'parent_info': slice._parent_info,
+            'lims_record': slice._lims_record,
+        }
+
+    @classmethod
+    def from_index_state(cls, yml_file, state):
+        """Return an Experiment loaded from *yml_file*, using metadata previously returned by index_state()
+        instead of reading it again from the server and LIMS.
+
+        Electrodes, cells and connections are rebuilt from the stored pipettes.yml content, so
+        the file is not read again (ExperimentList re-parses experiments whose pipettes.yml has
+        changed). Any metadata missing from *state* is loaded on demand as usual.
+        """
+        expt = cls(yml_file=yml_file, verify=False)
+        slice = expt.slice
+        for attr, key in [('_slice_info', 'slice_info'), ('_parent_info', 'parent_info'), ('_lims_record', 'lims_record')]:
+            if getattr(slice, attr) is None:
+                setattr(slice, attr, state.get(key))
+        expt._site_info = state.get('site_info')
+        expt._nwb_file = state.get('nwb_file')
+        expt._mosaic_file = state.get('mosaic_file')
+        pipettes = state.get('pipettes')
+        if pipettes is None:
+            expt._load()
+        else:
+            expt._load_yml(yml_file, pipettes=pipettes)
+            expt._loaded = True
+        for cid, pos in state.get('cell_positions', {}).items():
+            if cid in expt.cells:
+                expt.cells[cid].position = pos
+        return expt
+
     def verify(self):
         """Perform some basic checks to ensure this experiment was acquired correctly.
         """
@@ -352,15 +399,23 @@ class Experiment(object):
             self._cells = {e.cell.cell_id:e.cell for e in self.electrodes.values() if e.cell is not None}
         return self._cells
 
-    def _load_yml(self, yml_file):
+    def _load_yml(self, yml_file, pipettes=None):
         """Load experiment information from a pipettes.yml file.
 
+        If *pipettes* is given, it is used as the already-parsed content of the file
+        (see PipetteMetadata.pipettes) and the file is not read.
+
         Sets several properties: source_id, _site_path, electrodes, _connections, _gaps
         """
         self.source_id = (yml_file, None)
         self._electrodes = OrderedDict()
         
-        pips = PipetteMetadata(os.path.dirname(yml_file))
+        if pipettes is None:
+            pips = PipetteMetadata(os.path.dirname(yml_file))
+        else:
+            pips = PipetteMetadata()
+            pips.yml_file = yml_file
+            pips.pipettes = OrderedDict(pipettes)
         self._pipettes_yml = pips
         all_colors = set(FLUOROPHORES.values())
         genotype = self.genotype
@@ -877,7 +932,8 @@ class Experiment(object):
             index = os.path.join(self.path, '.index')
             if not os.path.isfile(index):
                 return None
-            self._site_info = pg.configfile.readConfigFile(index)['.']
+            import pyqtgraph.configfile
+            self._site_info = pyqtgraph.configfile.readConfigFile(index)['.']
         return self._site_info
 
     @property
@@ -1126,6 +1182,7 @@ class Experiment(object):
         return self.slice_info.get('project', None)
 
     def show(self):
+        import pyqtgraph as pg
         if self._view is None:
             pg.mkQApp()
             self._view_widget = pg.GraphicsLayoutWidget()
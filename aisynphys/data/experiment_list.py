@@ -3,6 +3,7 @@ from __future__ import print_function, division
 import numpy as np
 import os, glob
 import pickle
+import multiprocessing
 import scipy.optimize
 import scipy.stats
 import sys
@@ -10,24 +11,46 @@ import traceback
 import warnings
 import datetime
 
-import pyqtgraph as pg
 
-from .ui.graphics import MatrixItem, distance_plot
 from .experiment import Experiment
-from .constants import INHIBITORY_CRE_TYPES, EXCITATORY_CRE_TYPES
-from . import config
-from statsmodels.stats.proportion import proportion_confint
+from ..experiment_index import ExperimentIndex
+from ..constants import INHIBITORY_CRE_TYPES, EXCITATORY_CRE_TYPES
+from .. import config
 
 
 _expt_list = None
 cache_file = os.path.join(os.path.dirname(__file__), '..', 'expts_cache.pkl')
+index_file = os.path.join(os.path.dirname(__file__), '..', 'expts_index.sqlite')
 def cached_experiments():
-    global _expt_list, cache_file
+    """Return an ExperimentList loaded from the on-disk experiment index.
+
+    This does not touch the server; call ``cached_experiments().load_from_server()``
+    to bring the index up to date. If the index is empty, experiments are first
+    imported from the legacy pickle cache (expts_cache.pkl) if it exists.
+    """
+    global _expt_list, cache_file, index_file
     if _expt_list is None:
-        _expt_list = ExperimentList(cache=cache_file)
+        _expt_list = ExperimentList(index=index_file)
+        if len(_expt_list._index) == 0 and os.path.isfile(cache_file):
+            _expt_list.import_cache(cache_file)
     return _expt_list
 
 
+def _load_experiment(yml_file):
+    """Load one experiment from a pipettes.yml file; may be invoked in a subprocess.
+
+    Returns (yml_file, mtime, expt, error) where exactly one of *expt* or *error* is None.
+    """
+    mtime = os.stat(yml_file).st_mtime
+    try:
+        expt = Experiment(yml_file=yml_file)
+        return yml_file, mtime, expt, None
+    except Exception as exc:
+        if len(exc.args) > 0 and exc.args[0] == 'breakpoint':
+            raise
+        return yml_file, mtime, None, ''.join(traceback.format_exception(*sys.exc_info()))
+
+
 
 class Entry(object):
     def __init__(self, line, parent, file, lineno):
@@ -61,9 +84,11 @@ def indentation(line):
 
 class ExperimentList(object):
 
-    def __init__(self, expts=None, cache=None):
+    def __init__(self, expts=None, cache=None, index=None):
         self._cache_version = 10
         self._cache = cache
+        self._index = None if index is None else ExperimentIndex(index)
+        self._expts_by_yml = {}
         self._expts = []
         self._expts_by_datetime = {}
         self._expts_by_uid = {}
@@ -80,8 +105,66 @@ class ExperimentList(object):
             except Exception:
                 sys.excepthook(*sys.exc_info())
                 print('Error reading cache file "%s". (exception printed above)' % cache)
+        if self._index is not None:
+            self._load_index()
+            self.sort()
+
+    def _load_index(self, yml_files=None):
+        """Add experiments stored in the index (optionally only those from *yml_files*).
+        """
+        for yml_file, state in self._index.load(self._cache_version, yml_files):
+            try:
+                expt = Experiment.from_index_state(yml_file, state)
+            except Exception as exc:
+                if len(exc.args) > 0 and exc.args[0] == 'breakpoint':
+                    raise
+                print("Error loading indexed experiment %s (%s); it will be re-parsed on the next update." % (yml_file, exc))
+                continue
+            self._add_indexed_experiment(yml_file, expt)
+
+    def import_cache(self, filename):
+        """Add all experiments from a legacy pickle cache file to the index.
 
-    def load_from_server(self):
+        Experiments whose pipettes.yml was modified after the cache file was written are
+        marked to be re-parsed by the next call to load_from_server().
+        """
+        if self._index is None:
+            raise Exception("ExperimentList has no index; cannot import cache.")
+        el = ExperimentList(cache=filename)
+        cache_mtime = os.stat(filename).st_mtime
+        n_imported = 0
+        for expt in el:
+            yml_file = expt._yml_file
+            if yml_file is None or not os.path.isfile(yml_file):
+                continue
+            mtime = os.stat(yml_file).st_mtime
+            self._index.store(yml_file, mtime if mtime <= cache_mtime else None, self._cache_version, expt.uid, expt.index_state())
+            self._add_indexed_experiment(yml_file, expt)
+            n_imported += 1
+        self._index.commit()
+        self.sort()
+        print("Imported %d experiments from %s into the experiment index." % (n_imported, filename))
+
+    def __getstate__(self):
+        # sqlite connections can't be pickled (see write_cache)
+        state = self.__dict__.copy()
+        state['_index'] = None
+        return state
+
+    def load_from_server(self, parallel=True, workers=None):
+        """Load all experiments found on the server.
+
+        If this list was created with an *index*, then only experiments whose pipettes.yml
+        is new or has been modified since it was last indexed are parsed; all others are
+        loaded from the index, and the index is updated with the results.
+
+        Parameters
+        ----------
+        parallel : bool
+            If True, parse experiments in a pool of worker processes.
+        workers : int | None
+            Number of worker processes (default is one per CPU core).
+        """
         errs = []
 
         # Load all pipettes.yml files found on server
@@ -89,24 +172,55 @@ class ExperimentList(object):
         if len(yamls) == 0:
             print("No experiments found at %s" % config.synphys_data)
 
-        for i,yml_file in enumerate(yamls):
-            # if i>15:
-                # break
+        # decide which experiments need to be parsed
+        if self._index is None:
+            stale = yamls
+        else:
+            indexed = self._index.entries()
+            stale = []
+            for yml_file in yamls:
+                if indexed.get(yml_file, None) != (os.stat(yml_file).st_mtime, self._cache_version):
+                    stale.append(yml_file)
+            removed = set(indexed.keys()) - set(yamls)
+            if len(removed) > 0:
+                self._index.remove(removed)
+            # forget previously indexed experiments that are about to be replaced or have disappeared
+            for yml_file in list(removed) + stale:
+                if yml_file in self._expts_by_yml:
+                    self.remove_experiment(self._expts_by_yml.pop(yml_file))
+            fresh = set(yamls) - set(stale)
+            self._load_index(fresh - set(self._expts_by_yml.keys()))
+            print("Loaded %d experiments from index; %d new or changed." % (len(fresh), len(stale)))
+
+        if parallel and len(stale) > 1:
+            pool = multiprocessing.Pool(processes=workers)
             try:
-                expt = Experiment(yml_file=yml_file)
-                self.add_experiment(expt)
-            except Exception as exc:
-                if len(exc.args) > 0 and exc.args[0] == 'breakpoint':
-                    raise
-                errs.append((yml_file, sys.exc_info()))
+                results = list(pool.imap_unordered(_load_experiment, stale))
+            finally:
+                pool.close()
+        else:
+            results = map(_load_experiment, stale)
+
+        for yml_file, mtime, expt, err in results:
+            if err is not None:
+                errs.append((yml_file, err))
                 continue
+            if self._index is None:
+                self.add_experiment(expt)
+            else:
+                self._add_indexed_experiment(yml_file, expt)
+                self._index.store(yml_file, mtime, self._cache_version, expt.uid, expt.index_state())
+
+        if self._index is not None:
+            self._index.commit()
+        self.sort()
 
         if len(errs) > 0:
             print("Errors loading %d experiments from server:" % len(errs))
             for yml_file, exc in errs:
                 print("=======================")
                 print("yml:", yml_file)
-                traceback.print_exception(*exc)
+                print(exc)
                 src_file = open(os.path.join(os.path.dirname(yml_file), 'sync_source')).read()
                 print("source:", os.path.join(src_file, 'pipettes.yml'))
                 print("")
@@ -118,7 +232,7 @@ class ExperimentList(object):
             self._load_text(filename)
 
     def _load_pickle(self, filename):
-        el = pickle.load(open(filename))
+        el = pickle.load(open(filename, 'rb'))
         ver = getattr(el, '_cache_version', None)
         if ver != self._cache_version:
             print("Ignoring cache file %s due to incompatible version (%s != %s)" % (filename, ver, self._cache_version))
@@ -194,10 +308,21 @@ class ExperimentList(object):
         self._expts_by_source_id[expt.source_id] = expt
         self._expts.sort(key=lambda ex: ex.uid)
 
+    def _add_indexed_experiment(self, yml_file, expt):
+        self.add_experiment(expt)
+        if self._expts_by_uid.get(expt.uid, None) is expt:
+            self._expts_by_yml[yml_file] = expt
+
+    def remove_experiment(self, expt):
+        self._expts.remove(expt)
+        self._expts_by_uid.pop(expt.uid, None)
+        self._expts_by_datetime.pop(expt.datetime, None)
+        self._expts_by_source_id.pop(expt.source_id, None)
+
     def write_cache(self):
         if self._cache is None:
             raise Exception("ExperimentList has no cache file; cannot write cache.")
-        pickle.dump(self, open(self._cache, 'w'))
+        pickle.dump(self, open(self._cache, 'wb'))
 
     def select(self, start=None, stop=None, region=None, source_files=None, cre_type=None, target_layer=None, calcium=None,
                age=None, temp=None, organism=None, rig=None):
@@ -344,6 +469,7 @@ class ExperimentList(object):
             post_strs = [("" if layer is None else ("L" + layer + " ")) + (cre_type or "") for layer, cre_type in post_types]
             name = ("%s->%s "%(','.join(pre_strs), ','.join(post_strs)))
         
+        from ..ui.graphics import distance_plot
         return distance_plot(connected, distance=probed, plots=plots, color=color, name=name, window=40e-6, spacing=40e-6)
 
     def connectivity_matrix(self, rows, cols):
@@ -361,6 +487,8 @@ class ExperimentList(object):
         return matrix
 
     def matrix(self, rows, cols, size=50, header_color='k', no_data_color=0.9, mode='connectivity', title='Connectivity Matrix'):
+        import pyqtgraph as pg
+        from ..ui.graphics import MatrixItem
         w = pg.GraphicsLayoutWidget()
         w.setRenderHints(w.renderHints() | pg.QtGui.QPainter.Antialiasing)
         w.setWindowTitle(title)
@@ -601,6 +729,7 @@ class ExperimentList(object):
         return summary
 
     def print_connectivity_summary(self, cre_type=None):
+        from statsmodels.stats.proportion import proportion_confint
         print("------------------------------------------------------------------------------------------------------------------------------------------------------------------------")
         print("     Connectivity                           (# connected/probed, # reciprocal, % connectivity, lower CI, upper CI, %250, lower CI, upper CI, %100, lower CI, upper CI, cdist, udist, adist)")
         print("------------------------------------------------------------------------------------------------------------------------------------------------------------------------")
@@ -1,7 +1,5 @@
 import os.path, re, datetime
 import numpy as np
-import pyqtgraph as pg
-import pyqtgraph.configfile
 
 from .. import lims, config
 from ..constants import ALL_CRE_TYPES, ALL_LABELS, FLUOROPHORES, LAYERS, INJECTIONS
@@ -12,15 +10,29 @@ class Slice(object):
     _cache = {}
     
     @classmethod
-    def get(cls, path):
+    def get(cls, path, **kwds):
         if path not in Slice._cache:
-            Slice._cache[path] = Slice(path)
+            Slice._cache[path] = Slice(path, **kwds)
         return Slice._cache[path]
     
-    def __init__(self, path):
+    @classmethod
+    def load_lims_records(cls, slices):
+        """Fetch the LIMS records for many slices with a single query (see lims.specimen_info_batch).
+
+        Slices whose specimens are not found are left to query LIMS individually if needed.
+        """
+        slices = [s for s in slices if s._lims_record is None and s.slice_info is not None and 'specimen_ID' in s.slice_info]
+        recs = lims.specimen_info_batch(specimen_names=[s.lims_specimen_name for s in slices])
+        for s in slices:
+            s._lims_record = recs.get(s.lims_specimen_name)
+
+    def __init__(self, path, slice_info=None, parent_info=None):
+        """*slice_info* and *parent_info* may be given if the slice and parent .index files were
+        already parsed by the caller.
+        """
         self.path = path
-        self._slice_info = None
-        self._parent_info = None
+        self._slice_info = slice_info
+        self._parent_info = parent_info
         self._genotype = None
         self._lims_record = None
         self._slice_time = None
@@ -31,7 +43,8 @@ class Slice(object):
             index = os.path.join(self.path, '.index')
             if not os.path.isfile(index):
                 return None
-            self._slice_info = pg.configfile.readConfigFile(index)['.']
+            import pyqtgraph.configfile
+            self._slice_info = pyqtgraph.configfile.readConfigFile(index)['.']
         return self._slice_info
     
     @property
@@ -48,7 +61,8 @@ class Slice(object):
             index = os.path.join(self.parent_path, '.index')
             if not os.path.isfile(index):
                 raise TypeError("Cannot find index file (%s) for experiment %s" % (index, self))
-            self._parent_info = pg.configfile.readConfigFile(index)['.']
+            import pyqtgraph.configfile
+            self._parent_info = pyqtgraph.configfile.readConfigFile(index)['.']
         return self._parent_info
 
     @property
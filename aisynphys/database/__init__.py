@@ -20,7 +20,7 @@ else:
         default_db_name = '{database}_{version}'.format(database=config.synphys_db, version=SynphysDatabase.schema_version)
     else:
         default_db_name = config.synphys_db
-    default_db = SynphysDatabase(config.synphys_db_host, config.synphys_db_host_rw, default_db_name)
+    default_db = SynphysDatabase(config.synphys_db_host, config.synphys_db_host_rw, default_db_name, immutable=config.synphys_db_immutable)
 
 
 def dispose_all_engines():
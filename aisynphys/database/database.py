@@ -5,7 +5,8 @@ The actual schemas for database tables are implemented in other files in this su
 """
 from __future__ import division, print_function
 
-import os, sys, io, time, json, threading, gc, re, weakref
+import os, sys, io, time, json, threading, gc, re, weakref, zlib
+import urllib.parse
 from datetime import datetime
 from collections import OrderedDict
 import numpy as np
@@ -24,6 +25,7 @@ from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Boole
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship, deferred, sessionmaker, reconstructor
+from sqlalchemy.orm.interfaces import ONETOMANY, MANYTOONE
 from sqlalchemy.types import TypeDecorator
 from sqlalchemy.sql.expression import func
 
@@ -51,6 +53,20 @@ class NDArray(TypeDecorator):
         return np.load(buf, allow_pickle=False)
 
 
+class CompressedNDArray(NDArray):
+    """For marshalling large arrays in/out of zlib-compressed binary DB fields.
+    """
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return b''
+        return zlib.compress(NDArray.process_bind_param(self, value, dialect))
+
+    def process_result_value(self, value, dialect):
+        if value == b'':
+            return None
+        return NDArray.process_result_value(self, zlib.decompress(value), dialect)
+
+
 class JSONObject(TypeDecorator):
     """For marshalling objects in/out of json-encoded text.
     """
@@ -90,6 +106,7 @@ column_data_types = {
     'date': Date,
     'datetime': DateTime,
     'array': NDArray,
+    'compressed_array': CompressedNDArray,
 #    'object': JSONB,  # provides support for postges jsonb, but conflicts with sqlite
     'object': JSONObject,
 }
@@ -208,13 +225,32 @@ class Database(object):
     _all_dbs = weakref.WeakSet()
     default_app_name = (' '.join(sys.argv))[-63:]
 
-    def __init__(self, ro_host, rw_host, db_name, ormbase):
+    # Connection settings for read-only access to immutable sqlite files (see ro_engine)
+    sqlite_read_pragmas = OrderedDict([
+        ('mmap_size', 2**34),      # map up to 16 GB of the file into memory
+        ('cache_size', -2**18),    # 256 MB page cache per connection
+        ('temp_store', 'memory'),
+    ])
+    # engines for immutable sqlite files are shared by all Database instances in a process: {(pid, path): engine}
+    _immutable_engines = {}
+
+    # Extra (table, [columns]) indexes to build when baking sqlite files, in addition to an index on every
+    # foreign key column. Subclasses list multi-column indexes that cover their common queries here.
+    bake_indexes = []
+
+    def __init__(self, ro_host, rw_host, db_name, ormbase, immutable=False):
+        """
+        If *immutable* is True, then a read-only sqlite file is opened with the sqlite `immutable` flag and
+        read-optimized settings (see ro_engine). Only use this for files that are never modified while open,
+        such as downloaded database releases.
+        """
         self.ormbase = ormbase
         self._mappings = {}
         
         self.ro_host = ro_host
         self.rw_host = rw_host
         self.db_name = db_name
+        self.immutable = immutable and rw_host is None and ro_host.startswith('sqlite')
         self._ro_engine = None
         self._rw_engine = None
         self._maint_engine = None
@@ -297,7 +333,8 @@ class Database(object):
         """Dispose any existing DB engines. This is necessary when forking to avoid accessing the same DB
         connection simultaneously from two processes.
         """
-        if self._ro_engine is not None:
+        if self._ro_engine is not None and not self.immutable:
+            # immutable sqlite engines are shared with other instances; just drop our reference
             self._ro_engine.dispose()
         if self._rw_engine is not None:
             self._rw_engine.dispose()
@@ -341,14 +378,53 @@ class Database(object):
         """
         self._check_engines()
         if self._ro_engine is None:
-            if self.backend == 'postgresql':
-                # use echo=True to log all db queries for debugging
-                opts = {'echo': False, 'pool_size': 10, 'max_overflow': 40, 'isolation_level': 'AUTOCOMMIT'}
+            if self.immutable:
+                self._ro_engine = self._immutable_sqlite_engine(self.db_name)
             else:
-                opts = {}        
-            self._ro_engine = create_engine(self.ro_address, **opts)
+                if self.backend == 'postgresql':
+                    # use echo=True to log all db queries for debugging
+                    opts = {'echo': False, 'pool_size': 10, 'max_overflow': 40, 'isolation_level': 'AUTOCOMMIT'}
+                else:
+                    opts = {}        
+                self._ro_engine = create_engine(self.ro_address, **opts)
             self._engine_pid = os.getpid()
         return self._ro_engine
+
+    @classmethod
+    def _immutable_sqlite_engine(cls, db_file):
+        """Return an engine for read-only access to an sqlite file that will not change while it is open.
+
+        The file is opened with `mode=ro&immutable=1` (no file locking or change detection), and each
+        connection uses memory-mapped IO and a large page cache (see sqlite_read_pragmas). Connections are
+        pooled and may be used from any thread, so the page cache survives across sessions; the engine
+        is shared by all Database instances in this process that open the same file.
+        """
+        db_file = os.path.abspath(db_file)
+        key = (os.getpid(), db_file)
+        engine = cls._immutable_engines.get(key)
+        if engine is None:
+            address = 'sqlite:///file:%s?mode=ro&immutable=1&uri=true' % urllib.parse.quote(db_file)
+            engine = create_engine(address, poolclass=sqlalchemy.pool.QueuePool, pool_size=5, max_overflow=10,
+                                   connect_args={'check_same_thread': False})
+            pragmas = ["PRAGMA %s=%s" % (k, v) for k, v in cls.sqlite_read_pragmas.items()]
+
+            @sqlalchemy.event.listens_for(engine, 'connect')
+            def set_pragmas(dbapi_conn, conn_record):
+                cursor = dbapi_conn.cursor()
+                for pragma in pragmas:
+                    cursor.execute(pragma)
+                cursor.close()
+
+            cls._immutable_engines[key] = engine
+        return engine
+
+    @classmethod
+    def dispose_immutable_engine(cls, db_file):
+        """Dispose the shared engine for an immutable sqlite file (for example, after the file was modified).
+        """
+        engine = cls._immutable_engines.pop((os.getpid(), os.path.abspath(db_file)), None)
+        if engine is not None:
+            engine.dispose()
     
     @property
     def rw_engine(self):
@@ -543,6 +619,83 @@ class Database(object):
     #         s.execute("alter table %s %s trigger all;" % (table, enable))
     #     s.commit()
 
+    def delete_records(self, session, paths, keys, chunk_size=1000):
+        """Delete records owned by a set of keys using set-based DELETE queries.
+
+        This removes the same rows as loading the records with an ORM query and passing each one to
+        session.delete(): records reached through relationships with delete cascade are deleted,
+        and foreign keys of other dependent records are set to NULL. However, no records are loaded
+        into the session (except the IDs of records reached through many-to-one cascades).
+
+        Parameters
+        ----------
+        session : Session
+            Read-write session in which to execute the deletes (not committed).
+        paths : list
+            Ownership paths, each given as a tuple like ``('experiment.ext_id', 'pair', 'synapse')``.
+            The first item names the table and column to match against *keys*; each subsequent table
+            must have a foreign key referencing the table before it. All records in the final table
+            of each path are deleted.
+        keys : list
+            Values to match in the first column of each path.
+
+        Returns the number of rows deleted.
+        """
+        tables = self.metadata_tables()
+        mappers = {name: sqlalchemy.inspect(cls) for name, cls in self.orm_tables().items()}
+        deletes = OrderedDict()  # {table_name: [id selections]}
+        nullify = []  # [(table, fk_column, parent selection)]
+
+        def add(name, ids, chain):
+            deletes.setdefault(name, []).append(ids)
+            table = tables[name]
+            rels = [rel for rel in mappers[name].relationships if not rel.viewonly]
+            cascade_cols = set([col for rel in rels if rel.cascade.delete for _, col in rel.local_remote_pairs])
+            for rel in rels:
+                target = rel.mapper.local_table
+                (local_col, remote_col), = rel.local_remote_pairs
+                if local_col is table.c.id:
+                    parent_keys = ids
+                else:
+                    parent_keys = sqlalchemy.select([local_col]).where(table.c.id.in_(ids))
+                if rel.direction is ONETOMANY:
+                    if rel.cascade.delete:
+                        if target.name in chain:
+                            raise ValueError("Delete cascade cycle at %s" % target.name)
+                        child_ids = sqlalchemy.select([target.c.id]).where(remote_col.in_(parent_keys))
+                        add(target.name, child_ids, chain + [target.name])
+                    elif not rel.passive_deletes and remote_col not in cascade_cols:
+                        nullify.append((target, remote_col, parent_keys))
+                elif rel.direction is MANYTOONE and rel.cascade.delete:
+                    # referenced records can only be deleted after the referencing records are gone,
+                    # so their IDs must be collected first
+                    target_ids = sorted(set([rec[0] for rec in session.execute(parent_keys) if rec[0] is not None]))
+                    for i in range(0, len(target_ids), chunk_size):
+                        add(target.name, target_ids[i:i+chunk_size], chain + [target.name])
+
+        for path in paths:
+            table_name, _, column = path[0].partition('.')
+            table = tables[table_name]
+            ids = sqlalchemy.select([table.c.id]).where(table.c[column].in_(keys))
+            for child_name in path[1:]:
+                child = tables[child_name]
+                fks = [fk.parent for fk in child.foreign_keys if fk.column is table.c.id]
+                if len(fks) != 1:
+                    raise ValueError("Expected one foreign key from %s to %s (found %d)" % (child_name, table.name, len(fks)))
+                table = child
+                ids = sqlalchemy.select([table.c.id]).where(fks[0].in_(ids))
+            add(table.name, ids, [table.name])
+
+        for table, col, parent_keys in nullify:
+            session.execute(table.update().where(col.in_(parent_keys)).values({col.name: None}))
+
+        # delete from the most dependent tables first
+        n_deleted = 0
+        for name in reversed(list(tables.keys())):
+            for ids in deletes.get(name, []):
+                n_deleted += session.execute(tables[name].delete().where(tables[name].c.id.in_(ids))).rowcount
+        return n_deleted
+
     def vacuum(self, tables=None):
         """Cleans up database and analyzes table statistics in order to improve query planning.
         Should be run after any significant changes to the database.
@@ -571,6 +724,42 @@ class Database(object):
             last_size = size
             print("   sqlite file size:  %0.4fGB  (+%0.4fGB for %s)" % (size*1e-9, diff*1e-9, table))
 
+        sqlite_db.create_bake_indexes(self.bake_indexes)
+        sqlite_db.dispose_engines()
+
+    def create_bake_indexes(self, indexes=()):
+        """Create indexes that speed up read-only queries on a baked sqlite file.
+
+        An index is added for every foreign key column that is not already indexed, followed by the
+        multi-column *indexes*, given as a list of (table_name, [column_names]) tuples. Existing indexes
+        are left alone, so this is safe to call on partially indexed files. Table statistics are updated
+        afterward for the query planner.
+        """
+        meta_tables = self.metadata_tables()
+        new_indexes = []
+        for table in meta_tables.values():
+            indexed = set([col.name for col in table.columns if col.index or col.primary_key])
+            indexed |= set([list(ix.columns)[0].name for ix in table.indexes])
+            for fk in table.foreign_keys:
+                if fk.parent.name not in indexed:
+                    new_indexes.append((table.name, [fk.parent.name]))
+        new_indexes.extend(indexes)
+
+        existing = set()
+        for table_name in meta_tables:
+            existing |= set([ix['name'] for ix in sqlalchemy.inspect(self.rw_engine).get_indexes(table_name)])
+        for table_name, columns in new_indexes:
+            table = meta_tables[table_name]
+            name = 'ix_%s_%s' % (table_name, '_'.join(columns))
+            if name in existing:
+                continue
+            print("Creating index %s.." % name)
+            sqlalchemy.Index(name, *[table.columns[col] for col in columns]).create(bind=self.rw_engine)
+            existing.add(name)
+
+        with self.rw_engine.begin() as conn:
+            conn.execute('analyze')
+
     def clone_database(self, dest_db_name=None, dest_db=None, overwrite=False, **kwds):
         """Copy this database to a new one.
         """
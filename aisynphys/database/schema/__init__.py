@@ -2,7 +2,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from ..database import make_table_docstring, make_table as orig_make_table
 
 # schema version should be incremented whenever the schema has changed
-schema_version = "16"
+schema_version = "18"
 
 # all time series data are downsampled to this rate in the DB
 default_sample_rate = 20000
@@ -29,6 +29,7 @@ from .synapse_prediction import *
 from .resting_state_fit import *
 from .gap_junction import *
 from .patch_seq import *
+from .stochastic_model import *
 
 # Create all docstrings now that relationships have been declared
 for cls in ORMBase.__subclasses__():
@@ -247,6 +247,7 @@ PulseResponse = make_table(
         ('baseline_id', 'baseline.id', 'A random baseline snippet matched from the same recording.', {'index': True}),
         ('data', 'array', 'numpy array of response data sampled at '+sample_rate_str, {'deferred': True}),
         ('data_start_time', 'float', 'Starting time of this chunk of the recording in seconds, relative to the beginning of the recording'),
+        ('duration', 'float', 'Duration of the response data in seconds', {'index': True}),
         ('ex_qc_pass', 'bool', 'Indicates whether this recording snippet passes QC for excitatory synapse probing', {'index': True}),
         ('in_qc_pass', 'bool', 'Indicates whether this recording snippet passes QC for inhibitory synapse probing', {'index': True}),
     ]
@@ -0,0 +1,46 @@
+from sqlalchemy.orm import relationship
+from . import make_table
+from .experiment import Pair
+
+__all__ = ['StochasticModelResult']
+
+
+StochasticModelResult = make_table(
+    name='stochastic_model_result',
+    comment="""Results of running the stochastic release model over a grid of model parameters for each synapse.
+    Records are detached from their pair (pair_id is NULL) when the pair is dropped, and reused if the model
+    inputs of the reimported pair have the same input_hash.""",
+    columns=[
+        ('pair_id', 'pair.id', 'The ID of the entry in the pair table to which these results apply', {'index': True}),
+        ('experiment_ext_id', 'str', 'ext_id of the experiment containing the pair; used to match detached results to reimported pairs', {'index': True}),
+        ('pre_cell_ext_id', 'str', 'ext_id of the presynaptic cell'),
+        ('post_cell_ext_id', 'str', 'ext_id of the postsynaptic cell'),
+        ('input_hash', 'str', 'Hash of the model inputs (event times, amplitudes, and the parameter grid)'),
+        ('n_events', 'int', 'Number of presynaptic spikes in the model input'),
+        ('n_amplitudes', 'int', 'Number of events with a measured response amplitude'),
+
+        # maximum likelihood model
+        ('ml_likelihood', 'float', 'Likelihood of the best model in the parameter grid'),
+        ('ml_n_release_sites', 'int', 'Number of release sites in the maximum likelihood model'),
+        ('ml_base_release_probability', 'float', 'Resting release probability in the maximum likelihood model'),
+        ('ml_mini_amplitude', 'float', 'Optimized mini amplitude in the maximum likelihood model'),
+        ('ml_mini_amplitude_cv', 'float', 'Mini amplitude coefficient of variation in the maximum likelihood model'),
+        ('ml_vesicle_recovery_tau', 'float', 'Vesicle recovery time constant in the maximum likelihood model'),
+        ('ml_facilitation_amount', 'float', 'Facilitation amount in the maximum likelihood model'),
+        ('ml_facilitation_recovery_tau', 'float', 'Facilitation recovery time constant in the maximum likelihood model'),
+        ('ml_measurement_stdev', 'float', 'Measurement noise used by the model (from background amplitudes)'),
+
+        # likelihood landscape
+        ('likelihood_mean', 'float', 'Mean likelihood over the parameter grid'),
+        ('likelihood_stdev', 'float', 'Standard deviation of likelihood over the parameter grid'),
+        ('likelihood_near_max', 'float', 'Fraction of the parameter grid with likelihood within 5% of the maximum'),
+        ('parameter_space', 'object', 'Parameter grid: {"axes": [[name, values], ...], "static": {name: value}}'),
+        ('marginal_distributions', 'object', '{name: {"max": [...], "marginal": [...]}} for each grid axis. "max" is the maximum likelihood over all other axes; "marginal" is the normalized likelihood summed over all other axes.'),
+        ('likelihood', 'compressed_array', 'Model likelihood at every point in the parameter grid', {'deferred': True}),
+        ('mini_amplitude', 'compressed_array', 'Optimized mini amplitude at every point in the parameter grid', {'deferred': True}),
+    ]
+)
+
+# no delete cascade: deleting a pair detaches its results so that they can be reused
+Pair.stochastic_model_result = relationship(StochasticModelResult, back_populates="pair", uselist=False)
+StochasticModelResult.pair = relationship(Pair, back_populates="stochastic_model_result")
@@ -1,4 +1,5 @@
-import datetime
+import os, shutil, datetime
+import sqlalchemy
 from sqlalchemy.orm import aliased, contains_eager, selectinload
 from collections import OrderedDict
 from .database import Database
@@ -15,14 +16,25 @@ class SynphysDatabase(Database):
     mouse_projects = ["mouse V1 coarse matrix", "mouse V1 pre-production"]
     human_projects = ["human coarse matrix"]
 
+    # multi-column indexes covering the joins in pair_query and dynamics.pulse_response_query
+    bake_indexes = [
+        ('pair', ['experiment_id', 'pre_cell_id', 'post_cell_id']),
+        ('pulse_response', ['pair_id', 'stim_pulse_id', 'recording_id']),
+        ('stim_pulse', ['recording_id', 'onset_time']),
+        ('patch_clamp_recording', ['recording_id', 'clamp_mode']),
+    ]
+
 
     @classmethod
-    def load_sqlite(cls, sqlite_file, readonly=True):
+    def load_sqlite(cls, sqlite_file, readonly=True, immutable=False):
         """Return a SynphysDatabase instance connected to an existing sqlite file.
+
+        If *immutable* is True (and *readonly* is True), the file is opened with read-optimized
+        settings that assume it will not be modified while open (see :func:`Database.ro_engine`).
         """
         ro_host = 'sqlite:///'
         rw_host = None if readonly else ro_host
-        return cls(ro_host, rw_host, db_name=sqlite_file)
+        return cls(ro_host, rw_host, db_name=sqlite_file, immutable=immutable)
     
     @classmethod
     def list_versions(cls):
@@ -50,14 +62,19 @@ class SynphysDatabase(Database):
 
         """
         db_file = get_db_path(db_version)
-        db = SynphysDatabase.load_sqlite(db_file, readonly=False)
+        db = SynphysDatabase.load_sqlite(db_file, readonly=True, immutable=True)
         # instantiate any new tables that have been added to the schema but don't exist in the db file
-        db.create_tables()
+        if len(set(db.metadata_tables()) - set(db.table_names())) > 0:
+            rw_db = SynphysDatabase.load_sqlite(db_file, readonly=False)
+            rw_db.create_tables()
+            rw_db.dispose_engines()
+            Database.dispose_immutable_engine(db_file)
+            db = SynphysDatabase.load_sqlite(db_file, readonly=True, immutable=True)
         return db
 
-    def __init__(self, ro_host, rw_host, db_name):
+    def __init__(self, ro_host, rw_host, db_name, immutable=False):
         from .schema import ORMBase
-        Database.__init__(self, ro_host, rw_host, db_name, ORMBase)
+        Database.__init__(self, ro_host, rw_host, db_name, ORMBase, immutable=immutable)
         
     def create_tables(self, tables=None):
         """This method is used when initializing a new database or new tables within an existing database.
@@ -309,6 +326,174 @@ class SynphysDatabase(Database):
         
         return pairs
 
+    def bake_sqlite(self, sqlite_file, incremental=False, vacuum=True, skip_tables=(), skip_columns={}, **kwds):
+        """Dump a copy of this database to an sqlite file.
+
+        Extends :func:`Database.bake_sqlite` with an incremental mode. Each bake records the schema version
+        and the pipeline job finish times that it was built from; if *incremental* is True and *sqlite_file*
+        was previously baked with the same schema version, then only rows belonging to experiments whose
+        pipeline jobs changed (or that were added or removed) are deleted and copied again. Tables that do
+        not belong to an experiment (slice, pipeline, metadata, etc.) are copied in full. Otherwise, a full
+        bake is done.
+
+        Incremental bakes are written to a temporary copy of *sqlite_file* that replaces the original
+        only after the update is complete, so a failed update leaves the previous bake intact.
+        """
+        # record the state from before the bake; jobs that finish while baking are copied next time
+        new_state = self._pipeline_state()
+        if not incremental:
+            Database.bake_sqlite(self, sqlite_file, vacuum=vacuum, skip_tables=skip_tables, skip_columns=skip_columns, **kwds)
+            self._set_bake_state(sqlite_file, new_state)
+            return
+
+        tmp_file = sqlite_file + '.tmp'
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        try:
+            old_state = self._bake_state(sqlite_file) if os.path.exists(sqlite_file) else None
+            if old_state is None:
+                print("No bake state for schema version %s in %s; doing full bake" % (self.schema_version, sqlite_file))
+                Database.bake_sqlite(self, tmp_file, vacuum=vacuum, skip_tables=skip_tables, skip_columns=skip_columns, **kwds)
+            else:
+                shutil.copyfile(sqlite_file, tmp_file)
+                self._bake_sqlite_incremental(tmp_file, old_state, new_state, vacuum=vacuum, skip_tables=skip_tables, skip_columns=skip_columns)
+            self._set_bake_state(tmp_file, new_state)
+            os.replace(tmp_file, sqlite_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def _pipeline_state(self):
+        """Return {(module_name, job_id): (finish_time, success)} for all pipeline jobs.
+        """
+        session = self.session()
+        recs = session.query(self.Pipeline.module_name, self.Pipeline.job_id, self.Pipeline.finish_time, self.Pipeline.success).all()
+        session.close()
+        return {(rec[0], rec[1]): (str(rec[2]), rec[3]) for rec in recs}
+
+    @classmethod
+    def _bake_state(cls, sqlite_file):
+        """Return the pipeline state recorded in a baked sqlite file, or None if there is no record
+        or the file was baked with a different schema version.
+        """
+        engine = sqlalchemy.create_engine('sqlite:///' + sqlite_file)
+        try:
+            tables = engine.table_names()
+            if 'bake_state' not in tables or 'bake_info' not in tables:
+                return None
+            ver = engine.execute("select value from bake_info where key='schema_version'").fetchone()
+            if ver is None or ver[0] != cls.schema_version:
+                return None
+            recs = engine.execute("select module_name, job_id, finish_time, success from bake_state").fetchall()
+            return {(rec[0], rec[1]): (rec[2], None if rec[3] is None else bool(rec[3])) for rec in recs}
+        finally:
+            engine.dispose()
+
+    @classmethod
+    def _set_bake_state(cls, sqlite_file, state):
+        engine = sqlalchemy.create_engine('sqlite:///' + sqlite_file)
+        try:
+            with engine.begin() as conn:
+                conn.execute("create table if not exists bake_info (key text primary key, value text)")
+                conn.execute(sqlalchemy.text("insert or replace into bake_info values ('schema_version', :v)"), v=cls.schema_version)
+                conn.execute("create table if not exists bake_state (module_name text, job_id text, finish_time text, success boolean)")
+                conn.execute("delete from bake_state")
+                rows = [{'m': k[0], 'j': k[1], 't': v[0], 's': v[1]} for k, v in state.items()]
+                if len(rows) > 0:
+                    conn.execute(sqlalchemy.text("insert into bake_state values (:m, :j, :t, :s)"), rows)
+        finally:
+            engine.dispose()
+
+    def _bake_sqlite_incremental(self, sqlite_file, old_state, new_state, vacuum=True, skip_tables=(), skip_columns={}, chunksize=1000):
+        """Update a baked sqlite file in place from the pipeline state it was built with (*old_state*)
+        to *new_state*; see bake_sqlite().
+        """
+        sqlite_db = Database(ro_host="sqlite:///", rw_host="sqlite:///", db_name=sqlite_file, ormbase=self.ormbase)
+        sqlite_db.create_tables()
+        read_session = self.session(readonly=True)
+        write_session = sqlite_db.session(readonly=False)
+
+        # find experiments whose pipeline jobs changed since the last bake
+        changed_jobs = set([key[1] for key in set(old_state) | set(new_state) if old_state.get(key) != new_state.get(key)])
+        src_expts = set([rec[0] for rec in read_session.query(self.Experiment.ext_id)])
+        dst_expts = set([rec[0] for rec in write_session.query(self.Experiment.ext_id)])
+        changed = sorted((changed_jobs & (src_expts | dst_expts)) | (src_expts ^ dst_expts))
+        print("Incremental bake: %d experiments changed (%d pipeline jobs)" % (len(changed), len(changed_jobs)))
+        if len(changed_jobs) == 0 and len(changed) == 0:
+            read_session.close()
+            write_session.close()
+            sqlite_db.dispose_engines()
+            return
+
+        tables = [(name, table) for name, table in self.metadata_tables().items() if name not in skip_tables]
+        expt_table = self.Experiment.__table__
+
+        def owned_rows(table, expt_ids, memo):
+            """Return a select of table IDs that belong to *expt_ids*, or None if the table does not
+            belong to experiments.
+            """
+            if table.name not in memo:
+                memo[table.name] = None
+                if table is expt_table:
+                    memo[table.name] = sqlalchemy.select([table.c.id]).where(table.c.ext_id.in_(expt_ids))
+                else:
+                    conds = []
+                    for fk in table.foreign_keys:
+                        parent = fk.column.table
+                        if parent is table:
+                            continue
+                        parent_ids = owned_rows(parent, expt_ids, memo)
+                        if parent_ids is not None:
+                            conds.append(fk.parent.in_(parent_ids))
+                    if len(conds) > 0:
+                        memo[table.name] = sqlalchemy.select([table.c.id]).where(sqlalchemy.or_(*conds))
+            return memo[table.name]
+
+        # delete changed rows, most dependent tables first
+        for i in range(0, max(len(changed), 1), chunksize):
+            chunk = changed[i:i+chunksize]
+            memo = {}
+            for name, table in reversed(tables):
+                ids = owned_rows(table, chunk, memo)
+                if ids is None:
+                    if i == 0:
+                        write_session.execute(table.delete())
+                else:
+                    write_session.execute(table.delete().where(table.c.id.in_(ids)))
+        write_session.commit()
+
+        # copy changed rows
+        for name, table in tables:
+            print("Cloning %s.." % name)
+            columns = [col for col in table.columns if col.name not in skip_columns.get(name, [])]
+            n_rows = 0
+            for i in range(0, max(len(changed), 1), chunksize):
+                ids = owned_rows(table, changed[i:i+chunksize], {})
+                if ids is None:
+                    if i > 0:
+                        continue
+                    query = sqlalchemy.select(columns)
+                else:
+                    query = sqlalchemy.select(columns).where(table.c.id.in_(ids))
+                result = read_session.execute(query)
+                while True:
+                    recs = result.fetchmany(chunksize)
+                    if len(recs) == 0:
+                        break
+                    # convert to dict to avoid json column issues (see iter_copy_tables)
+                    write_session.execute(table.insert().prefix_with('OR REPLACE'), [dict(rec) for rec in recs])
+                    n_rows += len(recs)
+            print("   committing %d rows.." % n_rows)
+            write_session.commit()
+        read_session.close()
+        write_session.close()
+
+        sqlite_db.create_bake_indexes(self.bake_indexes)
+        if vacuum:
+            print("Optimizing database..")
+            sqlite_db.vacuum()
+        sqlite_db.dispose_engines()
+
     def __getstate__(self):
         """Allows DB to be pickled and passed to subprocesses.
         """
@@ -316,7 +501,8 @@ class SynphysDatabase(Database):
             'ro_host': self.ro_host, 
             'rw_host': self.rw_host, 
             'db_name': self.db_name,
+            'immutable': self.immutable,
         }
 
     def __setstate__(self, state):
-        self.__init__(ro_host=state['ro_host'], rw_host=state['rw_host'], db_name=state['db_name'])
+        self.__init__(ro_host=state['ro_host'], rw_host=state['rw_host'], db_name=state['db_name'], immutable=state.get('immutable', False))
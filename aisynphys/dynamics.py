@@ -2,6 +2,7 @@ import logging
 import numpy as np
 import scipy.stats
 from .database import default_db as db
+from .pulse_response_table import PulseResponseTable
 
 
 def sorted_pulse_responses(pr_recs):
@@ -40,6 +41,54 @@ def sorted_pulse_responses(pr_recs):
     return sorted_recs
 
 
+def pulse_train_amplitudes(pr_table, rows, amp_field):
+    """Return a dense matrix of pulse amplitudes with one row per recorded pulse train.
+
+    Parameters
+    ----------
+    pr_table : PulseResponseTable
+        Table of pulse responses.
+    rows : array
+        Indices of the table rows to include.
+    amp_field : str
+        Name of the table column containing amplitudes.
+
+    Returns
+    -------
+    ind_freq : array
+        Induction frequency of each train (NaN if unknown).
+    rec_delay : array
+        Recovery delay of each train (NaN if unknown).
+    amps : array
+        Amplitudes with shape (n_trains, max_pulse_number); ``amps[i, n-1]`` is the amplitude
+        of pulse *n* in train *i*, or NaN if there is no such response.
+
+    Trains are ordered the same way as the recordings in sorted_pulse_responses(): grouped
+    by stimulus parameters, in order of first appearance.
+    """
+    pulse_n = pr_table['pulse_number'][rows]
+    valid = np.isfinite(pulse_n)
+    rows, pulse_n = rows[valid], pulse_n[valid].astype(int)
+
+    rec_ids, train_rows, train_index = np.unique(pr_table['recording_id'][rows], return_index=True, return_inverse=True)
+    n_pulses = pulse_n.max() if len(rows) > 0 else 0
+    amps = np.full((len(rec_ids), n_pulses), np.nan)
+    amps[train_index, pulse_n - 1] = pr_table[amp_field][rows]
+
+    ind_freq = pr_table['induction_frequency'][rows][train_rows]
+    rec_delay = pr_table['recovery_delay'][rows][train_rows]
+
+    # order trains by the first appearance of their stimulus parameters, then of the train itself
+    stim_keys = np.stack([ind_freq, rec_delay], axis=1)
+    first_key = {}
+    key_order = np.empty(len(train_rows), dtype=int)
+    for i in np.argsort(train_rows, kind='stable'):
+        key = tuple(None if np.isnan(x) else x for x in stim_keys[i])
+        key_order[i] = first_key.setdefault(key, len(first_key))
+    order = np.lexsort((train_rows, key_order))
+    return ind_freq[order], rec_delay[order], amps[order]
+
+
 def pulse_response_query(pair, qc_pass=False, clamp_mode=None, data=False, spike_data=False, session=None):
     if session is None:
         session = db.session()
@@ -70,8 +119,11 @@ def pulse_response_query(pair, qc_pass=False, clamp_mode=None, data=False, spike
     return q
 
 
-def generate_pair_dynamics(pair, db, session):
+def generate_pair_dynamics(pair, db, session, pr_table=None):
     """Generate a Dynamics table entry for the given pair.
+
+    If *pr_table* (a PulseResponseTable for the pair's experiment) is given, pulse responses
+    are selected from it instead of querying the database.
     """
     logger = logging.getLogger(__name__)
     logger.info('generate dynamics for %s', pair)
@@ -80,148 +132,135 @@ def generate_pair_dynamics(pair, db, session):
     amp_field = 'dec_fit_reconv_amp'
     baseline_amp_field = 'baseline_' + amp_field
     
-    # load all IC pulse response amplitudes to determine the maximum that will be used for normalization
-    pr_query = pulse_response_query(pair, qc_pass=False, clamp_mode='ic', session=session)
-    pr_recs = pr_query.all()
+    if pr_table is None:
+        pr_table = PulseResponseTable(db, session, pair.experiment, pair_ids=[pair.id])
+
+    # select all IC pulse responses with a fit, recorded in a multipatch probe
+    # (the same records returned by pulse_response_query(pair, clamp_mode='ic'))
+    ic_mask = pr_table.mask(pair_id=pair.id, clamp_mode='ic') & pr_table.has_fit & pr_table.has_probe
+    all_amps = pr_table[amp_field]
+    qc_pass = pr_table[syn_type + '_qc_pass']
+
     # cull out all PRs that didn't get a fit or failed qc
-    qc_field = syn_type + '_qc_pass'
-    passed_pr_recs = [pr_rec for pr_rec in pr_recs if getattr(pr_rec.PulseResponse, qc_field) and getattr(pr_rec.PulseResponseFit, amp_field) is not None]
+    passed_rows = np.argwhere(ic_mask & qc_pass & np.isfinite(all_amps))[:, 0]
     
     percentile = 90 if syn_type == 'ex' else 10
     # dec_fit_reconv_amp generally has much lower noise than fit_amp:
-    amps = [getattr(rec.PulseResponseFit, amp_field) for rec in passed_pr_recs]
-    amp_90p = scipy.stats.scoreatpercentile(amps, percentile)
+    amp_90p = _percentile(all_amps[passed_rows], percentile)
 
     # load all baseline amplitudes to determine the noise level
-    noise_amps = np.array([getattr(rec.PulseResponseFit, baseline_amp_field) for rec in passed_pr_recs if getattr(rec.PulseResponseFit, baseline_amp_field) is not None])
+    noise_amps = pr_table[baseline_amp_field][passed_rows]
+    noise_amps = noise_amps[np.isfinite(noise_amps)]
     noise_std = noise_amps.std()
-    noise_90p = scipy.stats.scoreatpercentile(noise_amps, percentile)
+    noise_90p = _percentile(noise_amps, percentile)
+
+    # amplitudes at resting state
+    resting_amps = all_amps[passed_rows[pr_table['previous_pulse_dt'][passed_rows] > 8.0]]
+
+    # one row of amplitudes per pulse train: [train, pulse_number-1]
+    ind_freq, rec_delay, amps = pulse_train_amplitudes(pr_table, passed_rows, amp_field)
+    metrics = pulse_train_metrics(ind_freq, rec_delay, amps, amp_90p, noise_std, resting_amps)
+    if 'variability_resting_state' not in metrics:
+        logger.info("%s: no resting amps; bail out", pair)
 
-    # start new DB record
-    dynamics = db.Dynamics(
+    return db.Dynamics(
         pair_id=pair.id,
         pulse_amp_90th_percentile=amp_90p,
         noise_amp_90th_percentile=noise_90p,
         noise_std=noise_std,
+        **metrics
     )
 
-    # sort all PRs by recording and stimulus parameters
-    #   [(clamp_mode, ind_freq, recovery_delay)][recording][pulse_number]
-    sorted_prs = sorted_pulse_responses(passed_pr_recs)
+
+def pulse_train_metrics(ind_freq, rec_delay, amps, amp_90p, noise_std, resting_amps):
+    """Compute short term plasticity and variability metrics from a matrix of pulse train amplitudes.
+
+    Parameters
+    ----------
+    ind_freq, rec_delay, amps :
+        Pulse trains as returned by pulse_train_amplitudes().
+    amp_90p : float
+        Amplitude used for normalization (90th percentile for excitatory synapses, 10th for inhibitory).
+    noise_std : float
+        Standard deviation of baseline amplitudes.
+    resting_amps : array
+        Amplitudes of responses at resting state.
+
+    Returns
+    -------
+    metrics : dict
+        Values for Dynamics table columns. The variability columns are omitted if there are
+        no resting state amplitudes.
+    """
+    # pad to 12 pulses so that all pulse numbers used below can be indexed
+    n_trains = amps.shape[0]
+    if amps.shape[1] < 12:
+        amps = np.hstack([amps, np.full((n_trains, 12 - amps.shape[1]), np.nan)])
+    present = np.isfinite(amps)
+    # amplitude of pulse n for all trains is amp[n]
+    amp = {n: amps[:, n-1] for n in range(1, amps.shape[1]+1)}
+    is_50hz = ind_freq == 50
 
     # calculate 50Hz paired pulse and induction metrics
-    metrics = {'stp_initial_50hz': [], 'stp_induction_50hz': [], 'stp_recovery_250ms': []}
-    paired_pulse_ratio = []
-    
-    for key,recs in sorted_prs.items():
-        clamp_mode, ind_freq, rec_delay = key
-        if ind_freq != 50:
-            continue
-        for recording, pulses in recs.items():
-            if 1 not in pulses or 2 not in pulses:
-                continue
-            amps = {k:getattr(r.PulseResponseFit, amp_field) for k,r in pulses.items()}
-            metrics['stp_initial_50hz'].append((amps[2] - amps[1]) / amp_90p)
-            if amps[1] != 0:
-                paired_pulse_ratio.append(amps[2] / amps[1])
-
-            if any([k not in pulses for k in [1,6,7,8]]):
-                continue
-            metrics['stp_induction_50hz'].append((np.mean([amps[6], amps[7], amps[8]]) - amps[1]) / amp_90p)
-            
+    metrics = {}
+    initial = is_50hz & present[:, 0] & present[:, 1]
+    stp = {'stp_initial_50hz': (amp[2][initial] - amp[1][initial]) / amp_90p}
+    ppr = initial & (amp[1] != 0)
+    paired_pulse_ratio = amp[2][ppr] / amp[1][ppr]
+
+    induction = initial & present[:, 5:8].all(axis=1)
+    stp['stp_induction_50hz'] = (amps[induction, 5:8].mean(axis=1) - amp[1][induction]) / amp_90p
+
     # PPR is a bit out of place here, but we're including it since it's a popular metric used
     # in the literature.
-    dynamics.paired_pulse_ratio_50hz = scipy.stats.gmean(paired_pulse_ratio)
-    
+    metrics['paired_pulse_ratio_50hz'] = scipy.stats.gmean(paired_pulse_ratio)
+
     # calculate recovery at 250 ms
-    for key,recs in sorted_prs.items():
-        clamp_mode, ind_freq, rec_delay = key
-        if rec_delay is None:
-            continue
-        if abs(rec_delay - 250e-3) > 5e-3:
-            continue
-        for recording, pulses in recs.items():
-            if any([k not in pulses for k in range(1,13)]):
-                continue
-            amps = {k:getattr(r.PulseResponseFit, amp_field) for k,r in pulses.items()}
-            r = [amps[i+8] - amps[i] for i in range(1,5)]
-            metrics['stp_recovery_250ms'].append(np.mean(r) / amp_90p)
-
-    for k,v in metrics.items():
-        setattr(dynamics, k, np.mean(v))
-        setattr(dynamics, k+'_n', len(v))
-        setattr(dynamics, k+'_std', np.std(v))
-        
+    recovery = (np.abs(rec_delay - 250e-3) <= 5e-3) & present[:, :12].all(axis=1)
+    stp['stp_recovery_250ms'] = (amps[recovery, 8:12] - amps[recovery, 0:4]).mean(axis=1) / amp_90p
+
+    for k,v in stp.items():
+        metrics[k] = np.mean(v)
+        metrics[k+'_n'] = len(v)
+        metrics[k+'_std'] = np.std(v)
+
     # Measure PSP variability -- we want a metric something like the coefficient of variation, but 
     # normalized against the 90th% amplitude, and with measurement noise subtracted out. This
     # ends up looking like:
     #     sqrt(amp_stdev^2 - noise_stdev^2) / abs(amp_90th_percentile)
-        
-    # Variability at resting state:
-    resting_amps = []
-    for pr_rec in pr_recs:
-        if pr_rec.StimPulse.previous_pulse_dt > 8.0 and getattr(pr_rec.PulseResponse, qc_field):
-            resting_amps.append(getattr(pr_rec.PulseResponseFit, amp_field))
-    
     if len(resting_amps) == 0:
-        logger.info("%s: no resting amps; bail out", pair)
-        return dynamics
-        
+        return metrics
+
     def variability(x):
+        if len(x) == 0:
+            return np.nan
         return np.log((np.std(x)**2 - noise_std**2)**0.5 / abs(np.mean(x)))
 
-    dynamics.variability_resting_state = variability(resting_amps)
-
-    # Variability in STP-induced state (5th-8th pulses)
-    pulse_amps = {
-        (2,3): [],
-        (5,9): [],
-    }
-    # collect pulse amplitudes in each category
-    for key,recs in sorted_prs.items():
-        clamp_mode, ind_freq, rec_delay = key
-        if ind_freq != 50:
-            continue
-        for recording, pulses in recs.items():
-            for pulse_n, amps in pulse_amps.items():
-                if any([k not in pulses for k in range(1,pulse_n[-1])]):
-                    continue
-                for n in range(*pulse_n):
-                    amps.append(getattr(pulses[n].PulseResponseFit, amp_field))
-    
-    # normalize
-    pulse_var = {n:(variability(a) if len(a) > 0 else np.nan) for n,a in pulse_amps.items()}
-        
-    # record changes in vairabilty
-    dynamics.variability_second_pulse_50hz = pulse_var[2,3]
-    dynamics.variability_stp_induced_state_50hz = pulse_var[5,9]
-    dynamics.variability_change_initial_50hz = pulse_var[2,3] - dynamics.variability_resting_state
-    dynamics.variability_change_induction_50hz = pulse_var[5,9] - dynamics.variability_resting_state
-    
+    # Variability at resting state, after the second pulse, and in STP-induced state (5th-8th pulses)
+    metrics['variability_resting_state'] = variability(resting_amps)
+    second_pulse = variability(amp[2][initial])
+    induced = variability(amps[is_50hz & present[:, :8].all(axis=1), 4:8].ravel())
+    metrics['variability_second_pulse_50hz'] = second_pulse
+    metrics['variability_stp_induced_state_50hz'] = induced
+    metrics['variability_change_initial_50hz'] = second_pulse - metrics['variability_resting_state']
+    metrics['variability_change_induction_50hz'] = induced - metrics['variability_resting_state']
+
     # Look for evidence of vesicle depletion -- correlations between adjacent events in 50Hz pulses 5-8.
-    ev1_amp = []
-    ev2_amp = []
-    pulse_amps = [[] for i in range(9)]
-    for key,recs in sorted_prs.items():
-        clamp_mode, ind_freq, rec_delay = key
-        if ind_freq != 50:
-            continue
-        for recording, pulses in recs.items():
-            for i in range(1,9):
-                if i not in pulses:
-                    break
-                if i < 6:
-                    continue
-                ev1_amp.append(getattr(pulses[i-1].PulseResponseFit, amp_field))
-                ev2_amp.append(getattr(pulses[i].PulseResponseFit, amp_field))
-
-    ev1_amp = np.array(ev1_amp)
-    ev2_amp = np.array(ev2_amp)
+    # Pairs (n-1, n) for n=6..8 are used while all pulses up to n are present in a train.
+    leading = np.cumprod(present[:, :8], axis=1).astype(bool)
+    pairs = is_50hz[:, None] & leading[:, 5:8]
+    ev1_amp = amps[:, 4:7][pairs]
+    ev2_amp = amps[:, 5:8][pairs]
     ev1_amp -= np.median(ev1_amp)
     ev2_amp -= np.median(ev2_amp)
     
     r,p = scipy.stats.pearsonr(ev1_amp, ev2_amp)
-    dynamics.paired_event_correlation_r = r
-    dynamics.paired_event_correlation_p = p
-    
-    return dynamics
+    metrics['paired_event_correlation_r'] = r
+    metrics['paired_event_correlation_p'] = p
+
+    return metrics
+
+
+def _percentile(x, percentile):
+    # scipy.stats.scoreatpercentile returns NaN for empty input; np.percentile raises
+    return np.percentile(x, percentile) if len(x) > 0 else np.nan
@@ -0,0 +1,118 @@
+"""
+On-disk index of experiments parsed from the server, used by ExperimentList.
+
+Each experiment is stored as a JSON document holding the metadata that is slow to
+collect (pipettes.yml and .index contents, LIMS records, file locations, cell positions); see
+Experiment.index_state() and Experiment.from_index_state().
+"""
+from __future__ import print_function
+import json, sqlite3, datetime
+
+
+class ExperimentIndex(object):
+    """On-disk index of parsed experiments, stored in sqlite.
+
+    Each row is keyed by the path of the pipettes.yml file that the experiment was parsed
+    from, and records the modification time of that file and the ExperimentList cache version
+    in effect when it was parsed. This allows ExperimentList.load_from_server to re-parse only
+    experiments that are new or have changed since the index was last updated.
+    """
+    format_version = 3
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.execute("create table if not exists meta (key text primary key, value text)")
+        ver = self.db.execute("select value from meta where key='format_version'").fetchone()
+        if ver is not None and int(ver[0]) > self.format_version:
+            raise Exception("Experiment index %s was written by a newer version (%s > %s)" % (filename, ver[0], self.format_version))
+        if ver is not None and int(ver[0]) < self.format_version:
+            # older formats stored pickled experiments (1) or lacked pipettes.yml content (2); start over
+            self.db.execute("drop table if exists experiments")
+        self.db.execute("insert or replace into meta values ('format_version', ?)", (str(self.format_version),))
+        self.db.execute("""create table if not exists experiments (
+            yml_file text primary key,
+            mtime real,
+            cache_version integer,
+            uid text,
+            state text
+        )""")
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute("select count(*) from experiments").fetchone()[0]
+
+    def entries(self):
+        """Return {yml_file: (mtime, cache_version)} for all experiments in the index.
+        """
+        rows = self.db.execute("select yml_file, mtime, cache_version from experiments")
+        return {yml: (mtime, ver) for yml, mtime, ver in rows}
+
+    def load(self, cache_version, yml_files=None):
+        """Return a list of (yml_file, state) loaded from the index.
+
+        Only entries recorded with *cache_version* are returned.
+        """
+        rows = self.db.execute("select yml_file, state from experiments where cache_version=?", (cache_version,))
+        if yml_files is not None:
+            yml_files = set(yml_files)
+        states = []
+        for yml, state in rows:
+            if yml_files is not None and yml not in yml_files:
+                continue
+            states.append((yml, json_loads(state)))
+        return states
+
+    def store(self, yml_file, mtime, cache_version, uid, state):
+        """Store the *state* dict of one experiment.
+
+        *mtime* may be None to force the entry to be re-parsed on the next update.
+        """
+        self.db.execute("insert or replace into experiments values (?, ?, ?, ?, ?)",
+            (yml_file, mtime, cache_version, uid, json_dumps(state)))
+
+    def remove(self, yml_files):
+        self.db.executemany("delete from experiments where yml_file=?", [(yml,) for yml in yml_files])
+
+    def commit(self):
+        self.db.commit()
+
+
+def json_dumps(state):
+    """Encode a dict as JSON, including datetime/date and numpy values.
+
+    Top-level items that cannot be encoded are omitted; they will be recomputed
+    on demand by the restored object.
+    """
+    encodable = {}
+    for key, value in state.items():
+        try:
+            json.dumps(value, default=_json_default)
+        except (TypeError, ValueError):
+            continue
+        encodable[key] = value
+    return json.dumps(encodable, default=_json_default)
+
+
+def json_loads(text):
+    return json.loads(text, object_hook=_json_object_hook)
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime.datetime):
+        return {'__datetime__': obj.isoformat()}
+    if isinstance(obj, datetime.date):
+        return {'__date__': obj.isoformat()}
+    if hasattr(obj, 'tolist'):
+        # numpy arrays and scalars
+        return obj.tolist()
+    raise TypeError("Cannot encode %r as JSON" % obj)
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.datetime.fromisoformat(obj['__datetime__'])
+        if '__date__' in obj:
+            return datetime.date.fromisoformat(obj['__date__'])
+    return obj
@@ -0,0 +1,135 @@
+"""
+Concurrent file hashing with a persistent manifest of previously computed hashes.
+
+Hashes are stored in an sqlite manifest keyed by (path, size, mtime), so files that have not
+changed since they were last hashed are never read again.
+"""
+from __future__ import print_function, division
+import os, sys, time, hashlib, sqlite3, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .util import si_format
+
+
+class HashManifest(object):
+    """sqlite record of file hashes, keyed by absolute path, size, and mtime.
+
+    Only use from the thread that created it.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the sqlite file (created if needed).
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        dirname = os.path.dirname(filename)
+        if dirname != '' and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.db = sqlite3.connect(filename)
+        self.db.execute("""create table if not exists file_hash (
+            path text, algorithm text, size integer, mtime real, hash text,
+            primary key (path, algorithm)
+        )""")
+        self.db.commit()
+
+    def get(self, path, size, mtime, algorithm):
+        """Return the stored hash for a file, or None if the file has no hash or has changed.
+        """
+        rec = self.db.execute("select size, mtime, hash from file_hash where path=? and algorithm=?",
+            (os.path.abspath(path), algorithm)).fetchone()
+        if rec is None or rec[0] != size or rec[1] != mtime:
+            return None
+        return rec[2]
+
+    def set(self, path, size, mtime, algorithm, hash):
+        with self.db:
+            self.db.execute("insert or replace into file_hash values (?, ?, ?, ?, ?)",
+                (os.path.abspath(path), algorithm, size, mtime, hash))
+
+    def close(self):
+        self.db.close()
+
+
+def file_hash(filename, blocksize=2**24, func=hashlib.sha1, progress=None):
+    """Return the hex digest of a file's contents.
+
+    The file is read in blocks of *blocksize* bytes into a single reused buffer.
+    If given, *progress(n_bytes)* is called after each block is read.
+    """
+    hash = func()
+    buf = bytearray(blocksize)
+    view = memoryview(buf)
+    with open(filename, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hash.update(view[:n])
+            if progress is not None:
+                progress(n)
+    return hash.hexdigest()
+
+
+def hash_files(files, manifest=None, workers=4, blocksize=2**24, func=hashlib.sha1, verbose=True):
+    """Return {filename: hex_digest} for many files, hashing files concurrently in a thread pool.
+
+    Parameters
+    ----------
+    files : list
+        Files to hash.
+    manifest : HashManifest | None
+        If given, hashes of unchanged files are read from the manifest, and newly computed hashes
+        are added to it as soon as each file finishes (so interrupted runs can be resumed).
+    workers : int
+        Number of files to read concurrently.
+    blocksize : int
+        Number of bytes per read.
+    func : callable
+        Hash constructor from hashlib.
+    verbose : bool
+        If True, print progress (bytes hashed and rate) while hashing.
+    """
+    algorithm = func().name
+    hashes = {}
+    todo = []
+    total_bytes = 0
+    for filename in files:
+        if filename in hashes:
+            continue
+        stat = os.stat(filename)
+        if manifest is not None:
+            hash = manifest.get(filename, stat.st_size, stat.st_mtime, algorithm)
+            if hash is not None:
+                hashes[filename] = hash
+                continue
+        hashes[filename] = None
+        todo.append((filename, stat))
+        total_bytes += stat.st_size
+
+    lock = threading.Lock()
+    state = {'bytes': 0}
+    def progress(n_bytes):
+        with lock:
+            state['bytes'] += n_bytes
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(file_hash, filename, blocksize, func, progress): (filename, stat) for filename, stat in todo}
+        pending = set(futures.keys())
+        while len(pending) > 0:
+            done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            for fut in done:
+                filename, stat = futures[fut]
+                hashes[filename] = fut.result()
+                if manifest is not None:
+                    manifest.set(filename, stat.st_size, stat.st_mtime, algorithm, hashes[filename])
+            if verbose:
+                n_bytes = state['bytes']
+                rate = n_bytes / max(time.time() - start, 1e-6)
+                sys.stdout.write("      hashed %s / %s  (%s)      \r" % (
+                    si_format(n_bytes, suffix='B'), si_format(total_bytes, suffix='B'), si_format(rate, suffix='B/s')))
+                sys.stdout.flush()
+    if verbose and len(todo) > 0:
+        sys.stdout.write("\n")
+
+    return hashes
@@ -2,7 +2,9 @@
 avg_first_pulse_fit table.
 """
 
+from collections import OrderedDict
 import numpy as np
+from sqlalchemy.orm import aliased
 from neuroanalysis.data import TSeries, TSeriesList
 from neuroanalysis.fitting import fit_psp
 from .database import default_db as db
@@ -126,7 +128,124 @@ def extract_first_pulse_info_from_Pair_object(pair, desired_clamp='ic'):
     return pulse_responses, pulse_ids, psp_amps_measured, stim_freq
 
 
-def get_average_pulse_response(pair, desired_clamp='ic'):
+def extract_first_pulse_info_from_experiment(expt, session):
+    """Extract spike-aligned first pulse responses for all pairs in an experiment using a single query.
+
+    This selects the same pulse responses as extract_first_pulse_info_from_Pair_object (first pulses
+    with exactly one presynaptic spike that pass the qc matching the pair's synapse type), but for both
+    clamp modes and all pairs at once, and returns response data as arrays rather than TSeries.
+
+    Input
+    -----
+    expt: aisynphys.database.database.Experiment object
+    session: database session
+
+    Return
+    ------
+    pulse_data: dict
+        {pair_id: {clamp_mode: FirstPulseData}} for each pair and clamp mode with at least one
+        acceptable pulse response.
+    """
+    pre_rec = aliased(db.Recording)
+    pre_pcr = aliased(db.PatchClampRecording)
+    sp = db.SynapsePrediction
+    pr = db.PulseResponse
+    q = session.query(
+        pr.pair_id,
+        pr.stim_pulse_id,
+        pr.data,
+        pr.data_start_time,
+        sp.synapse_type,
+        pre_pcr.clamp_mode,
+        db.MultiPatchProbe.induction_frequency,
+        db.StimSpike.max_slope_time,
+        db.PulseResponseStrength.pos_amp,
+        db.PulseResponseStrength.neg_amp,
+    )
+    q = q.join(db.Pair, pr.pair_id==db.Pair.id)
+    q = q.join(sp, sp.pair_id==db.Pair.id)
+    q = q.join(db.StimPulse, pr.stim_pulse_id==db.StimPulse.id)
+    q = q.join(db.StimSpike, db.StimSpike.stim_pulse_id==db.StimPulse.id)
+    # note: clamp mode and induction frequency are taken from the presynaptic recording
+    q = q.join(pre_rec, db.StimPulse.recording_id==pre_rec.id)
+    q = q.join(pre_pcr, pre_pcr.recording_id==pre_rec.id)
+    q = q.outerjoin(db.MultiPatchProbe, db.MultiPatchProbe.patch_clamp_recording_id==pre_pcr.id)
+    q = q.outerjoin(db.PulseResponseStrength, db.PulseResponseStrength.pulse_response_id==pr.id)
+    q = q.filter(db.Pair.experiment_id==expt.id)
+    q = q.filter(db.StimPulse.pulse_number==1)
+    q = q.filter(db.StimPulse.n_spikes==1)
+    q = q.filter(((sp.synapse_type=='ex') & (pr.ex_qc_pass==True)) | ((sp.synapse_type=='in') & (pr.in_qc_pass==True)))
+    q = q.order_by(pr.id, db.StimSpike.id)
+
+    # group records by pair and clamp mode, keeping only the first spike of each pulse
+    groups = OrderedDict()
+    last_pulse = None
+    for rec in q.all():
+        key = (rec.pair_id, rec.stim_pulse_id)
+        if key == last_pulse:
+            continue
+        last_pulse = key
+        if rec.max_slope_time is None:
+            continue
+        groups.setdefault((rec.pair_id, rec.clamp_mode), []).append(rec)
+
+    pulse_data = {}
+    for (pair_id, clamp_mode), recs in groups.items():
+        pulse_data.setdefault(pair_id, {})[clamp_mode] = FirstPulseData(recs, sample_rate=db.default_sample_rate)
+    return pulse_data
+
+
+class FirstPulseData(object):
+    """Spike-aligned first pulse responses for one pair and clamp mode (see extract_first_pulse_info_from_experiment).
+
+    Attributes
+    ----------
+    data: 2D array
+        Pulse responses (one per row), aligned and cropped as by TSeriesList.mean() after each response
+        has been sliced to begin at *time_before_spike* before the presynaptic spike.
+    t0: float
+        time of the first column of *data*, relative to *time_before_spike* before the spike
+    pulse_ids: list of ints
+        stim_pulse ids of each response
+    psp_amps_measured: list of floats
+        amplitude of each response from the pulse_response_strength table
+    stim_freq: float
+        the stimulation frequency of the last response
+    dt: float
+        sample interval
+    """
+    def __init__(self, recs, sample_rate):
+        self.dt = 1.0 / sample_rate
+        self.pulse_ids = [rec.stim_pulse_id for rec in recs]
+        self.psp_amps_measured = [rec.pos_amp if rec.synapse_type == 'ex' else rec.neg_amp for rec in recs]
+        self.stim_freq = recs[-1].induction_frequency
+
+        # crop each response to begin at the sample nearest (spike_time - time_before_spike), as
+        # TSeries.time_slice(start=0) does in extract_first_pulse_info_from_Pair_object
+        starts = []
+        t0s = []
+        for rec in recs:
+            t0 = rec.data_start_time - rec.max_slope_time + time_before_spike
+            start = max(0, int(np.round(-t0 * sample_rate)))
+            starts.append(start)
+            t0s.append(t0 + start * self.dt)
+
+        # align all responses to the latest start time, as TSeriesList.mean does
+        self.t0 = max(t0s)
+        starts = [start + int(np.round((self.t0 - t0) * sample_rate)) for start, t0 in zip(starts, t0s)]
+        n_samples = min([len(rec.data) - start for rec, start in zip(recs, starts)])
+        self.data = np.vstack([rec.data[start:start+n_samples] for rec, start in zip(recs, starts)])
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def average(self):
+        """Return the average response as a TSeries with t0 relative to *time_before_spike* before the spike.
+        """
+        return TSeries(data=self.data.mean(axis=0), t0=self.t0, dt=self.dt)
+
+
+def get_average_pulse_response(pair, desired_clamp='ic', pulse_data=None):
     """
     Inputs
     ------
@@ -137,6 +256,9 @@ def get_average_pulse_response(pair, desired_clamp='ic'):
         Options are:
             'ic': current clamp
             'vc': voltage clamp
+    pulse_data: dict | None
+        Pulse responses for this pair previously extracted with extract_first_pulse_info_from_experiment
+        ({clamp_mode: FirstPulseData}). If None, pulse responses are queried for this pair only.
 
     Returns
     -------
@@ -156,14 +278,24 @@ def get_average_pulse_response(pair, desired_clamp='ic'):
     measured_baseline: float
         value of baseline
     """
-    # get pulses that pass qc
-    pulse_responses, pulse_ids, psp_amps_measured, freq = extract_first_pulse_info_from_Pair_object(pair, desired_clamp=desired_clamp)
-
-    # if pulses are returned take the average
-    if len(pulse_responses)>0:
-        avg_psp=TSeriesList(pulse_responses).mean()
+    if pulse_data is not None:
+        first_pulses = pulse_data.get(desired_clamp)
+        if first_pulses is None:
+            return None, None, None, None, None, None, None
+        pulse_responses = first_pulses.data
+        pulse_ids = first_pulses.pulse_ids
+        psp_amps_measured = first_pulses.psp_amps_measured
+        freq = first_pulses.stim_freq
+        avg_psp = first_pulses.average()
     else:
-        return None, None, None, None, None, None, None
+        # get pulses that pass qc
+        pulse_responses, pulse_ids, psp_amps_measured, freq = extract_first_pulse_info_from_Pair_object(pair, desired_clamp=desired_clamp)
+
+        # if pulses are returned take the average
+        if len(pulse_responses)>0:
+            avg_psp=TSeriesList(pulse_responses).mean()
+        else:
+            return None, None, None, None, None, None, None
 
     # get the measured baseline and amplitude of psp
     measured_relative_amp, measured_baseline=measure_amp(avg_psp.data, 
@@ -260,7 +392,12 @@ def fit_trace(waveform, excitation, clamp_mode='ic', weight=None, latency=None,
     return fit
 
 
-def fit_average_first_pulses(pair):
+def fit_average_first_pulses(pair, pulse_data=None):
+    """Fit the average first pulse response in current and voltage clamp for a pair.
+
+    *pulse_data* may be the pair's entry from extract_first_pulse_info_from_experiment; if it is
+    None then responses are queried for this pair alone.
+    """
     # get response latency from average of all pulse responses
     message = None #initialize error message 
     xoffset = pair.synapse_prediction.ic_fit_xoffset
@@ -274,9 +411,9 @@ def fit_average_first_pulses(pair):
     # -----------fit current clamp data---------------------        
     # get pulses
     (pulse_responses_i, pulse_ids_i, psp_amps_measured_i, freq, avg_psp_i, 
-        measured_relative_amp_i, measured_baseline_i) = get_average_pulse_response(pair, desired_clamp='ic')
+        measured_relative_amp_i, measured_baseline_i) = get_average_pulse_response(pair, desired_clamp='ic', pulse_data=pulse_data)
 
-    if pulse_responses_i:
+    if avg_psp_i is not None:
         # weight and fit the trace
         weight_i = np.ones(len(avg_psp_i.data)) * 10.  #set everything to ten initially
         weight_i[int((time_before_spike-3e-3) / avg_psp_i.dt):int(time_before_spike / avg_psp_i.dt)] = 0.   #area around stim artifact note that since this is spike aligned there will be some blur in where the cross talk is
@@ -304,9 +441,9 @@ def fit_average_first_pulses(pair):
     # --------------fit voltage clamp data---------------------        
     # get pulses
     (pulse_responses_v, pulse_ids_v, psp_amps_measured_v, freq_v, avg_psp_v,  
-        measured_relative_amp_v, measured_baseline_v) = get_average_pulse_response(pair, desired_clamp='vc')
+        measured_relative_amp_v, measured_baseline_v) = get_average_pulse_response(pair, desired_clamp='vc', pulse_data=pulse_data)
 
-    if pulse_responses_v:
+    if avg_psp_v is not None:
         # weight and fit the trace    
         weight_v = np.ones(len(avg_psp_v.data))*10.  #set everything to ten initially
         weight_v[int((time_before_spike+.0001+xoffset)/avg_psp_v.dt):int((time_before_spike+.0001+xoffset+4e-3)/avg_psp_v.dt)] = 30.  #area around steep PSP rise 
@@ -1,9 +1,7 @@
 import numpy as np
 import warnings, sys
 
-from pyqtgraph.debug import Profiler
 from neuroanalysis.data import TSeriesList
-from neuroanalysis.fitting import StackedPsp, Psp, fit_psp
 from aisynphys.data import PulseResponseList
 
 
@@ -29,17 +27,17 @@ def fit_avg_pulse_response(pulse_response_list, latency_window, sign, init_param
         The averaged pulse response data
     
     """
-    prof = Profiler(disabled=True, delayed=False)
+    # neuroanalysis.fitting loads lmfit and (optionally) Qt; only import it where fits are done
+    from neuroanalysis.fitting import fit_psp
+
     pair = pulse_response_list[0].pair
     clamp_mode = pulse_response_list[0].recording.patch_clamp_recording.clamp_mode
 
     # make a list of spike-aligned postsynaptic tseries
     tsl = PulseResponseList(pulse_response_list).post_tseries(align='spike', bsub=True)
-    prof('make tseries list')
     
     # average all together
     average = tsl.mean()
-    prof('average')
         
     # start with even weighting
     weight = np.ones(len(average))
@@ -55,9 +53,7 @@ def fit_avg_pulse_response(pulse_response_list, latency_window, sign, init_param
     if abs(pre_id - post_id) < 3:
         # nearby electrodes; mask out crosstalk
         pass
-    prof('weights')
 
     fit = fit_psp(average, search_window=latency_window, clamp_mode=clamp_mode, sign=sign, baseline_like_psp=True, init_params=init_params, fit_kws={'weights': weight})
-    prof('fit')
     
     return fit, average
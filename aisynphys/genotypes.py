@@ -1,5 +1,5 @@
 from __future__ import print_function
-import sys, itertools
+import sys, itertools, functools
 
 # ----------------- Genotype Handling ----------------------------
 # The purpose of the code below is to be able to ask, given a mouse genotype string, 
@@ -323,8 +323,13 @@ class Genotype(object):
 
             gt.predict_driver_expression({'red': True})
             # returns: {'pvalb': True, 'tlx3': None}
+
+        Results are cached per (genotype, colors, starting_factors); the same query
+        repeated for many cells of the same genotype only runs the model once.
         """
-        return self.model.reverse_model(unknown_factors=self.all_drivers, products=colors, starting_factors=starting_factors)
+        colors = tuple(sorted(colors.items()))
+        starting_factors = tuple(sorted(set(starting_factors)))
+        return dict(_predict_driver_expression(self.gtype, colors, starting_factors))
 
     def test_driver_combinations(self, colors, starting_factors=()):
         """Given information about fluorescent colors expressed in a cell,
@@ -408,6 +413,16 @@ class Genotype(object):
         self.all_colors = set([FLUOROPHORES[r] for r in self.all_reporters if r in FLUOROPHORES])
 
 
+@functools.lru_cache(maxsize=4096)
+def _predict_driver_expression(gtype, colors, starting_factors):
+    """Cached implementation of Genotype.predict_driver_expression.
+
+    *colors* and *starting_factors* must be given as hashable (sorted tuple) forms.
+    """
+    gt = Genotype(gtype)
+    return gt.model.reverse_model(unknown_factors=gt.all_drivers, products=dict(colors), starting_factors=starting_factors)
+
+
 class GeneticModel:
     """Genetic modeling engine.
 
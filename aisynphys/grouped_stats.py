@@ -0,0 +1,171 @@
+# coding: utf8
+"""
+Statistics computed for many groups of samples at once.
+
+Each function takes groups concatenated into flat arrays, with group i stored at
+values[offsets[i]:offsets[i+1]] (see concatenate_groups()). This lets analyses that
+compare many pairs and clamp modes (see synapse_prediction) replace per-group calls to
+numpy and scipy.stats with a few array operations.
+"""
+from __future__ import print_function, division
+
+import numpy as np
+import scipy.stats
+
+
+def concatenate_groups(arrays):
+    """Concatenate a list of 1D arrays, returning (values, offsets) where group i is values[offsets[i]:offsets[i+1]].
+    """
+    offsets = np.zeros(len(arrays) + 1, dtype=int)
+    offsets[1:] = np.cumsum([len(a) for a in arrays])
+    if len(arrays) == 0:
+        return np.zeros(0), offsets
+    return np.concatenate([np.asarray(a, dtype=float) for a in arrays]), offsets
+
+
+def _group_index(offsets):
+    """Return the group number of each element in concatenated groups described by *offsets*.
+    """
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def grouped_mean_std(values, offsets):
+    """Return (mean, stdev) of each group in concatenated *values*; group i is
+    values[offsets[i]:offsets[i+1]]. Empty groups give NaN.
+    """
+    groups = _group_index(offsets)
+    n = np.diff(offsets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(groups, weights=values, minlength=len(n)) / n
+        var = np.bincount(groups, weights=(values - mean[groups])**2, minlength=len(n)) / n
+    return mean, var**0.5
+
+
+def grouped_ttest_ind(a, b, offsets):
+    """Welch's t-test p values comparing a[offsets[i]:offsets[i+1]] to b[offsets[i]:offsets[i+1]]
+    for every group i.
+
+    Equivalent to ``scipy.stats.ttest_ind(a_i, b_i, equal_var=False).pvalue`` for each group.
+    """
+    groups = _group_index(offsets)
+    n = np.diff(offsets).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_a = np.bincount(groups, weights=a, minlength=len(n)) / n
+        mean_b = np.bincount(groups, weights=b, minlength=len(n)) / n
+        vn_a = np.bincount(groups, weights=(a - mean_a[groups])**2, minlength=len(n)) / (n - 1) / n
+        vn_b = np.bincount(groups, weights=(b - mean_b[groups])**2, minlength=len(n)) / (n - 1) / n
+        df = (vn_a + vn_b)**2 / (vn_a**2 / (n - 1) + vn_b**2 / (n - 1))
+        # undefined df means both variances are zero; df is then irrelevant
+        df = np.where(np.isnan(df), 1., df)
+        t = (mean_a - mean_b) / np.sqrt(vn_a + vn_b)
+    return 2 * scipy.stats.t.sf(np.abs(t), df)
+
+
+def grouped_ks_2samp(a, b, offsets):
+    """Two-sided two-sample KS test p values comparing a[offsets[i]:offsets[i+1]] to
+    b[offsets[i]:offsets[i+1]] for every group i.
+
+    The KS statistic for all groups is computed from a single sort of the concatenated
+    samples. P values match ``scipy.stats.ks_2samp(a_i, b_i).pvalue`` (exact for samples
+    of up to 10000 values, asymptotic otherwise). Groups containing NaN give NaN.
+    """
+    n = np.diff(offsets)
+    n_groups = len(n)
+    groups = _group_index(offsets)
+
+    # sort both samples of each group together; ties are evaluated after the last tied value
+    values = np.concatenate([a, b])
+    all_groups = np.concatenate([groups, groups])
+    is_a = np.concatenate([np.ones(len(a)), np.zeros(len(b))])
+    order = np.lexsort((values, all_groups))
+    values, all_groups, is_a = values[order], all_groups[order], is_a[order]
+    group_start = np.concatenate([[0], np.cumsum(2 * n)[:-1]]) if n_groups > 0 else np.zeros(0, dtype=int)
+    cum_a = np.cumsum(is_a)
+    cum_a -= (cum_a - is_a)[group_start[all_groups]]
+    cum_b = np.arange(1, len(values) + 1) - np.cumsum(is_a)
+    cum_b -= (cum_b - (1 - is_a))[group_start[all_groups]]
+    last = np.ones(len(values), dtype=bool)
+    last[:-1] = (values[1:] != values[:-1]) | (all_groups[1:] != all_groups[:-1])
+
+    d = np.zeros(n_groups)
+    np.maximum.at(d, all_groups[last], np.abs(cum_a[last] - cum_b[last]) / n[all_groups[last]])
+    has_nan = np.bincount(all_groups, weights=np.isnan(values), minlength=n_groups) > 0
+
+    pvals = np.full(n_groups, np.nan)
+    cache = {}
+    for i in range(n_groups):
+        if n[i] == 0 or has_nan[i]:
+            continue
+        h = int(np.round(d[i] * n[i]))
+        if (n[i], h) not in cache:
+            cache[n[i], h] = _ks_2samp_equal_n_pvalue(n[i], h)
+        pvals[i] = cache[n[i], h]
+    return pvals
+
+
+def _ks_2samp_equal_n_pvalue(n, h):
+    """P value for a two-sided KS statistic D = h/n between two samples of size n.
+
+    Follows scipy.stats.ks_2samp: the exact probability of a path leaving the
+    band |x-y| < h, falling back to the asymptotic distribution for large or
+    numerically difficult cases.
+    """
+    if h == 0:
+        return 1.0
+    if n <= 10000:
+        try:
+            with np.errstate(invalid='raise', over='raise'):
+                # P = 2 * A0 * (1 - A1*(1 - A2*(1 - A3*(...)))), evaluated Horner-style
+                prob = 0.0
+                k = int(np.floor(n / h))
+                while k >= 0:
+                    p1 = 1.0
+                    for j in range(h):
+                        p1 = (n - k * h - j) * p1 / (n + k * h + j + 1)
+                    prob = p1 * (1.0 - prob)
+                    k -= 1
+                prob = 2 * prob
+            if 0 <= prob <= 1:
+                return prob
+        except (FloatingPointError, OverflowError):
+            pass
+    return float(np.clip(scipy.stats.kstwo.sf(h / n, np.round(n / 2.)), 0, 1))
+
+
+def average_traces(data, t0, offsets, sample_rate):
+    """Average groups of traces that share the same sample rate, aligned by their time values.
+
+    Group i consists of data[offsets[i]:offsets[i+1]], with start times t0[offsets[i]:offsets[i+1]].
+    As with TSeriesList.mean(), traces in each group are left-clipped to the latest start time,
+    right-clipped to a common length, and averaged ignoring NaN. All clipped traces are
+    copied into a single 2D buffer so that the averages are computed together.
+
+    Returns a list containing (average data, t0) for each group, or None for empty groups.
+    """
+    n = np.diff(offsets)
+    groups = _group_index(offsets)
+    t0 = np.asarray(t0, dtype=float)
+    lengths = np.array([len(d) for d in data], dtype=int)
+
+    start_t = np.full(len(n), -np.inf)
+    np.maximum.at(start_t, groups, t0)
+    start_ind = np.round((start_t[groups] - t0) * sample_rate).astype(int)
+    start_ind = np.clip(start_ind, 0, np.maximum(lengths - 1, 0))
+    clip_len = np.full(len(n), np.iinfo(int).max)
+    np.minimum.at(clip_len, groups, lengths - start_ind)
+
+    buffer = np.full((len(data), max([0] + list(clip_len[n > 0]))), np.nan)
+    for i, d in enumerate(data):
+        l = clip_len[groups[i]]
+        buffer[i, :l] = d[start_ind[i]:start_ind[i]+l]
+    valid = ~np.isnan(buffer)
+    nonempty = np.argwhere(n > 0)[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sums = np.add.reduceat(np.where(valid, buffer, 0), offsets[nonempty], axis=0) if len(nonempty) > 0 else []
+        counts = np.add.reduceat(valid, offsets[nonempty], axis=0) if len(nonempty) > 0 else []
+
+    averages = [None] * len(n)
+    for j, i in enumerate(nonempty):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            averages[i] = ((sums[j] / counts[j])[:clip_len[i]], start_t[i])
+    return averages
@@ -2,6 +2,7 @@ from __future__ import print_function
 import os, re, json
 import six
 from . import config
+from .lims_cache import cached, batch_lookup
 import sqlalchemy
 
 
@@ -22,13 +23,58 @@ def lims_engine():
     return _lims_engine
 
 
-def query(query_str):
+def query(query_str, **params):
     """Query LIMS database and return result.
     """
     with lims_engine().connect() as conn:
-        return conn.execute(query_str).fetchall()
+        return conn.execute(query_str, **params).fetchall()
 
 
+def _batch_query(query_str, values, chunk_size=500):
+    """Run *query_str* once per chunk of *values*, where the query contains an
+    expanding ``:values`` parameter (as in ``where specimens.id in :values``).
+
+    Return the concatenated results.
+    """
+    q = sqlalchemy.text(query_str).bindparams(sqlalchemy.bindparam('values', expanding=True))
+    values = list(values)
+    recs = []
+    for i in range(0, len(values), chunk_size):
+        recs.extend(query(q, values=values[i:i+chunk_size]))
+    return recs
+
+
+_specimen_info_query = """
+    select 
+        organisms.name as organism, 
+        ages.days as age,
+        donors.date_of_birth as date_of_birth,
+        donors.full_genotype as genotype,
+        donors.weight as weight,
+        genders.name as sex,
+        structures.acronym as structure,
+        tissue_processings.section_thickness_um as thickness,
+        tissue_processings.instructions as section_instructions,
+        plane_of_sections.name as plane_of_section,
+        flipped_specimens.name as flipped,
+        specimens.histology_well_name as histology_well_name,
+        specimens.carousel_well_name as carousel_well_name,
+        specimens.parent_id as parent_id,
+        specimens.name as specimen_name,
+        specimens.id as specimen_id
+    from specimens
+        left join donors on specimens.donor_id=donors.id 
+        left join organisms on donors.organism_id=organisms.id
+        left join ages on donors.age_id=ages.id
+        left join genders on donors.gender_id=genders.id
+        left join structures on structures.id=specimens.structure_id
+        left join tissue_processings on specimens.tissue_processing_id=tissue_processings.id
+        left join plane_of_sections on tissue_processings.plane_of_section_id=plane_of_sections.id
+        left join flipped_specimens on flipped_specimens.id = specimens.flipped_specimen_id
+"""
+
+
+@cached
 def specimen_info(specimen_name=None, specimen_id=None):
     """Return a dictionary of information about a slice specimen queried from LIMS.
     
@@ -57,35 +103,7 @@ def specimen_info(specimen_name=None, specimen_id=None):
     section_number : indicates the order this slice was sectioned (1=first)
     """
     
-    # Query all interesting information about this specimen from LIMS
-    q = """
-        select 
-            organisms.name as organism, 
-            ages.days as age,
-            donors.date_of_birth as date_of_birth,
-            donors.full_genotype as genotype,
-            donors.weight as weight,
-            genders.name as sex,
-            structures.acronym as structure,
-            tissue_processings.section_thickness_um as thickness,
-            tissue_processings.instructions as section_instructions,
-            plane_of_sections.name as plane_of_section,
-            flipped_specimens.name as flipped,
-            specimens.histology_well_name as histology_well_name,
-            specimens.carousel_well_name as carousel_well_name,
-            specimens.parent_id as parent_id,
-            specimens.name as specimen_name,
-            specimens.id as specimen_id
-        from specimens
-            left join donors on specimens.donor_id=donors.id 
-            left join organisms on donors.organism_id=organisms.id
-            left join ages on donors.age_id=ages.id
-            left join genders on donors.gender_id=genders.id
-            left join structures on structures.id=specimens.structure_id
-            left join tissue_processings on specimens.tissue_processing_id=tissue_processings.id
-            left join plane_of_sections on tissue_processings.plane_of_section_id=plane_of_sections.id
-            left join flipped_specimens on flipped_specimens.id = specimens.flipped_specimen_id
-    """
+    q = _specimen_info_query
     if specimen_name is not None:
         sid = specimen_name.strip()
         q += "where specimens.name='%s';" % sid
@@ -98,8 +116,48 @@ def specimen_info(specimen_name=None, specimen_id=None):
     r = query(q)
     if len(r) != 1:
         raise Exception("LIMS lookup for specimen '%s' returned %d results (expected 1)" % (sid, len(r)))
-    rec = dict(r[0])
-    
+    return _parse_specimen_info(dict(r[0]))
+
+
+def specimen_info_batch(specimen_names=None, specimen_ids=None):
+    """Return specimen_info() for many specimens using a single LIMS query.
+
+    Returns a dict mapping each specimen name (or ID) to its info record. Specimens that
+    are not found (or whose records cannot be parsed) are omitted; calling specimen_info()
+    for those will raise the appropriate exception.
+    """
+    if specimen_names is not None:
+        items, arg, field, key = specimen_names, 'specimen_name', 'name', 'specimen_name'
+    elif specimen_ids is not None:
+        items, arg, field, key = specimen_ids, 'specimen_id', 'id', 'specimen_id'
+    else:
+        raise ValueError("Must specify specimen names or IDs")
+
+    def fetch(items):
+        if field == 'name':
+            items = {item.strip(): item for item in items}
+        else:
+            items = {item: item for item in items}
+        recs = _batch_query(_specimen_info_query + "where specimens.%s in :values" % field, items.keys())
+        by_key = {}
+        for rec in recs:
+            by_key.setdefault(rec[key], []).append(rec)
+        results = {}
+        for k, recs in by_key.items():
+            if len(recs) != 1:
+                continue
+            try:
+                results[items[k]] = _parse_specimen_info(dict(recs[0]))
+            except Exception:
+                continue
+        return results
+
+    return batch_lookup(specimen_info, items, fetch, call_args=lambda item: ((), {arg: item}))
+
+
+def _parse_specimen_info(rec):
+    """Convert a raw specimen record from LIMS into the form returned by specimen_info()
+    """
     # convert thickness to unscaled
     rec['thickness'] = None if rec['thickness'] is None else (rec['thickness'] * 1e-6)
     # convert organism to more easily searchable form
@@ -172,6 +230,7 @@ def specimen_info(specimen_name=None, specimen_id=None):
     return rec
     
     
+@cached
 def specimen_images(specimen):
     """Return a list of dicts describing images for a specimen.
 
@@ -248,6 +307,7 @@ def specimen_20x_image(specimen, treatment='Biocytin'):
     return None
 
 
+@cached
 def specimen_species(specimen_name):
     """returns species information
     """
@@ -285,6 +345,7 @@ def donor_medical_conditions(donor_id=None, specimen=None):
     return [{'name': rec['name'], 'value': rec['value']} for rec in r]
     
 
+@cached
 def specimen_id_from_name(spec_name):
     """Return the LIMS ID of a specimen give its name.
     """
@@ -293,12 +354,25 @@ def specimen_id_from_name(spec_name):
         raise ValueError('No LIMS specimen named "%s"' % spec_name)
     return recs[0]['id']
 
+
+def specimen_ids_from_names(spec_names):
+    """Return {name: id} for many specimen names using a single LIMS query.
+
+    Names that are not found in LIMS are omitted.
+    """
+    def fetch(names):
+        recs = _batch_query("select name, id from specimens where name in :values", names)
+        return {rec['name']: rec['id'] for rec in recs}
+    return batch_lookup(specimen_id_from_name, spec_names, fetch)
+
+
 def find_specimen_ids_matching_name(spec_name):
     """Return a list of LIMS IDs whose names include spec_name"""
     q = sqlalchemy.text("select id from specimens where name like :name", bindparams=[sqlalchemy.bindparam('name', value='%%%s%%' %spec_name)])
     recs = query(q)
     return [r['id'] for r in recs]
 
+@cached
 def specimen_name(spec_id):
     recs = query("select name from specimens where id=%s" % spec_id)
     if len(recs) == 0:
@@ -334,6 +408,8 @@ def specimen_ephys_roi_plans(specimen):
 def cell_cluster_ids(specimen):
     """Return the IDs of all cell-cluster children of *specimen*.
 
+    Not cached: new clusters must be visible as soon as they are created (see expt_submissions).
+
     Parameters
     ----------
     specimen : int | str
@@ -352,6 +428,36 @@ def cell_cluster_ids(specimen):
     return [rec['id'] for rec in recs]
 
 
+def cell_cluster_ids_batch(specimens):
+    """Return {specimen: cell_cluster_ids(specimen)} for many specimens using a single LIMS query.
+
+    Specimens may be given as IDs (int) or names (str); names that are not found in LIMS are omitted.
+    """
+    def fetch(specimens):
+        ids = _specimen_ids(specimens)
+        recs = _batch_query("""
+            select specimens.parent_id, specimens.id from specimens 
+            join specimen_types_specimens on specimen_types_specimens.specimen_id=specimens.id
+            join specimen_types on specimen_types.id=specimen_types_specimens.specimen_type_id
+            where specimens.parent_id in :values
+            and specimen_types.name='CellCluster'
+        """, set(ids.values()))
+        clusters = {}
+        for rec in recs:
+            clusters.setdefault(rec['parent_id'], []).append(rec['id'])
+        return {spec: clusters.get(spec_id, []) for spec, spec_id in ids.items()}
+    return batch_lookup(cell_cluster_ids, specimens, fetch)
+
+
+def _specimen_ids(specimens):
+    """Return {specimen: id} for a list of specimen IDs and/or names, omitting unknown names.
+    """
+    names = [s for s in specimens if not isinstance(s, int)]
+    ids = {s: s for s in specimens if isinstance(s, int)}
+    ids.update(specimen_ids_from_names(names))
+    return ids
+
+
 def child_specimens(specimen):
     if not isinstance(specimen, int):
         specimen = specimen_id_from_name(specimen)
@@ -384,6 +490,7 @@ def cell_cluster_data_paths(specimen):
     return [r['storage_directory'] for r in recs]
 
   
+@cached
 def specimen_metadata(specimen):
     if not isinstance(specimen, int):
         specimen = specimen_id_from_name(specimen)
@@ -398,6 +505,29 @@ def specimen_metadata(specimen):
         meta = json.loads(meta)  # unserialization corrects for a LIMS bug; we can remove this later.
     return meta
 
+
+def specimen_metadata_batch(specimens):
+    """Return {specimen: specimen_metadata(specimen)} for many specimens using a single LIMS query.
+    """
+    def fetch(specimens):
+        ids = _specimen_ids(specimens)
+        recs = _batch_query("select specimen_id, data from specimen_metadata where specimen_id in :values", set(ids.values()))
+        meta = {}
+        for rec in recs:
+            meta.setdefault(rec['specimen_id'], rec['data'])
+        results = {}
+        for spec, spec_id in ids.items():
+            data = meta.get(spec_id, '')
+            if data == '':
+                data = None
+            elif isinstance(data, six.string_types):
+                data = json.loads(data)
+            results[spec] = data
+        return results
+    return batch_lookup(specimen_metadata, specimens, fetch)
+
+
+@cached
 def specimen_tags(specimen):
     if not isinstance(specimen, int):
         specimen = specimen_id_from_name(specimen)
@@ -516,9 +646,12 @@ def submit_expt(spec_name, acq_timestamp, nwb_file, json_file):
     return incoming_files
 
 
-def expt_submissions(specimen, acq_timestamp):
+def expt_submissions(specimen, acq_timestamp, cluster_ids=None):
     """Return information about the status of each submission found for an
     experiment, identified by its specimen ID and experiment uid.
+
+    *cluster_ids* may be given if expt_cluster_ids() was already looked up for this
+    experiment (see expt_cluster_ids_batch()).
     """
     if not isinstance(specimen, int):
         specimen = specimen_id_from_name(specimen)
@@ -539,7 +672,8 @@ def expt_submissions(specimen, acq_timestamp):
             submissions.append(("trigger failed", failed_trigger, error))
             
     # Anything in LIMS already?
-    cluster_ids = expt_cluster_ids(specimen, acq_timestamp)
+    if cluster_ids is None:
+        cluster_ids = expt_cluster_ids(specimen, acq_timestamp)
     for cid in cluster_ids:
         data_path = cell_cluster_data_paths(cid)
         submissions.append(("succeeded", cid, data_path))
@@ -549,6 +683,8 @@ def expt_submissions(specimen, acq_timestamp):
 
 def expt_cluster_ids(specimen, acq_timestamp):
     """Return a list of CellCluster IDs associated with an experiment
+
+    Not cached: expt_submissions uses this to decide whether an experiment has been submitted.
     """
     if not isinstance(specimen, int):
         specimen = specimen_id_from_name(specimen)
@@ -561,6 +697,28 @@ def expt_cluster_ids(specimen, acq_timestamp):
     return cids
 
 
+def expt_cluster_ids_batch(expts):
+    """Return {(specimen, acq_timestamp): expt_cluster_ids(specimen, acq_timestamp)} for many
+    experiments, using a small number of LIMS queries.
+
+    Parameters
+    ----------
+    expts : list
+        List of (specimen, acq_timestamp) tuples, where specimen is an ID (int) or name (str).
+    """
+    def fetch(expts):
+        clusters = cell_cluster_ids_batch([spec for spec, ts in expts])
+        meta = specimen_metadata_batch([cid for cids in clusters.values() for cid in cids])
+        results = {}
+        for spec, ts in expts:
+            if spec not in clusters:
+                continue
+            results[(spec, ts)] = [cid for cid in clusters[spec] if meta.get(cid) is not None and meta[cid]['acq_timestamp'] == ts]
+        return results
+
+    return batch_lookup(expt_cluster_ids, [tuple(expt) for expt in expts], fetch, call_args=lambda expt: (expt, {}))
+
+
 def cluster_cells(cluster):
     """Return information about a CellCluster's child cells.
     """
@@ -595,6 +753,7 @@ def cluster_ephys_roi_result(specimen):
     return recs[0]['id']
 
 
+@cached
 def cell_specimen_ids(cell_cluster):
     """Return a dictionary mapping {cell_ext_id: lims_specimen_id} for all cells in a cluster.
     """
@@ -605,6 +764,19 @@ def cell_specimen_ids(cell_cluster):
     return {(lims_cell.external_specimen_name): lims_cell.id for lims_cell in lims_cells if lims_cell is not None}
 
 
+def cell_specimen_ids_batch(cell_clusters):
+    """Return {cluster: cell_specimen_ids(cluster)} for many cell clusters using a single LIMS query.
+    """
+    def fetch(clusters):
+        ids = _specimen_ids(clusters)
+        recs = _batch_query("select parent_id, id, external_specimen_name from specimens where parent_id in :values", set(ids.values()))
+        cells = {}
+        for rec in recs:
+            cells.setdefault(rec['parent_id'], {})[rec['external_specimen_name']] = rec['id']
+        return {cluster: cells.get(cid, {}) for cluster, cid in ids.items()}
+    return batch_lookup(cell_specimen_ids, cell_clusters, fetch)
+
+
 def cell_polygon(cell):
     """ Return polygon id for cell specimen
     """ 
@@ -620,6 +792,7 @@ def cell_polygon(cell):
     return recs
 
 
+@cached
 def cell_layer(cell):
     """ Return layer call for Cell specimen
     """
@@ -0,0 +1,167 @@
+"""
+Local sqlite mirror of LIMS query results.
+
+Functions in aisynphys.lims that are decorated with `cached` store their results here,
+keyed by function name and arguments. The cache is disabled unless `config.lims_cache_ttl`
+is set; entries expire after that many seconds, and `refresh()` discards entries explicitly.
+Empty and None results are never cached, since they usually mean that a record has not been
+created in LIMS yet.
+"""
+from __future__ import print_function
+import os, time, json, pickle, sqlite3, functools, inspect
+from . import config
+
+
+class LimsCache(object):
+    """Persistent key/value store for LIMS query results.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the sqlite file used for storage (created if needed).
+    ttl : float
+        Number of seconds for which a cached result remains valid.
+    """
+    def __init__(self, filename, ttl):
+        self.filename = filename
+        self.ttl = ttl
+        self._db = None
+        self._db_pid = None
+
+    @property
+    def db(self):
+        # sqlite connections must not be shared with forked processes
+        if self._db is None or self._db_pid != os.getpid():
+            dirname = os.path.dirname(self.filename)
+            if dirname != '' and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self._db = sqlite3.connect(self.filename, timeout=30)
+            self._db.execute("create table if not exists lims_cache (key text primary key, func text, time real, value blob)")
+            self._db.commit()
+            self._db_pid = os.getpid()
+        return self._db
+
+    def get(self, key):
+        """Return (True, value) if *key* has an unexpired entry, or (False, None) otherwise.
+        """
+        rec = self.db.execute("select time, value from lims_cache where key=?", (key,)).fetchone()
+        if rec is None or time.time() - rec[0] > self.ttl:
+            return False, None
+        return True, pickle.loads(rec[1])
+
+    def set(self, key, value):
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        """Store many (key, value) pairs in a single transaction.
+        """
+        now = time.time()
+        rows = [(key, json.loads(key)[0], now, sqlite3.Binary(pickle.dumps(value))) for key, value in items]
+        with self.db:
+            self.db.executemany("insert or replace into lims_cache values (?, ?, ?, ?)", rows)
+
+    def refresh(self, func=None):
+        """Discard cached results for one LIMS function name, or all results if *func* is None.
+        """
+        with self.db:
+            if func is None:
+                self.db.execute("delete from lims_cache")
+            else:
+                self.db.execute("delete from lims_cache where func=?", (func,))
+
+
+def cache_key(func, *args, **kwds):
+    """Return the cache key for a call to *func* with the given arguments.
+
+    Equivalent calls (positional vs keyword arguments, omitted defaults) map to the same key.
+    """
+    func = getattr(func, 'uncached', func)
+    bound = inspect.signature(func).bind(*args, **kwds)
+    bound.apply_defaults()
+    return json.dumps([func.__name__, list(bound.arguments.items())], default=str)
+
+
+_cache = None
+def lims_cache():
+    """Return the LimsCache configured for this process, or None if caching is disabled.
+    """
+    global _cache
+    if not config.lims_cache_ttl:
+        return None
+    filename = config.lims_cache_file or os.path.join(config.cache_path, 'lims_cache.sqlite')
+    if _cache is None or _cache.filename != filename:
+        _cache = LimsCache(filename, config.lims_cache_ttl)
+    _cache.ttl = config.lims_cache_ttl
+    return _cache
+
+
+def refresh(func=None):
+    """Discard cached LIMS results (see LimsCache.refresh).
+    """
+    cache = lims_cache()
+    if cache is not None:
+        cache.refresh(None if func is None else getattr(func, '__name__', func))
+
+
+def cacheable(value):
+    """Return True if *value* may be stored in the cache (it is not None or empty).
+    """
+    if value is None:
+        return False
+    if isinstance(value, (list, tuple, dict, set, str)) and len(value) == 0:
+        return False
+    return True
+
+
+def cached(func):
+    """Decorator causing a LIMS query function to check the local cache before querying LIMS.
+
+    The undecorated function remains available as ``func.uncached``.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwds):
+        cache = lims_cache()
+        if cache is None:
+            return func(*args, **kwds)
+        key = cache_key(func, *args, **kwds)
+        found, value = cache.get(key)
+        if not found:
+            value = func(*args, **kwds)
+            if cacheable(value):
+                cache.set(key, value)
+        return value
+    wrapper.uncached = func
+    return wrapper
+
+
+def batch_lookup(func, items, fetch, call_args=None):
+    """Return {item: func(item)} for many items at once.
+
+    Results already in the cache are used directly; all remaining items are passed
+    together to *fetch(missing_items)*, which must return {item: value}. Fetched values
+    are added to the cache under the same keys that *func(item)* would use, so later
+    single-item calls are served from the cache. If *func* is not decorated with `cached`,
+    all items are fetched. By default each item is passed as the single positional argument
+    to *func*; otherwise *call_args(item)* must return the (args, kwds) of the equivalent call.
+    """
+    cache = lims_cache() if hasattr(func, 'uncached') else None
+    results = {}
+    missing = []
+    keys = {}
+    for item in items:
+        if item in results or item in missing:
+            continue
+        if cache is not None:
+            args, kwds = ((item,), {}) if call_args is None else call_args(item)
+            keys[item] = cache_key(func, *args, **kwds)
+            found, value = cache.get(keys[item])
+            if found:
+                results[item] = value
+                continue
+        missing.append(item)
+    if len(missing) > 0:
+        fetched = fetch(missing)
+        results.update(fetched)
+        if cache is not None:
+            cache.set_many([(keys[item], value) for item, value in fetched.items() if cacheable(value)])
+    return results
@@ -1,10 +1,11 @@
 from .pipeline import Pipeline
 from . import pipeline_module
-from . import multipatch
 
 
 def all_pipelines():
     """Return a dictionary of {pipeline_name:pipeline_class} pairs
     """
+    # pipelines register themselves as Pipeline subclasses when imported
+    from . import multipatch
     return Pipeline.all_pipelines()
 
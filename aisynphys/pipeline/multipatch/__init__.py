@@ -12,6 +12,7 @@ from .resting_state import RestingStatePipelineModule
 from .patch_seq import PatchSeqPipelineModule
 from .gap_junction import GapJunctionPipelineModule
 from .intrinsic import IntrinsicPipelineModule
+from .stochastic_model import StochasticModelPipelineModule
 
 
 class MultipatchPipeline(Pipeline):
@@ -36,4 +37,6 @@ class MultipatchPipeline(Pipeline):
     def __init__(self, database, config):
         self.config = config
         self.database = database
+        if getattr(config, 'stochastic_model_pipeline', False):
+            self.module_classes = self.module_classes + [StochasticModelPipelineModule]
         Pipeline.__init__(self, config=config, database=database)
@@ -19,6 +19,7 @@ class DatasetPipelineModule(MultipatchPipelineModule):
     name = 'dataset'
     dependencies = [ExperimentPipelineModule]
     table_group = ['sync_rec', 'recording', 'patch_clamp_recording', 'multi_patch_probe', 'test_pulse', 'stim_pulse', 'stim_spike', 'pulse_response', 'baseline']
+    drop_paths = [('experiment.ext_id', 'sync_rec')]
 
     # datasets are large and NWB access leaks memory
     # when running parallel, each child process may run only one job before being killed
@@ -221,6 +222,7 @@ class DatasetPipelineModule(MultipatchPipelineModule):
                             pair=pair_entry,
                             data=resampled.data,
                             data_start_time=resampled.t0,
+                            duration=resampled.duration,
                             ex_qc_pass=resp['ex_qc_pass'],
                             in_qc_pass=resp['in_qc_pass'],
                             meta=None if resp['ex_qc_pass'] and resp['in_qc_pass'] else {'qc_failures': resp['qc_failures']},
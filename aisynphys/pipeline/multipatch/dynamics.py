@@ -20,6 +20,7 @@ class DynamicsPipelineModule(MultipatchPipelineModule):
     name = 'dynamics'
     dependencies = [PulseResponsePipelineModule]
     table_group = ['dynamics']
+    drop_paths = [('experiment.ext_id', 'pair', 'dynamics')]
     
     @classmethod
     def create_db_entries(cls, job, session):
@@ -30,11 +31,12 @@ class DynamicsPipelineModule(MultipatchPipelineModule):
 
         # Load experiment from DB
         expt = db.experiment_from_timestamp(job_id, session=session)
+        pr_table = cls.pulse_response_table(job, session, expt)
         for pair in expt.pairs.values():
             if pair.has_synapse is not True:
                 continue
             
-            dynamics = generate_pair_dynamics(pair, db, session)
+            dynamics = generate_pair_dynamics(pair, db, session, pr_table=pr_table)
             session.add(dynamics)
             logger.debug("Finished dynamics for pair %s", pair)
         session.commit()
@@ -17,6 +17,7 @@ class ExperimentPipelineModule(MultipatchPipelineModule):
     name = 'experiment'
     dependencies = [SlicePipelineModule]
     table_group = ['experiment', 'electrode', 'cell', 'pair']    
+    drop_paths = [('experiment.ext_id',)]
     
     @classmethod
     def create_db_entries(cls, job, session):
@@ -6,7 +6,7 @@ from sqlalchemy.orm import aliased
 from ... import config
 from .pipeline_module import MultipatchPipelineModule
 from .synapse_prediction import SynapsePredictionPipelineModule
-from ...fit_average_first_pulse import fit_average_first_pulses, fit_single_first_pulse
+from ...fit_average_first_pulse import fit_average_first_pulses, fit_single_first_pulse, extract_first_pulse_info_from_experiment
 import traceback
 import sys
 
@@ -18,6 +18,7 @@ class AverageFirstPulseFitPipelineModule(MultipatchPipelineModule):
     name = 'avg_first_pulse_fit'
     dependencies = [SynapsePredictionPipelineModule]
     table_group = ['avg_first_pulse_fit']
+    drop_paths = [('experiment.ext_id', 'pair', 'avg_first_pulse_fit')]
     
     @classmethod
     def create_db_entries(cls, job, session):
@@ -25,12 +26,15 @@ class AverageFirstPulseFitPipelineModule(MultipatchPipelineModule):
         expt_id = job['job_id']
 
         expt = db.experiment_from_timestamp(expt_id, session=session)
+
+        # load first pulse responses for all pairs at once
+        pulse_data = extract_first_pulse_info_from_experiment(expt, session)
        
         fails = []
         errors = ""
         for (pre_cell_id, post_cell_id), pair in expt.pairs.items():
             try:
-                result = fit_average_first_pulses(pair)
+                result = fit_average_first_pulses(pair, pulse_data=pulse_data.get(pair.id, {}))
                 if result['error'] is not None:
                     # known error occurred; we consider this a successful run
                     errors += "(%s->%s) %s\n\n" % (pre_cell_id, post_cell_id, result['error'])
@@ -136,6 +140,7 @@ class SingleFirstPulseFitPipelineModule(MultipatchPipelineModule):
     name = 'single_first_pulse_fit'
     dependencies = [SynapsePredictionPipelineModule]
     table_group = ['single_first_pulse_fit']
+    drop_paths = [('experiment.acq_timestamp', 'pair', 'pulse_response', 'single_first_pulse_fit')]
     
     @classmethod
     def create_db_entries(cls, job, session):
@@ -2,7 +2,6 @@
 from __future__ import print_function, division
 
 import os
-import pyqtgraph as pg
 import numpy as np
 import scipy.stats as stats
 from ... import config
@@ -21,6 +20,7 @@ class GapJunctionPipelineModule(MultipatchPipelineModule):
     name = 'gap_junction'
     dependencies = [ExperimentPipelineModule, DatasetPipelineModule, IntrinsicPipelineModule]
     table_group = ['gap_junction']
+    drop_paths = [('experiment.ext_id', 'pair', 'gap_junction')]
     
     @classmethod
     def create_db_entries(cls, job, session):
@@ -37,80 +37,48 @@ class GapJunctionPipelineModule(MultipatchPipelineModule):
         if sweeps is None:
             raise Exception('NWB has not content')
 
-        for pair in expt.pair_list:
-            pre_dev = pair.pre_cell.electrode.device_id
-            post_dev = pair.post_cell.electrode.device_id
-            
-            lp_pre, _ = get_lp_sweeps(sweeps, pre_dev)
-            lp_post, _ = get_lp_sweeps(sweeps, post_dev)
-            long_pulse = list(set(lp_pre).intersection(lp_post))
-            if len(long_pulse) == 0:
+        pairs = expt.pair_list
+        devs = sorted(set([cell.electrode.device_id for pair in pairs for cell in (pair.pre_cell, pair.post_cell)]))
+        targetv, pulse_diff, noise_diff = lp_sweep_matrix(expt, sweeps, devs)
+        chan = {dev: i for i, dev in enumerate(devs)}
+
+        # collect pre/post responses for each pair:  shape (pairs, sweeps)
+        pre_i = np.array([chan[pair.pre_cell.electrode.device_id] for pair in pairs], dtype=int)
+        post_i = np.array([chan[pair.post_cell.electrode.device_id] for pair in pairs], dtype=int)
+        pre_pulse = pulse_diff[:, pre_i, pre_i].T
+        post_pulse = pulse_diff[:, pre_i, post_i].T
+        pre_noise = noise_diff[:, pre_i, pre_i].T
+        post_noise = noise_diff[:, pre_i, post_i].T
+        mask = np.isfinite(pre_pulse) & np.isfinite(post_pulse)
+        n_sweeps = mask.sum(axis=1)
+
+        r_pulse, p_pulse = masked_pearsonr(pre_pulse, post_pulse, mask)
+        r_noise, p_noise = masked_pearsonr(pre_noise, post_noise, mask)
+        cc_pulse = masked_coupling_coeff(pre_pulse, post_pulse, mask)
+        cc_noise = masked_coupling_coeff(pre_noise, post_noise, mask)
+
+        for i, pair in enumerate(pairs):
+            if not (targetv[:, pre_i[i]] & targetv[:, post_i[i]]).any():
                 errors.append('Pair %s, %s, %s NWB has no TargetV sweeps' % (expt.ext_id, pair.pre_cell.ext_id, pair.post_cell.ext_id))
                 continue
-
-            pre_pulse = []
-            post_pulse = []
-            pre_noise = []
-            post_noise = []
-            qc_pass = 0
-            for sweep in long_pulse:
-                pre_rec = sweep[pre_dev]
-                post_rec = sweep[post_dev]
-                
-                db_pre_rec = get_db_recording(expt, pre_rec)
-                if db_pre_rec is None or db_pre_rec.patch_clamp_recording.qc_pass is False:
-                    continue
-                
-                db_post_rec = get_db_recording(expt, post_rec)
-                if db_post_rec is None or db_post_rec.patch_clamp_recording.qc_pass is False:
-                    continue
-
-                pulse_times = get_pulse_times(pre_rec)
-                if pulse_times is None:
-                    continue
-
-                qc_pass+=1
-
-                pulse_start = pulse_times[0] + padding
-                pulse_stop = pulse_start + duration
-                pulse_win = [pulse_start, pulse_stop]
-                
-                base_stop = pulse_times[0]
-                base_start = base_stop - duration
-                base_win = [base_start, base_stop]
-                
-                base2_stop = base_start - padding
-                base2_start = base2_stop - duration
-                base2_win = [base2_start, base2_stop]
-                
-                pre_pulse = get_chunk_diff(pre_rec, base_win, pulse_win, pre_pulse)
-                post_pulse = get_chunk_diff(post_rec, base_win, pulse_win, post_pulse)
-                pre_noise = get_chunk_diff(pre_rec, base2_win, base_win, pre_noise)
-                post_noise = get_chunk_diff(post_rec, base2_win, base_win, post_noise)
-                
-            if qc_pass < 2:
+            if n_sweeps[i] < 2:
                 errors.append('Only one qc-passed sweep for pair %s, %s, %s; we require 2' % (expt.ext_id, pair.pre_cell.ext_id, pair.post_cell.ext_id))
                 continue
 
-            r_pulse, p_pulse = stats.pearsonr(pre_pulse, post_pulse)
-            r_noise, p_noise = stats.pearsonr(pre_noise, post_noise)
-            cc_pulse = coupling_coeff(pre_pulse, post_pulse)
-            cc_noise = coupling_coeff(pre_noise, post_noise)
-
             post_intrinsic = pair.post_cell.intrinsic
             if post_intrinsic is not None:
                 post_ir = pair.post_cell.intrinsic.input_resistance
-                gap_conduct = (1/post_ir) * cc_pulse / (1 - cc_pulse)
+                gap_conduct = (1/post_ir) * cc_pulse[i] / (1 - cc_pulse[i])
             else:
                 gap_conduct = None
             
             results = {
-                'corr_coeff_pulse': r_pulse,
-                'p_val_pulse': p_pulse,
-                'corr_coeff_noise': r_noise, 
-                'p_val_noise': p_noise,
-                'coupling_coeff_pulse': cc_pulse,
-                'coupling_coeff_noise': cc_noise,
+                'corr_coeff_pulse': r_pulse[i],
+                'p_val_pulse': p_pulse[i],
+                'corr_coeff_noise': r_noise[i], 
+                'p_val_noise': p_noise[i],
+                'coupling_coeff_pulse': cc_pulse[i],
+                'coupling_coeff_noise': cc_noise[i],
                 'junctional_conductance': gap_conduct,
                 }
 
@@ -134,15 +102,88 @@ class GapJunctionPipelineModule(MultipatchPipelineModule):
 
 
     
-def get_chunk_diff(rec, win1, win2, array):
-    chunk1 = rec['primary'].time_slice(win1[0], win1[1])
-    chunk2 = rec['primary'].time_slice(win2[0], win2[1])
-    delta = chunk2.data.mean() - chunk1.data.mean()
-    array.append(delta)
-    return array     
-
-def coupling_coeff(a, b):
-    a_array= np.asarray(a)
-    b_array = np.asarray(b)
-    x, _,_,_ = np.linalg.lstsq(a_array[:, None], b_array[:, None])
-    return x[0][0]
\ No newline at end of file
+def lp_sweep_matrix(expt, sweeps, devs):
+    """Measure long pulse responses on all channels across all TargetV sweeps in an experiment.
+
+    For each sweep and each QC-passed channel *pre*, the responses of all QC-passed channels are
+    measured in windows aligned to the long pulse on *pre*. Window averages are computed once per
+    channel and window, so channels stimulated simultaneously share the same measurements.
+
+    Returns
+    -------
+    targetv : array
+        Boolean array (sweeps, channels); True where the sweep is a TargetV sweep for the channel.
+    pulse_diff : array
+        (sweeps, pre channels, post channels) difference between the pulse and baseline window averages;
+        NaN where not measured.
+    noise_diff : array
+        Same as pulse_diff, measured between two baseline windows.
+    """
+    lp = [set(get_lp_sweeps(sweeps, dev)[0]) for dev in devs]
+    lp_sweeps = [sweep for sweep in sweeps if any([sweep in dev_sweeps for dev_sweeps in lp])]
+    n_sweeps, n_chans = len(lp_sweeps), len(devs)
+    targetv = np.zeros((n_sweeps, n_chans), dtype=bool)
+    pulse_diff = np.full((n_sweeps, n_chans, n_chans), np.nan)
+    noise_diff = np.full((n_sweeps, n_chans, n_chans), np.nan)
+
+    for i, sweep in enumerate(lp_sweeps):
+        recs = {}
+        pulse_times = {}
+        for j, dev in enumerate(devs):
+            if sweep not in lp[j]:
+                continue
+            targetv[i, j] = True
+            rec = sweep[dev]
+            db_rec = get_db_recording(expt, rec)
+            if db_rec is None or db_rec.patch_clamp_recording.qc_pass is False:
+                continue
+            recs[j] = rec
+            pulse_times[j] = get_pulse_times(rec)
+
+        means = {}
+        def window_mean(j, win):
+            key = (j,) + win
+            if key not in means:
+                means[key] = recs[j]['primary'].time_slice(win[0], win[1]).data.mean()
+            return means[key]
+
+        for j, times in pulse_times.items():
+            if times is None:
+                continue
+            pulse_start = times[0] + padding
+            pulse_win = (pulse_start, pulse_start + duration)
+            base_win = (times[0] - duration, times[0])
+            base2_win = (base_win[0] - padding - duration, base_win[0] - padding)
+            for k in recs:
+                base = window_mean(k, base_win)
+                pulse_diff[i, j, k] = window_mean(k, pulse_win) - base
+                noise_diff[i, j, k] = base - window_mean(k, base2_win)
+
+    return targetv, pulse_diff, noise_diff
+
+
+def masked_pearsonr(x, y, mask):
+    """Pearson correlation and two-sided p-value (as in scipy.stats.pearsonr) for each row of *x* and *y*,
+    using only the values where *mask* is True.
+    """
+    n = mask.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xm = np.where(mask, x, 0).sum(axis=1) / n
+        ym = np.where(mask, y, 0).sum(axis=1) / n
+        dx = np.where(mask, x - xm[:, None], 0)
+        dy = np.where(mask, y - ym[:, None], 0)
+        r = (dx * dy).sum(axis=1) / np.sqrt((dx**2).sum(axis=1) * (dy**2).sum(axis=1))
+        r = np.clip(r, -1, 1)
+        ab = n / 2. - 1
+        p = 2 * stats.beta.cdf(0.5 * (1 - np.abs(r)), ab, ab)
+    p[n == 2] = 1.0
+    return r, p
+
+
+def masked_coupling_coeff(a, b, mask):
+    """Least-squares slope (through the origin) of *b* vs *a* for each row, using only the values where *mask* is True.
+    """
+    a = np.where(mask, a, 0)
+    b = np.where(mask, b, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (a * b).sum(axis=1) / (a * a).sum(axis=1)
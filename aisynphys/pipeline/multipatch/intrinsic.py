@@ -5,11 +5,10 @@ For generating a table that describes cell intrinisic properties
 """
 from __future__ import print_function, division
 
-import traceback, sys
+import multiprocessing, logging
+import concurrent.futures
 import numpy as np   
-from ipfx.data_set_features import extractors_for_sweeps
-from ipfx.stimulus_protocol_analysis import LongSquareAnalysis
-from ipfx.ephys_data_set import Sweep, SweepSet
+from ... import config
 from .pipeline_module import MultipatchPipelineModule
 from .experiment import ExperimentPipelineModule
 from ...nwb_recordings import get_lp_sweeps, get_pulse_times, get_db_recording
@@ -19,6 +18,7 @@ class IntrinsicPipelineModule(MultipatchPipelineModule):
     name = 'intrinsic'
     dependencies = [ExperimentPipelineModule]
     table_group = ['intrinsic']
+    drop_paths = [('experiment.ext_id', 'cell', 'intrinsic')]
 
     @classmethod
     def create_db_entries(cls, job, session):
@@ -33,84 +33,64 @@ class IntrinsicPipelineModule(MultipatchPipelineModule):
             raise Exception('No NWB data for this experiment')
         sweeps = nwb.contents
 
-        n_cells = len(expt.cell_list)
-        ipfx_fail = 0
+        # Extract sweep data for all cells first; this requires access to the DB and NWB file
+        cells = []
+        cell_data = []
         for cell in expt.cell_list:
-            qc_pass = True
-            dev_id = cell.electrode.device_id
-            target_v, if_curve = get_lp_sweeps(sweeps, dev_id)
-            lp_sweeps = target_v + if_curve
-            if len(lp_sweeps) == 0:
-                errors.append('No long pulse sweeps for cell %s' % cell.ext_id)
-                continue
-            recs = [rec[dev_id] for rec in lp_sweeps]
-            min_pulse_dur = np.inf
-            sweep_list = []
-            for rec in recs:
-                if rec.clamp_mode != 'ic':
-                    continue
-
-                db_rec = get_db_recording(expt, rec)
-                if db_rec is None or db_rec.patch_clamp_recording.qc_pass is False:
-                    continue
-
-                pulse_times = get_pulse_times(rec)
-                if pulse_times is None:
-                    continue
-                
-                # pulses may have different durations as well, so we just use the smallest duration
-                start, end = pulse_times
-                min_pulse_dur = min(min_pulse_dur, end-start)
-                
-                sweep = MPSweep(rec, -start)
-                if sweep is None:
-                    continue
-                sweep_list.append(sweep)
-            
-            if len(sweep_list) == 0:
-                errors.append('No sweeps passed qc for cell %s' % cell.ext_id)
+            data = cell_sweep_data(expt, sweeps, cell)
+            if isinstance(data, str):
+                errors.append(data)
                 continue
+            cells.append(cell)
+            cell_data.append(data)
 
-            sweep_set = SweepSet(sweep_list)    
-            spx, spfx = extractors_for_sweeps(sweep_set, start=0, end=min_pulse_dur)
-            lsa = LongSquareAnalysis(spx, spfx, subthresh_min_amp=-200)
-            
-            try:
-                analysis = lsa.analyze(sweep_set)
-            except Exception as exc:
-                errors.append('Error running IPFX analysis for cell %s: %s' % (cell.ext_id, str(exc)))
+        # Run IPFX analysis for each cell
+        n_cells = len(expt.cell_list)
+        ipfx_fail = 0
+        for cell, (results, error) in zip(cells, cls.analyze_cells(cell_data)):
+            if error is not None:
+                errors.append('Error running IPFX analysis for cell %s: %s' % (cell.ext_id, error))
                 ipfx_fail += 1
                 continue
 
-            if ipfx_fail == n_cells and n_cells > 1:
-                raise Exception('All cells failed IPFX analysis')
-                continue
-            
-            spike_features = lsa.mean_features_first_spike(analysis['spikes_set'])
-            up_down = spike_features['upstroke_downstroke_ratio']
-            rheo = analysis['rheobase_i']
-            fi_slope = analysis['fi_fit_slope']
-            input_r = analysis['input_resistance']
-            sag = analysis['sag']
-            avg_rate = np.mean(analysis['spiking_sweeps'].avg_rate)
-            adapt = np.mean(analysis['spiking_sweeps'].adapt)
-            
-            results = {
-                'upstroke_downstroke_ratio': up_down,
-                'rheobase': rheo,
-                'fi_slope': fi_slope,
-                'input_resistance': input_r,
-                'sag': sag,
-                'avg_firing_rate': avg_rate,
-                'adaptation_index': adapt,
-            }
-
             # Write new record to DB
             conn = db.Intrinsic(cell_id=cell.id, **results)
             session.add(conn)
 
+        if ipfx_fail == n_cells and n_cells > 1:
+            raise Exception('All cells failed IPFX analysis')
+
         return errors
 
+    @classmethod
+    def analyze_cells(cls, cell_data):
+        """Return a list of analyze_cell_sweeps() results for each item in *cell_data*, in the same order.
+
+        Cells are analyzed serially unless config.intrinsic_workers > 1, in which case they are analyzed in a
+        thread or process pool as selected by config.intrinsic_pool. Pipeline jobs that run in parallel
+        execute in daemonic worker processes, which cannot start child processes; these always use threads.
+
+        Exceptions raised by analyze_cell_sweeps() are re-raised here.
+        """
+        n_workers = min(config.intrinsic_workers, len(cell_data))
+        if n_workers < 2:
+            return [analyze_cell_sweeps(data) for data in cell_data]
+
+        pool_type = config.intrinsic_pool
+        if pool_type not in ('thread', 'process'):
+            raise ValueError("config.intrinsic_pool must be 'thread' or 'process' (got %r)" % pool_type)
+        if pool_type == 'process' and multiprocessing.current_process().daemon:
+            logging.getLogger(__name__).warning("Analyzing %d cells in a thread pool; %s jobs running in a daemonic "
+                "worker process cannot start a process pool.", len(cell_data), cls.name)
+            pool_type = 'thread'
+
+        if pool_type == 'thread':
+            executor = concurrent.futures.ThreadPoolExecutor
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor
+        with executor(max_workers=n_workers) as pool:
+            return list(pool.map(analyze_cell_sweeps, cell_data))
+
     def job_records(self, job_ids, session):
         """Return a list of records associated with a list of job IDs.
         
@@ -123,22 +103,96 @@ class IntrinsicPipelineModule(MultipatchPipelineModule):
         q = q.filter(db.Experiment.ext_id.in_(job_ids))
         return q.all()
 
-class MPSweep(Sweep):
-    """Adapter for neuroanalysis.Recording => ipfx.Sweep
+def cell_sweep_data(expt, sweeps, cell):
+    """Collect long-pulse sweep data for one cell into plain arrays that can be passed to analyze_cell_sweeps()
+    (possibly in another process).
+
+    Returns a dict with keys 'sweeps' (list of sweep array dicts) and 'min_pulse_dur', or an error string.
+    """
+    dev_id = cell.electrode.device_id
+    target_v, if_curve = get_lp_sweeps(sweeps, dev_id)
+    lp_sweeps = target_v + if_curve
+    if len(lp_sweeps) == 0:
+        return 'No long pulse sweeps for cell %s' % cell.ext_id
+    recs = [rec[dev_id] for rec in lp_sweeps]
+    min_pulse_dur = np.inf
+    sweep_list = []
+    for rec in recs:
+        if rec.clamp_mode != 'ic':
+            continue
+
+        db_rec = get_db_recording(expt, rec)
+        if db_rec is None or db_rec.patch_clamp_recording.qc_pass is False:
+            continue
+
+        pulse_times = get_pulse_times(rec)
+        if pulse_times is None:
+            continue
+        
+        # pulses may have different durations as well, so we just use the smallest duration
+        start, end = pulse_times
+        min_pulse_dur = min(min_pulse_dur, end-start)
+        
+        sweep = sweep_data(rec, -start)
+        if sweep is None:
+            continue
+        sweep_list.append(sweep)
+    
+    if len(sweep_list) == 0:
+        return 'No sweeps passed qc for cell %s' % cell.ext_id
+
+    return {'sweeps': sweep_list, 'min_pulse_dur': min_pulse_dur}
+
+
+def analyze_cell_sweeps(data):
+    """Run IPFX long square analysis on the sweep data returned by cell_sweep_data().
+
+    Returns (results, error), where *results* is a dict of Intrinsic column values and *error* is None
+    or an error string.
+    """
+    # ipfx is slow to import; only load it where the analysis runs
+    from ipfx.data_set_features import extractors_for_sweeps
+    from ipfx.stimulus_protocol_analysis import LongSquareAnalysis
+    from ipfx.ephys_data_set import Sweep, SweepSet
+
+    sweep_set = SweepSet([Sweep(**sweep) for sweep in data['sweeps']])
+    spx, spfx = extractors_for_sweeps(sweep_set, start=0, end=data['min_pulse_dur'])
+    lsa = LongSquareAnalysis(spx, spfx, subthresh_min_amp=-200)
+    
+    try:
+        analysis = lsa.analyze(sweep_set)
+    except Exception as exc:
+        return None, str(exc)
+
+    spike_features = lsa.mean_features_first_spike(analysis['spikes_set'])
+    results = {
+        'upstroke_downstroke_ratio': spike_features['upstroke_downstroke_ratio'],
+        'rheobase': analysis['rheobase_i'],
+        'fi_slope': analysis['fi_fit_slope'],
+        'input_resistance': analysis['input_resistance'],
+        'sag': analysis['sag'],
+        'avg_firing_rate': np.mean(analysis['spiking_sweeps'].avg_rate),
+        'adaptation_index': np.mean(analysis['spiking_sweeps'].adapt),
+    }
+    return results, None
+
+
+def sweep_data(rec, t0):
+    """Return a dict of ipfx.Sweep arguments for a neuroanalysis.Recording, or None if the
+    recording has no holding current.
     """
-    def __init__(self, rec, t0):
-        # pulses may have different start times, so we shift time values to make all pulses start at t=0
-        pri = rec['primary'].copy(t0=t0)
-        cmd = rec['command'].copy()
-        t = pri.time_values
-        v = pri.data * 1e3  # convert to mV
-        holding = [i for i in rec.stimulus.items if i.description=='holding current']
-        if len(holding) == 0:
-            return None
-        holding = holding[0].amplitude
-        i = (cmd.data - holding) * 1e12   # convert to pA with holding current removed
-        srate = pri.sample_rate
-        sweep_num = rec.parent.key
-        clamp_mode = rec.clamp_mode  # this will be 'ic' or 'vc'; not sure if that's right
-
-        Sweep.__init__(self, t, v, i, clamp_mode, srate, sweep_number=sweep_num)
\ No newline at end of file
+    # pulses may have different start times, so we shift time values to make all pulses start at t=0
+    pri = rec['primary'].copy(t0=t0)
+    cmd = rec['command'].copy()
+    holding = [i for i in rec.stimulus.items if i.description=='holding current']
+    if len(holding) == 0:
+        return None
+    holding = holding[0].amplitude
+    return {
+        't': np.ascontiguousarray(pri.time_values),
+        'v': np.ascontiguousarray(pri.data * 1e3),  # convert to mV
+        'i': np.ascontiguousarray((cmd.data - holding) * 1e12),  # convert to pA with holding current removed
+        'clamp_mode': rec.clamp_mode,  # this will be 'ic' or 'vc'; not sure if that's right
+        'sampling_rate': pri.sample_rate,
+        'sweep_number': rec.parent.key,
+    }
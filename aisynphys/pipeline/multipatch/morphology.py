@@ -32,6 +32,7 @@ class MorphologyPipelineModule(MultipatchPipelineModule):
     name = 'morphology'
     dependencies = [ExperimentPipelineModule]
     table_group = ['morphology']
+    drop_paths = [('experiment.ext_id', 'cell', 'morphology')]
     
     @classmethod
     def create_db_entries(cls, job, session):
@@ -60,6 +60,7 @@ class PatchSeqPipelineModule(MultipatchPipelineModule):
     name = 'patch_seq'
     dependencies = [ExperimentPipelineModule]
     table_group = ['patch_seq']
+    drop_paths = [('experiment.ext_id', 'cell', 'patch_seq')]
 
     @classmethod
     def create_db_entries(cls, job, session):
@@ -3,6 +3,32 @@ from ..pipeline_module import DatabasePipelineModule
 
 
 class MultipatchPipelineModule(DatabasePipelineModule):
+
+    @classmethod
+    def pulse_response_table(cls, job, session, expt):
+        """Return a PulseResponseTable with all pulse responses in *expt*.
+
+        The table is built on first use and stored in *job* as 'pulse_response_table', so that all
+        pairs analyzed in one job are selected from a single query. Each module creates its own job
+        dicts, so tables are not shared between modules; process_job() drops the table when the job
+        finishes unless the caller supplied it in *job*.
+        """
+        from ...pulse_response_table import PulseResponseTable
+        table = job.get('pulse_response_table')
+        if table is None or table.expt_id != expt.id:
+            table = PulseResponseTable(job['database'], session, expt)
+            job['pulse_response_table'] = table
+        return table
+
+    @classmethod
+    def process_job(cls, job):
+        # don't keep tables created by this job alive after it finishes
+        keep_table = 'pulse_response_table' in job
+        try:
+            return super(MultipatchPipelineModule, cls).process_job(job)
+        finally:
+            if not keep_table:
+                job.pop('pulse_response_table', None)
     
     def job_status(self):
         """Extends DatabasePipelineModule to provide more information about the source of each job.
@@ -2,7 +2,6 @@
 from __future__ import print_function, division
 
 import os, random
-import pyqtgraph as pg
 from ... import config
 from .pipeline_module import MultipatchPipelineModule
 from .dataset import DatasetPipelineModule
@@ -16,6 +15,10 @@ class PulseResponsePipelineModule(MultipatchPipelineModule):
     name = 'pulse_response'
     dependencies = [DatasetPipelineModule, SynapsePipelineModule]
     table_group = ['pulse_response_fit', 'pulse_response_strength']
+    drop_paths = [
+        ('experiment.ext_id', 'pair', 'pulse_response', 'pulse_response_fit'),
+        ('experiment.ext_id', 'pair', 'pulse_response', 'pulse_response_strength'),
+    ]
     
     @classmethod
     def create_db_entries(cls, job, session):
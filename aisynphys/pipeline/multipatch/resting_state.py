@@ -4,7 +4,7 @@ from __future__ import print_function, division
 import numpy as np
 from .pipeline_module import MultipatchPipelineModule
 from .synapse import SynapsePipelineModule
-from ...resting_state import resting_state_response_fits
+from ...resting_state import resting_state_response_fits, get_experiment_resting_state_responses, empty_resting_state
 
 
 # Minimum duration (seconds) we need to wait between stimuli to consider
@@ -22,6 +22,7 @@ class RestingStatePipelineModule(MultipatchPipelineModule):
     name = 'resting_state'
     dependencies = [SynapsePipelineModule]
     table_group = ['resting_state_fit']
+    drop_paths = [('experiment.ext_id', 'pair', 'resting_state_fit')]
     
     @classmethod
     def create_db_entries(cls, job, session):
@@ -29,13 +30,17 @@ class RestingStatePipelineModule(MultipatchPipelineModule):
         expt_id = job['job_id']
 
         expt = db.experiment_from_ext_id(expt_id, session=session)
+
+        # select resting-state responses for all pairs at once
+        rest_prs = get_experiment_resting_state_responses(expt, session, rest_duration=minimum_rest_duration, response_duration=10e-3)
        
         for pair in expt.pairs.values():
             if pair.has_synapse is not True:
                 continue
 
             # get resting-state response fits for this pair            
-            result = resting_state_response_fits(pair, rest_duration=minimum_rest_duration)
+            pair_prs = rest_prs.get(pair.id, empty_resting_state())
+            result = resting_state_response_fits(pair, rest_duration=minimum_rest_duration, rest_prs=pair_prs)
             if result is None:
                 continue
             
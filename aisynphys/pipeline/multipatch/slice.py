@@ -14,6 +14,7 @@ class SlicePipelineModule(MultipatchPipelineModule):
     name = 'slice'
     dependencies = []
     table_group = ['slice']
+    drop_paths = [('slice.acq_timestamp',)]
     
     @classmethod
     def create_db_entries(cls, job, session):
@@ -0,0 +1,97 @@
+# coding: utf8
+"""
+For generating a DB table of stochastic release model results for each synapse.
+
+"""
+from __future__ import print_function, division
+
+import logging, multiprocessing
+import numpy as np
+from ... import config
+from .pipeline_module import MultipatchPipelineModule
+from .synapse import SynapsePipelineModule
+from .pulse_response import PulseResponsePipelineModule
+
+
+class StochasticModelPipelineModule(MultipatchPipelineModule):
+    """Runs the stochastic release model over a parameter grid for each synapse.
+
+    Running the model is expensive, so results are not deleted when a job is dropped. Instead they are
+    detached from their pair, and reused when the job is processed again if the model inputs are unchanged.
+
+    This module is only part of the multipatch pipeline if config.stochastic_model_pipeline is True. The
+    search grid and the number of worker processes per job are set by config.stochastic_model_grid and
+    config.stochastic_model_workers.
+    """
+    name = 'stochastic_model'
+    dependencies = [SynapsePipelineModule, PulseResponsePipelineModule]
+    table_group = ['stochastic_model_result']
+
+    @classmethod
+    def create_db_entries(cls, job, session):
+        from ...stochastic_release_model import load_pair_events, search_parameters, model_input_hash, model_result_fields, BatchModelRunner
+        logger = logging.getLogger(__name__)
+        db = job['database']
+        job_id = job['job_id']
+
+        expt = db.experiment_from_ext_id(job_id, session=session)
+        detached = session.query(db.StochasticModelResult).filter(db.StochasticModelResult.pair_id==None).filter(db.StochasticModelResult.experiment_ext_id==expt.ext_id).all()
+        detached = {(rec.pre_cell_ext_id, rec.post_cell_ext_id, rec.input_hash): rec for rec in detached}
+
+        pairs = [pair for pair in expt.pair_list if pair.has_synapse is True and pair.synapse is not None]
+        pair_events = load_pair_events(pairs, db, session)
+
+        run_pairs = []
+        for pair in pairs:
+            spike_times, amplitudes, bg_amplitudes = pair_events[pair.id]
+            if not np.any(np.isfinite(amplitudes)):
+                continue
+            params = search_parameters(bg_amplitudes)
+            input_hash = model_input_hash(spike_times, amplitudes, bg_amplitudes, params)
+
+            # reuse results for unchanged inputs
+            rec = detached.pop((pair.pre_cell.ext_id, pair.post_cell.ext_id, input_hash), None)
+            if rec is not None:
+                logger.debug("Reusing stochastic model result for pair %s", pair)
+                rec.pair_id = pair.id
+            else:
+                run_pairs.append((pair, params, input_hash))
+
+        # run the model for all remaining pairs together; parallel pipeline workers are daemonic and cannot start a process pool
+        workers = config.stochastic_model_workers
+        if workers != 1 and multiprocessing.current_process().daemon:
+            logger.warning("Running stochastic model in a single process; daemonic pipeline workers cannot start a process pool.")
+            workers = 1
+        runner = BatchModelRunner([pair_events[pair.id][:2] for pair, params, input_hash in run_pairs], [params for pair, params, input_hash in run_pairs], workers=workers)
+        for (pair, params, input_hash), param_space in zip(run_pairs, runner.run()):
+            spike_times, amplitudes, bg_amplitudes = pair_events[pair.id]
+            fields = model_result_fields(param_space, spike_times, amplitudes)
+            rec = db.StochasticModelResult(pair_id=pair.id, experiment_ext_id=expt.ext_id, pre_cell_ext_id=pair.pre_cell.ext_id,
+                post_cell_ext_id=pair.post_cell.ext_id, input_hash=input_hash, **fields)
+            session.add(rec)
+            logger.debug("Finished stochastic model for pair %s", pair)
+
+        # remaining detached results are obsolete
+        for rec in detached.values():
+            session.delete(rec)
+
+    def drop_jobs(self, job_ids, session=None, skip=None):
+        """Detach results for a list of job IDs from their pairs.
+
+        Detached results are reused or deleted the next time their job is processed.
+        """
+        db = self.database
+        if session is None:
+            session = db.session(readonly=False)
+        if skip is None:
+            skip = []
+
+        print("Detaching %d jobs from %s module.." % (len(job_ids), self.name))
+        pair_ids = session.query(db.Pair.id).join(db.Experiment, db.Pair.experiment_id==db.Experiment.id).filter(db.Experiment.ext_id.in_(job_ids))
+        n_records = session.query(db.StochasticModelResult).filter(db.StochasticModelResult.pair_id.in_(pair_ids.subquery())).update({'pair_id': None}, synchronize_session=False)
+        session.query(db.Pipeline).filter(db.Pipeline.module_name==self.name).filter(db.Pipeline.job_id.in_(job_ids)).delete(synchronize_session=False)
+        print("   detached %d records; committing.." % n_records)
+        session.commit()
+
+        skip.append(self)  # only process each module once
+
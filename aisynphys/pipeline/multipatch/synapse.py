@@ -3,7 +3,6 @@ from __future__ import print_function, division
 
 import os
 import numpy as np
-import pyqtgraph as pg
 from collections import OrderedDict
 from ... import config
 from .pipeline_module import MultipatchPipelineModule
@@ -19,6 +18,10 @@ class SynapsePipelineModule(MultipatchPipelineModule):
     name = 'synapse'
     dependencies = [DatasetPipelineModule, MorphologyPipelineModule]
     table_group = ['synapse', 'avg_response_fit']
+    drop_paths = [
+        ('experiment.ext_id', 'pair', 'synapse'),
+        ('experiment.ext_id', 'pair', 'avg_response_fit'),
+    ]
     
     @classmethod
     def create_db_entries(cls, job, session):
@@ -2,13 +2,12 @@
 from __future__ import print_function, division
 
 import os
-import pyqtgraph as pg
 from ... import config
 from .pipeline_module import MultipatchPipelineModule
 from .experiment import ExperimentPipelineModule
 from .dataset import DatasetPipelineModule
 from .pulse_response import PulseResponsePipelineModule
-from ...synapse_prediction import get_amps, analyze_pair_connectivity
+from ...synapse_prediction import get_amps, analyze_pairs_connectivity
 
 
 class SynapsePredictionPipelineModule(MultipatchPipelineModule):
@@ -17,6 +16,7 @@ class SynapsePredictionPipelineModule(MultipatchPipelineModule):
     name = 'synapse_prediction'
     dependencies = [ExperimentPipelineModule, DatasetPipelineModule, PulseResponsePipelineModule]
     table_group = ['synapse_prediction']
+    drop_paths = [('experiment.ext_id', 'pair', 'synapse_prediction')]
     
     @classmethod
     def create_db_entries(cls, job, session):
@@ -24,23 +24,23 @@ class SynapsePredictionPipelineModule(MultipatchPipelineModule):
         expt_id = job['job_id']
         
         expt = db.experiment_from_timestamp(expt_id, session=session)
+        pr_table = cls.pulse_response_table(job, session, expt)
 
+        # Select all pulse amplitude records for each pair and clamp mode
+        pair_amps = {}
         for pair in expt.pair_list:
-            # Query all pulse amplitude records for each clamp mode
             amps = {}
             for clamp_mode in ('ic', 'vc'):
-                clamp_mode_fg = get_amps(session, pair, clamp_mode=clamp_mode, get_data=True)
+                clamp_mode_fg = get_amps(session, pair, clamp_mode=clamp_mode, get_data=True, pr_table=pr_table)
                 amps[clamp_mode] = clamp_mode_fg
-            
-            # Generate summary results for this pair
-            results = analyze_pair_connectivity(amps)
-            
-            if results is None:
-                # no data to analyze
-                continue
+            pair_amps[pair] = amps
 
+        # Generate summary results for all pairs together
+        results = analyze_pairs_connectivity(pair_amps)
+
+        for pair, fields in results.items():
             # Write new record to DB
-            conn = db.SynapsePrediction(pair_id=pair.id, **results)
+            conn = db.SynapsePrediction(pair_id=pair.id, **fields)
             session.add(conn)
         
     def job_records(self, job_ids, session):
@@ -1,6 +1,6 @@
 import re
 from collections import OrderedDict
-from pyqtgraph import toposort
+from ..util import toposort
 from .pipeline_module import PipelineModule, DatabasePipelineModule
 
 
@@ -21,6 +21,7 @@ class Pipeline(object):
     
     def __init__(self, **kwds):
         self.kwds = kwds
+        self._memo = None
         self.modules = [mcls(self) for mcls in self.module_classes]
 
         excluded = [PipelineModule, DatabasePipelineModule]
@@ -36,9 +37,52 @@ class Pipeline(object):
     def get_module(self, module_name):
         return self.sorted_modules()[module_name]
         
-    def update(self, modules=None, job_ids=None):
+    def update(self, modules=None, job_ids=None, **kwds):
+        """Update all jobs in *modules* (in dependency order).
+
+        Job status queries (finished / updatable jobs) are memoized for the duration of the update;
+        cached results for a module and its downstream modules are discarded after the module
+        is updated.
+
+        Extra keyword arguments are passed to PipelineModule.update(). Return a list of
+        (module, result) pairs.
+        """
         if modules is None:
             modules = self.modules
+        modules = [m for m in self.sorted_modules().values() if m in modules]
+
+        self._memo = {}
+        try:
+            results = []
+            for module in modules:
+                print("=============================================")
+                results.append((module, module.update(job_ids=job_ids, **kwds)))
+                self.invalidate(module)
+            return results
+        finally:
+            self._memo = None
+
+    def memoize(self, module, key, func):
+        """Return func(), reusing the previous result for (*module*, *key*) if called during update().
+        """
+        memo = getattr(self, '_memo', None)
+        if memo is None:
+            return func()
+        key = (module.name, key)
+        if key not in memo:
+            memo[key] = func()
+        return memo[key]
+
+    def invalidate(self, module):
+        """Discard memoized results for *module* and all modules downstream of it.
+        """
+        memo = getattr(self, '_memo', None)
+        if memo is None:
+            return
+        names = set([module.name] + [m.name for m in module.all_downstream_modules()])
+        for key in list(memo.keys()):
+            if key[0] in names:
+                del memo[key]
         
     def drop(self, modules=None, job_ids=None):
         if modules is None:
@@ -3,6 +3,7 @@ import sys, time, multiprocessing, traceback, logging
 from datetime import datetime
 import numpy as np
 from collections import OrderedDict
+import sqlalchemy
 from .. import database
 
 
@@ -332,6 +333,11 @@ class DatabasePipelineModule(PipelineModule):
     """
     table_group = None
 
+    # Ownership paths for records created by this module, used by drop_jobs() to delete records
+    # with set-based queries; for example [('experiment.ext_id', 'pair', 'synapse')]. See
+    # Database.delete_records(). If None, drop_jobs() deletes each record returned by job_records().
+    drop_paths = None
+
     @property
     def database(self):
         return self.pipeline.database    
@@ -453,16 +459,20 @@ class DatabasePipelineModule(PipelineModule):
             dep.drop_jobs(dep_jobs, session=session, skip=skip)
         
         print("Dropping %d jobs from %s module.." % (len(job_ids), self.name))
-        records = self.job_records(job_ids, session)
-        if len(records) == 0:
-            print("   (no records to remove for these job IDs)")
+        if self.drop_paths is not None:
+            n_records = db.delete_records(session, self.drop_paths, job_ids)
         else:
+            records = self.job_records(job_ids, session)
+            n_records = len(records)
             for i,rec in enumerate(records):
                 session.delete(rec)
                 print("   record %d/%d\r" % (i, len(records)), end='')
                 sys.stdout.flush()
+        if n_records == 0:
+            print("   (no records to remove for these job IDs)")
+        else:
             session.query(db.Pipeline).filter(db.Pipeline.module_name==self.name).filter(db.Pipeline.job_id.in_(job_ids)).delete(synchronize_session=False)
-            print("   dropped %d records; committing.." % len(records))
+            print("   dropped %d records; committing.." % n_records)
             session.commit()
         
         skip.append(self)  # only process each module once
@@ -473,12 +483,83 @@ class DatabasePipelineModule(PipelineModule):
 
         Note that some results returned may be obsolete if dependencies have changed.
         """
+        return OrderedDict(self.pipeline.memoize(self, 'finished_jobs', self._query_finished_jobs))
+
+    def _query_finished_jobs(self):
         db = self.database
         session = db.session()
         jobs = session.query(db.Pipeline.job_id, db.Pipeline.finish_time, db.Pipeline.success).filter(db.Pipeline.module_name==self.name).all()
         session.rollback()
         return OrderedDict([(uid, (date, success)) for uid, date, success in jobs])
 
+    def updatable_jobs(self):
+        """Return lists of jobs that should be updated and/or should have their results dropped.
+
+        See PipelineModule.updatable_jobs(). For modules that use the default ready_jobs() and whose
+        dependencies are all stored in the pipeline table, this is computed with SQL queries rather than
+        by comparing the results of ready_jobs() and finished_jobs().
+        """
+        drop_job_ids, run_jobs, error_jobs = self.pipeline.memoize(self, 'updatable_jobs', self._updatable_jobs)
+        return list(drop_job_ids), OrderedDict(run_jobs), OrderedDict(error_jobs)
+
+    def _updatable_jobs(self):
+        deps = self.upstream_modules()
+        sql_ok = (
+            type(self).ready_jobs is PipelineModule.ready_jobs and
+            len(deps) > 0 and
+            all(isinstance(dep, DatabasePipelineModule) and dep.database is self.database and 
+                type(dep).finished_jobs is DatabasePipelineModule.finished_jobs for dep in deps)
+        )
+        if not sql_ok:
+            return PipelineModule.updatable_jobs(self)
+
+        db = self.database
+        session = db.session()
+        dep_rec = sqlalchemy.orm.aliased(db.Pipeline)
+        own_rec = sqlalchemy.orm.aliased(db.Pipeline)
+
+        # jobs for which all dependencies finished successfully, and the time of the latest dependency
+        ready = session.query(
+            dep_rec.job_id.label('job_id'),
+            sqlalchemy.func.max(dep_rec.finish_time).label('dep_time'),
+        ).filter(
+            dep_rec.module_name.in_([dep.name for dep in deps])
+        ).filter(
+            dep_rec.success.isnot(False)
+        ).group_by(
+            dep_rec.job_id
+        ).having(
+            sqlalchemy.func.count(sqlalchemy.distinct(dep_rec.module_name)) == len(deps)
+        ).subquery()
+
+        # ready jobs that have no result, an outdated result, or a failed result
+        update_q = session.query(
+            ready.c.job_id, ready.c.dep_time, own_rec.finish_time, own_rec.success
+        ).outerjoin(
+            own_rec, sqlalchemy.and_(own_rec.job_id==ready.c.job_id, own_rec.module_name==self.name)
+        ).filter(sqlalchemy.or_(
+            own_rec.job_id.is_(None),
+            own_rec.finish_time < ready.c.dep_time,
+            own_rec.success.is_(False),
+        ))
+
+        # results that are no longer ready
+        drop_q = session.query(own_rec.job_id).filter(own_rec.module_name==self.name).filter(
+            ~own_rec.job_id.in_(session.query(ready.c.job_id)))
+
+        run_jobs = OrderedDict()
+        error_jobs = OrderedDict()
+        for job_id, dep_time, finish_time, success in update_q.all():
+            if finish_time is None or finish_time < dep_time:
+                run_jobs[job_id] = None
+            else:
+                error_jobs[job_id] = None
+        drop_job_ids = [rec.job_id for rec in drop_q.all()]
+        session.rollback()
+
+        print("%d need drop, %d need update, %d previous errors" % (len(drop_job_ids), len(run_jobs), len(error_jobs)))
+        return drop_job_ids, run_jobs, error_jobs
+
     def job_status(self):
         """Return the status and error message for each job in this module.
             
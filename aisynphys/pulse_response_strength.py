@@ -8,7 +8,6 @@ from __future__ import print_function, division
 import sys, multiprocessing, time, warnings
 
 import numpy as np
-import pyqtgraph as pg
 
 from neuroanalysis.data import TSeries
 from neuroanalysis import filter
@@ -0,0 +1,245 @@
+# coding: utf8
+"""
+Columnar view of the pulse responses in one experiment.
+
+Several pipeline analyses (dynamics, synapse prediction, ...) need the same scalar fields
+from pulse_response and the tables joined to it. PulseResponseTable collects these for
+an entire experiment in a single query and stores each field as a numpy array, so that
+per-pair selections are made with boolean masks rather than new queries.
+"""
+from __future__ import print_function, division
+
+from collections import OrderedDict
+import numpy as np
+import sqlalchemy
+from sqlalchemy.orm import aliased
+
+
+class PulseResponseTable(object):
+    """Scalar fields for all pulse responses in an experiment, stored as one numpy array per field.
+
+    Rows are ordered by post-synaptic recording start time and pulse onset time. Missing
+    values (for example, responses that have no fit, or recordings without a multipatch
+    probe) are stored as NaN in float columns, -1 in ID columns, False in bool columns,
+    and None in str columns.
+
+    Response data is not loaded with the table; use data() to load it for selected rows.
+
+    Parameters
+    ----------
+    db : Database
+        Database that contains the experiment.
+    session : Session
+        Session used for queries.
+    expt : Experiment
+        Experiment record whose pulse responses will be loaded.
+    pair_ids : list | None
+        Optionally restrict the table to pulse responses from these pairs.
+
+    Examples
+    --------
+
+    Dynamics-style selection of qc-passed current clamp responses with a fit amplitude::
+
+        prs = PulseResponseTable(db, session, expt)
+        mask = prs.mask(pair_id=pair.id, clamp_mode='ic', ex_qc_pass=True) & prs.has_fit
+        amps = prs['dec_fit_reconv_amp'][mask]
+    """
+    def __init__(self, db, session, expt, pair_ids=None):
+        self.db = db
+        self.session = session
+        self.expt_id = expt.id
+        self._data = {}
+        self._stim_spikes = None
+
+        columns = self._columns(db, session, expt)
+        q = session.query(*[col.label(name) for name, (col, kind) in columns.items()])
+        q = self._joins(db, session, q, expt)
+        q = q.filter(db.SyncRec.experiment_id==expt.id)
+        if pair_ids is not None:
+            q = q.filter(db.PulseResponse.pair_id.in_(list(pair_ids)))
+        q = q.order_by(db.Recording.start_time, db.StimPulse.onset_time, db.PulseResponse.id)
+        rows = q.all()
+
+        self.columns = OrderedDict()
+        for i, (name, (col, kind)) in enumerate(columns.items()):
+            self.columns[name] = _to_array([row[i] for row in rows], kind)
+
+    def _columns(self, db, session, expt):
+        """Return {name: (column expression, kind)} for all fields in the table.
+        """
+        pr = db.PulseResponse
+        fit = db.PulseResponseFit
+        strength = db.PulseResponseStrength
+        pcr = db.PatchClampRecording
+        mpp = db.MultiPatchProbe
+        self._first_spike = aliased(db.StimSpike)
+        self._spikes = self._spike_counts(db, session, expt)
+
+        columns = [
+            ('id', pr.id, 'id'),
+            ('pair_id', pr.pair_id, 'id'),
+            ('recording_id', pr.recording_id, 'id'),
+            ('stim_pulse_id', pr.stim_pulse_id, 'id'),
+            ('baseline_id', pr.baseline_id, 'id'),
+            ('data_start_time', pr.data_start_time, 'float'),
+            ('duration', pr.duration, 'float'),
+            ('ex_qc_pass', pr.ex_qc_pass, 'bool'),
+            ('in_qc_pass', pr.in_qc_pass, 'bool'),
+            ('rec_start_time', db.Recording.start_time, 'datetime'),
+            ('clamp_mode', pcr.clamp_mode, 'str'),
+            ('recording_qc_pass', pcr.qc_pass, 'bool'),
+            ('baseline_potential', pcr.baseline_potential, 'float'),
+            ('baseline_current', pcr.baseline_current, 'float'),
+            ('probe_id', mpp.id, 'id'),
+            ('induction_frequency', mpp.induction_frequency, 'float'),
+            ('recovery_delay', mpp.recovery_delay, 'float'),
+            ('pulse_number', db.StimPulse.pulse_number, 'int'),
+            ('onset_time', db.StimPulse.onset_time, 'float'),
+            ('n_spikes', db.StimPulse.n_spikes, 'int'),
+            ('first_spike_time', db.StimPulse.first_spike_time, 'float'),
+            ('previous_pulse_dt', db.StimPulse.previous_pulse_dt, 'float'),
+            ('spike_count', sqlalchemy.func.coalesce(self._spikes.c.spike_count, 0), 'int'),
+            ('max_slope_time', self._first_spike.max_slope_time, 'float'),
+            ('synapse_type', db.Synapse.synapse_type, 'str'),
+            ('fit_id', fit.id, 'id'),
+            ('fit_amp', fit.fit_amp, 'float'),
+            ('baseline_fit_amp', fit.baseline_fit_amp, 'float'),
+            ('dec_fit_amp', fit.dec_fit_amp, 'float'),
+            ('dec_fit_reconv_amp', fit.dec_fit_reconv_amp, 'float'),
+            ('baseline_dec_fit_amp', fit.baseline_dec_fit_amp, 'float'),
+            ('baseline_dec_fit_reconv_amp', fit.baseline_dec_fit_reconv_amp, 'float'),
+            ('strength_id', strength.id, 'id'),
+        ]
+        for field in ['pos_amp', 'neg_amp', 'pos_dec_amp', 'neg_dec_amp', 'pos_dec_latency', 'neg_dec_latency', 'crosstalk']:
+            columns.append((field, getattr(strength, field), 'float'))
+            columns.append(('baseline_' + field, getattr(strength, 'baseline_' + field), 'float'))
+        return OrderedDict([(name, (col, kind)) for name, col, kind in columns])
+
+    def _spike_counts(self, db, session, expt):
+        """Subquery giving the number of spikes and the ID of the first spike for each stim pulse in *expt*.
+        """
+        q = session.query(
+            db.StimSpike.stim_pulse_id.label('stim_pulse_id'),
+            sqlalchemy.func.count(db.StimSpike.id).label('spike_count'),
+            sqlalchemy.func.min(db.StimSpike.id).label('first_spike_id'),
+        )
+        q = q.join(db.StimPulse, db.StimSpike.stim_pulse_id==db.StimPulse.id)
+        q = q.join(db.Recording, db.StimPulse.recording_id==db.Recording.id)
+        q = q.join(db.SyncRec, db.Recording.sync_rec_id==db.SyncRec.id)
+        q = q.filter(db.SyncRec.experiment_id==expt.id)
+        q = q.group_by(db.StimSpike.stim_pulse_id)
+        return q.subquery()
+
+    def _joins(self, db, session, q, expt):
+        pr = db.PulseResponse
+        q = q.select_from(pr)
+        q = q.join(db.Recording, pr.recording_id==db.Recording.id)
+        q = q.join(db.SyncRec, db.Recording.sync_rec_id==db.SyncRec.id)
+        q = q.join(db.StimPulse, pr.stim_pulse_id==db.StimPulse.id)
+        q = q.outerjoin(db.PatchClampRecording, db.PatchClampRecording.recording_id==db.Recording.id)
+        q = q.outerjoin(db.MultiPatchProbe, db.MultiPatchProbe.patch_clamp_recording_id==db.PatchClampRecording.id)
+        q = q.outerjoin(self._spikes, self._spikes.c.stim_pulse_id==db.StimPulse.id)
+        q = q.outerjoin(self._first_spike, self._first_spike.id==self._spikes.c.first_spike_id)
+        q = q.outerjoin(db.Synapse, db.Synapse.pair_id==pr.pair_id)
+        q = q.outerjoin(db.PulseResponseFit, db.PulseResponseFit.pulse_response_id==pr.id)
+        q = q.outerjoin(db.PulseResponseStrength, db.PulseResponseStrength.pulse_response_id==pr.id)
+        return q
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    @property
+    def has_fit(self):
+        """Boolean mask of rows that have a pulse_response_fit record.
+        """
+        return self.columns['fit_id'] >= 0
+
+    @property
+    def has_strength(self):
+        """Boolean mask of rows that have a pulse_response_strength record.
+        """
+        return self.columns['strength_id'] >= 0
+
+    @property
+    def has_probe(self):
+        """Boolean mask of rows recorded in a multipatch probe.
+        """
+        return self.columns['probe_id'] >= 0
+
+    def mask(self, **values):
+        """Return a boolean mask selecting rows where each named column equals the given value.
+
+        A list or tuple of values selects rows matching any of them.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, value in values.items():
+            col = self.columns[name]
+            if isinstance(value, (list, tuple)):
+                mask &= np.isin(col, value)
+            else:
+                mask &= col == value
+        return mask
+
+    def stim_spikes(self):
+        """Return (stim_pulse_id, max_slope_time) arrays with one element per stim spike in the
+        experiment, ordered by stim pulse ID and spike ID.
+
+        Spikes are loaded with a single query on first use.
+        """
+        if self._stim_spikes is None:
+            db = self.db
+            q = self.session.query(db.StimSpike.stim_pulse_id, db.StimSpike.max_slope_time)
+            q = q.join(db.StimPulse, db.StimSpike.stim_pulse_id==db.StimPulse.id)
+            q = q.join(db.Recording, db.StimPulse.recording_id==db.Recording.id)
+            q = q.join(db.SyncRec, db.Recording.sync_rec_id==db.SyncRec.id)
+            q = q.filter(db.SyncRec.experiment_id==self.expt_id)
+            q = q.order_by(db.StimSpike.stim_pulse_id, db.StimSpike.id)
+            rows = q.all()
+            self._stim_spikes = (
+                _to_array([row[0] for row in rows], 'id'),
+                _to_array([row[1] for row in rows], 'float'),
+            )
+        return self._stim_spikes
+
+    def data(self, mask):
+        """Return a list of response data arrays for the rows selected by *mask* (a boolean
+        mask or array of row indices).
+
+        Data that has not been loaded yet is fetched with a single query; loaded data is kept
+        for later calls.
+        """
+        ids = self.columns['id'][mask]
+        missing = [int(i) for i in ids if i not in self._data]
+        db = self.db
+        for i in range(0, len(missing), 1000):
+            chunk = missing[i:i+1000]
+            q = self.session.query(db.PulseResponse.id, db.PulseResponse.data).filter(db.PulseResponse.id.in_(chunk))
+            self._data.update(q.all())
+        return [self._data[i] for i in ids]
+
+
+def _to_array(values, kind):
+    if kind == 'float':
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+    elif kind == 'id':
+        return np.array([-1 if v is None else v for v in values], dtype=int)
+    elif kind == 'int':
+        # nullable integers become float so that NaN can mark missing values
+        if any(v is None for v in values):
+            return np.array([np.nan if v is None else v for v in values], dtype=float)
+        return np.array(values, dtype=int)
+    elif kind == 'bool':
+        return np.array([bool(v) for v in values], dtype=bool)
+    elif kind == 'datetime':
+        return np.array(values, dtype='datetime64[ns]')
+    else:
+        arr = np.empty(len(values), dtype=object)
+        arr[:] = values
+        return arr
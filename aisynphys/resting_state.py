@@ -1,13 +1,14 @@
 # coding: utf8
 from __future__ import print_function, division
 
+from collections import OrderedDict
 from .fitting import fit_avg_pulse_response
 from .data import PulseResponseList
 from .database import default_db as db
 from .util import datetime_to_timestamp 
 
 
-def resting_state_response_fits(pair, rest_duration):
+def resting_state_response_fits(pair, rest_duration, rest_prs=None):
     """Return curve fits to average pulse responses from *pair* for pulses that are at "resting state",
     meaning that each stimulus included in the average is preceded by a certain minimum period
     with no other presynaptic stimuli.
@@ -19,6 +20,9 @@ def resting_state_response_fits(pair, rest_duration):
     rest_duration : float
         Duration (seconds) of the time window that must be quiescent in order to consider
         the synapse at "resting state".
+    rest_prs : dict | None
+        Resting-state responses for this pair, as returned by get_resting_state_responses().
+        If None, they are queried from the database.
         
     Returns
     -------
@@ -40,7 +44,8 @@ def resting_state_response_fits(pair, rest_duration):
     }
         
     # 1. Select qc-passed "resting state" PRs
-    rest_prs = get_resting_state_responses(pair, rest_duration, response_duration=10e-3)
+    if rest_prs is None:
+        rest_prs = get_resting_state_responses(pair, rest_duration, response_duration=10e-3)
     
     # 2. Average and fit
     fits = {}
@@ -75,25 +80,52 @@ def get_resting_state_responses(pair, rest_duration, response_duration):
     are no presynaptic spikes. Typical values here might be a few seconds to tens of seconds to 
     allow the synapse to recover to its resting state.
     """
-    syn_typ = pair.synapse.synapse_type
-    qc_field = getattr(db.PulseResponse, syn_typ + '_qc_pass')
-    
-    q = db.query(db.PulseResponse, db.StimPulse, db.Recording, db.PatchClampRecording, db.PulseResponse.data)
-    q = q.join(db.StimPulse, db.PulseResponse.stim_pulse)
-    q = q.join(db.Recording, db.PulseResponse.recording)
-    q = q.join(db.PatchClampRecording, db.PatchClampRecording.recording_id==db.Recording.id)
+    q = resting_state_response_query(db.default_session, rest_duration, response_duration)
     q = q.filter(db.PulseResponse.pair_id==pair.id)
+    return _group_resting_state_responses(q.all()).get(pair.id, empty_resting_state())
+
+
+def get_experiment_resting_state_responses(expt, session, rest_duration, response_duration):
+    """Return {pair_id: {'ic': PulseResponseList(), 'vc': PulseResponseList()}} for all pairs
+    with a synapse in *expt*, using a single query.
+
+    See get_resting_state_responses().
+    """
+    q = resting_state_response_query(session, rest_duration, response_duration)
+    q = q.filter(db.Pair.experiment_id==expt.id)
+    return _group_resting_state_responses(q.all())
+
+
+def resting_state_response_query(session, rest_duration, response_duration):
+    """Return a query for qc-passed resting-state pulse responses with at least *response_duration*
+    seconds of data.
+
+    The qc criteria are selected by the synapse type of each pair, and all selection is done in
+    the database; response data is only loaded for the records that pass.
+    """
+    pr = db.PulseResponse
+    q = session.query(pr, db.StimPulse, db.Recording, db.PatchClampRecording, pr.data)
+    q = q.join(db.StimPulse, pr.stim_pulse)
+    q = q.join(db.Recording, pr.recording)
+    q = q.join(db.PatchClampRecording, db.PatchClampRecording.recording_id==db.Recording.id)
+    q = q.join(db.Pair, pr.pair_id==db.Pair.id)
+    q = q.join(db.Synapse, db.Synapse.pair_id==db.Pair.id)
     q = q.filter(db.StimPulse.previous_pulse_dt > response_duration)
-    q = q.filter(qc_field==True)
-    q = q.order_by(db.Recording.start_time, db.StimPulse.onset_time)
-    recs = q.all()
-        
-    rest_prs = {'ic': [], 'vc': []}
+    q = q.filter(pr.duration >= response_duration)
+    q = q.filter(((db.Synapse.synapse_type=='ex') & (pr.ex_qc_pass==True)) | ((db.Synapse.synapse_type=='in') & (pr.in_qc_pass==True)))
+    q = q.order_by(pr.pair_id, db.Recording.start_time, db.StimPulse.onset_time)
+    return q
+
+
+def empty_resting_state():
+    """Return the resting-state responses for a pair that has none ({'ic': ..., 'vc': ...}).
+    """
+    return {'ic': PulseResponseList([]), 'vc': PulseResponseList([])}
+
+
+def _group_resting_state_responses(recs):
+    rest_prs = OrderedDict()
     for rec in recs:
         pr = rec.PulseResponse
-        if pr.post_tseries.duration < response_duration:
-            # not enough data; skip
-            continue
-        rest_prs[rec.PatchClampRecording.clamp_mode].append(pr)
-
-    return {k:PulseResponseList(v) for k,v in rest_prs.items()}
+        rest_prs.setdefault(pr.pair_id, {'ic': [], 'vc': []})[rec.PatchClampRecording.clamp_mode].append(pr)
+    return OrderedDict([(pair_id, {k:PulseResponseList(v) for k,v in prs.items()}) for pair_id, prs in rest_prs.items()])
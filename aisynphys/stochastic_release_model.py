@@ -1,18 +1,49 @@
 # coding: utf8
 from __future__ import print_function, division
-import functools, pickle, time, os
+import functools, pickle, time, os, hashlib
 from collections import OrderedDict
 import numpy as np
-import numba
 import scipy.stats as stats
 import scipy.optimize
+from . import config
 
 
 # lets us quickly disable jit for debugging:
 def _fake_jit(**kwds):
     return lambda fn: fn
+
+
+_lazy_jit_functions = []
+_jitted_functions = {}
+
+def _lazy_jit(**kwds):
+    """Like numba.jit, but numba is not imported until one of the decorated functions is first called.
+
+    At that point, all decorated module-level functions are replaced with their numba dispatchers,
+    so jitted functions can call each other in nopython mode.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def call_jitted(*args, **kwargs):
+            return _jit_all()[fn](*args, **kwargs)
+        _lazy_jit_functions.append((fn, kwds, call_jitted))
+        return call_jitted
+    return decorate
+
+
+def _jit_all():
+    if len(_jitted_functions) == 0:
+        import numba
+        jitted = {}
+        for fn, kwds, wrapper in _lazy_jit_functions:
+            jitted[fn] = numba.jit(**kwds)(fn)
+            if globals().get(fn.__name__) is wrapper:
+                globals()[fn.__name__] = jitted[fn]
+        _jitted_functions.update(jitted)
+    return _jitted_functions
+
 #jit = _fake_jit    
-jit = numba.jit
+jit = _lazy_jit
 
 
 class StochasticReleaseModel(object):
@@ -518,10 +549,10 @@ class ParameterSpace(object):
     def axes(self):
         return OrderedDict([(ax, {'values': self.params[ax]}) for ax in self.param_order])
         
-    def run(self, func, workers=None, **kwds):
+    def run(self, func, workers=None, progress_dialog='synapticulating...', **kwds):
         from pyqtgraph.multiprocess import Parallelize
         all_inds = list(np.ndindex(self.result.shape))
-        with Parallelize(enumerate(all_inds), results=self.result, progressDialog='synapticulating...', workers=workers) as tasker:
+        with Parallelize(enumerate(all_inds), results=self.result, progressDialog=progress_dialog, workers=workers) as tasker:
             for i, inds in tasker:
                 params = self[inds]
                 tasker.results[inds] = func(params, **kwds)
@@ -532,10 +563,80 @@ class ParameterSpace(object):
             params[param] = self.params[param][inds[i]]
         return params
 
+    def summary(self):
+        """Return a dict of fields summarizing the model results, as stored in the stochastic_model_result table.
 
-def event_query(pair, db, session):
-    q = session.query(
-        db.PulseResponse,
+        Each result must contain 'likelihood' and 'params' (see StochasticModelRunner.run_model).
+        """
+        likelihood = np.array([res['likelihood'] for res in self.result.flat], dtype=float).reshape(self.result.shape)
+        mini_amp = np.array([_mini_amplitude(res) for res in self.result.flat], dtype=float).reshape(self.result.shape)
+
+        best = np.unravel_index(np.nanargmax(likelihood), likelihood.shape)
+        best_params = self[best]
+        best_params['mini_amplitude'] = mini_amp[best]
+        max_likelihood = likelihood[best]
+
+        fields = {
+            'ml_likelihood': max_likelihood,
+            'likelihood_mean': np.nanmean(likelihood),
+            'likelihood_stdev': np.nanstd(likelihood),
+            'likelihood_near_max': np.mean(likelihood >= 0.95 * max_likelihood),
+            'parameter_space': {
+                'axes': [[name, np.asarray(self.params[name]).tolist()] for name in self.param_order],
+                'static': {name: np.asarray(val).tolist() for name, val in self.static_params.items()},
+            },
+            'likelihood': likelihood,
+            'mini_amplitude': mini_amp,
+        }
+        for name in StochasticReleaseModel.param_names:
+            val = best_params.get(name, None)
+            fields['ml_' + name] = None if val is None else np.asarray(val).tolist()
+
+        total = np.nansum(likelihood)
+        marginals = OrderedDict()
+        for i, name in enumerate(self.param_order):
+            other_axes = tuple([j for j in range(likelihood.ndim) if j != i])
+            marginals[name] = {
+                'max': np.nanmax(likelihood, axis=other_axes).tolist(),
+                'marginal': (np.nansum(likelihood, axis=other_axes) / total).tolist(),
+            }
+        fields['marginal_distributions'] = marginals
+        return fields
+
+    @classmethod
+    def from_summary(cls, parameter_space, likelihood, mini_amplitude):
+        """Rebuild a ParameterSpace from fields generated by summary().
+
+        Each result contains 'likelihood', 'params', and 'optimized_params' (see StochasticModelRunner.run_model).
+        """
+        params = OrderedDict([(name, np.array(values)) for name, values in parameter_space['axes']])
+        params.update(parameter_space['static'])
+        param_space = cls(params)
+        param_space.set_results(likelihood, mini_amplitude)
+        return param_space
+
+    def set_results(self, likelihood, mini_amplitude):
+        """Fill in the result at each point in the parameter space from arrays of likelihood and
+        mini amplitude values (with the same shape as the parameter space).
+        """
+        optimized = 'mini_amplitude' not in self.param_order and 'mini_amplitude' not in self.static_params
+        for inds in np.ndindex(self.result.shape):
+            res = {'likelihood': likelihood[inds], 'params': self[inds]}
+            if optimized:
+                res['optimized_params'] = {'mini_amplitude': mini_amplitude[inds]}
+            self.result[inds] = res
+
+
+def _mini_amplitude(result):
+    """Return the mini amplitude used to generate a model result (either a model parameter or optimized).
+    """
+    if 'mini_amplitude' in result['params']:
+        return result['params']['mini_amplitude']
+    return result.get('optimized_params', {}).get('mini_amplitude', np.nan)
+
+
+def _event_columns(db):
+    return [
         db.PulseResponse.ex_qc_pass,
         db.PulseResponse.in_qc_pass,
         db.Baseline.ex_qc_pass.label('baseline_ex_qc_pass'),
@@ -553,7 +654,10 @@ def event_query(pair, db, session):
         db.MultiPatchProbe.induction_frequency,
         db.MultiPatchProbe.recovery_delay,
         db.SyncRec.ext_id.label('sync_rec_ext_id'),
-    )
+    ]
+
+
+def _join_events(q, db):
     q = q.join(db.Baseline, db.PulseResponse.baseline)
     q = q.join(db.PulseResponseFit)
     q = q.join(db.StimPulse)
@@ -561,19 +665,362 @@ def event_query(pair, db, session):
     q = q.join(db.SyncRec, db.Recording.sync_rec)
     q = q.join(db.PatchClampRecording)
     q = q.join(db.MultiPatchProbe)
+    q = q.filter(db.PatchClampRecording.clamp_mode=='ic')
+    return q
+
+
+def model_input_hash(spike_times, amplitudes, bg_amplitudes, params):
+    """Return a hex digest identifying the model inputs: event times, amplitudes, and the parameter space.
+
+    Results generated from inputs with the same hash are interchangeable.
+    """
+    h = hashlib.sha1()
+    for arr in (spike_times, amplitudes, bg_amplitudes):
+        h.update(np.ascontiguousarray(arr, dtype=float).tobytes())
+    for name in sorted(params):
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(params[name], dtype=float).tobytes())
+    return h.hexdigest()
+
 
+def model_result_fields(param_space, spike_times, amplitudes):
+    """Return a dict of stochastic_model_result fields describing model results in *param_space*.
+    """
+    fields = param_space.summary()
+    fields['n_events'] = len(spike_times)
+    fields['n_amplitudes'] = int(np.isfinite(amplitudes).sum())
+    if fields['ml_n_release_sites'] is not None:
+        fields['ml_n_release_sites'] = int(fields['ml_n_release_sites'])
+    return fields
+
+
+def search_parameters(bg_amplitudes):
+    """Return the parameter space searched for a synapse with background amplitudes *bg_amplitudes*.
+
+    Array values define grid axes; scalar values are held constant. Entries in config.stochastic_model_grid
+    replace the default values for the named parameters.
+    """
+    search_params = {
+        'n_release_sites': np.array([1, 2, 4, 8, 16, 32, 64]),
+        #'n_release_sites': np.array([1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64]),
+        'base_release_probability': np.array([0.00625, 0.0125, 0.025, 0.05, 0.1, 0.2, 0.4, 0.6, 0.8, 1.0]),
+        #'base_release_probability': 1.0 / 1.5**(np.arange(15)[::-1]),
+        #'mini_amplitude': avg_amplitude * 1.2**np.arange(-12, 24, 2),  # optimized by model
+        'mini_amplitude_cv': np.array([0.05, 0.1, 0.2, 0.4, 0.8]),
+        'measurement_stdev': np.nanstd(bg_amplitudes),
+        'vesicle_recovery_tau': np.array([0.0025, 0.01, 0.04, 0.16, 0.64, 2.56]),
+        'facilitation_amount': np.array([0.0, 0.00625, 0.025, 0.05, 0.1, 0.2, 0.4]),
+        'facilitation_recovery_tau': np.array([0.01, 0.02, 0.04, 0.08, 0.16, 0.32, 0.64, 1.28]),
+    }
+
+    for k,v in config.stochastic_model_grid.items():
+        if k not in search_params:
+            raise KeyError("Unknown stochastic model parameter %r in config.stochastic_model_grid" % k)
+        search_params[k] = v if np.isscalar(v) else np.array(v)
+    
+    # sanity checking
+    for k,v in search_params.items():
+        if np.isscalar(v):
+            assert not np.isnan(v), k
+        else:
+            assert not np.any(np.isnan(v)), k
+
+    return search_params
+
+
+def event_query(pair, db, session):
+    q = session.query(db.PulseResponse, *_event_columns(db))
+    q = _join_events(q, db)
     q = q.filter(db.PulseResponse.pair_id==pair.id)
-    q = q.filter(db.PatchClampRecording.clamp_mode=='ic')
     
     q = q.order_by(db.Recording.start_time).order_by(db.StimPulse.onset_time)
 
     return q
 
 
+def load_pair_events(pairs, db, session, max_events=None):
+    """Load model inputs for many pairs with a single query.
+
+    Returns {pair.id: (spike_times, amplitudes, bg_amplitudes)}, as in StochasticModelRunner.synapse_events.
+    """
+    cols = [db.PulseResponse.pair_id] + _event_columns(db)
+    q = session.query(*cols).select_from(db.PulseResponse)
+    q = _join_events(q, db)
+    q = q.filter(db.PulseResponse.pair_id.in_([pair.id for pair in pairs]))
+    q = q.order_by(db.PulseResponse.pair_id, db.Recording.start_time, db.StimPulse.onset_time)
+    rows = q.all()
+
+    names = [col.key for col in cols]
+    columns = {name: np.array([row[i] for row in rows]) for i, name in enumerate(names)}
+    if len(rows) > 0:
+        columns['rec_start_time'] = columns['rec_start_time'].astype('datetime64[ns]')
+        for name in ('dec_fit_reconv_amp', 'baseline_dec_fit_reconv_amp', 'first_spike_time', 'onset_time'):
+            columns[name] = columns[name].astype(float)
+
+    events = OrderedDict()
+    for pair in pairs:
+        mask = columns['pair_id'] == pair.id if len(rows) > 0 else slice(0, 0)
+        pair_columns = {name: col[mask] for name, col in columns.items()}
+        spike_times, amplitudes, bg_amplitudes = event_arrays(pair_columns, pair.synapse.synapse_type)
+        if max_events is not None:
+            spike_times = spike_times[:max_events]
+            amplitudes = amplitudes[:max_events]
+        events[pair.id] = (spike_times, amplitudes, bg_amplitudes)
+    return events
+
+
+def event_arrays(events, syn_type):
+    """Return (spike_times, amplitudes, bg_amplitudes) model inputs from the columns selected by event_query().
+
+    *events* maps column names to arrays (or a pandas dataframe) with rows in chronological order.
+    Missing spike times are filled in using the median spike latency, and amplitudes that failed
+    qc for *syn_type* or have no spike time are set to NaN.
+    """
+    rec_start_time = np.asarray(events['rec_start_time'], dtype='datetime64[ns]')
+    if len(rec_start_time) == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    rec_times = (rec_start_time - rec_start_time[0]) / np.timedelta64(1, 's')
+    first_spike_time = np.asarray(events['first_spike_time'], dtype=float)
+    onset_time = np.asarray(events['onset_time'], dtype=float)
+    spike_times = first_spike_time + rec_times
+
+    # any missing spike times get filled in with the average latency
+    missing_spike_mask = np.isnan(spike_times)
+    avg_spike_latency = np.nanmedian(first_spike_time - onset_time)
+    pulse_times = onset_time + avg_spike_latency + rec_times
+    spike_times[missing_spike_mask] = pulse_times[missing_spike_mask]
+
+    # get individual event amplitudes
+    amplitudes = np.array(events['dec_fit_reconv_amp'], dtype=float)
+
+    # filter events by inhibitory or excitatory qc
+    qc_field = syn_type + '_qc_pass'
+    qc_mask = np.asarray(events[qc_field]) == True
+    amplitudes[~qc_mask] = np.nan
+    amplitudes[missing_spike_mask] = np.nan
+
+    # get background events for determining measurement noise
+    bg_amplitudes = np.array(events['baseline_dec_fit_reconv_amp'], dtype=float)
+    # filter by qc
+    bg_amplitudes[~qc_mask] = np.nan
+
+    return spike_times, amplitudes, bg_amplitudes
+
+
+def evaluate_model(params, spike_times, amplitudes, **kwds):
+    """Run the model with *params* on one set of events.
+
+    If *params* does not include mini_amplitude, then it is optimized to maximize likelihood.
+    Returns the full model result (see StochasticReleaseModel.measure_likelihood) and the model.
+    """
+    model = StochasticReleaseModel(params)
+    if 'mini_amplitude' in params:
+        result = model.measure_likelihood(spike_times, amplitudes, **kwds)
+    else:
+        result = model.optimize_mini_amplitude(spike_times, amplitudes, **kwds)
+    return result, model
+
+
+class SharedEventArrays(object):
+    """Model input events (spike times and amplitudes) for many synapses, packed into shared memory blocks.
+
+    The process that creates the arrays owns the shared memory and unlinks it when closed. Other
+    processes attach to the same blocks by passing *spec* to attach(), without copying any event data.
+
+    Examples
+    --------
+
+    ::
+
+        with SharedEventArrays.create([(spike_times_1, amplitudes_1), (spike_times_2, amplitudes_2)]) as shared:
+            spec = shared.spec  # small and picklable; send to workers
+
+        # in a worker process:
+        events = SharedEventArrays.attach(spec)
+        spike_times, amplitudes = events[1]
+    """
+    fields = ('spike_times', 'amplitudes')
+
+    def __init__(self, blocks, n_events, n_synapses, owner):
+        self._blocks = blocks
+        self.n_events = n_events
+        self.n_synapses = n_synapses
+        self.owner = owner
+        self.offsets = np.ndarray((n_synapses + 1,), dtype='int64', buffer=blocks['offsets'].buf)
+        self.arrays = {field: np.ndarray((n_events,), dtype='float64', buffer=blocks[field].buf) for field in self.fields}
+
+    @classmethod
+    def create(cls, events):
+        """Copy a list of (spike_times, amplitudes) for each synapse into new shared memory blocks.
+        """
+        from multiprocessing import shared_memory
+        sizes = [len(ev[0]) for ev in events]
+        n_events = int(np.sum(sizes))
+        blocks = {'offsets': shared_memory.SharedMemory(create=True, size=8 * (len(events) + 1))}
+        for field in cls.fields:
+            # zero-size blocks are not allowed
+            blocks[field] = shared_memory.SharedMemory(create=True, size=max(8, 8 * n_events))
+        shared = cls(blocks, n_events, len(events), owner=True)
+        shared.offsets[0] = 0
+        shared.offsets[1:] = np.cumsum(sizes)
+        for i, field in enumerate(cls.fields):
+            for j, ev in enumerate(events):
+                shared.arrays[field][shared.offsets[j]:shared.offsets[j+1]] = ev[i]
+        return shared
+
+    @property
+    def spec(self):
+        """Picklable description of the shared memory blocks, used to attach() from other processes.
+        """
+        return {
+            'names': {name: block.name for name, block in self._blocks.items()},
+            'n_events': self.n_events,
+            'n_synapses': self.n_synapses,
+        }
+
+    @classmethod
+    def attach(cls, spec):
+        """Attach to shared memory blocks created in another process.
+        """
+        from multiprocessing import shared_memory
+        blocks = {name: shared_memory.SharedMemory(name=block_name) for name, block_name in spec['names'].items()}
+        return cls(blocks, spec['n_events'], spec['n_synapses'], owner=False)
+
+    def __len__(self):
+        return self.n_synapses
+
+    def __getitem__(self, i):
+        """Return (spike_times, amplitudes) for synapse *i*. These are views on the shared memory.
+        """
+        start, stop = self.offsets[i], self.offsets[i+1]
+        return tuple(self.arrays[field][start:stop] for field in self.fields)
+
+    def close(self):
+        """Release the shared memory (and unlink it if this instance created it).
+        """
+        if self._blocks is None:
+            return
+        # numpy views must be released before the memory can be closed
+        self.arrays = None
+        self.offsets = None
+        for block in self._blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self._blocks = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# state of BatchModelRunner worker processes
+_batch_worker = None
+
+
+class _BatchWorker(object):
+    def __init__(self, events, params):
+        self.events = events
+        self.param_spaces = [ParameterSpace(OrderedDict(p)) for p in params]
+
+    def run_chunk(self, index, start, stop):
+        """Run the model for flat parameter indices start:stop of synapse *index*.
+
+        Returns (index, start, likelihood, mini_amplitude).
+        """
+        spike_times, amplitudes = self.events[index]
+        param_space = self.param_spaces[index]
+        shape = param_space.result.shape
+        likelihood = np.empty(stop - start)
+        mini_amp = np.empty(stop - start)
+        for i in range(start, stop):
+            params = param_space[np.unravel_index(i, shape)]
+            result, model = evaluate_model(params, spike_times, amplitudes)
+            likelihood[i-start] = result['likelihood']
+            mini_amp[i-start] = _mini_amplitude(result)
+        return index, start, likelihood, mini_amp
+
+
+def _init_batch_worker(spec, params):
+    global _batch_worker
+    _batch_worker = _BatchWorker(SharedEventArrays.attach(spec), params)
+
+
+def _run_batch_chunk(index, start, stop):
+    return _batch_worker.run_chunk(index, start, stop)
+
+
+class BatchModelRunner(object):
+    """Runs the model over the parameter spaces of many synapses using a pool of worker processes.
+
+    Event data are copied once into shared memory (see SharedEventArrays) and parameter spaces are
+    sent to each worker when it starts, so that each task only consists of
+    (synapse index, start, stop) indices into the flattened parameter space.
+
+    Parameters
+    ----------
+    events : list
+        (spike_times, amplitudes) for each synapse
+    params : list
+        Parameters to search for each synapse, as returned by search_parameters()
+    workers : int | None
+        Number of worker processes, or None to use one per CPU. If 1, the model is run
+        in this process.
+    chunk_size : int
+        Number of parameter space points evaluated per task
+    """
+    def __init__(self, events, params, workers=None, chunk_size=100):
+        assert len(events) == len(params)
+        self.events = [(np.asarray(st, dtype=float), np.asarray(amp, dtype=float)) for st, amp in events]
+        self.params = [OrderedDict(p) for p in params]
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_pairs(cls, pairs, db, session, max_events=None, **kwds):
+        """Load events for many pairs with a single query and return a BatchModelRunner for them.
+        """
+        pair_events = load_pair_events(pairs, db, session, max_events=max_events)
+        events = [pair_events[pair.id][:2] for pair in pairs]
+        params = [search_parameters(pair_events[pair.id][2]) for pair in pairs]
+        return cls(events, params, **kwds)
+
+    def run(self):
+        """Run the model for all synapses.
+
+        Returns a list of ParameterSpace instances with results structured as from
+        StochasticModelRunner.run_model().
+        """
+        param_spaces = [ParameterSpace(OrderedDict(p)) for p in self.params]
+        likelihood = [np.empty(ps.result.size) for ps in param_spaces]
+        mini_amp = [np.empty(ps.result.size) for ps in param_spaces]
+        tasks = [(i, start, min(start + self.chunk_size, ps.result.size)) for i, ps in enumerate(param_spaces) for start in range(0, ps.result.size, self.chunk_size)]
+
+        if self.workers == 1:
+            worker = _BatchWorker(self.events, self.params)
+            results = [worker.run_chunk(*task) for task in tasks]
+        else:
+            import concurrent.futures
+            with SharedEventArrays.create(self.events) as shared:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_init_batch_worker, initargs=(shared.spec, self.params)) as pool:
+                    futures = [pool.submit(_run_batch_chunk, *task) for task in tasks]
+                    results = [fut.result() for fut in futures]
+
+        for index, start, chunk_likelihood, chunk_mini_amp in results:
+            likelihood[index][start:start+len(chunk_likelihood)] = chunk_likelihood
+            mini_amp[index][start:start+len(chunk_likelihood)] = chunk_mini_amp
+
+        for i, ps in enumerate(param_spaces):
+            ps.set_results(likelihood[i].reshape(ps.result.shape), mini_amp[i].reshape(ps.result.shape))
+        return param_spaces
+
+
 class StochasticModelRunner:
     """Handles loading data for a synapse and executing the model across a parameter space.
     """
-    def __init__(self, db, experiment_id, pre_cell_id, post_cell_id, workers=None):
+    def __init__(self, db, experiment_id, pre_cell_id, post_cell_id, workers=None, progress_dialog='synapticulating...'):
         self.db = db
         self.experiment_id = experiment_id
         self.pre_cell_id = pre_cell_id
@@ -581,6 +1028,7 @@ class StochasticModelRunner:
         self.title = "%s %s %s" % (experiment_id, pre_cell_id, post_cell_id)
         
         self.workers = workers
+        self.progress_dialog = progress_dialog
         self.max_events = None
         
         self._synapse_events = None
@@ -608,13 +1056,38 @@ class StochasticModelRunner:
         # prof = cProfile.Profile()
         # prof.enable()
         
-        param_space.run(self.run_model, workers=self.workers)
+        param_space.run(self.run_model, workers=self.workers, progress_dialog=self.progress_dialog)
         # prof.disable()
         print("Run time:", time.time() - start)
         # prof.print_stats(sort='cumulative')
         
         return param_space
 
+    @property
+    def input_hash(self):
+        """Hex digest identifying the model inputs (see model_input_hash()).
+        """
+        spike_times, amplitudes, bg_amplitudes, event_meta = self.synapse_events
+        return model_input_hash(spike_times, amplitudes, bg_amplitudes, self.parameters)
+
+    def result_fields(self):
+        """Return a dict of fields for a stochastic_model_result record describing this synapse.
+        """
+        spike_times, amplitudes, bg_amplitudes, event_meta = self.synapse_events
+        fields = model_result_fields(self.param_space, spike_times, amplitudes)
+        fields.update({
+            'experiment_ext_id': self.experiment_id,
+            'pre_cell_ext_id': self.pre_cell_id,
+            'post_cell_ext_id': self.post_cell_id,
+            'input_hash': self.input_hash,
+        })
+        return fields
+
+    def load_db_result(self, rec):
+        """Load model results from a stochastic_model_result record rather than running the model.
+        """
+        self._param_space = ParameterSpace.from_summary(rec.parameter_space, rec.likelihood, rec.mini_amplitude)
+
     def store_result(self, cache_file):    
         tmp = cache_file + '.tmp'
         pickle.dump(self.param_space, open(tmp, 'wb'))
@@ -645,36 +1118,14 @@ class StochasticModelRunner:
         events = event_query(pair, self.db, session).dataframe()
         print("loaded %d events" % len(events))
 
-        rec_times = (events['rec_start_time'] - events['rec_start_time'].iloc[0]).dt.total_seconds().to_numpy()
-        spike_times = events['first_spike_time'].to_numpy() + rec_times
-        
         # some metadata to follow the events around--not needed for the model, but useful for 
         # analysis later on.
         event_meta = events[['sync_rec_ext_id', 'pulse_number', 'induction_frequency', 'recovery_delay']]
-        
-        # any missing spike times get filled in with the average latency
-        missing_spike_mask = np.isnan(spike_times)
-        print("%d events missing spike times" % missing_spike_mask.sum())
-        avg_spike_latency = np.nanmedian(events['first_spike_time'] - events['onset_time'])
-        pulse_times = events['onset_time'] + avg_spike_latency + rec_times
-        spike_times[missing_spike_mask] = pulse_times[missing_spike_mask]
-
-        # get individual event amplitudes
-        amplitudes = events['dec_fit_reconv_amp'].to_numpy()
-        
-        # filter events by inhibitory or excitatory qc
-        qc_field = syn_type + '_qc_pass'
-        qc_mask = events[qc_field] == True
-        print("%d events passed qc" % qc_mask.sum())
-        amplitudes[~qc_mask] = np.nan
-        amplitudes[missing_spike_mask] = np.nan
-        print("%d good events to be analyzed" % np.isfinite(amplitudes).sum())
 
-        # get background events for determining measurement noise
-        bg_amplitudes = events['baseline_dec_fit_reconv_amp'].to_numpy()
-        # filter by qc
-        bg_qc_mask = events['baseline_'+qc_field] == True
-        bg_amplitudes[~qc_mask] = np.nan
+        spike_times, amplitudes, bg_amplitudes = event_arrays(events, syn_type)
+        print("%d events missing spike times" % np.isnan(events['first_spike_time'].to_numpy(dtype=float)).sum())
+        print("%d events passed qc" % (events[syn_type + '_qc_pass'] == True).sum())
+        print("%d good events to be analyzed" % np.isfinite(amplitudes).sum())
         
         # first_pulse_mask = events['pulse_number'] == 1
         # first_pulse_amps = amplitudes[first_pulse_mask]
@@ -698,25 +1149,7 @@ class StochasticModelRunner:
     def _generate_parameters(self):
         spike_times, amplitudes, bg_amplitudes, event_meta = self.synapse_events
         
-        search_params = {
-            'n_release_sites': np.array([1, 2, 4, 8, 16, 32, 64]),
-            #'n_release_sites': np.array([1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64]),
-            'base_release_probability': np.array([0.00625, 0.0125, 0.025, 0.05, 0.1, 0.2, 0.4, 0.6, 0.8, 1.0]),
-            #'base_release_probability': 1.0 / 1.5**(np.arange(15)[::-1]),
-            #'mini_amplitude': avg_amplitude * 1.2**np.arange(-12, 24, 2),  # optimized by model
-            'mini_amplitude_cv': np.array([0.05, 0.1, 0.2, 0.4, 0.8]),
-            'measurement_stdev': np.nanstd(bg_amplitudes),
-            'vesicle_recovery_tau': np.array([0.0025, 0.01, 0.04, 0.16, 0.64, 2.56]),
-            'facilitation_amount': np.array([0.0, 0.00625, 0.025, 0.05, 0.1, 0.2, 0.4]),
-            'facilitation_recovery_tau': np.array([0.01, 0.02, 0.04, 0.08, 0.16, 0.32, 0.64, 1.28]),
-        }
-        
-        # sanity checking
-        for k,v in search_params.items():
-            if np.isscalar(v):
-                assert not np.isnan(v), k
-            else:
-                assert not np.any(np.isnan(v)), k
+        search_params = search_parameters(bg_amplitudes)
 
         print("Parameter space:")
         for k, v in search_params.items():
@@ -725,18 +1158,14 @@ class StochasticModelRunner:
         return search_params
 
     def run_model(self, params, full_result=False, **kwds):
-        model = StochasticReleaseModel(params)
         spike_times, amplitudes, bg, event_meta = self.synapse_events
-        if 'mini_amplitude' in params:
-            result = model.measure_likelihood(spike_times, amplitudes, **kwds)
-        else:
-            result = model.optimize_mini_amplitude(spike_times, amplitudes, **kwds)
+        result, model = evaluate_model(params, spike_times, amplitudes, **kwds)
         if full_result:
             result['model'] = model
             result['event_meta'] = event_meta
             return result
         else:
-            return {'likelihood': result['likelihood'], 'params': result['params']}
+            return {'likelihood': result['likelihood'], 'params': result['params'], 'optimized_params': result.get('optimized_params', {})}
 
 
 class CombinedModelRunner:
@@ -5,20 +5,28 @@ Analyses that measure the strength of synaptic connections.
 """
 from __future__ import print_function, division
 
-import sys, multiprocessing, time
+import sys
+import concurrent.futures
+from collections import OrderedDict
 import numpy as np
 import pandas
-import scipy.stats
 from sqlalchemy.orm import aliased
-from neuroanalysis.data import TSeries, TSeriesList
+from neuroanalysis.data import TSeries
 from neuroanalysis.baseline import float_mode
-from .fitting import fit_psp
+from neuroanalysis.fitting import fit_psp
+from .grouped_stats import concatenate_groups, grouped_mean_std, grouped_ttest_ind, grouped_ks_2samp, average_traces
 from .database import default_db as db
 
 
-def get_amps(session, pair, clamp_mode='ic', get_data=False):
+def get_amps(session, pair, clamp_mode='ic', get_data=False, pr_table=None):
     """Select records from pulse_response_strength table
+
+    If *pr_table* (a PulseResponseTable for the pair's experiment) is given, records are
+    selected from it instead of querying the database.
     """
+    if pr_table is not None:
+        return _get_amps_from_table(pr_table, pair, clamp_mode, get_data)
+
     cols = [
         db.PulseResponseStrength.id,
         db.PulseResponseStrength.pos_amp,
@@ -67,13 +75,63 @@ def get_amps(session, pair, clamp_mode='ic', get_data=False):
         q = q.filter(*filter_args)
     
     # should result in chronological order
-    q = q.order_by(db.PulseResponse.id)
+    q = q.order_by(db.PulseResponse.id, db.StimSpike.id)
 
     df = pandas.read_sql_query(q.statement, q.session.bind)
     recs = df.to_records()
     return recs
 
 
+_amp_fields = [
+    'pos_amp', 'neg_amp', 'pos_dec_amp', 'neg_dec_amp', 'pos_dec_latency', 'neg_dec_latency', 'crosstalk',
+    'baseline_pos_amp', 'baseline_neg_amp', 'baseline_pos_dec_amp', 'baseline_neg_dec_amp',
+    'baseline_pos_dec_latency', 'baseline_neg_dec_latency', 'baseline_crosstalk',
+]
+
+
+def _get_amps_from_table(pr_table, pair, clamp_mode, get_data):
+    """Return the same structured array as get_amps(), selected from a PulseResponseTable.
+
+    As with the join to stim_spike in get_amps(), each response is returned once per spike evoked
+    by its stimulus (and not at all if there were no spikes).
+    """
+    mask = pr_table.mask(pair_id=pair.id, clamp_mode=clamp_mode) & pr_table.has_strength
+    # chronological order, as in get_amps()
+    rows = np.argwhere(mask)[:, 0]
+    rows = rows[np.argsort(pr_table['id'][rows], kind='stable')]
+
+    # repeat each row for every spike of its stim pulse
+    spike_pulse_ids, spike_max_slope_times = pr_table.stim_spikes()
+    pulse_ids = pr_table['stim_pulse_id'][rows]
+    first = np.searchsorted(spike_pulse_ids, pulse_ids, side='left')
+    counts = np.searchsorted(spike_pulse_ids, pulse_ids, side='right') - first
+    rows = np.repeat(rows, counts)
+    spikes = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    fields = [('index', np.arange(len(rows))), ('id', pr_table['strength_id'][rows])]
+    fields += [(name, pr_table[name][rows]) for name in _amp_fields]
+    fields += [
+        ('ex_qc_pass', pr_table['ex_qc_pass'][rows]),
+        ('in_qc_pass', pr_table['in_qc_pass'][rows]),
+        ('qc_pass', pr_table['recording_qc_pass'][rows]),
+        ('clamp_mode', pr_table['clamp_mode'][rows]),
+        ('baseline_potential', pr_table['baseline_potential'][rows]),
+        ('baseline_current', pr_table['baseline_current'][rows]),
+        ('pulse_number', pr_table['pulse_number'][rows]),
+        ('max_slope_time', spike_max_slope_times[spikes]),
+        ('response_start_time', pr_table['data_start_time'][rows]),
+    ]
+    if get_data:
+        data = np.empty(len(rows), dtype=object)
+        for i, d in enumerate(pr_table.data(rows)):
+            data[i] = d
+        fields.append(('data', data))
+    fields.append(('rec_start_time', pr_table['rec_start_time'][rows]))
+
+    names, arrays = zip(*fields)
+    return np.rec.fromarrays(arrays, names=list(names))
+
+
 # def get_baseline_amps(session, pair, clamp_mode='ic', amps=None, get_data=True):
 #     """Select records from baseline_response_strength table
 
@@ -204,148 +262,194 @@ def analyze_pair_connectivity(amps, sign=None):
     3. Generate KS test p values describing the differences between foreground
        and background distributions for amplitude, deconvolved amplitude, and
        deconvolved latency    
+
+    See analyze_pairs_connectivity() to analyze many pairs at once.
     """
-    # Filter by QC
-    for k,v in amps.items():
-        mask = v['qc_pass'].astype(bool)
-        amps[k] = v[mask]
-    
     # See if any data remains
     if all([len(a) == 0 for a in amps]):
         return None
 
-    requested_sign = sign
-    fields = {}  # used to fill the new DB record
-    
+    return analyze_pairs_connectivity({None: amps}, sign=sign)[None]
+
+
+def analyze_pairs_connectivity(pair_amps, sign=None, workers=1):
+    """Run analyze_pair_connectivity() for many pairs (typically all pairs in an experiment).
+
+    The KS / t-test statistics and response averages for all pairs and clamp modes are
+    computed together over concatenated arrays (see grouped_ks_2samp(), grouped_ttest_ind()
+    and average_traces()); only the PSP fits to each average response are run separately.
+
+    Parameters
+    ----------
+    pair_amps : dict
+        {key: amps} where each *amps* is structured as described in analyze_pair_connectivity().
+        Records that fail qc are removed from these arrays in place.
+    sign : None, -1, or +1
+        If None, then automatically determine whether to treat each connection as
+        inhibitory or excitatory.
+    workers : int
+        If greater than 1, PSP fits are run in a pool of this many processes.
+
+    Returns
+    -------
+    results : dict
+        {key: fields} with the same fields returned by analyze_pair_connectivity().
+    """
+    # Filter by QC
+    for amps in pair_amps.values():
+        for k,v in amps.items():
+            mask = v['qc_pass'].astype(bool)
+            amps[k] = v[mask]
+
+    keys = list(pair_amps.keys())
+    results = OrderedDict([(key, {}) for key in keys])  # used to fill the new DB records
+
     # Use KS p value to check for differences between foreground and background
+    qc_field = {'vc': {'pos': 'in_qc_pass', 'neg': 'ex_qc_pass'}, 'ic': {'pos': 'ex_qc_pass', 'neg': 'in_qc_pass'}}
     qc_amps = {}
-    ks_pvals = {}
-    amp_means = {}
-    amp_diffs = {}
-    for clamp_mode in ('ic', 'vc'):
-        clamp_mode_amps = amps[clamp_mode]
-        if len(clamp_mode_amps) == 0:
-            continue
-        for sign in ('pos', 'neg'):
-            # Separate into positive/negative tests and filter out responses that failed qc
-            qc_field = {'vc': {'pos': 'in_qc_pass', 'neg': 'ex_qc_pass'}, 'ic': {'pos': 'ex_qc_pass', 'neg': 'in_qc_pass'}}[clamp_mode][sign]
-            fg = clamp_mode_amps[clamp_mode_amps[qc_field]]
-            qc_amps[sign, clamp_mode] = fg
-            if len(fg) == 0:
+    for key in keys:
+        for clamp_mode in ('ic', 'vc'):
+            clamp_mode_amps = pair_amps[key][clamp_mode]
+            if len(clamp_mode_amps) == 0:
                 continue
-            
-            # Measure some statistics from these records
-            bg = fg['baseline_' + sign + '_dec_amp']
-            fg = fg[sign + '_dec_amp']
-            pval = scipy.stats.ks_2samp(fg, bg).pvalue
-            ks_pvals[(sign, clamp_mode)] = pval
-            # we could ensure that the average amplitude is in the right direction:
-            fg_mean = np.mean(fg)
-            bg_mean = np.mean(bg)
-            amp_means[sign, clamp_mode] = {'fg': fg_mean, 'bg': bg_mean}
-            amp_diffs[sign, clamp_mode] = fg_mean - bg_mean
-
-    if requested_sign is None:
-        # Decide whether to treat this connection as excitatory or inhibitory.
-        #   strategy: accumulate evidence for either possibility by checking
-        #   the ks p-values for each sign/clamp mode and the direction of the deflection
-        is_exc = 0
-        # print(expt.acq_timestamp, pair.pre_cell.ext_id, pair.post_cell.ext_id)
-        for sign in ('pos', 'neg'):
-            for mode in ('ic', 'vc'):
-                ks = ks_pvals.get((sign, mode), None)
-                if ks is None:
-                    continue
-                # turn p value into a reasonable scale factor
-                ks = norm_pvalue(ks)
-                dif_sign = 1 if amp_diffs[sign, mode] > 0 else -1
-                if mode == 'vc':
-                    dif_sign *= -1
-                is_exc += dif_sign * ks
-                # print("    ", sign, mode, is_exc, dif_sign * ks)
-    else:
-        is_exc = requested_sign
+            for sgn in ('pos', 'neg'):
+                # Separate into positive/negative tests and filter out responses that failed qc
+                fg = clamp_mode_amps[clamp_mode_amps[qc_field[clamp_mode][sgn]]]
+                qc_amps[key, sgn, clamp_mode] = fg
 
-    if is_exc > 0:
-        fields['synapse_type'] = 'ex'
-        signs = {'ic':'pos', 'vc':'neg'}
-    else:
-        fields['synapse_type'] = 'in'
-        signs = {'ic':'neg', 'vc':'pos'}
+    groups = [g for g in qc_amps if len(qc_amps[g]) > 0]
+    fg, offsets = concatenate_groups([qc_amps[g][g[1] + '_dec_amp'] for g in groups])
+    bg, _ = concatenate_groups([qc_amps[g]['baseline_' + g[1] + '_dec_amp'] for g in groups])
+    ks_pvals = dict(zip(groups, grouped_ks_2samp(fg, bg, offsets)))
+    # we could ensure that the average amplitude is in the right direction:
+    fg_mean = grouped_mean_std(fg, offsets)[0]
+    bg_mean = grouped_mean_std(bg, offsets)[0]
+    amp_diffs = dict(zip(groups, fg_mean - bg_mean))
+
+    # Decide which sign of deflection to analyze for each pair
+    signs = {}
+    for key in keys:
+        if sign is None:
+            # Decide whether to treat this connection as excitatory or inhibitory.
+            #   strategy: accumulate evidence for either possibility by checking
+            #   the ks p-values for each sign/clamp mode and the direction of the deflection
+            is_exc = 0
+            for sgn in ('pos', 'neg'):
+                for mode in ('ic', 'vc'):
+                    ks = ks_pvals.get((key, sgn, mode), None)
+                    if ks is None:
+                        continue
+                    # turn p value into a reasonable scale factor
+                    ks = norm_pvalue(ks)
+                    dif_sign = 1 if amp_diffs[key, sgn, mode] > 0 else -1
+                    if mode == 'vc':
+                        dif_sign *= -1
+                    is_exc += dif_sign * ks
+        else:
+            is_exc = sign
+
+        if is_exc > 0:
+            results[key]['synapse_type'] = 'ex'
+            signs[key] = {'ic':'pos', 'vc':'neg'}
+        else:
+            results[key]['synapse_type'] = 'in'
+            signs[key] = {'ic':'neg', 'vc':'pos'}
 
     # compute the rest of statistics for only positive or negative deflections
-    for clamp_mode in ('ic', 'vc'):
-        sign = signs[clamp_mode]
-        fg = qc_amps.get((sign, clamp_mode))
-        if fg is None or len(fg) == 0:
-            fields[clamp_mode + '_n_samples'] = 0
-            continue
-        
-        fields[clamp_mode + '_n_samples'] = len(fg)
-        fields[clamp_mode + '_crosstalk_mean'] = np.mean(fg['crosstalk'])
-        fields[clamp_mode + '_base_crosstalk_mean'] = np.mean(fg['baseline_crosstalk'])
-        
-        # measure mean, stdev, and statistical differences between
-        # fg and bg for each measurement
-        for val, field in [('amp', 'amp'), ('deconv_amp', 'dec_amp'), ('latency', 'dec_latency')]:
-            f = fg[sign + '_' + field]
-            b = fg['baseline_' + sign + '_' + field]
-            fields[clamp_mode + '_' + val + '_mean'] = np.mean(f)
-            fields[clamp_mode + '_' + val + '_stdev'] = np.std(f)
-            fields[clamp_mode + '_base_' + val + '_mean'] = np.mean(b)
-            fields[clamp_mode + '_base_' + val + '_stdev'] = np.std(b)
-            # statistical tests comparing fg vs bg
-            # Note: we use log(1-log(pval)) because it's nicer to plot and easier to
-            # use as a classifier input
-            tt_pval = scipy.stats.ttest_ind(f, b, equal_var=False).pvalue
-            ks_pval = scipy.stats.ks_2samp(f, b).pvalue
-            fields[clamp_mode + '_' + val + '_ttest'] = norm_pvalue(tt_pval)
-            fields[clamp_mode + '_' + val + '_ks2samp'] = norm_pvalue(ks_pval)
-
-
-        ### generate the average response and psp fit
-        
-        # collect all bg and fg traces
-        fg_traces = TSeriesList()
-        for rec in fg:
-            if not np.isfinite(rec['max_slope_time']) or rec['max_slope_time'] is None:
+    groups = []
+    for key in keys:
+        for clamp_mode in ('ic', 'vc'):
+            fg = qc_amps.get((key, signs[key][clamp_mode], clamp_mode))
+            if fg is None or len(fg) == 0:
+                results[key][clamp_mode + '_n_samples'] = 0
                 continue
-            t0 = rec['response_start_time'] - rec['max_slope_time']   # time-align to presynaptic spike
-            trace = TSeries(rec['data'], sample_rate=db.default_sample_rate, t0=t0)
-            fg_traces.append(trace)
-        
-        # get averages
-        
-        if len(fg_traces) == 0:
+            results[key][clamp_mode + '_n_samples'] = len(fg)
+            groups.append((key, clamp_mode))
+    group_amps = [qc_amps[key, signs[key][clamp_mode], clamp_mode] for key, clamp_mode in groups]
+    group_signs = [signs[key][clamp_mode] for key, clamp_mode in groups]
+
+    stats = OrderedDict()
+    for name in ('crosstalk', 'baseline_crosstalk'):
+        values, offsets = concatenate_groups([amps[name] for amps in group_amps])
+        stats[name] = grouped_mean_std(values, offsets)[0]
+
+    # measure mean, stdev, and statistical differences between
+    # fg and bg for each measurement
+    for val, field in [('amp', 'amp'), ('deconv_amp', 'dec_amp'), ('latency', 'dec_latency')]:
+        f, offsets = concatenate_groups([amps[sgn + '_' + field] for amps, sgn in zip(group_amps, group_signs)])
+        b, _ = concatenate_groups([amps['baseline_' + sgn + '_' + field] for amps, sgn in zip(group_amps, group_signs)])
+        stats[val + '_mean'], stats[val + '_stdev'] = grouped_mean_std(f, offsets)
+        stats['base_' + val + '_mean'], stats['base_' + val + '_stdev'] = grouped_mean_std(b, offsets)
+        # statistical tests comparing fg vs bg
+        stats[val + '_ttest'] = grouped_ttest_ind(f, b, offsets)
+        stats[val + '_ks2samp'] = grouped_ks_2samp(f, b, offsets)
+
+    for i, (key, clamp_mode) in enumerate(groups):
+        fields = results[key]
+        fields[clamp_mode + '_crosstalk_mean'] = stats['crosstalk'][i]
+        fields[clamp_mode + '_base_crosstalk_mean'] = stats['baseline_crosstalk'][i]
+        for name, values in stats.items():
+            if name.endswith('crosstalk'):
+                continue
+            if name.endswith('_ttest') or name.endswith('_ks2samp'):
+                # Note: we use log(1-log(pval)) because it's nicer to plot and easier to
+                # use as a classifier input
+                fields[clamp_mode + '_' + name] = norm_pvalue(values[i])
+            else:
+                fields[clamp_mode + '_' + name] = values[i]
+
+    ### generate the average responses and psp fits
+
+    # collect all fg traces, time-aligned to the presynaptic spike
+    spike_mask = [np.isfinite(amps['max_slope_time']) for amps in group_amps]
+    data = [d for amps, mask in zip(group_amps, spike_mask) for d in amps['data'][mask]]
+    t0, offsets = concatenate_groups([amps['response_start_time'][mask] - amps['max_slope_time'][mask] for amps, mask in zip(group_amps, spike_mask)])
+    averages = average_traces(data, t0, offsets, db.default_sample_rate)
+
+    fits = []
+    for (key, clamp_mode), sgn, avg in zip(groups, group_signs, averages):
+        if avg is None:
             continue
-            
-        # bg_avg = bg_traces.mean()
-        fg_avg = fg_traces.mean()
+        fields = results[key]
+        fg_avg = TSeries(avg[0], sample_rate=db.default_sample_rate, t0=avg[1])
         base_rgn = fg_avg.time_slice(-6e-3, 0)
         base = float_mode(base_rgn.data)
         fields[clamp_mode + '_average_response'] = fg_avg.data
         fields[clamp_mode + '_average_response_t0'] = fg_avg.t0
         fields[clamp_mode + '_average_base_stdev'] = base_rgn.std()
+        # remove base to help fitting
+        fits.append((key, clamp_mode, base, (fg_avg.data - base, fg_avg.t0, db.default_sample_rate, clamp_mode, {'pos':1, 'neg':-1}[sgn])))
+
+    if workers > 1 and len(fits) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_fit_average_response, *args) for key, clamp_mode, base, args in fits]
+            fit_results = [fut.result() for fut in futures]
+    else:
+        fit_results = [_fit_average_response(*args) for key, clamp_mode, base, args in fits]
 
-        sign = {'pos':1, 'neg':-1}[signs[clamp_mode]]
-        fg_bsub = fg_avg.copy(data=fg_avg.data - base)  # remove base to help fitting
-        try:
-            fit = fit_psp(fg_bsub, clamp_mode=clamp_mode, sign=sign, search_window=[0, 6e-3])
-            for param, val in fit.best_values.items():
-                fields['%s_fit_%s' % (clamp_mode, param)] = val
-            fields[clamp_mode + '_fit_yoffset'] = fit.best_values['yoffset'] + base
-            fields[clamp_mode + '_fit_nrmse'] = fit.nrmse()
-        except:
-            print("Error in PSP fit:")
-            sys.excepthook(*sys.exc_info())
+    for (key, clamp_mode, base, args), fit_params in zip(fits, fit_results):
+        if fit_params is None:
             continue
-        
-        #global fit_plot
-        #if fit_plot is None:
-            #fit_plot = FitExplorer(fit)
-            #fit_plot.show()
-        #else:
-            #fit_plot.set_fit(fit)
-        #raw_input("Waiting to continue..")
-
-    return fields
+        fields = results[key]
+        for param, val in fit_params.items():
+            fields['%s_fit_%s' % (clamp_mode, param)] = val
+        fields[clamp_mode + '_fit_yoffset'] = fit_params['yoffset'] + base
+
+    return results
+
+
+def _fit_average_response(data, t0, sample_rate, clamp_mode, sign):
+    """Fit a PSP to a baseline-subtracted average response.
+
+    Returns {param: value} including 'nrmse', or None if the fit failed.
+    """
+    fg_bsub = TSeries(data, sample_rate=sample_rate, t0=t0)
+    try:
+        fit = fit_psp(fg_bsub, clamp_mode=clamp_mode, sign=sign, search_window=[0, 6e-3])
+        params = dict(fit.best_values)
+        params['nrmse'] = fit.nrmse()
+        return params
+    except:
+        print("Error in PSP fit:")
+        sys.excepthook(*sys.exc_info())
+        return None
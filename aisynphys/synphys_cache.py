@@ -1,7 +1,12 @@
-import os, sys, glob, pickle, base64, urllib, json, re
+import os, sys, pickle, base64, urllib, json, re, time, threading
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from . import config
-from .util import sync_file, dir_timestamp, interactive_download
+from .util import interactive_download, iter_download_with_resume, iter_md5_hash, get_url_download_size, si_format
+
+
+# host serving the raw data files listed by get_data_file_index()
+data_file_host = "http://api.brain-map.org"
 
 
 _db_versions = None
@@ -70,13 +75,19 @@ def get_data_file_index():
     return _file_index
 
 
+def get_nwb_cache_file(expt_id):
+    """Return the local path where an experiment's nwb file is cached (whether or not it exists).
+    """
+    return os.path.join(config.cache_path, 'raw_data_files', expt_id, 'data.nwb')
+
+
 def get_nwb_path(expt_id):
     """Return the local filesystem path to an experiment's nwb file. 
 
     If the file does not exist locally, then attempt to download.
     """
-    cache_path = os.path.join(config.cache_path, 'raw_data_files', expt_id)
-    cache_file = os.path.join(cache_path, 'data.nwb')
+    cache_file = get_nwb_cache_file(expt_id)
+    cache_path = os.path.dirname(cache_file)
     
     if not os.path.exists(cache_path):
         os.makedirs(cache_path)
@@ -85,7 +96,163 @@ def get_nwb_path(expt_id):
         url = index.get(expt_id, None)
         if url is None:
             return None
-        url = "http://api.brain-map.org" + url
+        url = data_file_host + url
         interactive_download(url, cache_file)
         
     return cache_file
+
+
+def _file_md5(file_path):
+    for result in iter_md5_hash(file_path):
+        pass
+    return result
+
+
+def _download_nwb(expt_id, url, md5=None, rehash=False, max_retries=10, progress=None):
+    """Download one nwb file into the cache (see download_nwb_files).
+
+    Returns a dict describing the result.
+    """
+    cache_file = get_nwb_cache_file(expt_id)
+    hash_file = cache_file + '.md5'
+    result = {'expt_id': expt_id, 'file': cache_file, 'status': None, 'bytes': 0, 'error': None}
+    try:
+        if os.path.exists(cache_file):
+            if os.path.exists(hash_file) and not rehash and md5 is None:
+                result['status'] = 'skipped'
+                return result
+
+            # verify file against the server size and any known hash before skipping
+            file_md5 = None
+            if os.path.getsize(cache_file) == get_url_download_size(url):
+                file_md5 = _file_md5(cache_file)
+                if os.path.exists(hash_file) and open(hash_file).read().strip() != file_md5:
+                    file_md5 = None
+                if md5 is not None and file_md5 != md5:
+                    file_md5 = None
+            if file_md5 is not None:
+                with open(hash_file, 'w') as fh:
+                    fh.write(file_md5)
+                result['status'] = 'skipped'
+                return result
+            os.remove(cache_file)
+
+        if os.path.exists(hash_file):
+            os.remove(hash_file)
+        if not os.path.exists(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+
+        # partially downloaded files are resumed by iter_download_with_resume
+        part_file = cache_file + '.part_%d' % get_url_download_size(url)
+        last_byte = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+        errors = 0
+        for i, size, err in iter_download_with_resume(url, cache_file):
+            if err is not None:
+                errors += 1
+                if errors > max_retries:
+                    raise Exception("Download failed after %d retries: %s" % (max_retries, err))
+                continue
+            errors = 0
+            if progress is not None:
+                progress(i - last_byte)
+            result['bytes'] += i - last_byte
+            last_byte = i
+
+        file_md5 = _file_md5(cache_file)
+        if md5 is not None and file_md5 != md5:
+            os.remove(cache_file)
+            raise Exception("Downloaded file %s has md5 %s; expected %s" % (cache_file, file_md5, md5))
+        with open(hash_file, 'w') as fh:
+            fh.write(file_md5)
+        result['status'] = 'downloaded'
+
+    except Exception as exc:
+        result['status'] = 'failed'
+        result['error'] = str(exc)
+    return result
+
+
+def download_nwb_files(expt_ids=None, workers=4, md5=None, rehash=False, max_retries=10, verbose=True):
+    """Download many experiment nwb files into the local cache concurrently.
+
+    Files that were completely downloaded previously are skipped, and partially
+    downloaded files are resumed. Each file is checked against the size reported by
+    the server, and its md5 hash is stored alongside the file (as data.nwb.md5) so that
+    it can be verified later.
+
+    Parameters
+    ----------
+    expt_ids : list | query | None
+        Experiment IDs to download. May be a list of ID strings, or any iterable
+        (such as a DB query) yielding Experiment records that have an ``ext_id``
+        attribute. If None, then all files in get_data_file_index() are downloaded.
+    workers : int
+        Number of concurrent downloads.
+    md5 : dict | None
+        Optional {expt_id: md5_hex} of expected hashes.
+    rehash : bool
+        If True, previously downloaded files are hashed and compared to their stored hash
+        (and downloaded again if they do not match).
+    max_retries : int
+        Number of consecutive failed attempts before giving up on a file.
+    verbose : bool
+        If True, print aggregate progress and throughput while downloading.
+
+    Returns
+    -------
+    results : list
+        One dict per file with keys 'expt_id', 'file', 'status' ('downloaded', 'skipped', 'missing',
+        or 'failed'), 'bytes', and 'error'.
+    """
+    index = get_data_file_index()
+    if expt_ids is None:
+        expt_ids = sorted(index.keys())
+    else:
+        expt_ids = [getattr(e, 'ext_id', e) for e in expt_ids]
+    md5 = md5 or {}
+
+    results = []
+    jobs = []
+    for expt_id in expt_ids:
+        if expt_id not in index:
+            results.append({'expt_id': expt_id, 'file': None, 'status': 'missing', 'bytes': 0, 'error': "Not in data file index"})
+        else:
+            jobs.append(expt_id)
+
+    lock = threading.Lock()
+    state = {'bytes': 0}
+    def progress(n_bytes):
+        with lock:
+            state['bytes'] += n_bytes
+
+    start = time.time()
+    last_print = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_download_nwb, expt_id, data_file_host + index[expt_id], md5=md5.get(expt_id),
+                        rehash=rehash, max_retries=max_retries, progress=progress)
+            for expt_id in jobs
+        ]
+        for fut in as_completed(futures):
+            result = fut.result()
+            results.append(result)
+            if result['status'] == 'failed' and verbose:
+                print("Error downloading %s: %s" % (result['expt_id'], result['error']))
+            now = time.time()
+            if verbose and (now - last_print > 1.0 or len(results) == len(expt_ids)):
+                last_print = now
+                with lock:
+                    n_bytes = state['bytes']
+                rate = n_bytes / max(now - start, 1e-6)
+                sys.stdout.write("  %d / %d files  %s  %s      \r" % (len(results), len(expt_ids),
+                    si_format(n_bytes, suffix='B'), si_format(rate, suffix='B/s')))
+                sys.stdout.flush()
+
+    if verbose:
+        counts = OrderedDict([(k, 0) for k in ('downloaded', 'skipped', 'missing', 'failed')])
+        for result in results:
+            counts[result['status']] += 1
+        dt = time.time() - start
+        print("\nDownloaded %s in %0.1f s (%s)" % (si_format(state['bytes'], suffix='B'), dt, si_format(state['bytes'] / max(dt, 1e-6), suffix='B/s')))
+        print("  " + ", ".join(["%d %s" % (n, k) for k, n in counts.items()]))
+    return results
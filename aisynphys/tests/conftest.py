@@ -0,0 +1,74 @@
+import datetime
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def make_synthetic_db(tmpdir):
+    """Return a function that creates a synthetic DB in *tmpdir*; see synthetic_db() for arguments.
+    """
+    def make(**kwds):
+        return synthetic_db(str(tmpdir.join('synthetic.sqlite')), **kwds)
+    return make
+
+
+def synthetic_db(db_file, seed=0, missing_amps=True, fail_rate=0.1):
+    """Create an sqlite DB with one experiment containing randomized multipatch probe responses.
+
+    Cell 0 makes an excitatory synapse onto cell 1; the reverse pair has no synapse.
+    If *missing_amps* is False, every pulse response fit has an amplitude. *fail_rate* is
+    the fraction of responses with no fit (twice that fraction fail qc).
+    Returns (db, expt_id).
+    """
+    from aisynphys.database.database import Database
+    from aisynphys.database.schema import ORMBase
+
+    rng = np.random.RandomState(seed)
+    db = Database('sqlite:///', 'sqlite:///', db_file, ORMBase)
+    db.create_tables()
+    session = db.session(readonly=False)
+
+    expt = db.Experiment(ext_id='1500000000.000')
+    electrodes = [db.Electrode(experiment=expt, ext_id=str(i+1), device_id=i) for i in range(2)]
+    cells = [db.Cell(experiment=expt, ext_id=str(i), electrode=electrodes[i]) for i in range(2)]
+    pairs = [db.Pair(experiment=expt, pre_cell=cells[i], post_cell=cells[1-i], has_synapse=(i == 0)) for i in range(2)]
+    session.add(db.Synapse(pair=pairs[0], synapse_type='ex'))
+    session.add_all([expt] + electrodes + cells + pairs)
+
+    start = datetime.datetime(2017, 8, 14, 12, 0, 0)
+    stims = [(50, 250e-3), (50, 125e-3), (20, 250e-3), (50, None), (None, None)]
+    for i in range(40):
+        srec = db.SyncRec(experiment=expt, ext_id=i)
+        for pre, post in [(0, 1), (1, 0)]:
+            clamp_mode = 'ic' if i % 6 else 'vc'
+            pre_rec = db.Recording(sync_rec=srec, electrode=electrodes[pre], start_time=start + datetime.timedelta(seconds=20*i))
+            post_rec = db.Recording(sync_rec=srec, electrode=electrodes[post], start_time=start + datetime.timedelta(seconds=20*i))
+            pcr = db.PatchClampRecording(recording=post_rec, clamp_mode=clamp_mode, qc_pass=bool(rng.rand() > 0.1),
+                baseline_potential=-70e-3, baseline_current=0)
+            db.PatchClampRecording(recording=pre_rec, clamp_mode='ic', qc_pass=True)
+            ind_freq, rec_delay = stims[i % len(stims)]
+            if ind_freq is not None or rec_delay is not None or i % 10 == 4:
+                db.MultiPatchProbe(patch_clamp_recording=pcr, induction_frequency=ind_freq, recovery_delay=rec_delay)
+
+            for j in range(12):
+                n_spikes = rng.choice([0, 1, 1, 1, 1, 2])
+                pulse = db.StimPulse(recording=pre_rec, pulse_number=j+1, onset_time=0.1 + j*0.02,
+                    n_spikes=int(n_spikes), previous_pulse_dt=10.0 if j == 0 and rng.rand() > 0.3 else 0.02)
+                for k in range(n_spikes):
+                    db.StimSpike(stim_pulse=pulse, max_slope_time=0.1015 + j*0.02 + k*1e-3)
+                pr = db.PulseResponse(recording=post_rec, stim_pulse=pulse, pair=pairs[pre],
+                    data=rng.normal(size=200), data_start_time=0.09 + j*0.02, duration=200 / 20000.,
+                    ex_qc_pass=bool(rng.rand() > 2*fail_rate), in_qc_pass=bool(rng.rand() > 2*fail_rate))
+                if rng.rand() > fail_rate:
+                    amp = rng.normal(loc=1e-3 * (1 + 0.1*j), scale=2e-4)
+                    session.add(db.PulseResponseFit(pulse_response=pr, dec_fit_reconv_amp=amp if rng.rand() > 0.05 or not missing_amps else None,
+                        baseline_dec_fit_reconv_amp=rng.normal(scale=2e-4) if rng.rand() > 0.05 else None))
+                if rng.rand() > 0.1:
+                    fields = {name: rng.normal() for name in ['pos_amp', 'neg_amp', 'pos_dec_amp', 'neg_dec_amp', 'pos_dec_latency', 'neg_dec_latency', 'crosstalk']}
+                    fields.update({'baseline_' + k: rng.normal() for k in list(fields)})
+                    session.add(db.PulseResponseStrength(pulse_response=pr, **fields))
+        session.add(srec)
+    session.commit()
+    expt_id = expt.id
+    session.close()
+    return db, expt_id
@@ -0,0 +1,65 @@
+import numpy as np
+import scipy.optimize
+import pytest
+from aisynphys.connectivity import ExpModel, GaussianModel, measure_distance
+
+
+def test_distance_model_fit_batch():
+    rng = np.random.RandomState(0)
+    x = rng.lognormal(size=100, sigma=.6, mean=np.log(150e-6))
+    for model in (ExpModel(0.1, 150e-6), GaussianModel(0.3, 100e-6)):
+        cls = type(model)
+        conn = model.generate(x, n_samples=50, seed=rng)
+        assert conn.shape == (50, 100) and conn.dtype == bool
+        params = cls.fit_batch(x, conn, chunk_size=20)
+        assert params.shape == (50, 2)
+
+        # batch fits are at least as good as fitting each sample separately
+        for i in range(len(conn)):
+            fit = scipy.optimize.minimize(lambda p: -cls(*p).likelihood(x, conn[i]), x0=cls.init, bounds=cls.bounds)
+            assert cls(*params[i]).likelihood(x, conn[i]) >= -fit.fun - 1e-6
+
+        fit = cls.fit(x, conn[0])
+        assert np.allclose(fit.params, params[0])
+        assert fit.fit_result.success
+
+
+def test_distance_model_bootstrap():
+    x = np.random.RandomState(1).lognormal(size=100, sigma=.6, mean=np.log(150e-6))
+    x_vals = np.linspace(0, 400e-6, 9)
+    model = ExpModel(0.1, 150e-6)
+    lower, upper = model.bootstrap(x, x_vals, n_iter=200, seed=2)
+    assert np.all(lower <= model.pdf(x_vals)) and np.all(upper >= model.pdf(x_vals))
+
+    # seeded results are reproducible, including with a process pool
+    assert np.array_equal(model.bootstrap(x, x_vals, n_iter=200, seed=2), [lower, upper])
+    assert np.allclose(model.bootstrap(x, x_vals, n_iter=200, seed=2, chunk_size=50, workers=2), [lower, upper])
+
+
+class FakeClass(object):
+    output_synapse_type = 'ex'
+
+
+class FakePair(object):
+    def __init__(self, distance, has_synapse):
+        self.distance = distance
+        self.has_synapse = has_synapse
+        self.n_ex_test_spikes = 100
+
+
+def test_measure_distance_unknown_pairs():
+    pytest.importorskip('statsmodels')
+    rng = np.random.RandomState(3)
+    x = rng.lognormal(size=100, sigma=.6, mean=np.log(150e-6))
+    conn = ExpModel(0.3, 100e-6).generate(x, n_samples=1, seed=rng)[0]
+    pairs = [FakePair(d, bool(c)) for d, c in zip(x, conn)]
+    # pairs with unknown connectivity, mostly at short distances where they would inflate the fit
+    unknown = [FakePair(d, None) for d in rng.uniform(10e-6, 50e-6, size=30)]
+    key = (FakeClass(), FakeClass())
+
+    known = measure_distance({key: pairs}, 40e-6, model=ExpModel, n_iter=50, seed=4)[key]
+    mixed = measure_distance({key: pairs + unknown}, 40e-6, model=ExpModel, n_iter=50, seed=4)[key]
+    assert np.allclose(mixed['conn_prob'], known['conn_prob'], equal_nan=True)
+    assert np.allclose(mixed['model'].params, known['model'].params)
+    assert np.allclose(mixed['model_lower_ci'], known['model_lower_ci'])
+    assert np.allclose(mixed['model_upper_ci'], known['model_upper_ci'])
@@ -0,0 +1,189 @@
+import os, shutil, sqlite3, datetime
+import sqlalchemy
+import pytest
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
+from aisynphys.database.database import Database, make_table
+
+
+ORMBase = declarative_base()
+
+Parent = make_table(ORMBase, 'parent', [('ext_id', 'str', '', {'index': True})])
+Child = make_table(ORMBase, 'child', [('parent_id', 'parent.id', '')])
+Note = make_table(ORMBase, 'note', [('child_id', 'child.id', '')])
+Leaf = make_table(ORMBase, 'leaf', [('child_id', 'child.id', ''), ('note_id', 'note.id', '')])
+
+Parent.children = relationship(Child, back_populates='parent', cascade='save-update,merge,delete', single_parent=True)
+Child.parent = relationship(Parent, back_populates='children')
+Child.leaves = relationship(Leaf, back_populates='child', cascade='save-update,merge,delete', single_parent=True)
+Leaf.child = relationship(Child, back_populates='leaves')
+# no delete cascade: notes are orphaned (child_id set to NULL) when their child is deleted
+Child.notes = relationship(Note, back_populates='child')
+Note.child = relationship(Child, back_populates='notes')
+# many-to-one delete cascade: deleting a leaf also deletes its note
+Leaf.note = relationship(Note, cascade='save-update,merge,delete', single_parent=True)
+
+
+def make_db(db_file):
+    return Database('sqlite:///', 'sqlite:///', db_file, ORMBase)
+
+
+def table_contents(db):
+    session = db.session()
+    contents = {name: sorted([tuple(rec) for rec in session.execute(table.select())]) for name, table in db.metadata_tables().items()}
+    session.close()
+    return contents
+
+
+def test_delete_records(tmpdir):
+    db_file = str(tmpdir.join('orm.sqlite'))
+    db = make_db(db_file)
+    db.create_tables()
+    session = db.session(readonly=False)
+    for i in range(4):
+        parent = Parent(ext_id=str(i))
+        for j in range(3):
+            child = Child(parent=parent)
+            notes = [Note(child=child) for k in range(2)]
+            for k in range(2):
+                Leaf(child=child, note=notes[k] if j > 0 else None)
+        session.add(parent)
+    session.commit()
+    session.close()
+
+    bulk_file = str(tmpdir.join('bulk.sqlite'))
+    shutil.copy(db_file, bulk_file)
+    bulk_db = make_db(bulk_file)
+
+    # delete children of two parents by ORM cascade
+    session = db.session(readonly=False)
+    for child in session.query(Child).join(Parent).filter(Parent.ext_id.in_(['1', '2'])).all():
+        session.delete(child)
+    session.commit()
+    session.close()
+
+    # delete the same records with set-based queries
+    session = bulk_db.session(readonly=False)
+    n = bulk_db.delete_records(session, [('parent.ext_id', 'child')], ['1', '2'])
+    session.commit()
+    session.close()
+
+    assert n == 6 + 12 + 8  # children, leaves, notes referenced by leaves
+    expected = table_contents(db)
+    assert table_contents(bulk_db) == expected
+    assert len(expected['child']) == 6
+    assert len([rec for rec in expected['note'] if rec[1] is None]) == 4
+
+    db.dispose_engines()
+    bulk_db.dispose_engines()
+
+
+def test_immutable_sqlite(tmpdir):
+    db_file = str(tmpdir.join('bake.sqlite'))
+    db = make_db(db_file)
+    db.create_tables()
+    session = db.session(readonly=False)
+    session.add_all([Child(parent=Parent(ext_id=str(i))) for i in range(5)])
+    session.commit()
+    session.close()
+
+    db.create_bake_indexes([('leaf', ['child_id', 'note_id'])])
+    db.dispose_engines()
+    indexes = {rec[1]: rec[2] for rec in sqlite3.connect(db_file).execute("select * from sqlite_master where type='index'")}
+    assert 'ix_leaf_child_id_note_id' in indexes
+    # foreign key columns are indexed
+    assert indexes.get('ix_child_parent_id') == 'child'
+
+    ro_db = Database('sqlite:///', None, db_file, ORMBase, immutable=True)
+    ro_db2 = Database('sqlite:///', None, db_file, ORMBase, immutable=True)
+    assert ro_db.ro_engine is ro_db2.ro_engine
+    with ro_db.ro_engine.connect() as conn:
+        assert conn.execute('pragma temp_store').scalar() == 2
+    session = ro_db.session()
+    assert session.query(Child).join(Parent).filter(Parent.ext_id == '3').count() == 1
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        session.execute(Parent.__table__.insert({'ext_id': 'x'}))
+    session.close()
+    Database.dispose_immutable_engine(db_file)
+
+
+def test_incremental_bake(tmpdir, monkeypatch):
+    from aisynphys.database.synphys_database import SynphysDatabase
+    src = SynphysDatabase('sqlite:///', 'sqlite:///', str(tmpdir.join('src.sqlite')))
+    src.create_tables()
+    start = datetime.datetime(2020, 1, 1)
+
+    def add_expt(ext_id, n_cells, minutes=0):
+        session = src.session(readonly=False)
+        expt = src.Experiment(ext_id=ext_id)
+        cells = [src.Cell(experiment=expt, ext_id=str(i)) for i in range(n_cells)]
+        pairs = [src.Pair(experiment=expt, pre_cell=a, post_cell=b) for a in cells for b in cells if a is not b]
+        session.add_all([expt] + cells + pairs)
+        session.add(src.Pipeline(module_name='experiment', job_id=ext_id, success=True, finish_time=start + datetime.timedelta(minutes=minutes)))
+        session.commit()
+        session.close()
+
+    def remove_expt(ext_id):
+        session = src.session(readonly=False)
+        src.delete_records(session, [('experiment.ext_id', 'pair'), ('experiment.ext_id', 'cell'), ('experiment.ext_id',)], [ext_id])
+        session.query(src.Pipeline).filter(src.Pipeline.job_id==ext_id).delete()
+        session.commit()
+        session.close()
+
+    def contents(db_file):
+        return table_contents(Database('sqlite:///', 'sqlite:///', db_file, src.ormbase))
+
+    def full_bake():
+        db_file = str(tmpdir.join('full.sqlite'))
+        if os.path.exists(db_file):
+            os.remove(db_file)
+        src.bake_sqlite(db_file)
+        return contents(db_file)
+
+    n_incremental = []
+    bake_incremental = SynphysDatabase._bake_sqlite_incremental
+    def count_incremental(*args, **kwds):
+        n_incremental.append(1)
+        return bake_incremental(*args, **kwds)
+    monkeypatch.setattr(SynphysDatabase, '_bake_sqlite_incremental', count_incremental)
+
+    for i in range(3):
+        add_expt('expt%d' % i, 3)
+    bake_file = str(tmpdir.join('bake.sqlite'))
+    src.bake_sqlite(bake_file, incremental=True)
+    assert len(n_incremental) == 0
+    assert contents(bake_file) == full_bake()
+
+    # changed, removed and new experiments are updated
+    remove_expt('expt1')
+    remove_expt('expt2')
+    add_expt('expt2', 4, minutes=10)
+    add_expt('expt3', 2)
+    src.bake_sqlite(bake_file, incremental=True)
+    assert len(n_incremental) == 1
+    expected = full_bake()
+    assert contents(bake_file) == expected
+    assert sorted(rec[1] for rec in expected['experiment']) == ['expt0', 'expt2', 'expt3']
+    assert not os.path.exists(bake_file + '.tmp')
+
+    # a failed update leaves the previous bake intact
+    add_expt('expt4', 2)
+    def fail(*args, **kwds):
+        raise RuntimeError('bake failed')
+    monkeypatch.setattr(Database, 'create_bake_indexes', fail)
+    with pytest.raises(RuntimeError):
+        src.bake_sqlite(bake_file, incremental=True)
+    monkeypatch.undo()
+    assert contents(bake_file) == expected
+    assert not os.path.exists(bake_file + '.tmp')
+
+    # files baked with a different schema version get a full bake
+    monkeypatch.setattr(SynphysDatabase, '_bake_sqlite_incremental', count_incremental)
+    del n_incremental[:]
+    with sqlite3.connect(bake_file) as conn:
+        conn.execute("update bake_info set value='0' where key='schema_version'")
+    src.bake_sqlite(bake_file, incremental=True)
+    assert len(n_incremental) == 0
+    assert contents(bake_file) == full_bake()
+
+    src.dispose_engines()
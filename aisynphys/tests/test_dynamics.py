@@ -0,0 +1,186 @@
+import logging
+import numpy as np
+import scipy.stats
+import pytest
+
+pytest.importorskip('neuroanalysis')
+import aisynphys.dynamics
+from aisynphys.dynamics import generate_pair_dynamics, pulse_response_query, sorted_pulse_responses
+from aisynphys.pulse_response_table import PulseResponseTable
+
+
+def legacy_pair_dynamics(pair, db, session):
+    """Original ORM-based implementation of generate_pair_dynamics, kept for parity testing.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('generate dynamics for %s', pair)
+    syn_type = pair.synapse.synapse_type
+    
+    amp_field = 'dec_fit_reconv_amp'
+    baseline_amp_field = 'baseline_' + amp_field
+    
+    # load all IC pulse response amplitudes to determine the maximum that will be used for normalization
+    pr_query = pulse_response_query(pair, qc_pass=False, clamp_mode='ic', session=session)
+    pr_recs = pr_query.all()
+    # cull out all PRs that didn't get a fit or failed qc
+    qc_field = syn_type + '_qc_pass'
+    passed_pr_recs = [pr_rec for pr_rec in pr_recs if getattr(pr_rec.PulseResponse, qc_field) and getattr(pr_rec.PulseResponseFit, amp_field) is not None]
+    
+    percentile = 90 if syn_type == 'ex' else 10
+    # dec_fit_reconv_amp generally has much lower noise than fit_amp:
+    amps = [getattr(rec.PulseResponseFit, amp_field) for rec in passed_pr_recs]
+    amp_90p = scipy.stats.scoreatpercentile(amps, percentile)
+
+    # load all baseline amplitudes to determine the noise level
+    noise_amps = np.array([getattr(rec.PulseResponseFit, baseline_amp_field) for rec in passed_pr_recs if getattr(rec.PulseResponseFit, baseline_amp_field) is not None])
+    noise_std = noise_amps.std()
+    noise_90p = scipy.stats.scoreatpercentile(noise_amps, percentile)
+
+    # start new DB record
+    dynamics = db.Dynamics(
+        pair_id=pair.id,
+        pulse_amp_90th_percentile=amp_90p,
+        noise_amp_90th_percentile=noise_90p,
+        noise_std=noise_std,
+    )
+
+    # sort all PRs by recording and stimulus parameters
+    #   [(clamp_mode, ind_freq, recovery_delay)][recording][pulse_number]
+    sorted_prs = sorted_pulse_responses(passed_pr_recs)
+
+    # calculate 50Hz paired pulse and induction metrics
+    metrics = {'stp_initial_50hz': [], 'stp_induction_50hz': [], 'stp_recovery_250ms': []}
+    paired_pulse_ratio = []
+    
+    for key,recs in sorted_prs.items():
+        clamp_mode, ind_freq, rec_delay = key
+        if ind_freq != 50:
+            continue
+        for recording, pulses in recs.items():
+            if 1 not in pulses or 2 not in pulses:
+                continue
+            amps = {k:getattr(r.PulseResponseFit, amp_field) for k,r in pulses.items()}
+            metrics['stp_initial_50hz'].append((amps[2] - amps[1]) / amp_90p)
+            if amps[1] != 0:
+                paired_pulse_ratio.append(amps[2] / amps[1])
+
+            if any([k not in pulses for k in [1,6,7,8]]):
+                continue
+            metrics['stp_induction_50hz'].append((np.mean([amps[6], amps[7], amps[8]]) - amps[1]) / amp_90p)
+            
+    # PPR is a bit out of place here, but we're including it since it's a popular metric used
+    # in the literature.
+    dynamics.paired_pulse_ratio_50hz = scipy.stats.gmean(paired_pulse_ratio)
+    
+    # calculate recovery at 250 ms
+    for key,recs in sorted_prs.items():
+        clamp_mode, ind_freq, rec_delay = key
+        if rec_delay is None:
+            continue
+        if abs(rec_delay - 250e-3) > 5e-3:
+            continue
+        for recording, pulses in recs.items():
+            if any([k not in pulses for k in range(1,13)]):
+                continue
+            amps = {k:getattr(r.PulseResponseFit, amp_field) for k,r in pulses.items()}
+            r = [amps[i+8] - amps[i] for i in range(1,5)]
+            metrics['stp_recovery_250ms'].append(np.mean(r) / amp_90p)
+
+    for k,v in metrics.items():
+        setattr(dynamics, k, np.mean(v))
+        setattr(dynamics, k+'_n', len(v))
+        setattr(dynamics, k+'_std', np.std(v))
+        
+    # Measure PSP variability -- we want a metric something like the coefficient of variation, but 
+    # normalized against the 90th% amplitude, and with measurement noise subtracted out. This
+    # ends up looking like:
+    #     sqrt(amp_stdev^2 - noise_stdev^2) / abs(amp_90th_percentile)
+        
+    # Variability at resting state:
+    resting_amps = []
+    for pr_rec in pr_recs:
+        if pr_rec.StimPulse.previous_pulse_dt > 8.0 and getattr(pr_rec.PulseResponse, qc_field):
+            resting_amps.append(getattr(pr_rec.PulseResponseFit, amp_field))
+    
+    if len(resting_amps) == 0:
+        logger.info("%s: no resting amps; bail out", pair)
+        return dynamics
+        
+    def variability(x):
+        return np.log((np.std(x)**2 - noise_std**2)**0.5 / abs(np.mean(x)))
+
+    dynamics.variability_resting_state = variability(resting_amps)
+
+    # Variability in STP-induced state (5th-8th pulses)
+    pulse_amps = {
+        (2,3): [],
+        (5,9): [],
+    }
+    # collect pulse amplitudes in each category
+    for key,recs in sorted_prs.items():
+        clamp_mode, ind_freq, rec_delay = key
+        if ind_freq != 50:
+            continue
+        for recording, pulses in recs.items():
+            for pulse_n, amps in pulse_amps.items():
+                if any([k not in pulses for k in range(1,pulse_n[-1])]):
+                    continue
+                for n in range(*pulse_n):
+                    amps.append(getattr(pulses[n].PulseResponseFit, amp_field))
+    
+    # normalize
+    pulse_var = {n:(variability(a) if len(a) > 0 else np.nan) for n,a in pulse_amps.items()}
+        
+    # record changes in vairabilty
+    dynamics.variability_second_pulse_50hz = pulse_var[2,3]
+    dynamics.variability_stp_induced_state_50hz = pulse_var[5,9]
+    dynamics.variability_change_initial_50hz = pulse_var[2,3] - dynamics.variability_resting_state
+    dynamics.variability_change_induction_50hz = pulse_var[5,9] - dynamics.variability_resting_state
+    
+    # Look for evidence of vesicle depletion -- correlations between adjacent events in 50Hz pulses 5-8.
+    ev1_amp = []
+    ev2_amp = []
+    pulse_amps = [[] for i in range(9)]
+    for key,recs in sorted_prs.items():
+        clamp_mode, ind_freq, rec_delay = key
+        if ind_freq != 50:
+            continue
+        for recording, pulses in recs.items():
+            for i in range(1,9):
+                if i not in pulses:
+                    break
+                if i < 6:
+                    continue
+                ev1_amp.append(getattr(pulses[i-1].PulseResponseFit, amp_field))
+                ev2_amp.append(getattr(pulses[i].PulseResponseFit, amp_field))
+
+    ev1_amp = np.array(ev1_amp)
+    ev2_amp = np.array(ev2_amp)
+    ev1_amp -= np.median(ev1_amp)
+    ev2_amp -= np.median(ev2_amp)
+    
+    r,p = scipy.stats.pearsonr(ev1_amp, ev2_amp)
+    dynamics.paired_event_correlation_r = r
+    dynamics.paired_event_correlation_p = p
+    
+    return dynamics
+
+
+@pytest.mark.parametrize('seed,fail_rate', [(0, 0.1), (1, 0.1), (2, 0.02), (3, 0.02), (4, 0.0)])
+def test_dynamics_parity(make_synthetic_db, monkeypatch, seed, fail_rate):
+    db, expt_id = make_synthetic_db(seed=seed, missing_amps=False, fail_rate=fail_rate)
+    # pulse_response_query uses the default database
+    monkeypatch.setattr(aisynphys.dynamics, 'db', db)
+    session = db.session()
+    expt = session.query(db.Experiment).get(expt_id)
+    pair = [p for p in expt.pair_list if p.has_synapse][0]
+
+    expected = legacy_pair_dynamics(pair, db, session)
+    table = PulseResponseTable(db, session, expt)
+    for result in (generate_pair_dynamics(pair, db, session, pr_table=table), generate_pair_dynamics(pair, db, session)):
+        for col in db.Dynamics.__table__.columns:
+            if col.name in ('id', 'meta'):
+                continue
+            v1, v2 = getattr(expected, col.name), getattr(result, col.name)
+            assert (v1 is None and v2 is None) or np.allclose(v1, v2, equal_nan=True), col.name
+    session.close()
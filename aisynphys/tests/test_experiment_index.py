@@ -0,0 +1,199 @@
+import os, datetime, pickle, sqlite3
+import numpy as np
+import pytest
+from aisynphys.experiment_index import ExperimentIndex
+
+
+def test_experiment_index(tmpdir):
+    filename = str(tmpdir.join('index.sqlite'))
+    index = ExperimentIndex(filename)
+    state = {
+        'site_info': {'__timestamp__': 1500000000.123, 'description': 'site'},
+        'lims_record': {'date_of_birth': datetime.datetime(2017, 1, 2, 3, 4, 5), 'organism': 'mouse'},
+        'cell_positions': {'1': np.array([1e-3, 2e-3, 3e-3]), '2': [0, 1, 2]},
+        'unencodable': object(),
+    }
+    index.store('a/pipettes.yml', 10.0, 1, 'a', state)
+    index.store('b/pipettes.yml', None, 1, 'b', {'site_info': None})
+    index.store('c/pipettes.yml', 12.0, 2, 'c', {})
+    index.commit()
+
+    # entries are stored as JSON and restored with dates intact
+    index = ExperimentIndex(filename)
+    assert len(index) == 3
+    assert index.entries() == {'a/pipettes.yml': (10.0, 1), 'b/pipettes.yml': (None, 1), 'c/pipettes.yml': (12.0, 2)}
+    states = dict(index.load(1))
+    assert set(states) == {'a/pipettes.yml', 'b/pipettes.yml'}
+    a = states['a/pipettes.yml']
+    assert a['site_info'] == state['site_info']
+    assert a['lims_record'] == state['lims_record']
+    assert a['cell_positions'] == {'1': [1e-3, 2e-3, 3e-3], '2': [0, 1, 2]}
+    assert 'unencodable' not in a
+    state_text = sqlite3.connect(filename).execute("select state from experiments where yml_file='a/pipettes.yml'").fetchone()[0]
+    assert isinstance(state_text, str)
+
+    # entries from a different cache version are not returned
+    assert [yml for yml, s in index.load(2)] == ['c/pipettes.yml']
+    assert [yml for yml, s in index.load(1, yml_files=['b/pipettes.yml'])] == ['b/pipettes.yml']
+
+    index.remove(['a/pipettes.yml'])
+    index.commit()
+    assert set(ExperimentIndex(filename).entries()) == {'b/pipettes.yml', 'c/pipettes.yml'}
+
+
+def test_experiment_index_format(tmpdir):
+    # indexes written in the older pickle format are discarded
+    filename = str(tmpdir.join('index.sqlite'))
+    db = sqlite3.connect(filename)
+    db.execute("create table meta (key text primary key, value text)")
+    db.execute("insert into meta values ('format_version', '1')")
+    db.execute("create table experiments (yml_file text primary key, mtime real, cache_version integer, uid text, expt blob)")
+    db.execute("insert into experiments values ('a/pipettes.yml', 1.0, 1, 'a', ?)", (pickle.dumps({}),))
+    db.commit()
+    db.close()
+    assert len(ExperimentIndex(filename)) == 0
+
+    db = sqlite3.connect(filename)
+    db.execute("update meta set value='%d' where key='format_version'" % (ExperimentIndex.format_version + 1))
+    db.commit()
+    db.close()
+    with pytest.raises(Exception):
+        ExperimentIndex(filename)
+
+
+class FakeExperiment(object):
+    """Stands in for Experiment; the content of each pipettes.yml is the experiment's name.
+    """
+    parsed = []
+
+    def __init__(self, yml_file=None, verify=True):
+        FakeExperiment.parsed.append(yml_file)
+        name = open(yml_file).read()
+        if name in ('invalid', 'breakpoint'):
+            raise Exception(name)
+        self._set(yml_file, name)
+
+    def _set(self, yml_file, name):
+        self._yml_file = yml_file
+        self.name = self.uid = self.datetime = name
+        self.source_id = (yml_file, name)
+
+    def index_state(self):
+        return {'name': self.name}
+
+    @classmethod
+    def from_index_state(cls, yml_file, state):
+        expt = cls.__new__(cls)
+        expt._set(yml_file, state['name'])
+        return expt
+
+
+def test_experiment_list_index(tmpdir, monkeypatch):
+    experiment_list = pytest.importorskip('aisynphys.data.experiment_list')
+    from aisynphys import config
+    monkeypatch.setattr(experiment_list, 'Experiment', FakeExperiment)
+    monkeypatch.setattr(config, 'synphys_data', str(tmpdir.join('data')))
+    index_file = str(tmpdir.join('index.sqlite'))
+
+    def write_site(name, content=None, mtime=None):
+        site = tmpdir.join('data', name, 'slice_000', 'site_000')
+        site.ensure(dir=True)
+        site.join('sync_source').write('/server/' + name)
+        yml = site.join('pipettes.yml')
+        yml.write(name if content is None else content)
+        if mtime is not None:
+            os.utime(str(yml), (mtime, mtime))
+        return str(yml)
+
+    def names(el):
+        return sorted(expt.name for expt in el)
+
+    ymls = {name: write_site(name, mtime=1000) for name in ['a', 'b', 'c']}
+
+    # first update parses everything
+    FakeExperiment.parsed = []
+    el = experiment_list.ExperimentList(index=index_file)
+    el.load_from_server(parallel=False)
+    assert sorted(FakeExperiment.parsed) == sorted(ymls.values())
+    assert names(el) == ['a', 'b', 'c']
+
+    # a new list loads from the index without parsing
+    FakeExperiment.parsed = []
+    el = experiment_list.ExperimentList(index=index_file)
+    assert names(el) == ['a', 'b', 'c'] and FakeExperiment.parsed == []
+
+    # only new and modified sites are parsed; removed sites are dropped
+    write_site('b', content='b2', mtime=2000)
+    ymls['d'] = write_site('d', mtime=1000)
+    tmpdir.join('data', 'c').remove()
+    el.load_from_server(parallel=False)
+    assert sorted(FakeExperiment.parsed) == sorted([ymls['b'], ymls['d']])
+    assert names(el) == ['a', 'b2', 'd']
+    assert names(experiment_list.ExperimentList(index=index_file)) == ['a', 'b2', 'd']
+
+    # changing the cache version invalidates all entries
+    FakeExperiment.parsed = []
+    el = experiment_list.ExperimentList(index=index_file)
+    el._cache_version += 1
+    el.load_from_server(parallel=False)
+    assert len(FakeExperiment.parsed) == 3
+
+    # the legacy pickle cache is imported into a new, empty index
+    legacy = experiment_list.ExperimentList(expts=[FakeExperiment(ymls['a']), FakeExperiment(ymls['b'])])
+    legacy._cache = str(tmpdir.join('expts_cache.pkl'))
+    legacy.write_cache()
+    monkeypatch.setattr(experiment_list, 'cache_file', legacy._cache)
+    monkeypatch.setattr(experiment_list, 'index_file', str(tmpdir.join('new_index.sqlite')))
+    monkeypatch.setattr(experiment_list, '_expt_list', None)
+    FakeExperiment.parsed = []
+    el = experiment_list.cached_experiments()
+    assert names(el) == ['a', 'b2'] and FakeExperiment.parsed == []
+    el.load_from_server(parallel=False)
+    assert FakeExperiment.parsed == [ymls['d']]
+    assert names(el) == ['a', 'b2', 'd']
+
+    # parse errors are reported and the site is retried next time; 'breakpoint' is re-raised
+    write_site('e', content='invalid')
+    el.load_from_server(parallel=False)
+    assert 'invalid' not in names(el)
+    write_site('e', content='breakpoint', mtime=3000)
+    with pytest.raises(Exception, match='breakpoint'):
+        el.load_from_server(parallel=False)
+
+
+def test_experiment_from_index_state(tmpdir):
+    experiment = pytest.importorskip('aisynphys.data.experiment')
+    site = tmpdir.join('2017.08.14_000', 'slice_000', 'site_000')
+    site.ensure(dir=True)
+    # no pipettes.yml on disk: the experiment must be rebuilt from the stored state alone
+    yml_file = str(site.join('pipettes.yml'))
+
+    def pipette(ad_channel, got_data, status, synapse_to=None, gap_to=None):
+        return {
+            'patch_start': datetime.datetime(2017, 8, 14, 12, ad_channel), 'patch_stop': None, 'ad_channel': ad_channel,
+            'pipette_status': status, 'got_data': got_data, 'target_layer': '2/3', 'morphology': 'pyramidal',
+            'cell_labels': {'biocytin': '+', 'green': '+'}, 'internal_dye': 'AF488',
+            'cell_qc': {'holding': '+', 'access': '-', 'spiking': ''}, 'synapse_to': synapse_to, 'gap_to': gap_to,
+        }
+    state = {
+        'pipettes': {'1': pipette(0, True, 'GOhm seal', synapse_to=['2']), '2': pipette(1, True, 'GOhm seal', gap_to=['1']),
+                     '3': pipette(2, False, 'No seal')},
+        'site_info': {'__timestamp__': 1502737200.0},
+        'slice_info': {},
+        'parent_info': {},
+        'lims_record': {'organism': 'human', 'genotype': None},
+        'cell_positions': {'2': [1e-3, 2e-3, 3e-3]},
+    }
+    index = ExperimentIndex(str(tmpdir.join('index.sqlite')))
+    index.store(yml_file, 10.0, 1, 'a', state)
+    stored = dict(index.load(1))[yml_file]
+
+    expt = experiment.Experiment.from_index_state(yml_file, stored)
+    assert list(expt.electrodes) == ['1', '2', '3']
+    assert list(expt.cells) == ['1', '2']
+    assert expt.electrodes['1'].start_time == datetime.datetime(2017, 8, 14, 12, 0)
+    assert expt.cells['1'].labels == {'biocytin': True, 'AF488': True}
+    assert (expt.cells['1'].holding_qc, expt.cells['1'].access_qc, expt.cells['1'].spiking_qc) == (True, False, None)
+    assert expt._connections == [('1', '2')] and expt._gaps == [('2', '1')]
+    assert expt.cells['2'].position == [1e-3, 2e-3, 3e-3]
+    assert expt.index_state()['pipettes'] == state['pipettes']
@@ -0,0 +1,45 @@
+import os, hashlib
+from aisynphys import file_hash
+from aisynphys.file_hash import HashManifest, hash_files
+
+
+def test_hash_files(tmpdir, monkeypatch):
+    files = []
+    for i in range(10):
+        subdir = tmpdir.join('dir%d' % (i % 3))
+        subdir.ensure(dir=True)
+        f = subdir.join('file%d.dat' % i)
+        f.write_binary(os.urandom(1000 * i + 7))
+        files.append(str(f))
+
+    # count files that are actually read
+    hashed = []
+    _file_hash = file_hash.file_hash
+    def counting_file_hash(filename, *args, **kwds):
+        hashed.append(filename)
+        return _file_hash(filename, *args, **kwds)
+    monkeypatch.setattr(file_hash, 'file_hash', counting_file_hash)
+
+    manifest = HashManifest(str(tmpdir.join('manifest.sqlite')))
+    hashes = hash_files(files, manifest=manifest, workers=3, blocksize=1024, verbose=False)
+    assert hashes == {f: hashlib.sha1(open(f, 'rb').read()).hexdigest() for f in files}
+    assert sorted(hashed) == sorted(files)
+
+    # unchanged files are not hashed again, even with a new manifest instance
+    manifest.close()
+    manifest = HashManifest(str(tmpdir.join('manifest.sqlite')))
+    hashed[:] = []
+    assert hash_files(files, manifest=manifest, verbose=False) == hashes
+    assert hashed == []
+
+    # modified files are
+    with open(files[3], 'ab') as fh:
+        fh.write(b'x')
+    hashed[:] = []
+    new_hashes = hash_files(files, manifest=manifest, verbose=False)
+    assert hashed == [files[3]]
+    assert new_hashes[files[3]] == hashlib.sha1(open(files[3], 'rb').read()).hexdigest()
+
+    # manifest entries are per hash algorithm
+    assert hash_files(files[:1], manifest=manifest, func=hashlib.md5, verbose=False)[files[0]] == hashlib.md5(open(files[0], 'rb').read()).hexdigest()
+    manifest.close()
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+fit_average_first_pulse = pytest.importorskip('aisynphys.fit_average_first_pulse')
+
+
+def test_first_pulse_average(make_synthetic_db, monkeypatch):
+    db, expt_id = make_synthetic_db()
+    # both extraction functions query the default database
+    monkeypatch.setattr(fit_average_first_pulse, 'db', db)
+    monkeypatch.setattr(db, 'default_sample_rate', 20000, raising=False)
+
+    # add the records used to select first pulses, and start responses at random offsets up to
+    # 2 ms after (spike - time_before_spike) so that they are cropped and aligned differently
+    rng = np.random.RandomState(0)
+    session = db.session(readonly=False)
+    expt = session.query(db.Experiment).get(expt_id)
+    for pair, syn_type in zip(expt.pair_list, ['ex', 'in']):
+        session.add(db.SynapsePrediction(pair=pair, synapse_type=syn_type))
+        for pr in pair.pulse_responses:
+            pcr = pr.stim_pulse.recording.patch_clamp_recording
+            if len(pcr.multi_patch_probe) == 0:
+                session.add(db.MultiPatchProbe(patch_clamp_recording=pcr, induction_frequency=50))
+            if pr.pulse_response_strength is None:
+                session.add(db.PulseResponseStrength(pulse_response=pr, pos_amp=0, neg_amp=0))
+            spikes = pr.stim_pulse.spikes
+            if len(spikes) > 0:
+                pr.data_start_time = spikes[0].max_slope_time - fit_average_first_pulse.time_before_spike - rng.uniform(0, 2e-3)
+    session.commit()
+
+    pulse_data = fit_average_first_pulse.extract_first_pulse_info_from_experiment(expt, session)
+    assert len(pulse_data) == 2
+    for pair in expt.pair_list:
+        first_pulses = pulse_data[pair.id]['ic']
+        pulse_responses, pulse_ids, psp_amps, freq = fit_average_first_pulse.extract_first_pulse_info_from_Pair_object(pair, 'ic')
+        assert first_pulses.pulse_ids == pulse_ids
+        expected = fit_average_first_pulse.TSeriesList(pulse_responses).mean()
+        avg = first_pulses.average()
+        assert avg.t0 > 0
+        assert np.isclose(avg.t0, expected.t0)
+        assert np.allclose(avg.data, expected.data)
+    session.close()
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+import scipy.stats as stats
+
+gap_junction = pytest.importorskip('aisynphys.pipeline.multipatch.gap_junction')
+
+
+def per_sweep_results(x, y, mask):
+    """Reference results computed one pair at a time, as the gap junction module did before
+    sweeps were collected into a matrix.
+    """
+    r, p, cc = [], [], []
+    for i in range(len(x)):
+        xs = list(x[i][mask[i]])
+        ys = list(y[i][mask[i]])
+        ri, pi = stats.pearsonr(xs, ys)
+        coeff, _, _, _ = np.linalg.lstsq(np.asarray(xs)[:, None], np.asarray(ys)[:, None], rcond=None)
+        r.append(ri)
+        p.append(pi)
+        cc.append(coeff[0][0])
+    return np.array(r), np.array(p), np.array(cc)
+
+
+def test_masked_pearsonr():
+    rng = np.random.RandomState(0)
+    n_pairs, n_sweeps = 40, 12
+    x = rng.normal(size=(n_pairs, n_sweeps))
+    y = rng.uniform(-1, 1, size=(n_pairs, 1)) * x + rng.normal(scale=0.5, size=(n_pairs, n_sweeps))
+
+    # sweeps that were not measured are NaN; masked sweeps may also hold arbitrary values
+    x[rng.rand(n_pairs, n_sweeps) < 0.2] = np.nan
+    y[rng.rand(n_pairs, n_sweeps) < 0.1] = np.nan
+    mask = np.isfinite(x) & np.isfinite(y)
+    extra = mask & (rng.rand(n_pairs, n_sweeps) < 0.1)
+    mask &= ~extra
+    x[extra] = 1e9
+
+    # exactly 2 and 3 usable sweeps
+    x[:2] = rng.normal(size=(2, n_sweeps))
+    y[:2] = rng.normal(size=(2, n_sweeps))
+    mask[0] = False
+    mask[0, :2] = True
+    mask[1] = False
+    mask[1, 3:6] = True
+    assert (mask.sum(axis=1) >= 2).all()
+
+    r, p = gap_junction.masked_pearsonr(x, y, mask)
+    cc = gap_junction.masked_coupling_coeff(x, y, mask)
+    r_ref, p_ref, cc_ref = per_sweep_results(x, y, mask)
+    assert np.allclose(r, r_ref)
+    assert np.allclose(p, p_ref)
+    assert np.allclose(cc, cc_ref)
+    assert p[0] == 1.0
+
+
+def test_masked_pearsonr_nan():
+    x = np.array([
+        [1., 2., 3., 4.],
+        [1., 1., 1., 1.],     # constant input: undefined correlation
+        [1., np.nan, 3., 4.],  # unmasked NaN propagates, as with scipy
+        [1., 2., 3., 4.],     # fewer than 2 sweeps
+    ])
+    y = np.array([
+        [2., 1., 4., 3.],
+        [1., 2., 3., 4.],
+        [1., 2., 3., 4.],
+        [1., 2., 3., 4.],
+    ])
+    mask = np.ones(x.shape, dtype=bool)
+    mask[3, 1:] = False
+    r, p = gap_junction.masked_pearsonr(x, y, mask)
+    assert np.allclose([r[0], p[0]], stats.pearsonr(x[0], y[0]))
+    assert np.isnan(r[1:]).all()
+    assert np.isnan(p[1:]).all()
+
+    cc = gap_junction.masked_coupling_coeff(x, y, mask)
+    assert np.allclose(cc[:2], [per_sweep_results(x[i:i+1], y[i:i+1], mask[i:i+1])[2][0] for i in range(2)])
+    assert np.isnan(cc[2])
@@ -0,0 +1,43 @@
+import numpy as np
+import scipy.stats
+import pytest
+from aisynphys.grouped_stats import concatenate_groups, grouped_ks_2samp, grouped_ttest_ind, grouped_mean_std, average_traces
+
+
+def test_grouped_stats():
+    rng = np.random.RandomState(0)
+    sizes = [0, 1, 5, 37, 200, 12000]
+    # rounding creates ties between and within samples
+    a = [np.round(rng.normal(size=n), 1) for n in sizes]
+    b = [np.round(rng.normal(loc=0.3, size=n), 1) for n in sizes]
+    a_all, offsets = concatenate_groups(a)
+    b_all, _ = concatenate_groups(b)
+    assert list(offsets) == [0] + list(np.cumsum(sizes))
+
+    ks = grouped_ks_2samp(a_all, b_all, offsets)
+    tt = grouped_ttest_ind(a_all, b_all, offsets)
+    mean, std = grouped_mean_std(a_all, offsets)
+    assert np.isnan(ks[0]) and np.isnan(mean[0])
+    for i in range(1, len(sizes)):
+        assert np.isclose(ks[i], scipy.stats.ks_2samp(a[i], b[i]).pvalue, rtol=1e-10)
+        assert np.isclose(tt[i], scipy.stats.ttest_ind(a[i], b[i], equal_var=False).pvalue, rtol=1e-8, equal_nan=True)
+        assert np.allclose([mean[i], std[i]], [np.mean(a[i]), np.std(a[i])])
+
+
+def test_average_traces():
+    pytest.importorskip('neuroanalysis')
+    from neuroanalysis.data import TSeries, TSeriesList
+    rng = np.random.RandomState(1)
+    sizes = [3, 0, 1, 6]
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    data = [rng.normal(size=rng.randint(150, 250)) for i in range(offsets[-1])]
+    data[4][10] = np.nan
+    t0 = rng.uniform(-3e-3, 0, size=offsets[-1])
+
+    averages = average_traces(data, t0, offsets, 20000.)
+    assert averages[1] is None
+    for i in (0, 2, 3):
+        traces = [TSeries(data[j], sample_rate=20000., t0=t0[j]) for j in range(offsets[i], offsets[i+1])]
+        avg = TSeriesList(traces).mean()
+        assert averages[i][1] == avg.t0
+        assert np.allclose(averages[i][0], avg.data)
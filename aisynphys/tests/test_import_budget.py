@@ -0,0 +1,84 @@
+import os, sys, json, subprocess
+import pytest
+
+
+# modules that are slow to import and must only be loaded by the code that uses them
+heavy_modules = ['pyqtgraph', 'PyQt4', 'PyQt5', 'PySide', 'PySide2', 'ipfx', 'numba', 'lmfit', 'statsmodels']
+
+
+def import_stats(module):
+    """Import *module* in a fresh interpreter and return (heavy modules in sys.modules, number of modules, loaded aisynphys modules).
+
+    Heavy modules imported directly by aisynphys code are blocked and fail the calling test, whether
+    or not they are installed. Skips the calling test if *module* cannot be imported for another
+    reason (a missing optional dependency).
+    """
+    code = """if True:
+        import sys, os, json, importlib
+        package_dir = {package_dir!r}
+        skip_dirs = (os.path.dirname(importlib.__file__), '<frozen')
+        blocked = []
+        class BlockHeavy(object):
+            def find_spec(self, name, path, target=None):
+                if name.partition('.')[0] not in {heavy}:
+                    return None
+                # find the module that asked for this import
+                frame = sys._getframe(1)
+                while frame.f_code.co_filename.startswith(skip_dirs):
+                    frame = frame.f_back
+                if frame.f_code.co_filename.startswith(package_dir):
+                    blocked.append(name)
+                    raise ImportError("heavy module %s is not allowed" % name)
+        sys.meta_path.insert(0, BlockHeavy())
+        error = None
+        try:
+            import {module}
+        except ImportError as exc:
+            error = str(exc)
+        heavy = sorted(mod for mod in {heavy} if mod in sys.modules)
+        loaded = sorted(mod for mod in sys.modules if mod.startswith('aisynphys'))
+        print(json.dumps([blocked, error, heavy, len(sys.modules), loaded]))
+    """.format(module=module, heavy=heavy_modules, package_dir=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # pass no arguments so that aisynphys.config does not see pytest's command line
+    proc = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert proc.returncode == 0, proc.stderr
+    blocked, error, heavy, n_modules, loaded = json.loads(proc.stdout.strip().split('\n')[-1])
+    assert blocked == [], "importing %s loads %s" % (module, blocked)
+    if error is not None:
+        pytest.skip("cannot import %s: %s" % (module, error))
+    return heavy, n_modules, loaded
+
+
+def test_import_aisynphys():
+    heavy, n_modules, loaded = import_stats('aisynphys')
+    assert heavy == []
+    assert n_modules < 200
+
+
+def test_import_database():
+    pytest.importorskip('neuroanalysis')
+    heavy, n_modules, loaded = import_stats('aisynphys.database')
+    assert heavy == []
+    # neuroanalysis (required by the schema) imports scipy.stats, which accounts for most modules
+    assert n_modules < 1500
+
+
+# Modules used by the analysis pipeline. neuroanalysis.miesnwb imports neuroanalysis.fitting (lmfit,
+# numba and optionally Qt), so only imports made by aisynphys itself are checked here.
+@pytest.mark.parametrize('module', [
+    'aisynphys.data.slice',
+    'aisynphys.data.experiment',
+    'aisynphys.data.experiment_list',
+    'aisynphys.fitting',
+    'aisynphys.avg_response_fit',
+])
+def test_import_analysis(module):
+    import_stats(module)
+
+
+def test_import_pipeline():
+    # analysis_pipeline.py imports the pipeline package before parsing its arguments; pipelines
+    # themselves are loaded by all_pipelines()
+    heavy, n_modules, loaded = import_stats('aisynphys.pipeline')
+    assert heavy == []
+    assert 'aisynphys.pipeline.multipatch' not in loaded
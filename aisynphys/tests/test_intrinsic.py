@@ -0,0 +1,61 @@
+import os, time, logging, threading
+import pytest
+from aisynphys import config
+
+intrinsic = pytest.importorskip('aisynphys.pipeline.multipatch.intrinsic')
+IntrinsicPipelineModule = intrinsic.IntrinsicPipelineModule
+
+
+def fake_analysis(data):
+    # later cells finish first, so results arrive out of order
+    time.sleep(0.02 * (5 - data['index']))
+    if data.get('raise'):
+        raise ValueError('bad sweeps for cell %d' % data['index'])
+    if data.get('fail'):
+        return None, 'analysis failed'
+    return {'index': data['index'], 'pid': os.getpid(), 'thread': (os.getpid(), threading.get_ident())}, None
+
+
+@pytest.fixture
+def fake_cells(monkeypatch):
+    monkeypatch.setattr(intrinsic, 'analyze_cell_sweeps', fake_analysis)
+    return [{'index': i, 'fail': i == 2} for i in range(5)]
+
+
+def worker_ids(results, key):
+    return set(r[0][key] for r in results if r[0] is not None)
+
+
+@pytest.mark.parametrize('n_workers,pool', [(1, 'thread'), (3, 'thread'), (3, 'process')])
+def test_analyze_cells_order(fake_cells, monkeypatch, n_workers, pool):
+    monkeypatch.setattr(config, 'intrinsic_workers', n_workers)
+    monkeypatch.setattr(config, 'intrinsic_pool', pool)
+    results = IntrinsicPipelineModule.analyze_cells(fake_cells)
+    assert [r[1] for r in results] == [None, None, 'analysis failed', None, None]
+    assert [r[0]['index'] for i, r in enumerate(results) if i != 2] == [0, 1, 3, 4]
+    assert (os.getpid() in worker_ids(results, 'pid')) == (pool == 'thread')
+    main_thread = (os.getpid(), threading.get_ident())
+    assert (main_thread in worker_ids(results, 'thread')) == (n_workers == 1)
+
+
+@pytest.mark.parametrize('n_workers,pool', [(1, 'thread'), (3, 'thread'), (3, 'process')])
+def test_analyze_cells_error(fake_cells, monkeypatch, n_workers, pool):
+    monkeypatch.setattr(config, 'intrinsic_workers', n_workers)
+    monkeypatch.setattr(config, 'intrinsic_pool', pool)
+    fake_cells[3]['raise'] = True
+    with pytest.raises(ValueError, match='cell 3'):
+        IntrinsicPipelineModule.analyze_cells(fake_cells)
+
+
+def test_analyze_cells_daemon(fake_cells, monkeypatch, caplog):
+    # pipeline workers are daemonic and cannot start a process pool
+    class Process(object):
+        daemon = True
+    monkeypatch.setattr(config, 'intrinsic_workers', 3)
+    monkeypatch.setattr(config, 'intrinsic_pool', 'process')
+    monkeypatch.setattr(intrinsic.multiprocessing, 'current_process', lambda: Process())
+    with caplog.at_level(logging.WARNING):
+        results = IntrinsicPipelineModule.analyze_cells(fake_cells)
+    assert worker_ids(results, 'pid') == {os.getpid()}
+    assert (os.getpid(), threading.get_ident()) not in worker_ids(results, 'thread')
+    assert 'thread pool' in caplog.text
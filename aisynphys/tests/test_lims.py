@@ -0,0 +1,106 @@
+import json
+import sqlite3
+import pytest
+from aisynphys import config, lims, lims_cache
+
+
+@pytest.fixture
+def lims_db(tmpdir, monkeypatch):
+    """A minimal sqlite stand-in for the LIMS tables used by cluster / cell lookups.
+    """
+    db_file = str(tmpdir.join('lims.sqlite'))
+    db = sqlite3.connect(db_file)
+    db.executescript("""
+        create table specimens (id integer primary key, name text, parent_id integer, external_specimen_name text);
+        create table specimen_types (id integer primary key, name text);
+        create table specimen_types_specimens (specimen_id integer, specimen_type_id integer);
+        create table specimen_metadata (specimen_id integer, data text);
+        insert into specimen_types values (1, 'CellCluster');
+    """)
+    cell_id = 10000
+    for i in range(20):
+        slice_id = 100 + i
+        db.execute("insert into specimens values (?, ?, null, null)", (slice_id, 'slice-%d' % i))
+        for j in range(2):
+            cluster_id = slice_id * 10 + j
+            db.execute("insert into specimens values (?, ?, ?, null)", (cluster_id, 'cluster-%d' % cluster_id, slice_id))
+            db.execute("insert into specimen_types_specimens values (?, 1)", (cluster_id,))
+            db.execute("insert into specimen_metadata values (?, ?)", (cluster_id, json.dumps({'acq_timestamp': float(j)})))
+            for k in range(3):
+                cell_id += 1
+                db.execute("insert into specimens values (?, ?, ?, ?)", (cell_id, 'cell-%d' % cell_id, cluster_id, 'electrode_%d' % k))
+    db.commit()
+    db.close()
+
+    monkeypatch.setattr(config, 'lims_address', 'sqlite:///' + db_file)
+    monkeypatch.setattr(config, 'lims_cache_file', str(tmpdir.join('lims_cache.sqlite')))
+    monkeypatch.setattr(config, 'lims_cache_ttl', 3600)
+    monkeypatch.setattr(lims, '_lims_engine', None)
+
+    # count queries issued to the stand-in database
+    queries = []
+    query = lims.query
+    def counting_query(*args, **kwds):
+        queries.append(args[0])
+        return query(*args, **kwds)
+    monkeypatch.setattr(lims, 'query', counting_query)
+    return queries
+
+
+def test_lims_cache(lims_db, monkeypatch):
+    assert lims.specimen_metadata(1031) == {'acq_timestamp': 1.0}
+    n_queries = len(lims_db)
+    assert lims.specimen_metadata(1031) == {'acq_timestamp': 1.0}
+    assert len(lims_db) == n_queries
+
+    lims_cache.refresh(lims.specimen_metadata)
+    lims.specimen_metadata(1031)
+    assert len(lims_db) == n_queries + 1
+
+    # empty and None results are not cached
+    n_queries = len(lims_db)
+    assert lims.specimen_metadata(5) is None
+    assert lims.specimen_metadata(5) is None
+    assert len(lims_db) == n_queries + 2
+
+    # cluster lookups always query LIMS
+    n_queries = len(lims_db)
+    assert lims.cell_cluster_ids(103) == [1030, 1031]
+    assert lims.cell_cluster_ids(103) == [1030, 1031]
+    assert len(lims_db) == n_queries + 2
+
+    # a ttl of 0 (the default) disables the cache
+    monkeypatch.setattr(config, 'lims_cache_ttl', 0)
+    n_queries = len(lims_db)
+    lims.specimen_metadata(1031)
+    assert len(lims_db) == n_queries + 1
+
+
+def test_lims_batch(lims_db, monkeypatch):
+    expts = [('slice-%d' % i, float(i % 2)) for i in range(20)] + [('missing', 0.0)]
+    with monkeypatch.context() as m:
+        m.setattr(config, 'lims_cache_ttl', 0)
+        uncached = {expt: lims.expt_cluster_ids(*expt) for expt in expts[:-1]}
+    del lims_db[:]
+
+    batch = lims.expt_cluster_ids_batch(expts)
+    assert batch == uncached
+    assert len(lims_db) == 3
+
+    # cluster IDs and unknown names are fetched again; known names and metadata come from the cache
+    del lims_db[:]
+    assert lims.expt_cluster_ids_batch(expts) == uncached
+    assert len(lims_db) == 2
+
+    cells = lims.cell_specimen_ids_batch([5, 1190])
+    assert cells[1190] == lims.cell_specimen_ids(1190)
+    assert len(cells[1190]) == 3
+    assert cells[5] == {}
+
+    # submission checks use cluster IDs from the batch instead of querying them again
+    monkeypatch.setattr(lims, 'cell_cluster_data_paths', lambda cid: ['path-%d' % cid])
+    del lims_db[:]
+    assert lims.expt_submissions(100, 0.0, cluster_ids=batch[('slice-0', 0.0)]) == [('succeeded', 1000, ['path-1000'])]
+    assert len(lims_db) == 0
+    assert lims.expt_submissions(100, 0.0) == [('succeeded', 1000, ['path-1000'])]
+    assert len(lims_db) > 0
@@ -0,0 +1,82 @@
+import os, importlib
+import pytest
+from aisynphys import config
+from aisynphys.util import path_mtimes
+
+
+script = os.path.join(os.path.dirname(__file__), '..', '..', 'util', 'patchseq_reports.py')
+
+
+@pytest.fixture
+def reports(tmpdir, monkeypatch):
+    """The util/patchseq_reports.py script loaded as a module.
+    """
+    pytest.importorskip('pandas')
+    pytest.importorskip('pyqtgraph')
+    # the script lists experiments in synphys_data when it is loaded
+    monkeypatch.setattr(config, 'synphys_data', str(tmpdir))
+    spec = importlib.util.spec_from_file_location('patchseq_reports', script)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def test_path_mtimes(tmpdir):
+    path = tmpdir.join('file')
+    path.write('x')
+    missing = str(tmpdir.join('missing'))
+    mtimes = path_mtimes([str(path), missing, None])
+    assert mtimes == {str(path): os.stat(str(path)).st_mtime, missing: None}
+
+
+def test_report_tubes(reports, tmpdir, monkeypatch):
+    pd = reports.pd
+    reads = []
+    def read_excel(filename, **kwds):
+        reads.append(filename)
+        if filename.endswith('bad.xlsx'):
+            raise ValueError("not an excel file")
+        return pd.DataFrame({'Patch Tube Name': ['PMS4_200101_001_A01', 123]})
+    monkeypatch.setattr(pd, 'read_excel', read_excel)
+
+    good = tmpdir.join('good.xlsx')
+    good.write('')
+    bad = tmpdir.join('bad.xlsx')
+    bad.write('')
+    missing = str(tmpdir.join('missing.xlsx'))
+
+    # tube names are str whether or not they come from the cache
+    expected = ['PMS4_200101_001_A01', '123']
+    assert reports.read_report_tubes(str(good)) == expected
+    cache = reports.SiteMetadataCache(str(tmpdir.join('cache.sqlite')))
+    assert cache.report_tubes(str(good)) == expected
+    assert cache.report_tubes(str(good)) == expected
+    assert reads == [str(good), str(good)]
+
+    # unreadable reports are skipped and not cached
+    assert reports.read_report_tubes(str(bad)) is None
+    assert cache.report_tubes(str(bad)) is None
+    assert cache.report_tubes(str(bad)) is None
+    assert reads.count(str(bad)) == 3
+    assert cache.report_tubes(missing) is None
+
+    # modified reports are read again
+    os.utime(str(good), (0, 0))
+    assert cache.report_tubes(str(good)) == expected
+    assert reads.count(str(good)) == 3
+    cache.close()
+
+
+def test_site_cache(reports, tmpdir):
+    site = tmpdir.mkdir('day').mkdir('slice_000').mkdir('site_000')
+    site.join('.index').write('')
+    cache = reports.SiteMetadataCache(str(tmpdir.join('cache.sqlite')))
+    assert cache.get_site(str(site)) is None
+
+    cache.set_site(str(site), path_mtimes(reports.site_input_files(str(site))), {'site_path': str(site)})
+    assert cache.get_site(str(site)) == {'site_path': str(site)}
+
+    # new or modified input files invalidate the record
+    site.join('sync_source').write('source')
+    assert cache.get_site(str(site)) is None
+    cache.close()
@@ -0,0 +1,105 @@
+import os, datetime
+import numpy as np
+import pytest
+from aisynphys import config
+from aisynphys.database.database import Database
+from aisynphys.database.schema import ORMBase
+from aisynphys.pipeline.pipeline import Pipeline
+from aisynphys.pipeline.pipeline_module import PipelineModule, DatabasePipelineModule
+
+
+class ModuleA(DatabasePipelineModule):
+    name = 'module_a'
+
+
+class ModuleB(DatabasePipelineModule):
+    name = 'module_b'
+
+
+class ModuleC(DatabasePipelineModule):
+    name = 'module_c'
+    dependencies = [ModuleA, ModuleB]
+
+
+class TestPipeline(Pipeline):
+    module_classes = [ModuleA, ModuleB, ModuleC]
+
+    def __init__(self, database):
+        self.database = database
+        Pipeline.__init__(self, database=database)
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def pipeline_db(request, tmpdir):
+    """An empty pipeline table in sqlite, and in postgres if config.synphys_db_host_rw is a postgres server.
+    """
+    if request.param == 'sqlite':
+        db = Database('sqlite:///', 'sqlite:///', str(tmpdir.join('pipeline.sqlite')), ORMBase)
+    else:
+        host = config.synphys_db_host_rw
+        if host is None or not host.startswith('postgres'):
+            pytest.skip("no postgres server configured (config.synphys_db_host_rw)")
+        db = Database(host, host, 'test_pipeline_%d' % os.getpid(), ORMBase)
+        db.drop_database()
+        db.create_database()
+    db.create_tables(['pipeline'])
+    yield db
+    db.dispose_engines()
+    db.drop_database()
+
+
+def set_jobs(db, module_name, jobs):
+    """Replace pipeline records for *module_name* with {job_id: (minutes, success)}.
+    """
+    start = datetime.datetime(2020, 1, 1)
+    session = db.session(readonly=False)
+    session.query(db.Pipeline).filter(db.Pipeline.module_name==module_name).delete()
+    for job_id, (minutes, success) in jobs.items():
+        session.add(db.Pipeline(module_name=module_name, job_id=job_id, success=success,
+            finish_time=start + datetime.timedelta(minutes=minutes)))
+    session.commit()
+    session.close()
+
+
+def check_parity(module):
+    sql = module.updatable_jobs()
+    py = PipelineModule.updatable_jobs(module)
+    assert sorted(sql[0]) == sorted(py[0])
+    assert dict(sql[1]) == dict(py[1])
+    assert dict(sql[2]) == dict(py[2])
+    return sorted(sql[0]), sorted(sql[1]), sorted(sql[2])
+
+
+def test_updatable_jobs(pipeline_db):
+    db = pipeline_db
+    pipeline = TestPipeline(db)
+    module = pipeline.get_module('module_c')
+
+    # no results yet: every ready job is new
+    set_jobs(db, 'module_a', {'1': (0, True), '2': (0, True), '3': (0, True)})
+    set_jobs(db, 'module_b', {'1': (1, True), '2': (1, True), '3': (1, False)})
+    assert check_parity(module) == ([], ['1', '2'], [])
+
+    set_jobs(db, 'module_c', {
+        '1': (10, True),    # up to date
+        '2': (10, False),   # failed
+        '3': (10, True),    # orphaned; dependency failed
+        '4': (10, True),    # orphaned; no dependencies
+    })
+    assert check_parity(module) == (['3', '4'], [], ['2'])
+
+    # dependency changes invalidate finished and failed results; new jobs appear
+    set_jobs(db, 'module_a', {'1': (20, True), '2': (20, True), '3': (0, True), '5': (0, True)})
+    set_jobs(db, 'module_b', {'1': (1, True), '2': (1, True), '3': (30, True), '5': (1, True)})
+    assert check_parity(module) == (['4'], ['1', '2', '3', '5'], [])
+
+    # randomized job states
+    rng = np.random.RandomState(0)
+    for i in range(10):
+        for name in ['module_a', 'module_b', 'module_c']:
+            jobs = {}
+            for job in range(30):
+                if rng.rand() < 0.8:
+                    jobs[str(job)] = (int(rng.randint(20)), bool(rng.rand() > 0.2))
+            set_jobs(db, name, jobs)
+        check_parity(module)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('neuroanalysis')
+from aisynphys.pulse_response_table import PulseResponseTable
+
+
+def test_pulse_response_table(make_synthetic_db):
+    db, expt_id = make_synthetic_db()
+    session = db.session()
+    expt = session.query(db.Experiment).get(expt_id)
+    table = PulseResponseTable(db, session, expt)
+
+    prs = session.query(db.PulseResponse).all()
+    assert len(table) == len(prs) == 960
+    assert sorted(table['id']) == sorted(pr.id for pr in prs)
+
+    # each row matches the ORM records it was collected from
+    rows = {pr_id: i for i, pr_id in enumerate(table['id'])}
+    for pr in prs:
+        i = rows[pr.id]
+        pulse = pr.stim_pulse
+        pcr = pr.recording.patch_clamp_recording
+        mpp = pcr.multi_patch_probe
+        fit = pr.pulse_response_fit
+        assert table['pair_id'][i] == pr.pair_id
+        assert table['clamp_mode'][i] == pcr.clamp_mode
+        assert table['ex_qc_pass'][i] == pr.ex_qc_pass
+        assert table['pulse_number'][i] == pulse.pulse_number
+        assert table['spike_count'][i] == len(pulse.spikes)
+        if len(pulse.spikes) > 0:
+            assert table['max_slope_time'][i] == min(pulse.spikes, key=lambda s: s.id).max_slope_time
+        assert table['probe_id'][i] == (-1 if len(mpp) == 0 else mpp[0].id)
+        assert table.has_fit[i] == (fit is not None)
+        amp = None if fit is None else fit.dec_fit_reconv_amp
+        assert (amp is None and np.isnan(table['dec_fit_reconv_amp'][i])) or table['dec_fit_reconv_amp'][i] == amp
+        assert table['synapse_type'][i] == ('ex' if pr.pair.has_synapse else None)
+
+    # rows are in chronological order
+    order = np.lexsort((table['onset_time'], table['rec_start_time']))
+    assert np.all(order == np.arange(len(table)))
+
+    # masks and lazily loaded data
+    mask = table.mask(pair_id=prs[0].pair_id, clamp_mode=['ic']) & table.has_fit
+    assert mask.sum() == len([pr for pr in prs if pr.pair_id == prs[0].pair_id and pr.pulse_response_fit is not None
+        and pr.recording.patch_clamp_recording.clamp_mode == 'ic'])
+    data = table.data(mask)
+    assert all(np.array_equal(d, session.query(db.PulseResponse).get(int(i)).data) for d, i in zip(data, table['id'][mask]))
+    session.close()
+
+
+def test_get_amps_from_table(make_synthetic_db, monkeypatch):
+    synapse_prediction = pytest.importorskip('aisynphys.synapse_prediction')
+    db, expt_id = make_synthetic_db()
+    # get_amps() queries the default database
+    monkeypatch.setattr(synapse_prediction, 'db', db)
+    session = db.session()
+    expt = session.query(db.Experiment).get(expt_id)
+    table = PulseResponseTable(db, session, expt)
+
+    # queried and table-selected records are identical, including one row per spike for pulses with several spikes
+    n_multi_spike = 0
+    for pair in session.query(db.Pair).all():
+        for clamp_mode in ['ic', 'vc']:
+            sql = synapse_prediction.get_amps(session, pair, clamp_mode=clamp_mode, get_data=True)
+            tab = synapse_prediction.get_amps(session, pair, clamp_mode=clamp_mode, get_data=True, pr_table=table)
+            assert sql.dtype.names == tab.dtype.names
+            assert len(sql) == len(tab) > 0
+            n_multi_spike += len(tab) - len(set(tab['id']))
+            for name in sql.dtype.names:
+                if name == 'data':
+                    assert all(np.array_equal(a, b) for a, b in zip(sql[name], tab[name]))
+                elif name == 'rec_start_time':
+                    assert np.all(sql[name].astype('datetime64[ns]') == tab[name])
+                elif sql[name].dtype.kind == 'f':
+                    np.testing.assert_array_equal(sql[name], tab[name])
+                else:
+                    assert list(sql[name]) == list(tab[name]), name
+    assert n_multi_spike > 0
+    session.close()
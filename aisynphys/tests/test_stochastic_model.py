@@ -0,0 +1,121 @@
+from collections import OrderedDict
+import numpy as np
+import pytest
+
+from aisynphys import config
+from aisynphys.stochastic_release_model import ParameterSpace, SharedEventArrays, BatchModelRunner, evaluate_model, search_parameters
+
+
+def make_param_space(rng):
+    params = OrderedDict([
+        ('n_release_sites', np.array([1, 2, 4, 8])),
+        ('base_release_probability', np.array([0.1, 0.2, 0.4])),
+        ('facilitation_amount', np.array([0.0, 0.1])),
+        ('measurement_stdev', 1e-4),
+    ])
+    param_space = ParameterSpace(params)
+    for inds in np.ndindex(param_space.result.shape):
+        # mini amplitude is optimized for each model, as in StochasticModelRunner.run_model
+        param_space.result[inds] = {'likelihood': rng.uniform(0.1, 1.0), 'params': param_space[inds],
+            'optimized_params': {'mini_amplitude': rng.uniform(1e-4, 1e-3)}}
+    return param_space
+
+
+def test_model_result_table(make_synthetic_db):
+    pytest.importorskip('neuroanalysis')
+    db, expt_id = make_synthetic_db()
+    param_space = make_param_space(np.random.RandomState(0))
+    fields = param_space.summary()
+    likelihood = fields['likelihood']
+    best = np.unravel_index(np.argmax(likelihood), likelihood.shape)
+    assert fields['ml_likelihood'] == likelihood.max()
+    assert fields['ml_n_release_sites'] == param_space.params['n_release_sites'][best[0]]
+    assert fields['ml_mini_amplitude'] == param_space.result[best]['optimized_params']['mini_amplitude']
+    assert fields['ml_measurement_stdev'] == 1e-4
+    assert np.allclose(fields['marginal_distributions']['base_release_probability']['max'], likelihood.max(axis=(0, 2)))
+    assert np.isclose(sum(fields['marginal_distributions']['facilitation_amount']['marginal']), 1)
+
+    session = db.session(readonly=False)
+    expt = session.query(db.Experiment).get(expt_id)
+    pair = expt.pair_list[0]
+    session.add(db.StochasticModelResult(pair=pair, experiment_ext_id=expt.ext_id, input_hash='abc', **fields))
+    session.commit()
+
+    # full result grids are stored compressed and can be used to rebuild the parameter space
+    rec = session.query(db.StochasticModelResult).one()
+    assert np.array_equal(rec.likelihood, likelihood)
+    loaded = ParameterSpace.from_summary(rec.parameter_space, rec.likelihood, rec.mini_amplitude)
+    assert loaded.param_order == param_space.param_order
+    assert loaded.static_params == param_space.static_params
+    for inds in np.ndindex(loaded.result.shape):
+        assert loaded.result[inds]['likelihood'] == param_space.result[inds]['likelihood']
+        assert loaded.result[inds]['params'] == param_space.result[inds]['params']
+        assert loaded.result[inds]['optimized_params'] == param_space.result[inds]['optimized_params']
+
+    # deleting pairs detaches results rather than deleting them
+    db.delete_records(session, [('experiment.ext_id', 'pair')], [expt.ext_id])
+    session.commit()
+    rec = session.query(db.StochasticModelResult).one()
+    assert rec.pair_id is None and rec.input_hash == 'abc'
+    session.close()
+
+
+def test_search_parameters_grid(monkeypatch):
+    bg_amplitudes = np.random.RandomState(0).normal(0, 1e-4, size=50)
+    default = search_parameters(bg_amplitudes)
+    assert ParameterSpace(default).result.size == 117600
+
+    monkeypatch.setattr(config, 'stochastic_model_grid', {'n_release_sites': [1, 4, 16], 'facilitation_amount': 0.0})
+    params = search_parameters(bg_amplitudes)
+    assert np.array_equal(params['n_release_sites'], [1, 4, 16])
+    assert params['facilitation_amount'] == 0.0
+    assert np.array_equal(params['base_release_probability'], default['base_release_probability'])
+    assert ParameterSpace(params).result.size == 117600 // 7 * 3 // 7
+
+    monkeypatch.setattr(config, 'stochastic_model_grid', {'n_sites': [1]})
+    with pytest.raises(KeyError):
+        search_parameters(bg_amplitudes)
+
+
+def synthetic_events(rng, n_synapses):
+    events = []
+    for i in range(n_synapses):
+        n = 20 + 10*i
+        spike_times = np.cumsum(rng.uniform(0.02, 2.0, size=n))
+        amplitudes = rng.normal(1e-3, 3e-4, size=n)
+        amplitudes[rng.rand(n) < 0.1] = np.nan
+        events.append((spike_times, amplitudes))
+    return events
+
+
+def test_shared_event_arrays():
+    events = synthetic_events(np.random.RandomState(0), 3) + [(np.zeros(0), np.zeros(0))]
+    with SharedEventArrays.create(events) as shared:
+        attached = SharedEventArrays.attach(shared.spec)
+        assert len(attached) == 4
+        for i, (spike_times, amplitudes) in enumerate(events):
+            assert np.array_equal(attached[i][0], spike_times)
+            assert np.array_equal(attached[i][1], amplitudes, equal_nan=True)
+        attached.close()
+
+
+def test_batch_model_runner():
+    pytest.importorskip('numba')
+    events = synthetic_events(np.random.RandomState(1), 2)
+    params = OrderedDict([
+        ('n_release_sites', np.array([1, 4])),
+        ('base_release_probability', np.array([0.2, 0.6])),
+        ('mini_amplitude_cv', 0.2),
+        ('measurement_stdev', 1e-4),
+        ('vesicle_recovery_tau', np.array([0.1, 1.0])),
+        ('facilitation_amount', 0.0),
+        ('facilitation_recovery_tau', 0.1),
+    ])
+    serial = BatchModelRunner(events, [params, params], workers=1, chunk_size=3).run()
+    pooled = BatchModelRunner(events, [params, params], workers=2, chunk_size=3).run()
+    for i in range(len(events)):
+        for inds in np.ndindex(serial[i].result.shape):
+            result, model = evaluate_model(serial[i][inds], *events[i])
+            for res in (serial[i].result[inds], pooled[i].result[inds]):
+                assert res['likelihood'] == result['likelihood']
+                assert res['optimized_params']['mini_amplitude'] == result['optimized_params']['mini_amplitude']
@@ -0,0 +1,89 @@
+import os, re, hashlib, threading
+import pytest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from aisynphys import config, synphys_cache
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serves files from the class attribute *files* ({path: bytes}), with support for byte ranges.
+    """
+    files = {}
+    requests = []
+
+    def do_GET(self):
+        data = self.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.requests.append((self.path, self.headers.get('Range')))
+        m = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range') or '')
+        if m is None:
+            self.send_response(200)
+        else:
+            start, stop = int(m.groups()[0]), int(m.groups()[1])
+            data = data[start:stop+1]
+            self.send_response(206)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def nwb_server(tmpdir, monkeypatch):
+    files = {'/files/%d.nwb' % i: os.urandom(300000 + i * 1000) for i in range(6)}
+    RangeRequestHandler.files = files
+    RangeRequestHandler.requests = []
+    server = HTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    monkeypatch.setattr(config, 'cache_path', str(tmpdir))
+    monkeypatch.setattr(synphys_cache, 'data_file_host', 'http://127.0.0.1:%d' % server.server_port)
+    monkeypatch.setattr(synphys_cache, '_file_index', {'1500000000.%03d' % i: '/files/%d.nwb' % i for i in range(6)})
+    yield files
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_nwb_files(nwb_server):
+    expt_ids = sorted(synphys_cache._file_index.keys())
+
+    # leave a partial download for one file; this should be resumed
+    data = nwb_server['/files/0.nwb']
+    cache_file = synphys_cache.get_nwb_cache_file(expt_ids[0])
+    os.makedirs(os.path.dirname(cache_file))
+    with open(cache_file + '.part_%d' % len(data), 'wb') as fh:
+        fh.write(data[:100000])
+
+    md5 = {expt_ids[1]: hashlib.md5(nwb_server['/files/1.nwb']).hexdigest()}
+    results = synphys_cache.download_nwb_files(expt_ids + ['missing'], workers=3, md5=md5, verbose=False)
+    status = {r['expt_id']: r['status'] for r in results}
+    assert status == dict([(e, 'downloaded') for e in expt_ids] + [('missing', 'missing')])
+    assert ('/files/0.nwb', 'bytes=100000-%d' % (len(data) - 1)) in RangeRequestHandler.requests
+    total = sum(len(d) for d in nwb_server.values()) - 100000
+    assert sum(r['bytes'] for r in results) == total
+
+    for i, expt_id in enumerate(expt_ids):
+        data = nwb_server['/files/%d.nwb' % i]
+        cache_file = synphys_cache.get_nwb_cache_file(expt_id)
+        assert open(cache_file, 'rb').read() == data
+        assert open(cache_file + '.md5').read() == hashlib.md5(data).hexdigest()
+
+    # completed files are skipped
+    RangeRequestHandler.requests = []
+    results = synphys_cache.download_nwb_files(expt_ids, verbose=False)
+    assert set(r['status'] for r in results) == {'skipped'}
+    assert RangeRequestHandler.requests == []
+
+    # corrupted files are detected by rehashing and downloaded again
+    with open(synphys_cache.get_nwb_cache_file(expt_ids[2]), 'r+b') as fh:
+        fh.write(b'corrupt')
+    results = synphys_cache.download_nwb_files(expt_ids, rehash=True, verbose=False)
+    status = {r['expt_id']: r['status'] for r in results}
+    assert status.pop(expt_ids[2]) == 'downloaded'
+    assert set(status.values()) == {'skipped'}
+    assert open(synphys_cache.get_nwb_cache_file(expt_ids[2]), 'rb').read() == nwb_server['/files/2.nwb']
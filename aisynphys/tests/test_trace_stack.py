@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('neuroanalysis')
+from neuroanalysis.data import TSeries, TSeriesList
+from neuroanalysis.baseline import float_mode
+from aisynphys.trace_stack import TraceStack, float_mode_rows
+
+
+def random_traces(rng, n=50, sample_rate=20000.):
+    """Return (tseries, stim_times, spike_times) for *n* random traces of varying length and start time.
+    """
+    tseries, stim_times, spike_times = [], [], []
+    for i in range(n):
+        t0 = rng.uniform(0, 1)
+        data = rng.normal(size=rng.randint(300, 400)) + rng.normal()
+        tseries.append(TSeries(data, t0=t0, sample_rate=sample_rate))
+        stim_times.append(t0 + rng.uniform(2e-3, 6e-3))
+        spike_times.append(stim_times[-1] + 1e-3)
+    return tseries, np.array(stim_times), np.array(spike_times)
+
+
+def test_float_mode_rows():
+    rng = np.random.RandomState(0)
+    data = rng.normal(size=(200, 100)).round(1)
+    data[0] = 3.0
+    assert np.allclose(float_mode_rows(data), [float_mode(row) for row in data])
+
+
+def test_trace_stack():
+    rng = np.random.RandomState(1)
+    tseries, stim_times, spike_times = random_traces(rng)
+
+    # same traces as aligning and baseline-subtracting each TSeries separately
+    stack = TraceStack.from_tseries(tseries, align_times=spike_times, baseline_windows=np.stack([stim_times - 5e-3, stim_times], axis=1), baseline='mode')
+    assert stack.data.shape[0] == len(tseries)
+    tsl = []
+    for ts, stim_time, spike_time in zip(tseries, stim_times, spike_times):
+        baseline = float_mode(ts.time_slice(max(ts.t0, stim_time - 5e-3), stim_time).data)
+        tsl.append((ts - baseline).copy(t0=ts.t0 - spike_time))
+    for ts, row in zip(tsl, stack.tseries()):
+        assert len(row) == len(ts)
+        assert abs(row.t0 - ts.t0) <= 0.5 * ts.dt + 1e-12
+        assert np.allclose(row.data, ts.data)
+    avg = stack.mean()
+    expected = TSeriesList(tsl).mean()
+    assert len(avg) == len(expected) and np.allclose(avg.data, expected.data)
+
+    # NaN inside a trace is ignored rather than clipping the average
+    nan_tsl = [ts.copy(data=ts.data.copy()) for ts in tsl]
+    nan_tsl[3].data[len(nan_tsl[3]) // 2] = np.nan
+    nan_stack = TraceStack.from_tseries(nan_tsl)
+    avg = nan_stack.mean()
+    expected = TSeriesList(nan_tsl).mean()
+    assert len(avg) == len(expected) and abs(avg.t0 - expected.t0) < 0.5 * avg.dt
+    assert np.all(np.isfinite(avg.data)) and np.allclose(avg.data, expected.data)
+
+    # cropping and decimation
+    small = TraceStack.from_tseries(tseries, align_times=spike_times, window=(-2e-3, 5e-3), decimate=4)
+    full = TraceStack.from_tseries(tseries, align_times=spike_times, window=(-2e-3, 5e-3))
+    assert small.data.shape == (len(tseries), 35) and small.t0 == -2e-3
+    assert np.array_equal(small.data, full.decimate(4).data, equal_nan=True)
+    assert np.allclose(small.time_values, full.time_values[::4])
+
+    # one curve with breaks between traces
+    x, y, connect = stack[:3].curve_arrays()
+    lengths = [len(ts) for ts in tseries[:3]]
+    assert len(x) == len(y) == len(connect) == sum(lengths)
+    assert list(np.argwhere(connect == 0)[:, 0]) == list(np.cumsum(lengths) - 1)
@@ -0,0 +1,239 @@
+# coding: utf8
+"""
+Time-aligned stacks of recorded traces.
+
+Analyses and plots of many pulse responses usually align each response to a stimulus or spike
+time, subtract a baseline, and then average or overlay the results. TraceStack does this for all
+responses at once: rows are copied from the recorded arrays into a single 2D array that shares
+one time vector, so no per-response TSeries copies are made.
+"""
+from __future__ import print_function, division
+
+import warnings
+import numpy as np
+from neuroanalysis.data import TSeries, TSeriesList
+
+
+class TraceStack(object):
+    """A set of traces stored as rows of a 2D array with a shared time vector.
+
+    Samples outside the range recorded for each trace are NaN.
+
+    Parameters
+    ----------
+    data : array
+        2D array of shape (n_traces, n_samples).
+    t0 : float
+        Time of the first column.
+    sample_rate : float
+        Sample rate of the columns.
+    """
+    def __init__(self, data, t0, sample_rate):
+        self.data = data
+        self.t0 = t0
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def from_arrays(cls, arrays, t0, sample_rate, align_times=None, baseline_windows=None, baseline='median', window=None, decimate=1, dtype=float):
+        """Build a stack by copying each array into one row, aligned and baseline-subtracted.
+
+        Each trace is placed at the sample nearest to its aligned start time, so traces may be
+        shifted by up to half a sample.
+
+        Parameters
+        ----------
+        arrays : list
+            1D data arrays, all sampled at *sample_rate*.
+        t0 : array
+            Start time of each array.
+        sample_rate : float
+            Sample rate of all arrays.
+        align_times : array | None
+            Time in each trace that becomes time 0 in the stack. If None, traces are not re-timed.
+        baseline_windows : array | None
+            (start, stop) times of the baseline region in each trace (before alignment). If None,
+            no baseline is subtracted. Traces with an empty baseline window use their first sample
+            as baseline.
+        baseline : str
+            "median" or "mode" (see neuroanalysis.baseline.float_mode); the statistic used to
+            measure baselines.
+        window : tuple | None
+            Optional (start, stop) times (after alignment) to crop the stack to. By default the
+            stack covers every sample of every trace.
+        decimate : int
+            Keep only every Nth sample (for display).
+        dtype : dtype
+            Data type of the returned stack.
+        """
+        n = len(arrays)
+        rec_t0 = np.asarray(t0, dtype=float).reshape(n)
+        lengths = np.array([len(arr) for arr in arrays], dtype=int)
+        t0 = rec_t0 if align_times is None else rec_t0 - np.asarray(align_times, dtype=float).reshape(n)
+
+        # integer sample offset of each row on the shared timebase
+        if window is None:
+            # samples are matched relative to the latest start time, as in TSeriesList.mean()
+            ref = t0.max() if n > 0 else 0.0
+            offsets = -np.round((ref - t0) * sample_rate).astype(int)
+            shift = -offsets.min() if n > 0 else 0
+            offsets += shift
+            start = ref - shift / sample_rate
+            n_samples = (offsets + lengths).max() if n > 0 else 0
+        else:
+            start = window[0]
+            offsets = np.round((t0 - start) * sample_rate).astype(int)
+            n_samples = int(np.round((window[1] - window[0]) * sample_rate))
+
+        decimate = int(decimate)
+        n_cols = (n_samples + decimate - 1) // decimate
+        stack = np.full((n, n_cols), np.nan, dtype=dtype)
+        for i, arr in enumerate(arrays):
+            # first and last (exclusive) stack column covered by this row
+            j0 = -(-max(offsets[i], 0) // decimate)
+            j1 = -(-min(offsets[i] + lengths[i], n_samples) // decimate)
+            if j1 <= j0:
+                continue
+            src = j0 * decimate - offsets[i]
+            stack[i, j0:j1] = arr[src:src + (j1 - j0) * decimate:decimate]
+
+        if baseline_windows is not None:
+            stack -= baseline_values(arrays, rec_t0, sample_rate, baseline_windows, baseline)[:, None]
+
+        return cls(stack, start, sample_rate / decimate)
+
+    @classmethod
+    def from_tseries(cls, tseries, **kwds):
+        """Build a stack from a list of TSeries that share the same sample rate.
+
+        Extra keyword arguments are passed to from_arrays().
+        """
+        sample_rates = set(ts.sample_rate for ts in tseries)
+        if len(sample_rates) > 1:
+            raise ValueError("All traces must have the same sample rate (got %r)" % sorted(sample_rates))
+        sample_rate = sample_rates.pop() if len(sample_rates) > 0 else 1.0
+        return cls.from_arrays([ts.data for ts in tseries], [ts.t0 for ts in tseries], sample_rate, **kwds)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, index):
+        """Return a TraceStack containing the rows selected by *index* (a slice, mask, or array of row indices).
+        """
+        if np.isscalar(index):
+            index = [index]
+        return TraceStack(self.data[index], self.t0, self.sample_rate)
+
+    @property
+    def dt(self):
+        return 1.0 / self.sample_rate
+
+    @property
+    def time_values(self):
+        return self.t0 + np.arange(self.data.shape[1]) * self.dt
+
+    def decimate(self, n):
+        """Return a new stack keeping only every *n*th sample.
+        """
+        return TraceStack(self.data[:, ::n], self.t0, self.sample_rate / n)
+
+    def mean(self):
+        """Return a TSeries with the average of all traces.
+
+        Like TSeriesList.mean(), the average is clipped to the time range covered by every trace
+        (from its first to its last recorded sample), and NaN values within that range are ignored.
+        """
+        if len(self) == 0:
+            raise ValueError("Cannot average an empty TraceStack")
+        finite = np.isfinite(self.data)
+        if not finite.any(axis=1).all():
+            raise ValueError("Traces in this stack do not overlap")
+        i0 = finite.argmax(axis=1).max()
+        i1 = self.data.shape[1] - finite[:, ::-1].argmax(axis=1).max()
+        if i1 <= i0:
+            raise ValueError("Traces in this stack do not overlap")
+        with warnings.catch_warnings():
+            # columns where every trace is NaN average to NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            avg = np.nanmean(self.data[:, i0:i1], axis=0)
+        return TSeries(avg, t0=self.t0 + i0 * self.dt, sample_rate=self.sample_rate)
+
+    def tseries(self):
+        """Return a TSeriesList with one TSeries per row, trimmed to the samples recorded for that row.
+        """
+        tsl = []
+        for row in self.data:
+            cols = np.argwhere(np.isfinite(row))[:, 0]
+            i0, i1 = (cols[0], cols[-1] + 1) if len(cols) > 0 else (0, 0)
+            tsl.append(TSeries(row[i0:i1], t0=self.t0 + i0 * self.dt, sample_rate=self.sample_rate))
+        return TSeriesList(tsl)
+
+    def curve_arrays(self):
+        """Return (x, y, connect) arrays that draw all traces as one multi-line curve.
+
+        Arrays are suitable for ``pg.PlotCurveItem(x, y, connect=connect)``; samples outside each
+        trace are omitted, and *connect* is 0 at the last sample of each trace.
+        """
+        y = self.data.ravel()
+        x = np.tile(self.time_values, len(self))
+        row = np.repeat(np.arange(len(self)), self.data.shape[1])
+        mask = np.isfinite(y)
+        x, y, row = x[mask], y[mask], row[mask]
+        connect = np.zeros(len(y), dtype=np.ubyte)
+        connect[:-1] = row[:-1] == row[1:]
+        return x, y, connect
+
+
+def baseline_values(arrays, t0, sample_rate, windows, method='median'):
+    """Return the baseline value of each array, measured in the (start, stop) time window given for each array.
+
+    Window edges are converted to indices the same way as TSeries.time_slice(). Arrays whose
+    window contains no samples use their first sample as baseline.
+    """
+    n = len(arrays)
+    windows = np.asarray(windows, dtype=float).reshape(n, 2)
+    lengths = np.array([len(arr) for arr in arrays], dtype=int)
+    inds = np.round((windows - np.asarray(t0, dtype=float).reshape(n, 1)) * sample_rate).astype(int)
+    inds = np.clip(inds, 0, np.maximum(lengths - 1, 0)[:, None])
+    widths = inds[:, 1] - inds[:, 0]
+
+    values = np.empty(n)
+    for width in np.unique(widths):
+        rows = np.argwhere(widths == width)[:, 0]
+        if width <= 0:
+            values[rows] = [arrays[i][0] for i in rows]
+            continue
+        block = np.stack([arrays[i][inds[i, 0]:inds[i, 1]] for i in rows])
+        if method == 'median':
+            values[rows] = np.median(block, axis=1)
+        elif method == 'mode':
+            values[rows] = float_mode_rows(block)
+        else:
+            raise ValueError("baseline method must be 'median' or 'mode'; got %r" % method)
+    return values
+
+
+def float_mode_rows(data, bins=None):
+    """Vectorized neuroanalysis.baseline.float_mode applied to each row of a 2D array.
+    """
+    n, width = data.shape
+    if bins is None:
+        bins = int(np.clip(int(width**0.5), 3, 500))
+    lo = data.min(axis=1)
+    hi = data.max(axis=1)
+    # same range handling as np.histogram
+    flat = lo == hi
+    lo = np.where(flat, lo - 0.5, lo)
+    hi = np.where(flat, hi + 0.5, hi)
+    edges = np.linspace(lo, hi, bins + 1, axis=1)
+
+    # bin assignment mirrors np.histogram for uniform bins
+    norm = bins / (hi - lo)
+    ind = ((data - lo[:, None]) * norm[:, None]).astype(np.intp)
+    ind[ind == bins] -= 1
+    rows = np.arange(n)[:, None]
+    ind[data < edges[rows, ind]] -= 1
+    ind[(data >= edges[rows, ind + 1]) & (ind != bins - 1)] += 1
+
+    counts = np.bincount((ind + rows * bins).ravel(), minlength=n * bins).reshape(n, bins)
+    peak = np.argmax(counts, axis=1)
+    return 0.5 * (edges[np.arange(n), peak] + edges[np.arange(n), peak + 1])
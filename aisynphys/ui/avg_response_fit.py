@@ -68,14 +68,11 @@ class PulseResponsePlot(object):
 
             prl = PulseResponseList(prs)
 
-            post_ts = prl.post_tseries(align='spike', bsub=True)
-            for ts in post_ts:
-                item = self.response_plot.plot(ts.time_values, ts.data, pen=pen)
-                self.items.append(item)
-
-            pre_ts = prl.pre_tseries(align='spike', bsub=True)
-            for ts in pre_ts:
-                item = self.spike_plot.plot(ts.time_values, ts.data, pen=pen)
+            # draw all traces in each plot with a single curve item
+            for stack, plt in [(prl.post_stack(align='spike', bsub=True), self.response_plot), (prl.pre_stack(align='spike', bsub=True), self.spike_plot)]:
+                x, y, connect = stack.curve_arrays()
+                item = pg.PlotCurveItem(x, y, connect=connect, pen=pen)
+                plt.addItem(item)
                 self.items.append(item)
 
         self.response_plot.autoRange()
@@ -9,9 +9,12 @@ from collections import OrderedDict
 import numpy as np
 from .. import config, lims
 from ..data import Experiment
+from ..data.slice import Slice
 from ..database import default_db as database
 from ..genotypes import Genotype
+from ..util import path_mtimes
 from .actions import ExperimentActions
+from .dashboard_status import SiteStatusStore
 from ..yaml_local import yaml
 
 from acq4.util.DataManager import getDirHandle
@@ -25,7 +28,22 @@ pass_color = (200, 255, 200)
 
 
 class Dashboard(QtGui.QWidget):
-    def __init__(self, limit=0, no_thread=False, filter_defaults=None):
+    """
+    Parameters
+    ----------
+    limit : int
+        Maximum number of sites for each poller to queue (0 for no limit).
+    no_thread : bool
+        If True, do all polling / checking in the main thread (for debugging).
+    filter_defaults : dict | None
+        Default filter values.
+    n_checkers : int
+        Number of worker threads used to check site status.
+    status_file : str | None
+        sqlite file in which site status is persisted between sessions
+        (default is dashboard_status.sqlite in config.cache_path).
+    """
+    def __init__(self, limit=0, no_thread=False, filter_defaults=None, n_checkers=3, status_file=None):
         QtGui.QWidget.__init__(self)
 
         # fields displayed in ui
@@ -58,6 +76,7 @@ class Dashboard(QtGui.QWidget):
             ('experiment', object),
             ('lims_slice_name', object),
             ('item', object),
+            ('site_path', object),
             ('error', object),
             ('db_errors', object),
         ]
@@ -66,7 +85,7 @@ class Dashboard(QtGui.QWidget):
         self.field_indices = {self.visible_fields[i][0]:i for i in range(len(self.visible_fields))}
 
         self.records = GrowingArray(dtype=self.visible_fields + self.hidden_fields)
-        self.records_by_expt = {}  # maps expt:index
+        self.records_by_expt = {}  # maps expt timestamp:index
 
         self.selected = None
 
@@ -179,6 +198,13 @@ class Dashboard(QtGui.QWidget):
         # Queue of experiments to be checked
         self.expt_queue = queue.PriorityQueue()
 
+        # Status of previously checked sites; these are displayed immediately and
+        # only re-checked if their files have changed.
+        if status_file is None:
+            status_file = os.path.join(config.cache_path, 'dashboard_status.sqlite')
+        self.status_store = SiteStatusStore(status_file)
+        self._incoming_checker_records = self.status_store.records()
+
         # collect a list of all data sources to search
         search_paths = [config.synphys_data]
         for rig_name, rig_path_sets in config.rig_data_paths.items():
@@ -192,7 +218,7 @@ class Dashboard(QtGui.QWidget):
             if not os.path.exists(search_path):
                 print("Ignoring search path:", search_path)
                 continue
-            poll_thread = PollThread(self.expt_queue, search_path, limit=limit)
+            poll_thread = PollThread(self.expt_queue, search_path, limit=limit, status_store=self.status_store)
             poll_thread.update.connect(self.poller_update)
             if no_thread:
                 poll_thread.poll()  # for local debugging
@@ -201,15 +227,14 @@ class Dashboard(QtGui.QWidget):
             self.pollers.append(poll_thread)
 
         # Checkers pull experiments off of the queue and check their status
-        self._incoming_checker_records = []
         if no_thread:
-            self.checker = ExptCheckerThread(self.expt_queue)
+            self.checker = ExptCheckerThread(self.expt_queue, status_store=self.status_store)
             self.checker.update.connect(self.checker_update)
             self.checker.run(block=False)            
         else:
             self.checkers = []
-            for i in range(3):
-                self.checkers.append(ExptCheckerThread(self.expt_queue))
+            for i in range(n_checkers):
+                self.checkers.append(ExptCheckerThread(self.expt_queue, status_store=self.status_store))
                 self.checkers[-1].update.connect(self.checker_update)
                 self.checkers[-1].start()
 
@@ -222,6 +247,8 @@ class Dashboard(QtGui.QWidget):
 
         self.handle_checker_record_timer = QtCore.QTimer()
         self.handle_checker_record_timer.timeout.connect(self.handle_all_checker_records)
+        if len(self._incoming_checker_records) > 0:
+            self.handle_checker_record_timer.start(0)
 
     def poll_toggled(self):
         if self.poll_btn.isChecked():
@@ -245,12 +272,21 @@ class Dashboard(QtGui.QWidget):
     def contextMenuEvent(self, event):
         self.menu.popup(event.globalPos())
 
+    def record_experiment(self, rec):
+        """Return the ExperimentMetadata for a dashboard record.
+
+        Records restored from the status store are not attached to an experiment until needed.
+        """
+        if rec['experiment'] is None:
+            rec['experiment'] = ExperimentMetadata(path=rec['site_path'])
+        return rec['experiment']
+
     def tree_selection_changed(self):
         sel = self.expt_tree.selectedItems()[0]
         rec = self.records[sel.index]
         self.console.localNamespace['sel'] = rec
         self.selected = rec
-        expt = rec['experiment']
+        expt = self.record_experiment(rec)
         self.console.localNamespace['expt'] = expt
         self.expt_actions.experiment = expt
 
@@ -284,7 +320,11 @@ class Dashboard(QtGui.QWidget):
         err = rec['error']
         if err is not None:
             msg.append("--------------------------------\nError checking experiment:")
-            msg.extend([line.rstrip() for line in traceback.format_exception(*err)])
+            if isinstance(err, str):
+                # errors restored from the status store are already formatted
+                msg.append(err.rstrip())
+            else:
+                msg.extend([line.rstrip() for line in traceback.format_exception(*err)])
 
         db_errors = rec['db_errors']
         if isinstance(db_errors, dict) and len(db_errors) > 0:
@@ -327,10 +367,11 @@ class Dashboard(QtGui.QWidget):
         self.handle_checker_record_timer.stop()
 
     def handle_checker_record(self, rec):
-        expt = rec['experiment']
-        if expt in self.records_by_expt:
+        # the same site may be reported by several pollers (and by the status store)
+        key = rec.get('timestamp', rec.get('site_path'))
+        if key in self.records_by_expt:
             # use old record / item
-            index = self.records_by_expt[expt]
+            index = self.records_by_expt[key]
             item = self.records[index]['item']
         else:
             # add new record / item
@@ -342,7 +383,7 @@ class Dashboard(QtGui.QWidget):
 
         record = self.records[index]
         record['item'] = item
-        self.records_by_expt[expt] = index
+        self.records_by_expt[key] = index
 
         # update item/record fields
         update_filter = False
@@ -434,7 +475,7 @@ class Dashboard(QtGui.QWidget):
         self.quit()
 
     def reload_clicked(self, *args):
-        expt = self.selected['experiment']
+        expt = self.record_experiment(self.selected)
         self.expt_queue.put((-expt.timestamp, expt))
 
     def console_toggled(self):
@@ -481,10 +522,11 @@ class PollThread(QtCore.QThread):
     known_expts = {}
     known_expts_lock = threading.Lock()
 
-    def __init__(self, expt_queue, search_path, limit=0, interval=3600):
+    def __init__(self, expt_queue, search_path, limit=0, interval=3600, status_store=None):
         QtCore.QThread.__init__(self)
         self.expt_queue = expt_queue
         self.search_path = search_path
+        self.status_store = status_store
         self.limit = limit
         self.interval = interval
         self._stop = False
@@ -520,6 +562,10 @@ class PollThread(QtCore.QThread):
                 if self._stop or not self.enable_polling:
                     return
 
+                # skip sites whose stored status is still valid
+                if self.status_store is not None and self.status_store.is_current(expt_path):
+                    continue
+
                 try:
                     expt = ExperimentMetadata(path=expt_path)
                     ts = expt.timestamp
@@ -551,11 +597,18 @@ class PollThread(QtCore.QThread):
 
 
 class ExptCheckerThread(QtCore.QThread):
+    """Pulls experiments from the queue and checks their status.
+
+    Experiments are taken from the queue in batches of up to *batch_size* so that LIMS and DB
+    information can be fetched for the whole batch at once (see StatusBatch).
+    """
     update = QtCore.Signal(object)
 
-    def __init__(self, expt_queue):
+    def __init__(self, expt_queue, status_store=None, batch_size=20):
         QtCore.QThread.__init__(self)
         self.expt_queue = expt_queue
+        self.status_store = status_store
+        self.batch_size = batch_size
         self._stop = False
 
     def stop(self):
@@ -567,8 +620,103 @@ class ExptCheckerThread(QtCore.QThread):
             ts, expt = self.expt_queue.get(block=block)
             if self._stop or expt == 'stop':
                 return
-            rec = expt.check()
-            self.update.emit(rec)
+
+            batch = [expt]
+            while len(batch) < self.batch_size:
+                try:
+                    ts, expt = self.expt_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if expt == 'stop':
+                    # leave stop requests for other checker threads
+                    self.expt_queue.put((ts, expt))
+                    break
+                batch.append(expt)
+
+            StatusBatch(batch)
+            for expt in batch:
+                if self._stop:
+                    return
+                inputs = expt.status_inputs()
+                rec = expt.check()
+                if self.status_store is not None and 'timestamp' in rec:
+                    self.store_record(expt, inputs, rec)
+                self.update.emit(rec)
+
+    def store_record(self, expt, inputs, rec):
+        stored = rec.copy()
+        stored['experiment'] = None
+        if stored['error'] is not None:
+            stored['error'] = ''.join(traceback.format_exception(*stored['error']))
+        try:
+            site_paths = [expt.poll_path, expt.primary_path, expt.archive_path, expt.backup_path, expt.nas_path]
+            self.status_store.store(rec['timestamp'], site_paths, inputs, stored)
+        except Exception:
+            print("Error storing status for %s:" % expt)
+            sys.excepthook(*sys.exc_info())
+
+
+class StatusBatch(object):
+    """Fetches LIMS and DB information needed by ExperimentMetadata.check() for a batch of
+    experiments using a few bulk queries, rather than several queries per site.
+
+    Each experiment in the batch gets a reference to this object as ``expt.status_batch``.
+    LIMS specimen records are stored on each experiment's Slice; cell cluster IDs are kept in
+    ``cluster_ids`` as {(specimen_id, timestamp): [cluster_id, ...]}.
+    """
+    def __init__(self, expts):
+        self._morphology = None
+        self.jobs = {}
+        self.pairs = {}
+        self.cluster_ids = {}
+        for expt in expts:
+            expt.status_batch = self
+        try:
+            self._fetch_lims(expts)
+            self._fetch_db(expts)
+        except Exception:
+            print("Error fetching status for %d experiments:" % len(expts))
+            sys.excepthook(*sys.exc_info())
+
+    def _fetch_lims(self, expts):
+        slices = []
+        for expt in expts:
+            try:
+                slices.append(expt.slice)
+            except Exception:
+                pass
+        Slice.load_lims_records(slices)
+        keys = []
+        for expt in expts:
+            try:
+                rec = expt.lims_record
+            except Exception:
+                continue
+            if rec is not None and rec['specimen_id'] is not None:
+                keys.append((rec['specimen_id'], expt.timestamp))
+        self.cluster_ids = lims.expt_cluster_ids_batch(keys)
+
+    def _fetch_db(self, expts):
+        job_ids = []
+        timestamps = []
+        for expt in expts:
+            try:
+                job_ids.extend([expt.uid, expt.slice_id])
+                timestamps.append(expt.timestamp)
+            except Exception:
+                pass
+        for job in database.query(database.Pipeline).filter(database.Pipeline.job_id.in_(job_ids)):
+            self.jobs.setdefault(job.job_id, []).append(job)
+        q = database.query(database.Pair, database.Experiment.acq_timestamp).join(database.Experiment)
+        for pair, ts in q.filter(database.Experiment.acq_timestamp.in_(timestamps)):
+            self.pairs.setdefault(ts, []).append(pair)
+
+    def morphology(self):
+        """Return all Morphology records (queried once per batch, only if needed).
+        """
+        if self._morphology is None:
+            self._morphology = database.query(database.Morphology).all()
+        return self._morphology
 
 
 class ExperimentMetadata(Experiment):
@@ -577,6 +725,8 @@ class ExperimentMetadata(Experiment):
     def __init__(self, path=None):
         Experiment.__init__(self, verify=False)
         self._site_path = path
+        self.poll_path = path
+        self.status_batch = None
 
         self.site_dh = getDirHandle(path)
         self._rig_name = None
@@ -596,12 +746,33 @@ class ExperimentMetadata(Experiment):
                 self._site_info = None
                 break
 
+    def status_inputs(self):
+        """Return {path: mtime} for the files and directories that check() depends on.
+
+        If none of these change, then the result of check() is assumed to be unchanged
+        (apart from LIMS / DB state; see SiteStatusStore.max_age).
+        """
+        paths = [self.poll_path]
+        try:
+            site_paths = [self.primary_path, self.archive_path, self.backup_path, self.nas_path]
+        except Exception:
+            site_paths = []
+        for path in site_paths:
+            if path is None:
+                continue
+            paths.extend([path, os.path.join(path, '.index'), os.path.join(path, 'pipettes.yml')])
+        for path in site_paths[:1] + site_paths[3:]:
+            if path is None:
+                continue
+            paths.extend([os.path.join(path, '..', '.index'), os.path.join(path, '..', '..', '.index')])
+        return path_mtimes(paths)
+
     def check(self):
         """Check the status of this experiment, return a dict describing
         the state of each stage in the pipeline.
         """
         try:
-            rec = {'experiment': self, 'error': None}
+            rec = {'experiment': self, 'site_path': self.poll_path, 'error': None}
 
             rec['timestamp'] = '%0.3f' % self.timestamp
             rec['rig'] = self.rig_name
@@ -678,7 +849,10 @@ class ExperimentMetadata(Experiment):
                     connections = False
                     # if rec['DB'] is True:
                     if has_run:
-                        pairs = database.query(database.Pair).join(database.Experiment).filter(database.Experiment.acq_timestamp==self.timestamp).all()
+                        if self.status_batch is not None:
+                            pairs = self.status_batch.pairs.get(self.timestamp, [])
+                        else:
+                            pairs = database.query(database.Pair).join(database.Experiment).filter(database.Experiment.acq_timestamp==self.timestamp).all()
                         if len(pairs) > 0:
                             all_none = all(p.has_synapse is None for p in pairs)
                             if all_none is False:
@@ -721,7 +895,10 @@ class ExperimentMetadata(Experiment):
                         else:
                             rec['cell map'] = False
                         if rec['cell map'] is True:
-                            morpho = database.query(database.Morphology).all()
+                            if self.status_batch is not None:
+                                morpho = self.status_batch.morphology()
+                            else:
+                                morpho = database.query(database.Morphology).all()
                             cell_morpho = [cell for cell in morpho if cell.cell.meta.get('lims_specimen_id') in cell_specimens]
                             cell_meta = [cell.meta.get('morpho_db_hash') for cell in cell_morpho if cell.meta is not None]
                             has_morpho = len(cell_meta) > 0
@@ -874,9 +1051,12 @@ class ExperimentMetadata(Experiment):
 
     @property
     def db_status(self):
-        slice_jobs = database.query(database.Pipeline).filter(database.Pipeline.job_id==self.slice_id).all()
-        expt_jobs = database.query(database.Pipeline).filter(database.Pipeline.job_id==self.uid).all()
-        jobs = slice_jobs + expt_jobs
+        if self.status_batch is not None:
+            jobs = self.status_batch.jobs.get(self.slice_id, []) + self.status_batch.jobs.get(self.uid, [])
+        else:
+            slice_jobs = database.query(database.Pipeline).filter(database.Pipeline.job_id==self.slice_id).all()
+            expt_jobs = database.query(database.Pipeline).filter(database.Pipeline.job_id==self.uid).all()
+            jobs = slice_jobs + expt_jobs
                 
         has_run = len(jobs) > 0
         success = {j.module_name:j.success for j in jobs}
@@ -892,7 +1072,10 @@ class ExperimentMetadata(Experiment):
         spec_id = self.lims_record['specimen_id']
         if spec_id is None:
             return None
-        return lims.expt_submissions(spec_id, self.timestamp)
+        cluster_ids = None
+        if self.status_batch is not None:
+            cluster_ids = self.status_batch.cluster_ids.get((spec_id, self.timestamp))
+        return lims.expt_submissions(spec_id, self.timestamp, cluster_ids=cluster_ids)
 
     @property
     def lims_cell_cluster_id(self):
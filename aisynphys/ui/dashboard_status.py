@@ -0,0 +1,89 @@
+"""
+Persistent storage for dashboard site status.
+
+Each site checked by the dashboard is stored along with the modification times of the
+files and directories that its status was derived from. On the next poll, a site only
+needs to be checked again if one of those inputs has changed (or the stored result
+is older than a maximum age, to pick up changes in LIMS and the DB).
+"""
+from __future__ import print_function
+import os, time, json, pickle, sqlite3, threading
+from ..util import path_mtimes
+
+
+class SiteStatusStore(object):
+    """sqlite-backed record of the last status check for each site.
+
+    Records are keyed by site timestamp; each may be reached from several site paths
+    (the NAS copy and the rig primary / archive / backup copies). Safe to use from
+    multiple threads.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the sqlite file (created if needed).
+    max_age : float
+        Stored results older than this many seconds are considered stale even if
+        none of their inputs changed.
+    """
+    def __init__(self, filename, max_age=24*3600):
+        self.filename = filename
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        dirname = os.path.dirname(filename)
+        if dirname != '' and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("""create table if not exists site_status (
+            timestamp text primary key,
+            check_time real,
+            inputs text,
+            record blob
+        )""")
+        self.db.execute("create table if not exists site_path (path text primary key, timestamp text)")
+        self.db.commit()
+
+    def store(self, timestamp, site_paths, inputs, record):
+        """Store the *record* returned by checking a site.
+
+        Parameters
+        ----------
+        timestamp : str
+            The site timestamp (formatted as '%0.3f').
+        site_paths : list
+            All paths at which this site may be found by a poller.
+        inputs : dict
+            {path: mtime} for all files and directories that *record* was derived from.
+        record : dict
+            Picklable status record.
+        """
+        record = pickle.dumps(record)
+        with self.lock:
+            with self.db:
+                self.db.execute("insert or replace into site_status values (?, ?, ?, ?)",
+                    (timestamp, time.time(), json.dumps(inputs), sqlite3.Binary(record)))
+                self.db.executemany("insert or replace into site_path values (?, ?)",
+                    [(os.path.abspath(path), timestamp) for path in site_paths if path is not None])
+
+    def is_current(self, site_path):
+        """Return True if a stored status exists for *site_path* and none of its inputs have changed.
+        """
+        with self.lock:
+            rec = self.db.execute("""
+                select check_time, inputs from site_status
+                join site_path on site_path.timestamp=site_status.timestamp
+                where site_path.path=?""", (os.path.abspath(site_path),)).fetchone()
+        if rec is None:
+            return False
+        check_time, inputs = rec
+        if time.time() - check_time > self.max_age:
+            return False
+        inputs = json.loads(inputs)
+        return path_mtimes(inputs.keys()) == inputs
+
+    def records(self):
+        """Return a list of all stored status records, most recent sites first.
+        """
+        with self.lock:
+            rows = self.db.execute("select record from site_status order by timestamp desc").fetchall()
+        return [pickle.loads(rec) for rec, in rows]
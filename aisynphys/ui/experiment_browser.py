@@ -1,29 +1,37 @@
 from __future__ import print_function, division
 from datetime import datetime
+from collections import OrderedDict
 import pyqtgraph as pg
+from sqlalchemy.orm import aliased
 
 from aisynphys.database import default_db as db
 
 
 class ExperimentBrowser(pg.TreeWidget):
     """TreeWidget showing a list of experiments with cells and pairs.
+
+    All data displayed in the tree are loaded with a single query when the browser is populated.
+    Pair items are only created when their experiment is expanded (or when a pair is selected),
+    and the ORM records for each item are loaded the first time they are accessed.
     """
     # TODO: add filtering options, cell info, context menu of actions, etc.
-    
+
     def __init__(self):
         self.all_columns = ['date', 'timestamp', 'rig', 'organism', 'project', 'region', 'genotype', 'acsf']
         self.visible_columns = self.all_columns[:]
-        
+
         pg.TreeWidget.__init__(self)
-        
+
         self.setColumnCount(len(self.all_columns))
         self.setHeaderLabels(self.all_columns)
         self.setDragDropMode(self.NoDragDrop)
         self._last_expanded = None
-        
+        self.items_by_pair_id = PairItemIndex()
+        self.itemExpanded.connect(self._item_expanded)
+
     def populate(self, experiments=None, all_pairs=False, synapses=False):
         """Populate the browser with a list of experiments.
-        
+
         Parameters
         ----------
         experiments : list | None
@@ -35,49 +43,29 @@ class ExperimentBrowser(pg.TreeWidget):
         """
         with pg.BusyCursor():
             # if all_pairs is set to True, all pairs from an experiment will be included regardless of whether they have data
-            self.items_by_pair_id = {}
-            
+            self.items_by_pair_id = PairItemIndex()
+
             self.session = db.session()
-            
-            if experiments is None:
-                # preload all cells,pairs so they are not queried individually later on
-                q = self.session.query(db.Pair, db.Experiment, db.Cell, db.Slice)
-                q = q.join(db.Experiment, db.Pair.experiment_id==db.Experiment.id)
-                q = q.join(db.Cell, db.Cell.id==db.Pair.pre_cell_id)
-                q = q.join(db.Slice)
-                if synapses:
-                    q = q.filter(db.Pair.has_synapse==True)
-                    
-                recs = q.all()
-                experiments = list(set([rec.Experiment for rec in recs]))
-            
-            experiments.sort(key=lambda e: e.acq_timestamp)
-            for expt in experiments:
-                date = expt.acq_timestamp
-                date_str = datetime.fromtimestamp(date).strftime('%Y-%m-%d')
-                slice = expt.slice
-                expt_item = pg.TreeWidgetItem(map(str, [date_str, '%0.3f'%expt.acq_timestamp, expt.rig_name, slice.species, expt.project_name, expt.target_region, slice.genotype, expt.acsf]))
-                expt_item.expt = expt
+
+            expt_ids = None if experiments is None else [expt.id for expt in experiments]
+            expt_rows, pair_rows = browser_rows(self.session, expt_ids, synapses=synapses)
+
+            for expt_row in expt_rows:
+                pairs = [row for row in pair_rows.get(expt_row.id, []) if _show_pair(row, all_pairs, synapses)]
+                if experiments is None and len(pair_rows.get(expt_row.id, [])) == 0:
+                    # only experiments that have (synaptically connected) pairs are listed by default
+                    continue
+                expt_item = ExperimentItem(self, expt_row, pairs)
                 self.addTopLevelItem(expt_item)
+                for row in pairs:
+                    self.items_by_pair_id.add(row, expt_item)
 
-                for pair in expt.pair_list:
-                    if all_pairs is False and pair.n_ex_test_spikes == 0 and pair.n_in_test_spikes == 0:
-                        continue
-                    if synapses and not pair.has_synapse:
-                        continue
-                    cells = '%s => %s' % (pair.pre_cell.ext_id, pair.post_cell.ext_id)
-                    conn = {True:"syn", False:"-", None:"?"}[pair.has_synapse]
-                    types = 'L%s %s => L%s %s' % (pair.pre_cell.target_layer or "?", pair.pre_cell.cre_type, pair.post_cell.target_layer or "?", pair.post_cell.cre_type)
-                    pair_item = pg.TreeWidgetItem([cells, conn, types])
-                    expt_item.addChild(pair_item)
-                    pair_item.pair = pair
-                    pair_item.expt = expt
-                    self.items_by_pair_id[pair.id] = pair_item
-                    # also allow select by ext id
-                    self.items_by_pair_id[(expt.acq_timestamp, pair.pre_cell.ext_id, pair.post_cell.ext_id)] = pair_item
-                    
             self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
-                
+
+    def _item_expanded(self, item):
+        if isinstance(item, ExperimentItem):
+            item.populate_pairs()
+
     def select_pair(self, pair_id):
         """Select a specific pair from the list
         """
@@ -93,3 +81,165 @@ class ExperimentBrowser(pg.TreeWidget):
         else:
             self._last_expanded = None
         self.scrollToItem(item)
+
+
+class ExperimentItem(pg.TreeWidgetItem):
+    """Tree item for one experiment. Child items for its pairs are created on first expansion.
+    """
+    def __init__(self, browser, row, pair_rows):
+        date_str = datetime.fromtimestamp(row.acq_timestamp).strftime('%Y-%m-%d')
+        pg.TreeWidgetItem.__init__(self, list(map(str, [date_str, '%0.3f'%row.acq_timestamp, row.rig_name, row.species, row.project_name, row.target_region, row.genotype, row.acsf])))
+        self.browser = browser
+        self.expt_id = row.id
+        self.acq_timestamp = row.acq_timestamp
+        self._pair_rows = pair_rows
+        self._pair_items = None
+        self._expt = None
+        if len(pair_rows) > 0:
+            self.setChildIndicatorPolicy(pg.QtGui.QTreeWidgetItem.ShowIndicator)
+
+    @property
+    def expt(self):
+        """The Experiment record for this item, loaded on first access.
+        """
+        if self._expt is None:
+            self._expt = self.browser.session.query(db.Experiment).get(self.expt_id)
+        return self._expt
+
+    def populate_pairs(self):
+        """Create child items for all pairs in this experiment (if they have not been created already).
+
+        Returns {pair_id: PairItem}.
+        """
+        if self._pair_items is None:
+            self._pair_items = OrderedDict()
+            for row in self._pair_rows:
+                item = PairItem(self, row)
+                self.addChild(item)
+                self._pair_items[row.pair_id] = item
+        return self._pair_items
+
+
+class PairItem(pg.TreeWidgetItem):
+    """Tree item for one pair.
+    """
+    def __init__(self, expt_item, row):
+        cells = '%s => %s' % (row.pre_ext_id, row.post_ext_id)
+        conn = {True:"syn", False:"-", None:"?"}[row.has_synapse]
+        types = 'L%s %s => L%s %s' % (row.pre_target_layer or "?", row.pre_cre_type, row.post_target_layer or "?", row.post_cre_type)
+        pg.TreeWidgetItem.__init__(self, [cells, conn, types])
+        self.expt_item = expt_item
+        self.pair_id = row.pair_id
+        self._pair = None
+
+    @property
+    def pair(self):
+        """The Pair record for this item, loaded on first access.
+        """
+        if self._pair is None:
+            self._pair = self.expt_item.browser.session.query(db.Pair).get(self.pair_id)
+        return self._pair
+
+    @property
+    def expt(self):
+        return self.expt_item.expt
+
+
+class PairItemIndex(object):
+    """Maps pair IDs (and (acq_timestamp, pre_cell_ext_id, post_cell_ext_id) tuples) to PairItems.
+
+    Only the experiment containing each pair is stored; the PairItem is created on first access.
+    """
+    def __init__(self):
+        self._expt_items = {}
+
+    def add(self, row, expt_item):
+        self._expt_items[row.pair_id] = (row.pair_id, expt_item)
+        # also allow select by ext id
+        self._expt_items[(expt_item.acq_timestamp, row.pre_ext_id, row.post_ext_id)] = (row.pair_id, expt_item)
+
+    def __getitem__(self, key):
+        pair_id, expt_item = self._expt_items[key]
+        return expt_item.populate_pairs()[pair_id]
+
+    def __contains__(self, key):
+        return key in self._expt_items
+
+    def __len__(self):
+        return len(self._expt_items)
+
+    def keys(self):
+        return self._expt_items.keys()
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+def browser_rows(session, experiment_ids=None, synapses=False):
+    """Query all data displayed by ExperimentBrowser as plain row tuples.
+
+    Parameters
+    ----------
+    session : Session
+        Session used for the query
+    experiment_ids : list | None
+        IDs of experiments to include, or None for all experiments
+    synapses : bool
+        If True, then only synaptically connected pairs are returned
+
+    Returns
+    -------
+    expt_rows : list
+        One row per experiment, sorted by acq_timestamp
+    pair_rows : dict
+        {experiment_id: [pair rows]}
+    """
+    pre_cell = aliased(db.Cell)
+    post_cell = aliased(db.Cell)
+    pair_filter = db.Pair.experiment_id==db.Experiment.id
+    if synapses:
+        pair_filter = pair_filter & (db.Pair.has_synapse==True)
+
+    q = session.query(
+        db.Experiment.id,
+        db.Experiment.acq_timestamp,
+        db.Experiment.rig_name,
+        db.Experiment.project_name,
+        db.Experiment.target_region,
+        db.Experiment.acsf,
+        db.Slice.species,
+        db.Slice.genotype,
+        db.Pair.id.label('pair_id'),
+        db.Pair.has_synapse,
+        db.Pair.n_ex_test_spikes,
+        db.Pair.n_in_test_spikes,
+        pre_cell.ext_id.label('pre_ext_id'),
+        pre_cell.target_layer.label('pre_target_layer'),
+        pre_cell.cre_type.label('pre_cre_type'),
+        post_cell.ext_id.label('post_ext_id'),
+        post_cell.target_layer.label('post_target_layer'),
+        post_cell.cre_type.label('post_cre_type'),
+    )
+    q = q.outerjoin(db.Slice, db.Slice.id==db.Experiment.slice_id)
+    q = q.outerjoin(db.Pair, pair_filter)
+    q = q.outerjoin(pre_cell, pre_cell.id==db.Pair.pre_cell_id)
+    q = q.outerjoin(post_cell, post_cell.id==db.Pair.post_cell_id)
+    if experiment_ids is not None:
+        q = q.filter(db.Experiment.id.in_(experiment_ids))
+    q = q.order_by(db.Experiment.acq_timestamp, db.Pair.id)
+
+    expt_rows = OrderedDict()
+    pair_rows = {}
+    for row in q.all():
+        expt_rows.setdefault(row.id, row)
+        if row.pair_id is not None:
+            pair_rows.setdefault(row.id, []).append(row)
+    return list(expt_rows.values()), pair_rows
+
+
+def _show_pair(row, all_pairs, synapses):
+    if all_pairs is False and row.n_ex_test_spikes == 0 and row.n_in_test_spikes == 0:
+        return False
+    if synapses and not row.has_synapse:
+        return False
+    return True
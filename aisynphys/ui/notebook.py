@@ -258,6 +258,8 @@ def show_distance_profiles(ax, results, colors, class_labels):
     results : dict
         Output of aisynphys.connectivity.measure_distance. This structure maps
         (pre_class, post_class) onto the results of the connectivity as a function of distance.
+        Model fits (see measure_distance *model* argument) are drawn as dashed lines with dotted
+        confidence intervals.
     colors: dict
         color to draw each (pre_class, post_class) connectivity profile. Keys same as results.
         To color based on overall connection probability use color_by_conn_prob.
@@ -280,6 +282,12 @@ def show_distance_profiles(ax, results, colors, class_labels):
         mid_curve = plot.plot(xvals, cp, color=color, linewidth=2.5)
         lower_curve = plot.fill_between(xvals, lower, cp, color=color2)
         upper_curve = plot.fill_between(xvals, upper, cp, color=color2)
+
+        # model fit and bootstrap confidence interval, if measure_distance was given a model
+        if 'model_prob' in result:
+            plot.plot(xvals, result['model_prob'], color=color, linestyle='--')
+            plot.plot(xvals, result['model_lower_ci'], color=color, linestyle=':', linewidth=0.8)
+            plot.plot(xvals, result['model_upper_ci'], color=color, linestyle=':', linewidth=0.8)
         
         plot.set_title('%s -> %s' % (class_labels[pre_class], class_labels[post_class]))
         if i == len(ax)-1:
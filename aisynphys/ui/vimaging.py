@@ -6,7 +6,45 @@ import scipy.ndimage as ndimage
 import scipy.stats as stats
 
 
+class SequenceTrial(object):
+    """Camera frames from one trial of an imaging sequence, cropped to the first 200 ms.
+
+    *frames* is a MetaArray opened with readAllData=False, so frames are only read from disk
+    by iter_blocks(). If *minus* is given, the frames of that trial are subtracted from this one
+    (frame by frame, before cropping).
+    """
+    def __init__(self, frames, minus=None):
+        self.frames = frames
+        self.minus = minus
+        t = frames.xvals('Time')
+        if minus is not None:
+            t = t[:min(len(t), len(minus.xvals('Time')))]
+        self.start, stop = np.searchsorted(t, [0, 200e-3])
+        self.time = t[self.start:stop]
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def frame_shape(self):
+        return self.frames.shape[1:]
+
+    def iter_blocks(self, n_frames, block_size):
+        """Yield (index, frames) for blocks of up to *block_size* frames, covering the first *n_frames*.
+        """
+        for i in range(0, n_frames, block_size):
+            j = self.start + i
+            k = self.start + min(i + block_size, n_frames)
+            block = self.frames[j:k].asarray().astype(float)
+            if self.minus is not None:
+                block -= self.minus[j:k].asarray()
+            yield i, block
+
+
 class VImagingAnalyzer(QtGui.QSplitter):
+    # number of frames read from disk at a time
+    block_size = 100
+
     def __init__(self):
         QtGui.QSplitter.__init__(self, QtCore.Qt.Horizontal)
         self.resize(800, 1000)
@@ -87,22 +125,23 @@ class VImagingAnalyzer(QtGui.QSplitter):
         man = getManager()
         model = man.dataModel
 
-        # read all image data
-        self.img_data = model.buildSequenceArray(
+        # open all image data; frames are read from disk in blocks as they are needed (see SequenceTrial)
+        frames = model.buildSequenceArray(
             seqDir, 
-            lambda dh: dh['Camera']['frames.ma'].read(),
+            lambda dh: dh['Camera']['frames.ma'].read(readAllData=False),
             join=False).asarray()
         seqParams = list(model.listSequenceParams(seqDir).items())
-        if self.img_data.ndim == 1:
-            self.img_data = self.img_data[np.newaxis, :]
+        if frames.ndim == 1:
+            frames = frames[np.newaxis, :]
             seqParams.insert(0, (None, [0]))
 
         transpose = seqParams[0][0] == ('protocol', 'repetitions')
         if transpose:
-            self.img_data = np.swapaxes(self.img_data, 0, 1)
+            frames = np.swapaxes(frames, 0, 1)
             seqParams = seqParams[::-1]
         self.seqParams = seqParams
 
+        trials = [[SequenceTrial(frames[i, j]) for j in range(frames.shape[1])] for i in range(frames.shape[0])]
         if seqParams[0][0] is None:
             self.seqColors = [pg.mkColor('w')]
         else:
@@ -111,27 +150,20 @@ class VImagingAnalyzer(QtGui.QSplitter):
                 # Special case: add in difference between two sequence trials
                 seqParams[0] = (seqParams[0][0], list(seqParams[0][1]) + [np.mean(seqParams[0][1])])
                 nSeq = 3
-                img_data = np.empty((3,) + self.img_data.shape[1:], dtype=self.img_data.dtype)
-                img_data[:2] = self.img_data
-                for i in range(img_data.shape[1]):
-                    minlen = min(self.img_data[0,i].shape[0], self.img_data[1,i].shape[0])
-                    img_data[2,i] = self.img_data[0,i][:minlen].copy()
-                    img_data[2,i]._data = self.img_data[0,i][:minlen].asarray().astype('float') - self.img_data[1,i][:minlen].asarray()
-                self.img_data = img_data
-                
+                trials.append([SequenceTrial(frames[0, j], minus=frames[1, j]) for j in range(frames.shape[1])])
                 
             self.seqColors = [pg.intColor(i, nSeq*1.6) for i in range(nSeq)]
 
         # cull out truncated recordings :(
-        self.img_data = [[d['Time':0:200e-3] for d in row if d.xvals('Time')[-1] > 150e-3] for row in self.img_data]
+        self.trials = [[trial for trial in row if len(trial) > 0 and trial.time[-1] > 150e-3] for row in trials]
 
-        # crop / concatenate
-        img_len = min([min([d.shape[0] for d in row]) for row in self.img_data])
-        self.img_data = [[d[:img_len] for d in row] for row in self.img_data]
-        self.img_arrays = [np.concatenate([d.asarray()[np.newaxis, ...] for d in row], axis=0) for row in self.img_data]
+        # crop
+        self.img_len = min([min([len(trial) for trial in row]) for row in self.trials])
+        self.img_times = [row[0].time[:self.img_len] for row in self.trials]
 
-        # average
-        self.img_mean = [img_arr.mean(axis=0) for img_arr in self.img_arrays]
+        # average all frames and measure ROI time courses in one pass over the files
+        self.frame_shape = self.trials[-1][0].frame_shape
+        self.roi_traces, self.img_mean = self.stream_trials(self.roi_masks(), mean=True)
 
         for p in self.clamp_plots:
             self.plt2.removeItem(p)
@@ -168,14 +200,49 @@ class VImagingAnalyzer(QtGui.QSplitter):
             self.clamp_mode = None
             self.plt2.hide()
 
-        self.img_t = self.img_data[0][0].xvals('Time')
+        self.img_t = self.img_times[0]
 
         self.img1.setImage(self.img_mean[-1].mean(axis=0))
 
-        self.roi_changed(None)
+        self.plot_roi_traces()
         self.time_rgn_changed(None)
         self.update_sequence_analysis()
 
+    def stream_trials(self, masks, mean=False):
+        """Read all trials block by block and return ROI time courses measured at full resolution.
+
+        *masks* is a list of boolean pixel masks (see roi_masks), one per ROI. Returns a list (one per
+        sequence row) of arrays with shape (rois, trials, frames) giving the average pixel value within
+        each mask for every frame. If *mean* is True, return (roi_traces, img_mean) instead, where
+        *img_mean* is a list (one per row) of the frame stacks averaged over all trials.
+        """
+        n_frames = self.img_len
+        roi_traces = []
+        img_mean = []
+        for row in self.trials:
+            traces = np.empty((len(masks), len(row), n_frames))
+            row_sum = None
+            for j, trial in enumerate(row):
+                for start, block in trial.iter_blocks(n_frames, self.block_size):
+                    stop = start + block.shape[0]
+                    for k, mask in enumerate(masks):
+                        traces[k, j, start:stop] = block[:, mask].mean(axis=1)
+                    if mean:
+                        if row_sum is None:
+                            row_sum = np.zeros((n_frames,) + block.shape[1:])
+                        row_sum[start:stop] += block
+            roi_traces.append(traces)
+            if mean:
+                img_mean.append(row_sum / len(row))
+        if mean:
+            return roi_traces, img_mean
+        return roi_traces
+
+    def roi_masks(self):
+        """Return a boolean mask of the image pixels inside each ROI.
+        """
+        return [ellipse_mask(roi, self.img1, self.frame_shape) for roi in self.rois]
+
     def roi_changed(self, roi):
         if self.ignore_roi_change:
             return
@@ -193,25 +260,28 @@ class VImagingAnalyzer(QtGui.QSplitter):
                 other_roi.setSize(roi.size())            
         finally:
             self.ignore_roi_change = False
-        
-        
+
+        # frames are not kept in memory, so ROI time courses are measured again from disk
+        with pg.BusyCursor():
+            self.roi_traces = self.stream_trials(self.roi_masks())
+        self.plot_roi_traces()
+
+    def plot_roi_traces(self):
         for item in self.plt1_items:
             self.plt1.removeItem(item)
-
+        self.plt1_items = []
         
-        for i, img_data in enumerate(self.img_arrays):
+        for i, (rgn1, rgn2) in enumerate(self.roi_traces):
             color = self.seqColors[i]
             color2 = pg.mkColor(color)
             color2.setAlpha(40)
 
-            rgn1 = roi1.getArrayRegion(img_data, self.img1, axes=(2, 3)).mean(axis=2).mean(axis=2)
-            rgn2 = roi2.getArrayRegion(img_data, self.img1, axes=(2, 3)).mean(axis=2).mean(axis=2)
             dif = rgn1 - rgn2
             
             difmean = dif.mean(axis=0)
             baseline = np.median(difmean[:10])
             # plot individual examples only for last parameter
-            if i == len(self.img_arrays)-1:
+            if i == len(self.roi_traces)-1:
                 for j in range(dif.shape[0]):
                     offset = baseline - np.median(dif[j, :10])
                     self.plt1_items.append(self.plt1.plot(self.img_t, dif[j] + offset, pen=color2, antialias=True))
@@ -230,13 +300,13 @@ class VImagingAnalyzer(QtGui.QSplitter):
         elif rgn is self.noise_time_rgn:
             self.test_time_rgn.setRegion([tr[0], tr[0] + nr[1]-nr[0]])
             
-        img_data = self.img_arrays[-1]
-        img_t = self.img_data[-1][0].xvals('Time')
+        img_mean = self.img_mean[-1]
+        img_t = self.img_times[-1]
         
         base_starti, base_stopi, test_starti, test_stopi = self.time_indices(img_t)[:4]
 
-        base = img_data[:, base_starti:base_stopi].mean(axis=0).mean(axis=0)
-        test = img_data[:, test_starti:test_stopi].mean(axis=0).mean(axis=0)
+        base = img_mean[base_starti:base_stopi].mean(axis=0)
+        test = img_mean[test_starti:test_stopi].mean(axis=0)
 
         dff = ndimage.median_filter(test - base, 6) # original median radius was 10
         self.img2.setImage(dff)
@@ -267,12 +337,12 @@ class VImagingAnalyzer(QtGui.QSplitter):
         avg_y = []
         avg_noise = []
 
-        for i in range(len(self.img_data)):
+        for i in range(len(self.trials)):
 
-            img_data = self.img_arrays[i]
-            img_t = self.img_data[i][0].xvals('Time')
+            roi_traces = self.roi_traces[i]
+            img_t = self.img_times[i]
             base_starti, base_stopi, test_starti, test_stopi, noise_starti, noise_stopi = self.time_indices(img_t)
-            dff = self.measure_dff(img_data, img_t, (base_starti, base_stopi, test_starti, test_stopi))
+            dff = self.measure_dff(roi_traces, (base_starti, base_stopi, test_starti, test_stopi))
             
             x = self.seqParams[0][1][i]
             xvals.extend([x] * len(dff))
@@ -280,7 +350,7 @@ class VImagingAnalyzer(QtGui.QSplitter):
             yvals.extend(list(dff))
             
             if analysis in ('SNR', 'noise'):
-                noise_dff = self.measure_dff(img_data, img_t, (base_starti, base_stopi, noise_starti, noise_stopi))
+                noise_dff = self.measure_dff(roi_traces, (base_starti, base_stopi, noise_starti, noise_stopi))
                 noise.extend(list(noise_dff))
                 avg_noise.append(noise_dff.mean())
             
@@ -310,38 +380,44 @@ class VImagingAnalyzer(QtGui.QSplitter):
             lin = stats.linregress(avg_x, avg_y)
             self.plt3.setTitle("slope: %0.2g" % lin[0])
     
-    def measure_dff(self, img_data, img_t, time_indices):
+    def measure_dff(self, roi_traces, time_indices):
+        """Return dF/F for each trial given ROI time courses with shape (2, trials, frames) (see stream_trials).
+        """
         base_starti, base_stopi, test_starti, test_stopi = time_indices
         
-        base = img_data[:, base_starti:base_stopi]
-        base_mean = base.mean(axis=1)
-        test = img_data[:, test_starti:test_stopi]
-        test_mean = test.mean(axis=1)
-        
-        roi1, roi2 = self.rois   # roi1 is signal, roi2 is background
-        base_rgn1 = roi1.getArrayRegion(base_mean, self.img1, axes=(1, 2))
-        base_rgn2 = roi2.getArrayRegion(base_mean, self.img1, axes=(1, 2))
-        test_rgn1 = roi1.getArrayRegion(test_mean, self.img1, axes=(1, 2))
-        test_rgn2 = roi2.getArrayRegion(test_mean, self.img1, axes=(1, 2))
+        rgn1, rgn2 = roi_traces   # roi1 is signal, roi2 is background
 
         # Use the temporal profile in roi2 in order to remove changes in LED brightness over time
         # Then use the difference between baseline and test time regions to determine change in fluorescence
-        baseline1 = base_rgn1.mean(axis=1).mean(axis=1)
-        signal1 = test_rgn1.mean(axis=1).mean(axis=1)
-        baseline2 = base_rgn2.mean(axis=1).mean(axis=1)
-        signal2 = test_rgn2.mean(axis=1).mean(axis=1)
+        baseline1 = rgn1[:, base_starti:base_stopi].mean(axis=1)
+        signal1 = rgn1[:, test_starti:test_stopi].mean(axis=1)
+        baseline2 = rgn2[:, base_starti:base_stopi].mean(axis=1)
+        signal2 = rgn2[:, test_starti:test_stopi].mean(axis=1)
         dff = ((signal1-signal2) - (baseline1-baseline2)) / (baseline1-baseline2)
 
         return dff
     
     def closeEvent(self, ev):
-        self.img_data = None
-        self.img_arrays = None
+        self.trials = None
+        self.roi_traces = None
         self.img_mean = None
         self.clamp_data = None
         self.clamp_mode = None
 
 
+def ellipse_mask(roi, img_item, shape):
+    """Return a boolean array with *shape* that is True for the pixels of *img_item* whose centers
+    lie inside the EllipseROI *roi*.
+    """
+    tr, invertible = img_item.itemTransform(roi)
+    x, y = np.mgrid[:shape[0], :shape[1]] + 0.5
+    # pixel centers in the ROI's local coordinates, where the ellipse fills the rect (0, 0, w, h)
+    u = tr.m11() * x + tr.m21() * y + tr.dx()
+    v = tr.m12() * x + tr.m22() * y + tr.dy()
+    w, h = roi.size()
+    return (u / w - 0.5)**2 + (v / h - 0.5)**2 <= 0.25
+
+
 class VImagingAnalyzer2(QtGui.QWidget):
     def __init__(self):
         QtGui.QWidget.__init__(self)
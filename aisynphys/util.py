@@ -55,6 +55,20 @@ def dir_timestamp(path):
             return float(line[len(key):])
 
 
+def path_mtimes(paths):
+    """Return {path: mtime} for each path, with mtime None for paths that do not exist.
+    """
+    mtimes = {}
+    for path in paths:
+        if path is None:
+            continue
+        try:
+            mtimes[path] = os.stat(path).st_mtime
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+
 def sync_dir(source_path, dest_path, test=False, log_file=None, depth=0, archive_deleted=False):
     """Safely duplicate a directory structure
     
@@ -302,6 +316,29 @@ class OptionalImportError(object):
         raise self.exc
 
 
+def toposort(deps):
+    """Return a list of the keys in *deps* sorted such that each item comes after its dependencies.
+
+    *deps* is a dict of {item: [dependencies]}. (This replaces pyqtgraph.toposort, which requires
+    importing Qt.)
+    """
+    sorted_items = []
+    seen = set()
+    def visit(item, stack):
+        if item in stack:
+            raise Exception("Cyclic dependency detected", stack + [item])
+        if item in seen:
+            return
+        seen.add(item)
+        for dep in deps.get(item, []):
+            visit(dep, stack + [item])
+        sorted_items.append(item)
+
+    for item in deps:
+        visit(item, [])
+    return sorted_items
+
+
 def iter_md5_hash(file_path, chunksize=1000000):
     m = hashlib.md5()
     size = os.stat(file_path).st_size
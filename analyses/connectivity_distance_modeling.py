@@ -20,81 +20,37 @@ Extra credit:
 
 import numpy as np
 import pyqtgraph as pg
-import scipy.optimize
 import scipy.stats
-from aisynphys.connectivity import connectivity_profile
+from aisynphys.connectivity import connectivity_profile, DistanceModel, ExpModel, GaussianModel
 
 
-class Model:
-    def generate(self, x):
-        """Generate a random sample of connectivity give distances.
-        """
-        p = self.pdf(x)
-        return np.random.random(size=len(x)) < p
-
-    def likelihood(self, x, conn):
-        """Log-likelihood for logistic regression
-
-        LLF = Σᵢ(𝑦ᵢ log(𝑝(𝐱ᵢ)) + (1 − 𝑦ᵢ) log(1 − 𝑝(𝐱ᵢ)))
-        """
-        p = self.pdf(x)
-        return np.log(p[conn]).sum() + np.log((1-p)[~conn]).sum()
-
-    @classmethod
-    def err_fn(cls, params, *args):
-        model = cls(*params)
-        return -model.likelihood(*args)
+class SphereIntersectionModel(DistanceModel):
+    param_names = ('pmax', 'd')
+    init = (0.1, 100e-6)
+    bounds = ((0, 1), (10e-6, 1e-3))
 
     @classmethod
-    def fit(cls, x, conn, init=(0.1, 100e-6), bounds=((0, 1), (10e-6, 1e-3))):
-        fit = scipy.optimize.minimize(
-            cls.err_fn, 
-            x0=init, 
-            args=(x, conn),
-            bounds=bounds,
-        )
-        ret = cls(*fit.x)
-        ret.fit_result = fit
-        return ret
-
-
-class ExpModel(Model):
-    def __init__(self, pmax, tau):
-        self.pmax = pmax
-        self.tau = tau
-    
-    def pdf(self, x):
-        return self.pmax * np.exp(-x / self.tau)
-
-
-class SphereIntersectionModel(Model):
-    def __init__(self, pmax, d):
-        self.pmax = pmax
-        self.d = d
-
-    def pdf(self, x):
-        r = self.d / 2
+    def connection_probability(cls, params, x):
+        params = np.asarray(params)
+        pmax = params[..., 0:1]
+        d = params[..., 1:2]
+        r = d / 2
         mx = (4 * np.pi / 3) * r**3
         v = mx - np.pi * x * (r**2 - x**2/12)
-        return np.where(x < self.d, v * self.pmax / mx, 0)
-
-
-class LinearModel(Model):
-    def __init__(self, pmax, r):
-        self.pmax = pmax
-        self.r = r
+        return np.where(x < d, v * pmax / mx, 0)
 
-    def pdf(self, x):
-        return np.where(x < self.r, self.pmax * (self.r - x) / self.r, 0)
 
+class LinearModel(DistanceModel):
+    param_names = ('pmax', 'r')
+    init = (0.1, 100e-6)
+    bounds = ((0, 1), (10e-6, 1e-3))
 
-class GaussianModel(Model):
-    def __init__(self, pmax, sigma):
-        self.pmax = pmax
-        self.sigma = sigma
-
-    def pdf(self, x):
-        return self.pmax * np.exp(-x**2 / (2 * self.sigma**2))
+    @classmethod
+    def connection_probability(cls, params, x):
+        params = np.asarray(params)
+        pmax = params[..., 0:1]
+        r = params[..., 1:2]
+        return np.where(x < r, pmax * (r - x) / r, 0)
 
 
 
@@ -118,11 +74,14 @@ n_probes = 100
 # How many iterations to run when measuring confidence intervals
 n_iter = 1000
 
+# Seed for all random sampling
+rng = np.random.RandomState(0)
+
 
 plt = pg.plot(labels={'bottom': ('distance', 'm')})
 
 # model distance sampling as lognormal
-x_probed = np.random.lognormal(size=n_probes, sigma=.6, mean=np.log(150e-6))
+x_probed = rng.lognormal(size=n_probes, sigma=.6, mean=np.log(150e-6))
 x_bins = np.arange(0, 500e-6, 40e-6)
 x_vals = 0.5 * (x_bins[1:] + x_bins[:-1])
 
@@ -135,13 +94,13 @@ p.setZValue(-20)
 plt.plot(x_vals, true_model.pdf(x_vals), pen={'width': 2, 'color':(0, 255, 0, 100)})
 
 # generate connectivity data many times with the same model and x values 
-fit_p = np.empty((n_iter, len(x_vals)))
-for i in range(n_iter):
-    conn = true_model.generate(x_probed)
+all_conn = true_model.generate(x_probed, n_samples=n_iter, seed=rng)
 
-    # fit a model to the data
-    fit = test_model_class.fit(x_probed, conn)
-    fit_p[i] = fit.pdf(x_vals)
+# fit a model to the data
+fit_params = test_model_class.fit_batch(x_probed, all_conn)
+fit_p = test_model_class.connection_probability(fit_params, x_vals)
+conn = all_conn[-1]
+fit = test_model_class(*fit_params[-1])
 
 # plot last generated connectivity histogram (light grey)
 conn_x = x_probed[conn]
@@ -156,7 +115,7 @@ plt.plot(x_vals, lower, pen=0.5)
 plt.plot(x_vals, upper, pen=0.5)
 
 # plot the last fit result (thick red)
-print(fit.fit_result)
+print(fit)
 plt.plot(x_vals, fit.pdf(x_vals), pen={'width': 2, 'color':(255, 0, 0, 200)})
 
 # plot true confidence intervals on the fit (thin red)
@@ -167,17 +126,9 @@ plt.plot(x_vals, lower, pen=(255, 0, 0, 100))
 plt.plot(x_vals, upper, pen=(255, 0, 0, 100))
 
 # generate more random samples with the same x values to estimate confidence intervals
-n_iter = 1000
-refit_p = np.empty((n_iter, len(x_vals)))
-for i in range(n_iter):
-    conn = fit.generate(x_probed)
-    fit2 = test_model_class.fit(x_probed, conn)
-    refit_p[i] = fit2.pdf(x_vals)
-
 # plot estimated confidence intervals (thin yellow)
 #   -> this shows us how well we can estimate confidence intervals for the fit
-lower = scipy.stats.scoreatpercentile(refit_p, 5, axis=0)
-upper = scipy.stats.scoreatpercentile(refit_p, 95, axis=0)
+lower, upper = fit.bootstrap(x_probed, x_vals, n_iter=n_iter, percentiles=(5, 95), seed=rng)
 plt.plot(x_vals, lower, pen=(255, 255, 0, 100))
 plt.plot(x_vals, upper, pen=(255, 255, 0, 100))
 
@@ -13,6 +13,7 @@ from neuroanalysis import filter
 from aisynphys.ui.experiment_browser import ExperimentBrowser
 from aisynphys.synapse_prediction import get_amps, get_baseline_amps
 from aisynphys.database import default_db as db
+from aisynphys.trace_stack import TraceStack
 from aisynphys import data
 
 
@@ -40,19 +41,36 @@ class StimResponseList(object):
                 baseline = np.median(ts.time_slice(bstart, bstop).data)
                 ts = ts - baseline
             if align is not None:
-                if align == 'stim':
-                    t_align = sr.stim_pulse.onset_time 
-                elif align == 'pre':
-                    t_align = sr.stim_pulse.spikes[0].max_dvdt_time
-                elif align == 'post':
-                    raise NotImplementedError()
-                else:
-                    raise ValueError("invalid time alignment mode %r" % align)
-                t_align = t_align or 0
-                ts = ts.copy(t0=ts.t0-t_align)
+                ts = ts.copy(t0=ts.t0-self._align_time(sr, align))
             tseries.append(ts)
         return TSeriesList(tseries)
 
+    def get_stack(self, series, bsub=True, align='stim', bsub_window=(-3e-3, 0), window=None, decimate=1):
+        """Return a TraceStack of timeseries, optionally baseline-subtracted and time-aligned.
+
+        This gives the same traces as get_tseries(), but stored in a single 2D array.
+        See TraceStack.from_arrays() for the *window* and *decimate* arguments.
+        """
+        assert series in ('stim', 'pre', 'post'), "series must be one of 'stim', 'pre', or 'post'"
+        tseries = [getattr(sr, series + '_tseries') for sr in self.srs]
+        onsets = np.array([sr.stim_pulse.onset_time for sr in self.srs], dtype=float)
+        bsub_windows = np.stack([onsets + bsub_window[0], onsets + bsub_window[1]], axis=1) if bsub else None
+        align_times = None if align is None else [self._align_time(sr, align) for sr in self.srs]
+        return TraceStack.from_tseries(tseries, align_times=align_times, baseline_windows=bsub_windows,
+            baseline='median', window=window, decimate=decimate)
+
+    @staticmethod
+    def _align_time(sr, align):
+        if align == 'stim':
+            t_align = sr.stim_pulse.onset_time 
+        elif align == 'pre':
+            t_align = sr.stim_pulse.spikes[0].max_dvdt_time
+        elif align == 'post':
+            raise NotImplementedError()
+        else:
+            raise ValueError("invalid time alignment mode %r" % align)
+        return t_align or 0
+
     def __iter__(self):
         for sr in self.srs:
             yield sr
@@ -205,13 +223,13 @@ class CrosstalkAnalyzer(object):
             if len(rl) == 0:
                 return
             
-            stim_ts = rl.get_tseries('stim', align=align)
+            stim_ts = rl.get_stack('stim', align=align)
             self._plot_ts(stim_ts, self.plt1)
         
-            pre_ts = rl.get_tseries('pre', align=align)
+            pre_ts = rl.get_stack('pre', align=align)
             self._plot_ts(pre_ts, self.plt2)
 
-            post_ts = rl.get_tseries('post', align=align)
+            post_ts = rl.get_stack('post', align=align)
             dvdt = self.params['display', 'plot dv/dt']
             lowpass = self.params['display', 'plot lowpass']
             self._plot_ts(post_ts, self.plt3, dvdt=dvdt, lowpass=lowpass)
@@ -226,13 +244,17 @@ class CrosstalkAnalyzer(object):
                 pass
         return ts
         
-    def _plot_ts(self, ts_list, plt, dvdt=False, lowpass=None):
+    def _plot_ts(self, stack, plt, dvdt=False, lowpass=None):
         limit = self.params['display', 'limit']
-        for ts in ts_list[:limit]:
-            ts = self.display_filter(ts, dvdt, lowpass)
-            item = plt.plot(ts.time_values, ts.data, pen=(255, 255, 255, 80), antialias=True)
-            self._plot_items.append((item, plt))
-        avg = ts_list.mean()
+        traces = stack[:limit]
+        if dvdt or lowpass is not None:
+            traces = TraceStack.from_tseries([self.display_filter(ts, dvdt, lowpass) for ts in traces.tseries()])
+        # draw all traces with a single curve item
+        x, y, connect = traces.curve_arrays()
+        item = pg.PlotCurveItem(x, y, connect=connect, pen=(255, 255, 255, 80), antialias=True)
+        plt.addItem(item)
+        self._plot_items.append((item, plt))
+        avg = stack.mean()
         avg = self.display_filter(avg, dvdt, lowpass)
         item = plt.plot(avg.time_values, avg.data, pen={'color':'g', 'width':2}, shadowPen={'color':'k', 'width':3}, antialias=True)
         self._plot_items.append((item, plt))
@@ -0,0 +1,43 @@
+"""
+Download raw experiment data (NWB files) into the local cache.
+
+Examples::
+
+    # download all published files using 8 concurrent workers
+    python tools/download_nwb_files.py --all --workers 8
+
+    # download files for specific experiments
+    python tools/download_nwb_files.py 1499277786.89 1500668871.652
+
+    # download files for all experiments in a database
+    python tools/download_nwb_files.py --db-version synphys_r1.0_2019-08-29_small.sqlite --from-db
+
+"""
+import sys
+from aisynphys import synphys_cache
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('expt_ids', type=str, nargs='*', help="Experiment IDs to download.")
+    parser.add_argument('--all', action='store_true', default=False, help="Download all files in the data file index.")
+    parser.add_argument('--from-db', action='store_true', default=False, dest='from_db',
+                    help="Download files for all experiments in the database (selected with --db-version or --database).")
+    parser.add_argument('--workers', type=int, default=4, help="Number of concurrent downloads.")
+    parser.add_argument('--rehash', action='store_true', default=False, help="Verify hashes of previously downloaded files.")
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.all:
+        expt_ids = None
+    elif args.from_db:
+        from aisynphys.database import default_db as db
+        expt_ids = [ext_id for ext_id, in db.query(db.Experiment.ext_id)]
+    else:
+        expt_ids = args.expt_ids
+        if len(expt_ids) == 0:
+            parser.error("Specify experiment IDs, --all, or --from-db")
+
+    results = synphys_cache.download_nwb_files(expt_ids, workers=args.workers, rehash=args.rehash)
+    if any(r['status'] == 'failed' for r in results):
+        sys.exit(1)
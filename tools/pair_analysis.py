@@ -348,13 +348,16 @@ class TSeriesPlot(pg.GraphicsLayoutWidget):
                 if len(prs) == 0:
                     continue
                 prl = PulseResponseList(prs)
-                post_ts = prl.post_tseries(align='spike', bsub=True)
+                post_ts = prl.post_stack(align='spike', bsub=True)
+                if len(post_ts) == 0:
+                    continue
                 
-                for trace in post_ts:
-                    item = self.trace_plots[i].plot(trace.time_values, trace.data, pen=self.qc_color[qc])
-                    if qc == 'qc_fail':
-                        item.setZValue(-10)
-                    self.items.append(item)
+                x, y, connect = post_ts.curve_arrays()
+                item = pg.PlotCurveItem(x, y, connect=connect, pen=self.qc_color[qc])
+                self.trace_plots[i].addItem(item)
+                if qc == 'qc_fail':
+                    item.setZValue(-10)
+                self.items.append(item)
                 if qc == 'qc_pass':
                     grand_trace = post_ts.mean()
                     item = self.trace_plots[i].plot(grand_trace.time_values, grand_trace.data, pen={'color': 'b', 'width': 2})
@@ -794,8 +797,8 @@ class PairAnalysis(object):
                     if mode == 'vc':
                         p = Psp()
                         
-                    # make a list of spike-aligned postsynaptic tseries
-                    tsl = PulseResponseList(self.sorted_responses[mode, holding]['qc_pass']).post_tseries(align='spike', bsub=True)
+                    # make a stack of spike-aligned postsynaptic tseries
+                    tsl = PulseResponseList(self.sorted_responses[mode, holding]['qc_pass']).post_stack(align='spike', bsub=True)
                     if len(tsl) == 0:
                         continue
                     
@@ -29,6 +29,17 @@ if __name__ == '__main__':
 
         result = StochasticModelRunner(db, experiment_id, pre_cell_id, post_cell_id, workers=args.workers)
         result.max_events = args.max_events
+
+        # use results generated by the stochastic_model pipeline module if the model inputs match
+        if not args.no_cache and 'stochastic_model_result' in db.table_names():
+            q = db.query(db.StochasticModelResult).join(db.Pair).join(db.Experiment)
+            q = q.filter(db.Experiment.ext_id==experiment_id)
+            q = q.filter(db.StochasticModelResult.pre_cell_ext_id==pre_cell_id).filter(db.StochasticModelResult.post_cell_ext_id==post_cell_id)
+            rec = q.first()
+            if rec is not None and rec.input_hash == result.input_hash:
+                result.load_db_result(rec)
+                return result
+
         cache_path = os.path.join(config.cache_path, 'stochastic_model_results')
         if not os.path.exists(cache_path):
             os.makedirs(cache_path)
@@ -9,10 +9,9 @@ from aisynphys import config
 if __name__ == '__main__':
     logging.basicConfig(format="%(message)s")
     logging.getLogger().setLevel(logging.INFO)
-    all_pipelines = all_pipelines()
     
     parser = argparse.ArgumentParser(description="Process analysis pipeline jobs")
-    parser.add_argument('pipeline', type=str, help="The name of the pipeline to run: %s" % ', '.join(list(all_pipelines.keys())))
+    parser.add_argument('pipeline', type=str, help="The name of the pipeline to run (for example, multipatch)")
     parser.add_argument('modules', type=str, nargs='*', help="The name of the analysis module(s) to run")
     parser.add_argument('--update', action='store_true', default=False, help="Process any jobs that are ready to be updated")
     parser.add_argument('--retry', action='store_true', default=False, help="During update, retry processing jobs that previously failed (implies --update)")
@@ -27,16 +26,28 @@ if __name__ == '__main__':
     parser.add_argument('--vacuum', action='store_true', default=False, help="Run VACUUM ANALYZE on the database to optimize its query planner", )
     parser.add_argument('--bake', action='store_true', default=False, help="Bake an sqlite file after the pipeline update completes", )
     parser.add_argument('--info', action='store_true', default=False, help="Display information about the selected pipeline", )
+    parser.add_argument('--intrinsic-workers', type=int, default=None, dest='intrinsic_workers', help="Set the number of cells analyzed concurrently within each intrinsic job")
+    parser.add_argument('--intrinsic-pool', type=str, default=None, dest='intrinsic_pool', choices=['thread', 'process'], help="Pool used to analyze cells within each intrinsic job")
     
     
     args = parser.parse_args(sys.argv[1:])
 
+    # workers inherit these config values when jobs run in parallel
+    if args.intrinsic_workers is not None:
+        config.intrinsic_workers = args.intrinsic_workers
+    if args.intrinsic_pool is not None:
+        config.intrinsic_pool = args.intrinsic_pool
+
     if args.debug:
         args.local = True
         import pyqtgraph as pg 
         logging.getLogger().setLevel(logging.DEBUG)
         pg.dbg()
 
+    # pipeline modules are only imported once the arguments have been parsed
+    all_pipelines = all_pipelines()
+    if args.pipeline not in all_pipelines:
+        parser.error('Unknown pipeline "%s"; options are: %s' % (args.pipeline, ', '.join(all_pipelines.keys())))
     pipeline = all_pipelines[args.pipeline](database=db, config=config)
     all_modules = pipeline.sorted_modules()
     
@@ -94,11 +105,7 @@ if __name__ == '__main__':
                 module.drop_jobs(job_ids=args.uids)
  
     if args.update or args.rebuild or args.retry:
-        report = []
-        for module in modules:
-            print("=============================================")
-            result = module.update(job_ids=args.uids, retry_errors=args.retry, limit=args.limit, parallel=not args.local, workers=args.workers, debug=args.debug)
-            report.append((module, result))
+        report = pipeline.update(modules, job_ids=args.uids, retry_errors=args.retry, limit=args.limit, parallel=not args.local, workers=args.workers, debug=args.debug)
             
         if args.vacuum:
             print("Starting vacuum..")
@@ -40,7 +40,12 @@ skip_columns['medium'].update({
 skip_columns['small'] = skip_columns['medium'].copy()
 
 
-versions = sys.argv[1:]
+args = sys.argv[1:]
+
+# with --incremental, existing bakes are updated: only rows for experiments whose
+# pipeline jobs changed since the last bake are copied again
+incremental = '--incremental' in args
+versions = [arg for arg in args if arg != '--incremental']
 
 if len(versions) == 0:
     versions = list(db_files.keys())
@@ -49,6 +54,6 @@ if len(versions) == 0:
 for version in versions:
     filename = db_files[version]
     print("========== Cloning %s DB %s =============" % (version, filename))
-    if os.path.exists(filename):
+    if os.path.exists(filename) and not incremental:
         os.remove(filename)
-    db.bake_sqlite(filename, skip_tables=skip_tables[version], skip_columns=skip_columns[version])
+    db.bake_sqlite(filename, incremental=incremental, skip_tables=skip_tables[version], skip_columns=skip_columns[version])
@@ -1,11 +1,16 @@
-import os, sys, re, shutil, hashlib, time
+import os, re, shutil, time, argparse
+from aisynphys import config
+from aisynphys.file_hash import HashManifest, hash_files
 
 
 ignored_files = ['.*Thumbs.db']
 ignored_regex = [re.compile(x) for x in ignored_files]
 
 
-def conditional_delete(path1, path2):
+default_manifest = os.path.join(config.cache_path, 'conditional_delete_hashes.sqlite')
+
+
+def conditional_delete(path1, path2, manifest=None, workers=4):
     """Delete *path1* only if all files that would be deleted also exist in *path2*.
 
     Return True if *path1* was deleted.
@@ -13,7 +18,7 @@ def conditional_delete(path1, path2):
     This is used for recovering disk space after verifying the contents of a backup.
     """
     print("Comparing %s..." % path1)
-    if not compare_paths(path1, path2):
+    if not compare_paths(path1, path2, manifest=manifest, workers=workers):
         print("    Skipping %s" % path1)
         return False
 
@@ -23,7 +28,7 @@ def conditional_delete(path1, path2):
     return True
 
 
-def conditional_delete_old(path1, path2, min_age=90):
+def conditional_delete_old(path1, path2, min_age=90, manifest=None, workers=4):
     """Conditionally delete subdirectories from *path1* if they are older than *min_age* (in days) and
     have a valid copy in *path2*.
 
@@ -42,7 +47,7 @@ def conditional_delete_old(path1, path2, min_age=90):
             too_young.append(src_path)
             continue
         dst_path = os.path.join(path2, f)
-        deleted = conditional_delete(src_path, dst_path)
+        deleted = conditional_delete(src_path, dst_path, manifest=manifest, workers=workers)
         if deleted:
             deleted_paths.append(src_path)
         else:
@@ -55,11 +60,15 @@ def age_in_days(path):
     return (time.time() - os.stat(path).st_mtime) / (3600*24.)
 
 
-def compare_paths(path1, path2):
+def compare_paths(path1, path2, manifest=None, workers=4):
     """Return True only if all files inside the tree at *path1* also exist in the same relative 
     locations in *path2*.
+
+    File contents are compared by hashing with *workers* concurrent threads. If a HashManifest is
+    given, files that have not changed since they were last hashed are not read again.
     """
     match = True
+    file_pairs = []
     for src_path, dirs, files in os.walk(path1):
         subpath = os.path.relpath(src_path, path1)
         dst_path = os.path.join(path2, subpath)
@@ -91,27 +100,25 @@ def compare_paths(path1, path2):
                 match = False
                 print("      Wrong size %s" % rel_file)
                 continue
-            if file_hash(src_file) != file_hash(dst_file):
-                match = False
-                print("      Hash mismatch %s" % rel_file)
-                continue
-
-    return match
+            file_pairs.append((rel_file, src_file, dst_file))
 
+    hashes = hash_files([f for pair in file_pairs for f in pair[1:]], manifest=manifest, workers=workers)
+    for rel_file, src_file, dst_file in file_pairs:
+        if hashes[src_file] != hashes[dst_file]:
+            match = False
+            print("      Hash mismatch %s" % rel_file)
 
-def file_hash(filename, blocksize=2**24, func=hashlib.sha1):
-    """Source: https://stackoverflow.com/questions/3431825/generating-an-md5-checksum-of-a-file
-    """
-    hash = func()
-    with open(filename, "rb") as f:
-        for block in iter(lambda: f.read(blocksize), b""):
-            hash.update(block)
-    return hash.hexdigest()
+    return match
 
 
 if __name__ == '__main__':
-    path1, path2 = sys.argv[1:]
-    conditional_delete_old(path1, path2)
-
-
-
+    parser = argparse.ArgumentParser(description="Delete old subdirectories of path1 that have a verified copy in path2.")
+    parser.add_argument('path1', type=str)
+    parser.add_argument('path2', type=str)
+    parser.add_argument('--min-age', type=float, default=90, dest='min_age', help="Minimum age (days) of subdirectories to delete")
+    parser.add_argument('--workers', type=int, default=4, help="Number of files to hash concurrently")
+    parser.add_argument('--manifest', type=str, default=default_manifest, help="sqlite file used to remember hashes of unchanged files")
+    args = parser.parse_args()
+
+    manifest = HashManifest(args.manifest)
+    conditional_delete_old(args.path1, args.path2, min_age=args.min_age, manifest=manifest, workers=args.workers)
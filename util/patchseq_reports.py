@@ -1,9 +1,9 @@
-import glob, os, argparse, sys, csv, re
+import glob, os, argparse, sys, csv, re, json, pickle, sqlite3
 import pandas as pd
 import pyqtgraph as pg
-from acq4.util.DataManager import getHandle
+import pyqtgraph.configfile
 from aisynphys import config, lims
-from aisynphys.util import timestamp_to_datetime
+from aisynphys.util import timestamp_to_datetime, path_mtimes
 from datetime import datetime, timedelta
 from aisynphys.data.pipette_metadata import PipetteMetadata
 from aisynphys.data.slice import Slice
@@ -12,8 +12,155 @@ from collections import OrderedDict
 all_paths = glob.glob(os.path.join(config.synphys_data, '*.***'))
 nucleus = {'+': 'nucleus_present', '-': 'nucleus_absent', '': None}
 organism = {'Mus musculus': 'Mouse', 'Homo Sapiens': 'Human'}
+daily_report_folder = '//allen/programs/celltypes/workgroups/synphys/MPS_transcriptomics_report'
 
-def generate_daily_report(day):
+
+class SiteMetadataCache(object):
+    """sqlite record of the metadata extracted from each site directory, and of the tubes
+    listed in each daily report.
+
+    Every entry stores the mtimes of the files it was read from, and is only used while
+    none of those files have changed.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the sqlite file (created if needed).
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        dirname = os.path.dirname(filename)
+        if dirname != '' and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.db = sqlite3.connect(filename)
+        self.db.execute("create table if not exists site_metadata (path text primary key, inputs text, record blob)")
+        self.db.execute("create table if not exists report_tubes (path text primary key, mtime real, tubes text)")
+        self.db.commit()
+
+    def get_site(self, site):
+        """Return the stored record for *site*, or None if there is none or its inputs have changed.
+        """
+        rec = self.db.execute("select inputs, record from site_metadata where path=?", (os.path.abspath(site),)).fetchone()
+        if rec is None:
+            return None
+        inputs = json.loads(rec[0])
+        if path_mtimes(inputs.keys()) != inputs:
+            return None
+        return pickle.loads(rec[1])
+
+    def set_site(self, site, inputs, record):
+        self.db.execute("insert or replace into site_metadata values (?, ?, ?)",
+            (os.path.abspath(site), json.dumps(inputs), sqlite3.Binary(pickle.dumps(record))))
+
+    def report_tubes(self, report_file):
+        """Return the list of tube names in a daily report, or None if the report could not be read.
+        """
+        try:
+            mtime = os.stat(report_file).st_mtime
+        except OSError:
+            return None
+        rec = self.db.execute("select mtime, tubes from report_tubes where path=?", (report_file,)).fetchone()
+        if rec is not None and rec[0] == mtime:
+            return json.loads(rec[1])
+        tubes = read_report_tubes(report_file)
+        if tubes is None:
+            return None
+        with self.db:
+            self.db.execute("insert or replace into report_tubes values (?, ?, ?)", (report_file, mtime, json.dumps(tubes)))
+        return tubes
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def read_report_tubes(report_file):
+    """Return the list of tube names (as str) in a daily report, or None if the report could not be read.
+    """
+    try:
+        daily_df = pd.read_excel(report_file, header=0, index_col=None)
+    except Exception:
+        return None
+    return [str(t) for t in daily_df['Patch Tube Name']]
+
+
+_index_info = {}
+def index_info(dirname):
+    """Return the info ('.' entry) from the acq4 .index file in *dirname*.
+
+    Each .index file is parsed only once until it is modified, so day and slice indexes
+    are shared by all of the sites they contain.
+    """
+    index = os.path.join(dirname, '.index')
+    mtime = os.stat(index).st_mtime
+    cached = _index_info.get(index)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, pg.configfile.readConfigFile(index)['.'])
+        _index_info[index] = cached
+    return cached[1]
+
+
+def site_input_files(site):
+    """Return the list of files that extract_site_metadata() reads for *site*.
+    """
+    slice_path = os.path.dirname(site)
+    day_path = os.path.dirname(slice_path)
+    return [os.path.join(site, '.index'), os.path.join(slice_path, '.index'), os.path.join(day_path, '.index'),
+        os.path.join(site, 'pipettes.yml'), os.path.join(site, 'sync_source')]
+
+
+def extract_site_metadata(site):
+    """Read all metadata used by the PatchSeq reports from a site directory and its parent
+    slice and day directories.
+    """
+    slice_path = os.path.dirname(site)
+    day_path = os.path.dirname(slice_path)
+    return {
+        'site_path': site,
+        'slice_path': slice_path,
+        'site_source': open(os.path.join(site, 'sync_source')).read(),
+        'site_info': index_info(site),
+        'slice_info': index_info(slice_path),
+        'day_info': index_info(day_path),
+        'pipettes': PipetteMetadata(site).pipettes,
+    }
+
+
+def collect_site_metadata(expt_paths, cache=None):
+    """Return (site records, {slice_path: Slice}) for all sites in *expt_paths*.
+
+    Site records are read from *cache* (a SiteMetadataCache) where possible. LIMS records for
+    all slices are fetched together.
+    """
+    records = []
+    for path in expt_paths:
+        for site in sorted(glob.glob(os.path.join(path, 'slice_*', 'site_*'))):
+            record = None if cache is None else cache.get_site(site)
+            if record is None:
+                # record input mtimes before reading so that changes made while reading are caught next time
+                inputs = path_mtimes(site_input_files(site))
+                record = extract_site_metadata(site)
+                if cache is not None:
+                    cache.set_site(site, inputs, record)
+            records.append(record)
+    if cache is not None:
+        cache.commit()
+
+    slices = OrderedDict()
+    for rec in records:
+        if rec['slice_path'] not in slices:
+            slices[rec['slice_path']] = Slice.get(rec['slice_path'], slice_info=rec['slice_info'], parent_info=rec['day_info'])
+    Slice.load_lims_records(slices.values())
+    return records, slices
+
+
+def default_cache():
+    return SiteMetadataCache(os.path.join(config.cache_path, 'patchseq_site_metadata.sqlite'))
+
+
+def generate_daily_report(day, cache=None):
     """ Generate a daily PatchSeq report for Kim's team. PatchSeq metadata is collected from the acq4 directories
     for every experiment. Only metadata associated with a Patched Cell Container are processed.
     """
@@ -40,20 +187,18 @@ def generate_daily_report(day):
 
     # collect experiments for the specified day
     expt_paths = get_expts_in_range(all_paths, day, day)
-    site_paths = [glob.glob(os.path.join(path, 'slice_*', 'site_*')) for path in expt_paths]
-    site_paths = [sp for paths in site_paths for sp in paths] #flatten site paths if nested list
+    sites, slices = collect_site_metadata(expt_paths, cache)
     
     row_data = []
     # look through each site directory
-    for site in site_paths:
+    for site in sites:
         errors = []
-        site_source = open(os.path.join(site, 'sync_source')).read()
+        site_source = site['site_source']
         errors.append(site_source)
-        site_dh = getHandle(site)
-        site_info = site_dh.info()
-        slice_info = site_dh.parent().info()
-        day_info = site_dh.parent().parent().info()
-        pip_meta = PipetteMetadata(site)
+        site_info = site['site_info']
+        slice_info = site['slice_info']
+        day_info = site['day_info']
+        pipettes = site['pipettes']
         headstages = site_info.get('headstages')
         
         # check to make sure there are recorded headstages and patchseq tubes, else move to next site
@@ -68,8 +213,7 @@ def generate_daily_report(day):
         patch_date_dt = timestamp_to_datetime(day_info.get('__timestamp__'))
         patch_date = datetime.strftime(patch_date_dt, "%m/%d/%Y") if isinstance(patch_date_dt, datetime) else None 
         specimen_id = day_info.get('animal_ID')
-        species = lims.specimen_species(slice_info.get('specimen_ID'))
-        species = organism.get(species) 
+        species = slice_species(slices[site['slice_path']])
         if species == 'Mouse':
             genotype = day_info.get('LIMS_donor_info', {}).get('genotype')
         else:
@@ -92,7 +236,7 @@ def generate_daily_report(day):
                 continue
             row = OrderedDict([k, None] for k in columns)
 
-            pip = pip_meta.pipettes[hs[-1]]
+            pip = pipettes[hs[-1]]
             nucleus_state = nucleus[info.get('Nucleus', '')]
             roi_minor = format_roi_minor(pip['target_layer'])
 
@@ -125,7 +269,7 @@ def generate_daily_report(day):
     if report_df is not None:
         report_df.to_excel(file_path, index=False)
 
-def generate_monthly_report(start_date, end_date):
+def generate_monthly_report(start_date, end_date, cache=None):
     """ Generate a monthly PatchSeq report for Shiny. PatchSeq metadata is collected from the acq4 directories
     for every experiment. Only metadata associated with a Patched Cell Container are processed.
     """
@@ -166,21 +310,18 @@ def generate_monthly_report(start_date, end_date):
 
     # collect experiments for the date range provided
     expt_paths = get_expts_in_range(all_paths, start_date, end_date)
-    site_paths = [glob.glob(os.path.join(path, 'slice_*', 'site_*')) for path in expt_paths]
-    site_paths = [sp for paths in site_paths for sp in paths] #flatten site paths if nested list
+    sites, slices = collect_site_metadata(expt_paths, cache)
     
     row_data = []
     # look through each site directory for patchseq data
-    for site in site_paths:
+    for site in sites:
         errors = []
-        site_source = open(os.path.join(site, 'sync_source')).read()
+        site_source = site['site_source']
         errors.append(site_source)
-        site_dh = getHandle(site)
-        site_info = site_dh.info()
-        slice_info = site_dh.parent().info()
-        day_dh = site_dh.parent().parent()
-        day_info = day_dh.info()
-        pip_meta = PipetteMetadata(site)
+        site_info = site['site_info']
+        slice_info = site['slice_info']
+        day_info = site['day_info']
+        pipettes = site['pipettes']
         headstages = site_info.get('headstages')
         
         # if no headstages were recorded or tubes collected, move along
@@ -192,13 +333,12 @@ def generate_monthly_report(start_date, end_date):
         if no_tubes:
             continue
 
-        index_file = pg.configfile.readConfigFile(os.path.join(day_dh.path, '.index'))
-        rig_name = index_file['.'].get('rig_name')
+        rig_name = day_info.get('rig_name')
         patch_date_dt = timestamp_to_datetime(day_info.get('__timestamp__'))
         patch_date = datetime.strftime(patch_date_dt, "%m/%d/%Y") if isinstance(patch_date_dt, datetime) else None
         operator = day_info.get('rig_operator', '')
         roi = format_roi_major(day_info.get('target_region'))
-        slic = Slice(site_dh.parent().name())
+        slic = slices[site['slice_path']]
         genotype = slic.genotype
         if genotype is None and slic.species == 'Mouse':
             errors.append('\tno genotype for %s, this may affect the creCell column' % slic.lims_specimen_name)
@@ -237,7 +377,7 @@ def generate_monthly_report(start_date, end_date):
             elif color == 'NA':
                 reporter = ''
             
-            pip = pip_meta.pipettes[hs[-1]]
+            pip = pipettes[hs[-1]]
             layer = pip['target_layer']
             manual_roi = roi + layer if (roi not in [None, ''] and layer not in [None, '']) else None
             nucleus_state = nucleus[info.get('Nucleus', '')]
@@ -271,28 +411,26 @@ def generate_monthly_report(start_date, end_date):
     report_df = to_df(row_data, report_type='monthly')
     
     # cross-check with daily reports to make sure all tubes are accounted for
-    tube_cross_check(report_df['tubeID'], start_date, end_date)
+    tube_cross_check(report_df['tubeID'], start_date, end_date, cache)
 
     report_df.to_excel(file_path, index=False)  
 
-def tube_cross_check(monthly_tubes, start_date, end_date):
-    daily_report_folder = '//allen/programs/celltypes/workgroups/synphys/MPS_transcriptomics_report'
+def tube_cross_check(monthly_tubes, start_date, end_date, cache=None):
     delta = end_date - start_date
     days = [start_date + timedelta(days=i) for i in range(delta.days + 1)] 
-    daily_tubes = None
+    daily_tubes = []
     for day in days:
         daily_report_file = os.path.join(daily_report_folder, '%s_mps_Transcriptomics_report.xlsx' % datetime.strftime(day, "%y%m%d"))
-        try:
-            daily_df = pd.read_excel(daily_report_file, header=0, index_col=None)
-        except:
+        if cache is not None:
+            tubes = cache.report_tubes(daily_report_file)
+        else:
+            tubes = read_report_tubes(daily_report_file)
+        if tubes is None:
             print('No report for %s' % datetime.strftime(day, "%y%m%d"))
             continue
-        if daily_tubes is None:
-            daily_tubes = daily_df['Patch Tube Name']
-        else:
-            daily_tubes = daily_tubes.append(daily_df['Patch Tube Name'], ignore_index=True)
+        daily_tubes.extend(tubes)
     
-    daily_tubes = daily_tubes.replace('\n', '', regex=True)
+    daily_tubes = pd.Series(daily_tubes, dtype=object).replace('\n', '', regex=True)
     monthly_tubes = monthly_tubes.replace('\n', '', regex=True)
     extra = monthly_tubes[~monthly_tubes.isin(daily_tubes)]
     missing = daily_tubes[~daily_tubes.isin(monthly_tubes)]
@@ -332,6 +470,15 @@ def to_df(report_data, report_type):
 
     return data_df
 
+def slice_species(slic):
+    """Return 'Mouse' or 'Human' for a Slice.
+    """
+    try:
+        return {'mouse': 'Mouse', 'human': 'Human'}.get(slic.species)
+    except Exception:
+        # specimen could not be parsed by lims.specimen_info
+        return organism.get(lims.specimen_species(slic.slice_info.get('specimen_ID')))
+
 def format_roi_major(roi):
     if roi == 'V1':
         return 'VISp'
@@ -370,13 +517,16 @@ if __name__ == '__main__':
     parser.add_argument('--daily', type=valid_date, nargs='?', const=datetime.now().date(), help="Default date is today, optionally set the date with the format YYYYMMDD")
     parser.add_argument('--monthly', type=valid_date, nargs=2, help="Provide date range to create monthly report as YYYYMMDD YYYYMMDD (start, end)")
 
+    parser.add_argument('--no-cache', action='store_true', default=False, help="Read all site metadata from the server instead of the local cache")
+
     args = parser.parse_args(sys.argv[1:])
+    cache = None if args.no_cache else default_cache()
 
     if args.daily is not None:
         day = args.daily
-        generate_daily_report(day)
+        generate_daily_report(day, cache)
 
     if args.monthly is not None:
         start_date = args.monthly[0]
         end_date = args.monthly[1]
-        generate_monthly_report(start_date, end_date)
+        generate_monthly_report(start_date, end_date, cache)
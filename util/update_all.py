@@ -38,7 +38,7 @@ if __name__ == '__main__':
         ('patchseq report',     ('daily',  'python util/patchseq_reports.py --daily', 'patchseq report')),
         ('pipeline',            ('daily',  'python util/analysis_pipeline.py multipatch all --update --retry', 'run analysis pipeline')),
         ('vacuum',              ('daily',  'python util/database.py --vacuum', 'vacuum database')),
-        ('bake sqlite',         ('daily',  'python util/bake_sqlite.py small medium', 'bake sqlite')),
+        ('bake sqlite',         ('daily',  'python util/bake_sqlite.py --incremental small medium', 'bake sqlite')),
         ('bake sqlite full',    ('weekly', 'python util/bake_sqlite.py full', 'bake sqlite full')),
     ])
 